@@ -0,0 +1,183 @@
+"""
+bench_data_processor.py
+-----------------------
+Microbenchmark for utils/data_processor.py at history scale.
+
+Times and measures the peak traced allocation (tracemalloc, which includes
+NumPy buffers) of the current implementations against the pre-vectorisation
+ones kept below as a reference.  It runs on a synthetic frame shaped like
+``db.get_historical_data()`` output:
+
+    python benchmarks/bench_data_processor.py --rows 10000000 --output dp.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from utils import data_processor  # noqa: E402
+from utils.data_processor import REGIONS  # noqa: E402
+
+
+# ---------------------------------------------------------------------------
+# Reference implementations (before vectorisation)
+# ---------------------------------------------------------------------------
+
+def legacy_convert_speed_to_kmh(df, speed_column='speed'):
+    df[speed_column] = pd.to_numeric(df[speed_column], errors='coerce').fillna(0)
+    if 'derived_speed' in df.columns:
+        derived = pd.to_numeric(df['derived_speed'], errors='coerce')
+        df[speed_column] = df[speed_column].mask((df[speed_column] == 0) & derived.notna(), derived)
+    df[speed_column] = df[speed_column] * 3.6
+    df[speed_column] = df[speed_column].round(0).clip(upper=120)
+    return df
+
+
+def legacy_prepare_map_data(df, region):
+    df_filtered = df[df['region'] == region].copy()
+    if df_filtered.empty:
+        return pd.DataFrame()
+    df_filtered['latitude'] = pd.to_numeric(df_filtered['latitude'], errors='coerce')
+    df_filtered['longitude'] = pd.to_numeric(df_filtered['longitude'], errors='coerce')
+    df_filtered['bearing'] = pd.to_numeric(df_filtered['bearing'], errors='coerce').fillna(0)
+    df_filtered['speed'] = pd.to_numeric(df_filtered['speed'], errors='coerce').fillna(0)
+    df_filtered = legacy_convert_speed_to_kmh(df_filtered)
+    return df_filtered[
+        (df_filtered['latitude'].notna()) & (df_filtered['longitude'].notna()) &
+        (df_filtered['latitude'] != 0) & (df_filtered['longitude'] != 0)
+    ]
+
+
+def legacy_format_timestamps(timestamps):
+    # Previously done for every row by db.get_historical_data()
+    return pd.to_datetime(timestamps, unit='s', utc=True).dt.tz_convert(
+        data_processor.TIMEZONE).dt.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def legacy_format_display_dataframe(df):
+    df = df.assign(timestamp_formatted=legacy_format_timestamps(df['timestamp']))
+    display_df = df.sort_values('timestamp', ascending=False).copy()
+    display_df = legacy_convert_speed_to_kmh(display_df)
+    avg_speed = display_df.groupby('vehicle_id')['speed'].mean().round(0)
+    display_df['avg_speed'] = display_df['vehicle_id'].map(avg_speed)
+    display_df = display_df[['region', 'vehicle_id', 'latitude', 'longitude', 'bearing',
+                             'speed', 'avg_speed', 'timestamp_formatted']]
+    display_df = display_df.rename(columns={
+        'region': 'Region', 'vehicle_id': 'Vehicle ID', 'latitude': 'Latitude',
+        'longitude': 'Longitude', 'bearing': 'Heading (°)', 'speed': 'Speed (km/h)',
+        'avg_speed': 'Avg Speed (km/h)', 'timestamp_formatted': 'Timestamp',
+    })
+    display_df['Latitude'] = display_df['Latitude'].round(6)
+    display_df['Longitude'] = display_df['Longitude'].round(6)
+    display_df['Heading (°)'] = display_df['Heading (°)'].round(1)
+    display_df['Speed (km/h)'] = display_df['Speed (km/h)'].astype(int)
+    display_df['Avg Speed (km/h)'] = display_df['Avg Speed (km/h)'].astype(int)
+    return display_df.reset_index(drop=True)
+
+
+# ---------------------------------------------------------------------------
+# Harness
+# ---------------------------------------------------------------------------
+
+def make_history(n_rows, n_vehicles=20_000, seed=0):
+    """Synthetic frame with the dtypes db.get_historical_data returns."""
+    rng = np.random.default_rng(seed)
+    vehicle = rng.integers(0, n_vehicles, n_rows)
+    vehicle_ids = np.array([f'V{i:06d}' for i in range(n_vehicles)], dtype=object)
+    regions = np.array(REGIONS, dtype=object)
+    ts = 1_735_689_600 + np.sort(rng.integers(0, 60 * 86400, n_rows))
+    speed = rng.uniform(0, 20, n_rows)
+    speed[rng.random(n_rows) < 0.3] = 0
+    return pd.DataFrame({
+        'region': regions[vehicle % len(regions)],
+        'vehicle_id': vehicle_ids[vehicle],
+        'latitude': rng.uniform(1.3, 6.7, n_rows),
+        'longitude': rng.uniform(100.1, 110.4, n_rows),
+        'bearing': rng.uniform(0, 360, n_rows),
+        'speed': speed,
+        'derived_speed': np.where(rng.random(n_rows) < 0.5, rng.uniform(0, 15, n_rows), np.nan),
+        'timestamp': ts,
+    })
+
+
+def measure(fn, repeat):
+    """Median wall time (ms) over *repeat* runs and peak traced allocation (MB) of one run."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'median_ms': round(float(np.median(samples)), 1), 'peak_mb': round(peak / 1e6, 1)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='data_processor microbenchmark')
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write results JSON here (default: stdout)')
+    args = parser.parse_args(argv)
+
+    print(f"Building {args.rows:,} rows...")
+    df = make_history(args.rows)
+    region = REGIONS[0]
+    half = list(REGIONS[:len(REGIONS) // 2])
+
+    cases = {
+        'convert_speed_to_kmh': (
+            lambda: legacy_convert_speed_to_kmh(df[['speed', 'derived_speed']].copy()),
+            lambda: data_processor.convert_speed_to_kmh(df[['speed', 'derived_speed']].copy()),
+        ),
+        'prepare_map_data': (
+            lambda: legacy_prepare_map_data(df, region),
+            lambda: data_processor.prepare_map_data(df, region),
+        ),
+        'select_regions': (
+            lambda: df[df['region'].isin(half)],
+            lambda: data_processor.select_regions(df, half, index),
+        ),
+        'format_timestamps': (
+            lambda: legacy_format_timestamps(df['timestamp']),
+            lambda: data_processor.format_timestamps(df['timestamp']),
+        ),
+        'format_display_dataframe': (
+            lambda: legacy_format_display_dataframe(df),
+            lambda: data_processor.format_display_dataframe(df),
+        ),
+    }
+
+    start = time.perf_counter()
+    index = data_processor.RegionIndex(df)
+    results = {'rows': args.rows, 'region_index_build_ms': round((time.perf_counter() - start) * 1000, 1)}
+    for name, (legacy, current) in cases.items():
+        before, after = measure(legacy, args.repeat), measure(current, args.repeat)
+        results[name] = {
+            'legacy': before,
+            'current': after,
+            'speedup': round(before['median_ms'] / max(after['median_ms'], 1e-9), 2),
+            'alloc_ratio': round(after['peak_mb'] / max(before['peak_mb'], 1e-9), 2),
+        }
+        print(f"  {name:<26} {before['median_ms']:>9.1f} -> {after['median_ms']:>9.1f} ms   "
+              f"{before['peak_mb']:>8.1f} -> {after['peak_mb']:>8.1f} MB peak")
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            fh.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""
+load_test.py
+------------
+Concurrent-session load test for the dashboard's page data.
+
+Streamlit serves every session from threads of one process, so a session is
+simulated as a thread rendering the data behind each page: the Live Map
+frame for one region, the Analytics aggregates and a Data Table page (with
+its CSV).  The database is set up as in run_benchmarks.py (stub API, one
+real ingest cycle, seeded history).  Each round runs one more ingest cycle,
+i.e. a new data version, then every session renders all three pages at
+once, the way auto-refresh makes them do.
+
+Two modes are compared:
+
+  direct   the pages' previous data path, computed by each session
+  cached   utils.page_cache, computed once per data version and shared
+
+    python benchmarks/load_test.py --vehicles 5000 --sessions 1 10 50
+
+Streamlit logs a "No runtime found" warning per cache; the caches behave the
+same without a server.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from run_benchmarks import StubAPI, _point_pipeline_at, _run_cycle, _summary  # noqa: E402
+from synthetic import Network  # noqa: E402
+from utils import data_processor, db, fleet, gtfs_static, ingestion, page_cache, writer  # noqa: E402
+import duckdb  # noqa: E402
+
+# Regions a Data Table session starts with (the page's default is the first three)
+TABLE_REGIONS = 3
+
+
+# ---------------------------------------------------------------------------
+# One page render per mode
+# ---------------------------------------------------------------------------
+
+def _render_direct(region, table_regions):
+    """What the pages computed per session before utils.page_cache."""
+    snapshot = fleet.get_snapshot()
+    data_processor.prepare_map_data(snapshot.frame(region), region)
+
+    df, _, _ = db.get_historical_data()
+    df = data_processor.convert_speed_to_kmh(df.copy())
+    df.groupby('region')['vehicle_id'].nunique()
+    df.groupby('vehicle_id')['speed'].mean()
+    df.groupby(['vehicle_id', 'region'])['speed'].mean()
+    moving = df[df['speed'] > 0]['speed']
+    moving.max(), moving.min(), moving.mean(), moving.median()
+
+    df, _, _ = db.get_historical_data()
+    display_df = data_processor.format_display_dataframe(data_processor.select_regions(df, table_regions))
+    display_df.to_csv(index=False).encode('utf-8')
+
+
+def _render_cached(region, table_regions):
+    version = page_cache.data_version()
+    page_cache.live_snapshot(version)
+    page_cache.map_frame(version, region)
+    page_cache.analytics(version)
+    page_cache.history_regions(version)
+    page_cache.table_page(version, tuple(table_regions))
+
+
+RENDERERS = {'direct': _render_direct, 'cached': _render_cached}
+
+
+def _clear_caches():
+    for fn in (page_cache.live_snapshot, page_cache.history, page_cache.map_frame,
+               page_cache.analytics, page_cache.history_regions, page_cache.table_page):
+        fn.clear()
+
+
+def run_sessions(api, network, database, mode, n_sessions, rounds):
+    """Run *rounds* ingest + render rounds; return latency / throughput stats."""
+    render = RENDERERS[mode]
+    regions = data_processor.get_region_options()
+    _clear_caches()
+
+    # Count full-history reads (the expensive query every session used to run)
+    reads = []
+    get_historical_data = db.get_historical_data
+
+    def counted():
+        reads.append(1)
+        return get_historical_data()
+    db.get_historical_data = counted
+
+    latencies, round_ms = [], []
+
+    def session(i):
+        start = time.perf_counter()
+        render(regions[i % len(regions)], regions[:TABLE_REGIONS])
+        return (time.perf_counter() - start) * 1000
+
+    try:
+        with ThreadPoolExecutor(n_sessions) as pool:
+            for _ in range(rounds):
+                _run_cycle(api, network, database)
+                start = time.perf_counter()
+                latencies.extend(pool.map(session, range(n_sessions)))
+                round_ms.append((time.perf_counter() - start) * 1000)
+    finally:
+        db.get_historical_data = get_historical_data
+
+    return {
+        'render': _summary(latencies),
+        'round_median_ms': round(float(np.median(round_ms)), 2),
+        'history_reads_per_round': len(reads) / rounds,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--vehicles', type=int, default=5000, help='fleet size')
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 10, 50], help='concurrent sessions')
+    parser.add_argument('--modes', nargs='+', choices=list(RENDERERS), default=list(RENDERERS),
+                        help='modes to measure (direct holds a history copy per session)')
+    parser.add_argument('--rounds', type=int, default=3, help='ingest + render rounds per measurement')
+    parser.add_argument('--routes', type=int, default=20, help='routes per region')
+    parser.add_argument('--history-days', type=float, default=1, help='days of seeded history')
+    parser.add_argument('--history-interval', type=int, default=600, help='seconds between history pings')
+    parser.add_argument('--history-vehicles', type=int, default=1000, help='vehicles with seeded history')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results JSON here')
+    args = parser.parse_args(argv)
+    args.workers = 0
+
+    workdir = tempfile.mkdtemp(prefix='transit-load-')
+    api = StubAPI()
+    report = {'args': vars(args), 'runs': []}
+    try:
+        database = _point_pipeline_at(api, workdir, args)
+        network = Network(args.vehicles, routes_per_region=args.routes, t0=time.time(), seed=args.seed)
+        api.static = {slug: network.static_zip(slug) for slug in gtfs_static.STATIC_API_SOURCES.values()}
+        _run_cycle(api, network, database)
+        if args.history_days > 0:
+            sql = network.history_sql(args.history_days, args.history_interval,
+                                      args.history_vehicles, end=_run_cycle.last - 1)
+            columns = 'region, vehicle_id, trip_id, route_id, latitude, longitude, bearing, speed, ' \
+                      'timestamp, insert_timestamp, created_at'
+            con = duckdb.connect(database)
+            con.execute(f"INSERT INTO {ingestion.DATABASE_TABLE} ({columns}) {sql}")
+            rows = con.execute(f"SELECT count(*) FROM {ingestion.DATABASE_TABLE}").fetchone()[0]
+            con.close()
+            print(f"{args.vehicles:,} vehicles, {rows:,} history rows")
+
+        print(f"{'sessions':>8} {'mode':<7} {'render p50':>11} {'render p95':>11} {'round':>10} {'history reads':>14}")
+        for n_sessions in args.sessions:
+            for mode in args.modes:
+                result = run_sessions(api, network, database, mode, n_sessions, args.rounds)
+                report['runs'].append(dict(result, sessions=n_sessions, mode=mode))
+                print(f"{n_sessions:>8} {mode:<7} {result['render']['median_ms']:>9.1f}ms "
+                      f"{result['render']['p95_ms']:>9.1f}ms {result['round_median_ms']:>8.0f}ms "
+                      f"{result['history_reads_per_round']:>14.0f}")
+    finally:
+        writer.close_all()
+        api.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            fh.write(json.dumps(report, indent=2) + '\n')
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
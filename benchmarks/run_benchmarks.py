@@ -0,0 +1,323 @@
+"""
+run_benchmarks.py
+-----------------
+Reproducible end-to-end benchmarks on a synthetic fleet.
+
+For each fleet size a fresh DuckDB file is created in a temp directory and a
+local stub HTTP server stands in for api.data.gov.my, serving synthetic GTFS
+Realtime feeds and GTFS Static ZIPs (see synthetic.py).  The real pipeline and
+query code then run against it unchanged:
+
+  ingest_cold        first cycle (static ZIP download, index builds, CREATE TABLE)
+  ingest_cycle       steady-state cycles with moving vehicles (+ per-stage split)
+  ingest_duplicate   a cycle where every row is a duplicate (dedup cost)
+  live_query         db.get_live_data_optimized
+  history_query      db.get_historical_data over the seeded history
+  trail              db.get_vehicle_trail
+  analytics          the Analytics page aggregations over the history frame
+  route_lookup       gtfs_static.get_shapes_for_trip + get_route_name
+
+Results are written as JSON so runs can be compared across commits:
+
+    python benchmarks/run_benchmarks.py --vehicles 1000 10000 --output before.json
+    python benchmarks/run_benchmarks.py --vehicles 1000 10000 --compare before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, 'src'))
+os.environ.setdefault('NO_PROXY', '127.0.0.1,localhost')
+
+import duckdb  # noqa: E402
+
+from utils import data_processor, db, gtfs_static, headways, ingestion, motion, schedule, trips, writer  # noqa: E402
+from synthetic import Network  # noqa: E402
+
+# Slower than baseline by more than this factor is reported as a regression
+REGRESSION_RATIO = 1.2
+
+
+# ---------------------------------------------------------------------------
+# Stub API server
+# ---------------------------------------------------------------------------
+
+class StubAPI:
+    """Serves ``/gtfs-realtime/vehicle-position/<endpoint>`` and ``/gtfs-static/<slug>``."""
+
+    def __init__(self):
+        self.realtime = {}
+        self.static = {}
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                prefix, _, key = self.path.lstrip('/').partition('/')
+                if prefix == 'gtfs-realtime':
+                    body = api.realtime.get(key.partition('/')[2])
+                elif prefix == 'gtfs-static':
+                    body = api.static.get(key)
+                else:
+                    body = None
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base_url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+
+def _summary(samples_ms):
+    samples = np.asarray(samples_ms, dtype='float64')
+    return {
+        'runs': len(samples),
+        'min_ms': round(float(samples.min()), 2),
+        'median_ms': round(float(np.median(samples)), 2),
+        'p95_ms': round(float(np.percentile(samples, 95)), 2),
+        'max_ms': round(float(samples.max()), 2),
+    }
+
+
+def _time(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return _summary(samples)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _point_pipeline_at(api, workdir, args):
+    """Redirect the ingest / query modules to the stub server and a temp database."""
+    database = os.path.join(workdir, 'bench.duckdb')
+    ingestion.API_BASE_URL = f'{api.base_url}/gtfs-realtime/vehicle-position/'
+    ingestion.DATABASE_NAME = database
+    ingestion.METRICS_PORT = None
+    ingestion.INGEST_WORKERS = args.workers
+    db.DATABASE_NAME = database
+    gtfs_static.STATIC_API_BASE_URL = f'{api.base_url}/gtfs-static/'
+    gtfs_static.CACHE_DIR = workdir
+
+    # Forget anything cached from a previous fleet size
+    gtfs_static._INDEX_CACHE.clear()
+    gtfs_static._FAILED.clear()
+    motion.reset_state()
+    trips.reset_state()
+    headways.reset_state()
+    schedule.reset_state()
+    return database
+
+
+def _wait_for_next_second(previous):
+    """Cycles are keyed by unix second, so never run two in the same one."""
+    while int(time.time()) <= previous:
+        time.sleep(0.05)
+    return int(time.time())
+
+
+def _run_cycle(api, network, database, feed_time=None, payloads=None):
+    """Serve a feed, run one ingest cycle, return (wall_ms, {stage: ms})."""
+    cycle_ts = _wait_for_next_second(getattr(_run_cycle, 'last', 0))
+    _run_cycle.last = cycle_ts
+    api.realtime = payloads if payloads is not None else network.feed_payloads(feed_time or cycle_ts)
+
+    # Pass the cycle time explicitly: generating a large feed can take longer than a second
+    start = time.perf_counter()
+    ingestion.fetch_and_store_transit_data(current_unix=cycle_ts)
+    wall_ms = (time.perf_counter() - start) * 1000
+
+    con = duckdb.connect(database)
+    stages = con.execute(
+        f"""
+        SELECT stage, SUM(duration_ms) FROM {ingestion.METRICS_TABLE}
+        WHERE cycle_ts = ? AND (endpoint IS NULL OR endpoint = '') AND duration_ms IS NOT NULL
+        GROUP BY stage
+        """,
+        [cycle_ts],
+    ).fetchall()
+    con.close()
+    return wall_ms, {stage: round(ms, 2) for stage, ms in stages}
+
+
+# ---------------------------------------------------------------------------
+# Benchmarks
+# ---------------------------------------------------------------------------
+
+def bench_fleet(n_vehicles, args):
+    """Run every benchmark for one fleet size; return its results dict."""
+    workdir = tempfile.mkdtemp(prefix='transit-bench-')
+    api = StubAPI()
+    try:
+        database = _point_pipeline_at(api, workdir, args)
+        network = Network(n_vehicles, routes_per_region=args.routes, t0=time.time(), seed=args.seed)
+        api.static = {slug: network.static_zip(slug) for slug in gtfs_static.STATIC_API_SOURCES.values()}
+        results = {}
+
+        # ---- Ingest: cold start, then seed history behind the live table ----
+        wall_ms, stages = _run_cycle(api, network, database)
+        results['ingest_cold'] = dict(_summary([wall_ms]), stages_ms=stages)
+
+        history_rows = 0
+        if args.history_days > 0:
+            con = duckdb.connect(database)
+            start = time.perf_counter()
+            sql = network.history_sql(args.history_days, args.history_interval,
+                                      args.history_vehicles, end=_run_cycle.last - 1)
+            columns = 'region, vehicle_id, trip_id, route_id, latitude, longitude, bearing, speed, ' \
+                      'timestamp, insert_timestamp, created_at'
+            con.execute(f"INSERT INTO {ingestion.DATABASE_TABLE} ({columns}) {sql}")
+            history_rows = con.execute(f"SELECT count(*) FROM {ingestion.DATABASE_TABLE}").fetchone()[0]
+            con.close()
+            print(f"  seeded {history_rows:,} rows in {time.perf_counter() - start:.1f} s")
+
+        # ---- Ingest: steady state ----
+        walls, per_stage = [], {}
+        for _ in range(args.cycles):
+            wall_ms, stages = _run_cycle(api, network, database)
+            walls.append(wall_ms)
+            for stage, ms in stages.items():
+                per_stage.setdefault(stage, []).append(ms)
+        results['ingest_cycle'] = dict(
+            _summary(walls), stages_ms={s: round(float(np.median(v)), 2) for s, v in per_stage.items()}
+        )
+
+        # ---- Ingest: every row already stored ----
+        wall_ms, stages = _run_cycle(api, network, database, payloads=api.realtime)
+        results['ingest_duplicate'] = dict(_summary([wall_ms]), stages_ms=stages)
+
+        # ---- Queries ----
+        rng = np.random.default_rng(args.seed)
+        sample = network.vehicles.iloc[rng.integers(0, len(network.vehicles), args.repeat)]
+
+        results['live_query'] = _time(db.get_live_data_optimized, args.repeat)
+        results['history_query'] = _time(db.get_historical_data, max(1, args.repeat // 3))
+
+        trails = iter(zip(sample['vehicle_id'], sample['region']))
+        results['trail'] = _time(lambda: db.get_vehicle_trail(*next(trails)), args.repeat)
+
+        history, _, _ = db.get_historical_data()
+
+        def analytics():
+            df = data_processor.convert_speed_to_kmh(history.copy())
+            df.groupby('region')['vehicle_id'].nunique()
+            df.groupby(['vehicle_id', 'region'])['speed'].mean()
+            moving = df[df['speed'] > 0]['speed']
+            moving.mean(), moving.median(), moving.max(), moving.min()
+        results['analytics'] = _time(analytics, max(1, args.repeat // 3))
+
+        lookups = iter(zip(sample['region'], sample['trip_id'], sample['route_id']))
+
+        def route_lookup():
+            region, trip_id, route_id = next(lookups)
+            slug = gtfs_static.STATIC_API_SOURCES[region]
+            gtfs_static.get_shapes_for_trip(slug, trip_id)
+            gtfs_static.get_route_name(slug, route_id)
+        results['route_lookup'] = _time(route_lookup, args.repeat)
+
+        return {'vehicles': n_vehicles, 'history_rows': int(history_rows), 'results': results}
+    finally:
+        writer.close_all()
+        api.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(current, baseline):
+    """Print median deltas against a previous results file."""
+    previous = {run['vehicles']: run['results'] for run in baseline['runs']}
+    print(f"\nvs {baseline['meta'].get('commit') or 'baseline'}:")
+    for run in current['runs']:
+        old = previous.get(run['vehicles'])
+        if old is None:
+            continue
+        for name, result in run['results'].items():
+            if name not in old:
+                continue
+            ratio = result['median_ms'] / max(old[name]['median_ms'], 1e-9)
+            flag = '  << regression' if ratio > REGRESSION_RATIO else ''
+            print(f"  {run['vehicles']:>7} {name:<18} {old[name]['median_ms']:>10.1f} -> "
+                  f"{result['median_ms']:>10.1f} ms  ({ratio:.2f}x){flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--vehicles', type=int, nargs='+', default=[1000, 10000],
+                        help='fleet sizes to benchmark')
+    parser.add_argument('--cycles', type=int, default=5, help='steady-state ingest cycles')
+    parser.add_argument('--repeat', type=int, default=10, help='repetitions per query benchmark')
+    parser.add_argument('--routes', type=int, default=20, help='routes per region')
+    parser.add_argument('--history-days', type=float, default=7, help='days of seeded history')
+    parser.add_argument('--history-interval', type=int, default=600, help='seconds between history pings')
+    parser.add_argument('--history-vehicles', type=int, default=1000, help='vehicles with seeded history')
+    parser.add_argument('--workers', type=int, default=0, help='INGEST_WORKERS (0 = in-process threads)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results JSON here (default: stdout)')
+    parser.add_argument('--compare', help='previous results JSON to compare against')
+    args = parser.parse_args(argv)
+
+    report = {
+        'meta': {
+            'commit': _git_commit(),
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'duckdb': duckdb.__version__,
+            'platform': platform.platform(),
+            'args': vars(args),
+        },
+        'runs': [],
+    }
+    for n_vehicles in args.vehicles:
+        print(f"Benchmarking {n_vehicles:,} vehicles...")
+        report['runs'].append(bench_fleet(n_vehicles, args))
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            fh.write(text + '\n')
+        print(f"Results written to {args.output}")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as fh:
+            compare(report, json.load(fh))
+
+
+if __name__ == '__main__':
+    main()
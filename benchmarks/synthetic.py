@@ -0,0 +1,252 @@
+"""
+synthetic.py
+------------
+Deterministic synthetic transit network for benchmarks.
+
+Every region gets a set of straight routes radiating from its city centre,
+one trip per vehicle, and stops every few shape points.  Vehicle positions are
+a pure function of time, so feeds generated for consecutive cycles show
+vehicles moving along their shapes, roughly on schedule, which exercises the
+map matching, motion and schedule stages the same way real data does.
+
+  - ``Network.feed_payloads(t)``  -> {endpoint: FeedMessage bytes}
+  - ``Network.static_zip(slug)``  -> GTFS Static ZIP bytes
+  - ``Network.history_sql(...)``  -> DuckDB SELECT producing months of pings
+"""
+
+import io
+import zipfile
+
+import numpy as np
+import pandas as pd
+from google.transit import gtfs_realtime_pb2
+
+from utils import geo
+from utils.gtfs_static import STATIC_API_SOURCES
+from utils.ingestion import API_SOURCES
+
+# Approximate city centres so generated points pass the same filters as real ones
+REGION_CENTRES = {
+    'Rapid Bus KL': (3.139, 101.687),
+    'Rapid Bus MRT Feeder': (3.073, 101.607),
+    'Rapid Bus Kuantan': (3.817, 103.326),
+    'Rapid Bus Penang': (5.414, 100.329),
+    'KTM Berhad': (3.134, 101.686),
+    'myBAS Kangar': (6.441, 100.198),
+    'myBAS Alor Setar': (6.121, 100.367),
+    'myBAS Kota Bharu': (6.125, 102.238),
+    'myBAS Kuala Terengganu': (5.329, 103.137),
+    'myBAS Ipoh': (4.597, 101.090),
+    'myBAS Seremban': (2.726, 101.938),
+    'myBAS Melaka': (2.189, 102.250),
+    'myBAS Johor': (1.492, 103.741),
+    'myBAS Kuching': (1.553, 110.359),
+}
+
+ROUTE_LENGTH_M = 12_000
+SHAPE_POINT_SPACING_M = 200
+STOP_EVERY_N_POINTS = 3
+NOMINAL_SPEED_MPS = 8.0
+UTC_OFFSET_HOURS = 8
+
+
+class Network:
+    """
+    Synthetic routes, trips and vehicles for *n_vehicles* spread evenly over
+    every endpoint in ``API_SOURCES``.
+
+    Args:
+        n_vehicles: Total fleet size
+        routes_per_region: Number of routes per region
+        t0: Unix time the schedule is anchored to (vehicles are on time at t0)
+        seed: RNG seed
+    """
+
+    def __init__(self, n_vehicles, routes_per_region=20, t0=0, seed=0):
+        rng = np.random.default_rng(seed)
+        self.t0 = int(t0)
+        self.endpoints = [(region, ep) for region, eps in API_SOURCES.items() for ep in eps]
+        self.regions = list(API_SOURCES)
+
+        # ---- routes: straight lines from the centre at random headings ----
+        n_points = ROUTE_LENGTH_M // SHAPE_POINT_SPACING_M + 1
+        self.shape_dist = np.arange(n_points) * float(SHAPE_POINT_SPACING_M)
+        routes = []
+        for r_i, region in enumerate(self.regions):
+            lat0, lon0 = REGION_CENTRES[region]
+            for k in range(routes_per_region):
+                theta = rng.uniform(0, 2 * np.pi)
+                x = np.sin(theta) * self.shape_dist
+                y = np.cos(theta) * self.shape_dist
+                lat, lon = geo.unproject_local(x, y, lat0)
+                routes.append({
+                    'region': region, 'route_id': f'R{r_i:02d}{k:03d}',
+                    'lat0': lat0, 'lon0': lon0, 'lat': lat + lat0, 'lon': lon + lon0,
+                    'lat_end': lat[-1] + lat0, 'lon_end': lon[-1] + lon0,
+                })
+        self.routes = pd.DataFrame(routes)
+
+        # ---- vehicles: one trip each, assigned round-robin to endpoints ----
+        ep_of_vehicle = np.arange(n_vehicles) % len(self.endpoints)
+        region_of_vehicle = np.array([self.endpoints[e][0] for e in ep_of_vehicle])
+        route_in_region = rng.integers(0, routes_per_region, n_vehicles)
+        region_code = pd.Index(self.regions).get_indexer(region_of_vehicle)
+        self.vehicles = pd.DataFrame({
+            'vehicle_id': [f'V{i:06d}' for i in range(n_vehicles)],
+            'trip_id': [f'T{i:06d}' for i in range(n_vehicles)],
+            'endpoint': ep_of_vehicle,
+            'region': region_of_vehicle,
+            'route_row': region_code * routes_per_region + route_in_region,
+            # Position along the route at t0 and per-vehicle speed
+            'offset_m': rng.uniform(0, ROUTE_LENGTH_M, n_vehicles),
+            'speed_mps': rng.uniform(0.6, 1.2, n_vehicles) * NOMINAL_SPEED_MPS,
+        })
+        self.vehicles['route_id'] = self.routes['route_id'].to_numpy()[self.vehicles['route_row']]
+
+    # ------------------------------------------------------------------
+    # Positions
+    # ------------------------------------------------------------------
+
+    def positions(self, t):
+        """Latitude, longitude and bearing of every vehicle at unix time *t*."""
+        v = self.vehicles
+        dist = (v['offset_m'].to_numpy() + v['speed_mps'].to_numpy() * (t - self.t0)) % ROUTE_LENGTH_M
+        route = self.routes.iloc[v['route_row'].to_numpy()]
+        lat0, lon0 = route['lat0'].to_numpy(), route['lon0'].to_numpy()
+        lat_end, lon_end = route['lat_end'].to_numpy(), route['lon_end'].to_numpy()
+        frac = dist / ROUTE_LENGTH_M
+        lat = lat0 + (lat_end - lat0) * frac
+        lon = lon0 + (lon_end - lon0) * frac
+        bearing = geo.initial_bearing_deg(lat0, lon0, lat_end, lon_end)
+        return lat, lon, bearing
+
+    # ------------------------------------------------------------------
+    # GTFS Realtime
+    # ------------------------------------------------------------------
+
+    def feed_payloads(self, t):
+        """Serialized FeedMessage per endpoint with every vehicle's position at *t*."""
+        lat, lon, bearing = self.positions(t)
+        v = self.vehicles
+        payloads = {}
+        for e, (region, endpoint) in enumerate(self.endpoints):
+            feed = gtfs_realtime_pb2.FeedMessage()
+            feed.header.gtfs_realtime_version = '2.0'
+            feed.header.timestamp = int(t)
+            for i in np.flatnonzero(v['endpoint'].to_numpy() == e):
+                entity = feed.entity.add()
+                entity.id = v['vehicle_id'].iat[i]
+                vp = entity.vehicle
+                vp.vehicle.id = v['vehicle_id'].iat[i]
+                vp.trip.trip_id = v['trip_id'].iat[i]
+                vp.trip.route_id = v['route_id'].iat[i]
+                vp.position.latitude = lat[i]
+                vp.position.longitude = lon[i]
+                vp.position.bearing = bearing[i]
+                vp.position.speed = v['speed_mps'].iat[i]
+                vp.timestamp = int(t)
+            payloads[endpoint] = feed.SerializeToString()
+        return payloads
+
+    # ------------------------------------------------------------------
+    # GTFS Static
+    # ------------------------------------------------------------------
+
+    def static_zip(self, slug):
+        """GTFS Static ZIP (routes, trips, shapes, stops, stop_times) for *slug*."""
+        region = next(r for r, s in STATIC_API_SOURCES.items() if s == slug)
+        routes = self.routes[self.routes['region'] == region]
+        vehicles = self.vehicles[self.vehicles['region'] == region]
+        n_points = len(self.shape_dist)
+
+        shapes = pd.DataFrame({
+            'shape_id': np.repeat(routes['route_id'].to_numpy(), n_points),
+            'shape_pt_lat': np.concatenate(routes['lat'].to_numpy()).round(6) if len(routes) else [],
+            'shape_pt_lon': np.concatenate(routes['lon'].to_numpy()).round(6) if len(routes) else [],
+            'shape_pt_sequence': np.tile(np.arange(n_points), len(routes)),
+            'shape_dist_traveled': np.tile(self.shape_dist, len(routes)),
+        })
+        stop_points = np.arange(0, n_points, STOP_EVERY_N_POINTS)
+        stop_shapes = shapes[shapes['shape_pt_sequence'].isin(stop_points)]
+        stops = pd.DataFrame({
+            'stop_id': stop_shapes['shape_id'] + '_' + stop_shapes['shape_pt_sequence'].astype(str),
+            'stop_name': 'Stop ' + stop_shapes['shape_id'] + '/' + stop_shapes['shape_pt_sequence'].astype(str),
+            'stop_lat': stop_shapes['shape_pt_lat'],
+            'stop_lon': stop_shapes['shape_pt_lon'],
+        })
+
+        # Each trip is scheduled so the vehicle is exactly on time at t0
+        local_t0 = (self.t0 + UTC_OFFSET_HOURS * 3600) % 86400
+        start = (local_t0 - vehicles['offset_m'].to_numpy() / vehicles['speed_mps'].to_numpy()) % 86400
+        n_stops = len(stop_points)
+        arrival = (np.repeat(start, n_stops)
+                   + np.tile(self.shape_dist[stop_points], len(vehicles)) / np.repeat(vehicles['speed_mps'].to_numpy(), n_stops))
+        arrival = arrival.astype('int64')
+        stop_times = pd.DataFrame({
+            'trip_id': np.repeat(vehicles['trip_id'].to_numpy(), n_stops),
+            'arrival_time': _gtfs_time(arrival),
+            'departure_time': _gtfs_time(arrival),
+            'stop_id': np.repeat(vehicles['route_id'].to_numpy(), n_stops).astype(object)
+                       + '_' + np.tile(stop_points.astype(str), len(vehicles)).astype(object),
+            'stop_sequence': np.tile(np.arange(1, n_stops + 1), len(vehicles)),
+        })
+
+        files = {
+            'agency.txt': pd.DataFrame({'agency_id': [slug], 'agency_name': [region]}),
+            'routes.txt': pd.DataFrame({
+                'route_id': routes['route_id'], 'route_short_name': routes['route_id'],
+                'route_long_name': region + ' ' + routes['route_id'], 'route_type': 3,
+            }),
+            'trips.txt': pd.DataFrame({
+                'route_id': vehicles['route_id'], 'service_id': 'WKD',
+                'trip_id': vehicles['trip_id'], 'shape_id': vehicles['route_id'],
+            }),
+            'shapes.txt': shapes,
+            'stops.txt': stops,
+            'stop_times.txt': stop_times,
+        }
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for name, frame in files.items():
+                zf.writestr(name, frame.to_csv(index=False))
+        return buffer.getvalue()
+
+    # ------------------------------------------------------------------
+    # History
+    # ------------------------------------------------------------------
+
+    def history_sql(self, days, interval_s, n_vehicles, end):
+        """
+        DuckDB SELECT yielding one ping every *interval_s* for the first
+        *n_vehicles* vehicles over the *days* before *end*, with the columns
+        of the live table's original schema.
+        """
+        n_vehicles = min(n_vehicles, len(self.vehicles))
+        n_steps = int(days * 86400 // interval_s)
+        v = self.vehicles.iloc[:n_vehicles]
+        regions = ', '.join(f"'{r}'" for r in v['region'])
+        routes = ', '.join(f"'{r}'" for r in v['route_id'])
+        return f"""
+            SELECT
+                list_extract([{regions}], CAST(vi + 1 AS INTEGER)) AS region,
+                printf('V%06d', vi) AS vehicle_id,
+                CAST(printf('T%06d', vi) AS VARCHAR) AS trip_id,
+                list_extract([{routes}], CAST(vi + 1 AS INTEGER)) AS route_id,
+                1.5 + hash(vi) % 5000 / 1000.0 + sin(step / 50.0) * 0.01 AS latitude,
+                100.2 + hash(vi * 7) % 10000 / 1000.0 + cos(step / 50.0) * 0.01 AS longitude,
+                CAST(step * 7 % 360 AS DOUBLE) AS bearing,
+                CAST(hash(vi + step) % 15 AS DOUBLE) AS speed,
+                CAST({int(end)} - ({n_steps} - step) * {int(interval_s)} AS VARCHAR) AS timestamp,
+                {int(end)} - ({n_steps} - step) * {int(interval_s)} AS insert_timestamp,
+                to_timestamp({int(end)} - ({n_steps} - step) * {int(interval_s)}) AS created_at
+            FROM range({n_vehicles}) v(vi), range({n_steps}) s(step)
+        """
+
+
+def _gtfs_time(seconds):
+    """Seconds after midnight -> 'HH:MM:SS' (hours may exceed 24)."""
+    seconds = np.asarray(seconds, dtype='int64')
+    h, rem = np.divmod(seconds, 3600)
+    m, s = np.divmod(rem, 60)
+    return pd.Series(h).astype(str).str.zfill(2) + ':' + pd.Series(m).astype(str).str.zfill(2) \
+        + ':' + pd.Series(s).astype(str).str.zfill(2)
@@ -1,5 +1,4 @@
 import streamlit as st
-from streamlit_autorefresh import st_autorefresh
 from datetime import datetime, timedelta, timezone
 
 # Import config
@@ -41,6 +40,7 @@ if 'selected_regions_table' not in st.session_state:
 # Auto refresh MUST be at the top before any other widgets
 if st.session_state.auto_refresh:
     # Trigger a rerun every 20s when auto refresh is enabled
+    from streamlit_autorefresh import st_autorefresh
     st_autorefresh(interval=20_000, key="auto_refresh_counter")
 
 # Frozen header CSS
@@ -75,10 +75,11 @@ st.markdown(f"""
 with st.sidebar:
     # Page navigation (moved to the top of the sidebar)
     st.subheader("📍 Navigation")
+    pages = ["🗺️ Live Map", "📊 Data Table", "📈 Analytics", "🚏 Routes", "🩺 Pipeline Health"]
     page = st.radio(
         "Select View",
-        ["🗺️ Live Map", "📊 Data Table", "📈 Analytics"],
-        index=["🗺️ Live Map", "📊 Data Table", "📈 Analytics"].index(st.session_state.current_page),
+        pages,
+        index=pages.index(st.session_state.current_page),
         label_visibility="collapsed",
         key="page_radio"
     )
@@ -128,6 +129,12 @@ if st.session_state.current_page == "🗺️ Live Map":
 elif st.session_state.current_page == "📊 Data Table":
     from app_pages import data_table
     data_table.show()
+elif st.session_state.current_page == "🚏 Routes":
+    from app_pages import routes
+    routes.show()
+elif st.session_state.current_page == "🩺 Pipeline Health":
+    from app_pages import pipeline_health
+    pipeline_health.show()
 else:
     from app_pages import analytics
     analytics.show()
\ No newline at end of file
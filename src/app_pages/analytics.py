@@ -1,37 +1,36 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-from utils import db, data_processor
-from utils.ingestion import fetch_and_store_transit_data
+from utils import data_processor, page_cache
 
 
 def show():
-    # Refresh behaviour
+    # Imported here so merely loading the page stays cheap
+    import plotly.express as px
+
+    # Refresh behaviour (ingestion is only imported when a fetch actually runs)
     if st.session_state.auto_refresh:
         with st.spinner('🛰️ Auto-refreshing...'):
-            fetch_and_store_transit_data()
+            # At most one ingest cycle per interval, shared by every session
+            page_cache.refresh()
             st.session_state.last_refresh = True
     else:
         # Manual refresh button
         if st.button("🔄 Refresh Data", type="primary"):
             with st.spinner('🛰️ Fetching...'):
-                fetch_and_store_transit_data()
+                page_cache.refresh(min_interval=0)
                 st.session_state.last_refresh = True
             st.rerun()
 
-    # Get LATEST live data for current vehicle counts
-    df_live, _, actual_sync_time = db.get_live_data_optimized()
-    
-    # Get ALL historical data for charts and speed statistics
-    df_historical, _, _ = db.get_historical_data()
+    # Get LATEST live data for current vehicle counts, and the aggregates over
+    # ALL historical data (computed once per data version for every session)
+    version = page_cache.data_version()
+    snapshot = page_cache.live_snapshot(version)
+    aggregates = page_cache.analytics(version)
 
-    if df_live is None or df_live.empty or df_historical is None or df_historical.empty:
+    if snapshot is None or len(snapshot) == 0 or aggregates is None:
         st.info("🛰️ No data available. Please refresh.")
         return
-
-    # Convert speed using helper function
-    df_live = data_processor.convert_speed_to_kmh(df_live.copy())
-    df_historical = data_processor.convert_speed_to_kmh(df_historical.copy())
+    actual_sync_time = snapshot.sync_time
 
     # Show sync time
     if actual_sync_time:
@@ -42,10 +41,8 @@ def show():
 
     with col_chart1:
         st.subheader("📊 Buses by Region")
-        # Count DISTINCT vehicle_id per region
-        region_counts = df_historical.groupby('region')['vehicle_id'].nunique().reset_index()
-        region_counts.columns = ['Region', 'Count']
-        region_counts = region_counts.sort_values('Count', ascending=True)
+        # DISTINCT vehicle_id per region
+        region_counts = aggregates['region_counts']
 
         fig1 = px.bar(
             region_counts,
@@ -62,9 +59,8 @@ def show():
 
     with col_chart2:
         st.subheader("🏃 Speed Distribution")
-        # Calculate average speed per vehicle (not raw data points)
-        avg_speed_per_vehicle = df_historical.groupby('vehicle_id')['speed'].mean().reset_index()
-        avg_speed_per_vehicle.columns = ['vehicle_id', 'avg_speed']
+        # Average speed per vehicle (not raw data points)
+        avg_speed_per_vehicle = aggregates['avg_speed_per_vehicle']
         # Filter out zero speeds
         speed_data = avg_speed_per_vehicle[avg_speed_per_vehicle['avg_speed'] > 0]
 
@@ -95,9 +91,8 @@ def show():
     # Speed by region box plot (using average speed per vehicle)
     st.subheader("📈 Speed Analysis by Region")
     
-    # Calculate avg speed per vehicle with region info - INCLUDE ALL VEHICLES (even speed=0)
-    vehicle_avg_speeds = df_historical.groupby(['vehicle_id', 'region'])['speed'].mean().reset_index()
-    vehicle_avg_speeds.columns = ['vehicle_id', 'region', 'avg_speed']
+    # Avg speed per vehicle with region info - INCLUDE ALL VEHICLES (even speed=0)
+    vehicle_avg_speeds = aggregates['vehicle_avg_speeds']
     # DON'T filter out zero speeds - show all regions with data
 
     fig4 = px.box(
@@ -117,32 +112,31 @@ def show():
 
     stats_col1, stats_col2, stats_col3 = st.columns(3)
     
-    # Filter to moving vehicles only (speed > 0) for consistent speed metrics
-    moving_vehicles_historical = df_historical[df_historical['speed'] > 0]
+    # Speed stats over moving pings only (speed > 0), None if there are none
+    moving_speed = aggregates['moving_speed']
 
     with stats_col1:
         # Total unique vehicles from HISTORICAL data (distinct vehicle_id)
-        total_unique_vehicles = df_historical['vehicle_id'].nunique()
-        st.metric("Total Vehicles", total_unique_vehicles)
+        st.metric("Total Vehicles", aggregates['total_vehicles'])
         
         # Moving vehicles from LIVE data (speed > 0, distinct vehicle_id)
-        moving_count = len(df_live[df_live['speed'] > 0])
+        moving_count = int((data_processor.speed_kmh(snapshot.frame()) > 0).sum())
         st.metric("Moving Vehicles", moving_count)
 
     with stats_col2:
         # All speed stats from HISTORICAL moving vehicles (excludes stopped buses)
-        if len(moving_vehicles_historical) > 0:
-            st.metric("Max Speed", f"{moving_vehicles_historical['speed'].max():.2f} km/h")
-            st.metric("Min Speed", f"{moving_vehicles_historical['speed'].min():.2f} km/h")
+        if moving_speed is not None:
+            st.metric("Max Speed", f"{moving_speed['max']:.2f} km/h")
+            st.metric("Min Speed", f"{moving_speed['min']:.2f} km/h")
         else:
             st.metric("Max Speed", "0.00 km/h")
             st.metric("Min Speed", "0.00 km/h")
 
     with stats_col3:
         # Avg and Median speed from HISTORICAL moving vehicles
-        if len(moving_vehicles_historical) > 0:
-            st.metric("Avg Speed", f"{moving_vehicles_historical['speed'].mean():.2f} km/h")
-            st.metric("Median Speed", f"{moving_vehicles_historical['speed'].median():.2f} km/h")
+        if moving_speed is not None:
+            st.metric("Avg Speed", f"{moving_speed['avg']:.2f} km/h")
+            st.metric("Median Speed", f"{moving_speed['median']:.2f} km/h")
         else:
             st.metric("Avg Speed", "0.00 km/h")
             st.metric("Median Speed", "0.00 km/h")
\ No newline at end of file
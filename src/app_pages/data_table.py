@@ -1,26 +1,28 @@
 import streamlit as st
-from utils import db, data_processor
-from utils.ingestion import fetch_and_store_transit_data
+from utils import data_processor, page_cache
 
 
 def show():
-    # Refresh behaviour
+    # Refresh behaviour (ingestion is only imported when a fetch actually runs)
     if st.session_state.auto_refresh:
         with st.spinner('🛰️ Auto-refreshing...'):
-            fetch_and_store_transit_data()
+            # At most one ingest cycle per interval, shared by every session
+            page_cache.refresh()
             st.session_state.last_refresh = True
     else:
         # Manual refresh button
         if st.button("🔄 Refresh Data", type="primary"):
             with st.spinner('🛰️ Fetching...'):
-                fetch_and_store_transit_data()
+                page_cache.refresh(min_interval=0)
                 st.session_state.last_refresh = True
             st.rerun()
 
-    # Get historical data (all data, not just latest)
-    df_historical, metrics, actual_sync_time = db.get_historical_data()
+    # Historical data (all data, not just latest), read once per data version
+    # and shared by every session
+    version = page_cache.data_version()
+    df_historical, actual_sync_time, _ = page_cache.history(version)
 
-    if df_historical is None or df_historical.empty:
+    if df_historical is None:
         st.info("🛰️ No data. Click 'Refresh Data' to fetch.")
         return
 
@@ -31,17 +33,10 @@ def show():
     # No metrics - just pure table
 
     # Hardcoded region list to prevent dropdown changes during auto-refresh
-    try:
-        from utils.ingestion import API_SOURCES
-        all_regions = list(API_SOURCES.keys())
-        # Sort with Rapid Bus KL first
-        hardcoded_regions = ['Rapid Bus KL'] + sorted([r for r in all_regions if r != 'Rapid Bus KL'])
-    except ImportError:
-        # Fallback to dynamic list if import fails
-        hardcoded_regions = data_processor.get_sorted_regions(df_historical)
-    
+    hardcoded_regions = data_processor.get_region_options()
+
     # Get available regions from current data
-    available_regions = data_processor.get_sorted_regions(df_historical)
+    available_regions = page_cache.history_regions(version)
 
     if not available_regions:
         st.info("No active buses.")
@@ -70,11 +65,8 @@ def show():
         st.warning("Please select at least one region")
         return
 
-    # Filter data
-    df_filtered = df_historical[df_historical['region'].isin(selected_regions)]
-
-    # Format and display
-    display_df = data_processor.format_display_dataframe(df_filtered)
+    # Filtered, formatted rows and their CSV (shared by sessions selecting the same regions)
+    display_df, csv = page_cache.table_page(version, tuple(selected_regions))
 
     st.dataframe(
         display_df,
@@ -84,7 +76,6 @@ def show():
     )
 
     # Download button
-    csv = display_df.to_csv(index=False).encode('utf-8')
     st.download_button(
         label="📥 Download CSV",
         data=csv,
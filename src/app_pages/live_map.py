@@ -1,33 +1,39 @@
+import base64
+import time
+from datetime import timedelta
+
 import streamlit as st
-import pydeck as pdk
 import numpy as np
 import pandas as pd
-from streamlit_js_eval import get_geolocation as js_get_geolocation
-from utils import db, data_processor
-from utils.ingestion import fetch_and_store_transit_data
-from utils import gtfs_static
+from utils import db, data_processor, keyframes, page_cache, render_budget
+from utils import gtfs_static, schedule, spatial_index, vehicle_search
 
 try:
-    from config import DEFAULT_ZOOM, ARROW_SIZE
+    from config import DEFAULT_ZOOM, ARROW_SIZE, TIMEZONE
 except ImportError:
     DEFAULT_ZOOM = 13
     ARROW_SIZE = 0.001
+    TIMEZONE = 'Asia/Kuala_Lumpur'
+
+# Route Viewer search results listed at most
+SEARCH_RESULTS = 50
 
 
 def create_arrow_paths(lat, lon, bearing, size=ARROW_SIZE):
     """
     Generate arrow path geometry for pydeck PathLayer
-    
+
     Args:
-        lat: Latitude of vehicle position
-        lon: Longitude of vehicle position
+        lat: Latitude of vehicle position (scalar or array)
+        lon: Longitude of vehicle position (scalar or array)
         bearing: Direction heading in degrees (0-360)
         size: Arrow size multiplier (default from config)
-    
+
     Returns:
-        list: Path coordinates [[lon, lat], ...] forming arrow shape
+        list: Path coordinates [[lon, lat], ...] forming arrow shape, or
+            one such path per vehicle for arrays
     """
-    angle_rad = np.radians(90 - bearing)
+    angle_rad = np.radians(90 - np.asarray(bearing, dtype='float64'))
     arrow_length, arrow_width = size * 2, size * 0.8
 
     sin_angle, cos_angle = np.sin(angle_rad), np.cos(angle_rad)
@@ -39,39 +45,229 @@ def create_arrow_paths(lat, lon, bearing, size=ARROW_SIZE):
     right_angle = angle_rad + np.radians(150)
     right_lat, right_lon = lat + arrow_width * np.sin(right_angle), lon + arrow_width * np.cos(right_angle)
 
-    return [
-        [lon, lat],
-        [tip_lon, tip_lat],
-        [left_lon, left_lat],
-        [tip_lon, tip_lat],
-        [right_lon, right_lat],
-        [tip_lon, tip_lat],
-    ]
+    # (..., 6 points, [lon, lat]) in one array, so every vehicle is done at
+    # once; ~1 m precision keeps the JSON sent to the browser short
+    lons = np.stack(np.broadcast_arrays(lon, tip_lon, left_lon, tip_lon, right_lon, tip_lon), axis=-1)
+    lats = np.stack(np.broadcast_arrays(lat, tip_lat, left_lat, tip_lat, right_lat, tip_lat), axis=-1)
+    return np.round(np.stack([lons, lats], axis=-1), 5).tolist()
+
+
+FLEET_TOOLTIP = {
+    "html": "<b>Vehicle:</b> {vehicle_id}<br/><b>Speed:</b> {speed_display} km/h<br/><b>Bearing:</b> {bearing_display}°",
+    "style": {"backgroundColor": "steelblue", "color": "white"},
+}
+
+# Playback speed (× real time) options; each frame is shown for PLAYBACK_FRAME_SECONDS
+PLAYBACK_SPEEDS = {'30×': 30, '60×': 60, '120×': 120, '300×': 300, '600×': 600}
+PLAYBACK_FRAME_SECONDS = 1.0
+
+
+def build_fleet_layers(pdk, df_map):
+    """
+    Bus icon and heading arrow layers for a frame from
+    data_processor.prepare_map_data.  Each layer gets only the columns it
+    draws, so the deck's JSON doesn't carry the rest of the frame twice.
+    """
+    # Tooltip values as whole numbers (rendered as-is by the tooltip template)
+    icon_data = pd.DataFrame({
+        'vehicle_id': df_map['vehicle_id'].to_numpy(),
+        'longitude': np.round(df_map['longitude'].to_numpy(), 6),
+        'latitude': np.round(df_map['latitude'].to_numpy(), 6),
+        'speed_display': np.round(df_map['speed'].to_numpy()).astype('int64'),
+        'bearing_display': np.round(df_map['bearing'].to_numpy()).astype('int64'),
+    })
+
+    # Create bus icon layer
+    icon_layer = pdk.Layer(
+        "ScatterplotLayer",
+        data=icon_data,
+        get_position=['longitude', 'latitude'],
+        get_fill_color=[51, 153, 255, 255],
+        get_radius=100,
+        radius_min_pixels=8,
+        radius_max_pixels=15,
+        get_line_color=[255, 255, 255, 200],
+        line_width_min_pixels=2,
+        pickable=True,
+    )
+
+    # Create arrow layer
+    arrow_data = pd.DataFrame({'arrow_path': create_arrow_paths(
+        icon_data['latitude'].to_numpy(), icon_data['longitude'].to_numpy(), df_map['bearing'].to_numpy(), size=0.0003,
+    )})
+
+    arrow_layer = pdk.Layer(
+        "PathLayer",
+        data=arrow_data,
+        get_path='arrow_path',
+        get_color=[255, 255, 255, 255],
+        width_min_pixels=3,
+        width_max_pixels=5,
+        pickable=False,
+    )
+    return [icon_layer, arrow_layer]
+
+
+def build_density_layer(pdk, overlay):
+    """
+    BitmapLayer for a history density image from page_cache.density_overlay
+    ((PNG bytes, [west, south, east, north], zoom)).
+    """
+    png, bounds, _ = overlay
+    return pdk.Layer(
+        "BitmapLayer",
+        data=None,
+        image='data:image/png;base64,' + base64.b64encode(png).decode('ascii'),
+        bounds=bounds,
+        opacity=0.8,
+        pickable=False,
+    )
+
+
+def _to_local(ts):
+    return pd.Timestamp(ts, unit='s', tz='UTC').tz_convert(TIMEZONE).tz_localize(None).to_pydatetime()
+
+
+def _from_local(dt):
+    return int(pd.Timestamp(dt).tz_localize(TIMEZONE).timestamp())
+
+
+def _seek_playback():
+    # Dragging the slider pauses playback at the chosen time
+    st.session_state.playback_ts = _from_local(st.session_state.playback_slider)
+    st.session_state.playback_playing = False
+
+
+def show_playback(pdk, map_style):
+    """
+    Animate past fleet positions for one region from the keyframe index:
+    a time slider to seek, play / pause and a speed multiplier.
+    """
+    first, last = db.get_playback_range()
+    if first is None:
+        st.info("🛰️ No history to play back yet.")
+        return
+    step = keyframes.KEYFRAME_BUCKET_SECONDS
+
+    hardcoded_regions = data_processor.get_region_options()
+    region = st.selectbox("Select Region", options=hardcoded_regions, key='region_selector_playback')
+
+    state = st.session_state
+    if 'playback_ts' not in state or not first <= state.playback_ts <= last:
+        # Start an hour before the latest keyframe
+        state.playback_ts = max(first, last - 3600)
+        state.playback_playing = False
 
+    col_play, col_speed = st.columns([1, 3])
+    with col_play:
+        st.markdown("<br>", unsafe_allow_html=True)  # Vertical alignment
+        if st.button("⏸️ Pause" if state.playback_playing else "▶️ Play", use_container_width=True,
+                     key='playback_toggle'):
+            state.playback_playing = not state.playback_playing
+    with col_speed:
+        speed = st.select_slider("Speed", options=list(PLAYBACK_SPEEDS), value='60×', key='playback_speed')
+
+    # The slider follows the playback position (drags update it first, in
+    # _seek_playback); widget state can only be set before the widget is drawn
+    state.playback_slider = _to_local(state.playback_ts)
+    st.slider(
+        "Time",
+        min_value=_to_local(first),
+        max_value=_to_local(last),
+        step=timedelta(seconds=step),
+        format="D MMM YYYY, HH:mm:ss",
+        key='playback_slider',
+        on_change=_seek_playback,
+    )
+
+    placeholder = st.empty()
+    view_state = None
+
+    def render(bucket_ts):
+        nonlocal view_state
+        # Seek = one read of the keyframes covering the minute up to the bucket's end
+        at = bucket_ts + step - 1
+        df_map = data_processor.prepare_map_data(db.get_fleet_at(at), region)
+        with placeholder.container():
+            if df_map.empty:
+                st.warning(f"No vehicles in {region} at {_to_local(at):%d %b %Y %H:%M:%S}")
+                return
+            if view_state is None:
+                # Fixed for the whole run so the map doesn't jump between frames
+                view_state = pdk.ViewState(
+                    latitude=df_map['latitude'].mean(),
+                    longitude=df_map['longitude'].mean(),
+                    zoom=render_budget.fit_zoom(df_map['latitude'], df_map['longitude'], DEFAULT_ZOOM),
+                    pitch=0,
+                )
+            # Frames come every PLAYBACK_FRAME_SECONDS, so they get the same point budget
+            df_shown = render_budget.select_points(df_map, render_budget.MAP_MAX_POINTS, zoom=view_state.zoom)
+            st.pydeck_chart(pdk.Deck(
+                map_style=map_style,
+                initial_view_state=view_state,
+                layers=build_fleet_layers(pdk, df_shown),
+                tooltip=FLEET_TOOLTIP,
+            ))
+            shown = f"{len(df_shown)} of {len(df_map)}" if len(df_shown) < len(df_map) else f"{len(df_map)}"
+            st.caption(f"{_to_local(at):%d %b %Y %H:%M:%S} · {shown} vehicles in {region}")
+
+    if not state.playback_playing:
+        render(state.playback_ts)
+        return
+
+    # Advance whole buckets per frame; a widget interaction reruns the script
+    # and interrupts this loop, with the position kept in session state
+    advance = max(step, int(PLAYBACK_SPEEDS[speed] * PLAYBACK_FRAME_SECONDS) // step * step)
+    while state.playback_ts <= last:
+        started = time.monotonic()
+        render(state.playback_ts)
+        state.playback_ts += advance
+        time.sleep(max(0.0, PLAYBACK_FRAME_SECONDS - (time.monotonic() - started)))
+
+    state.playback_ts = last
+    state.playback_playing = False
+    st.rerun()
 
 
 def show():
+    # Imported here so merely loading the page stays cheap
+    import pydeck as pdk
+
     # Refresh behaviour
     if st.session_state.auto_refresh:
         # When auto-refresh is enabled, fetch data on every rerun
         with st.spinner('🛰️ Auto-refreshing...'):
-            fetch_and_store_transit_data()
+            # At most one ingest cycle per interval, shared by every session
+            page_cache.refresh()
             st.session_state.last_refresh = True
     else:
         # Manual refresh button (only show if not auto-refresh)
         if st.button("🔄 Refresh Data", type="primary", use_container_width=False):
             with st.spinner('🛰️ Fetching...'):
-                fetch_and_store_transit_data()
+                page_cache.refresh(min_interval=0)
                 st.session_state.last_refresh = True
             st.rerun()
 
-    # Get data - single optimized query for current state
-    df_live, metrics, actual_sync_time = db.get_live_data_optimized()
+    # Live view, or playback of past positions from the keyframe index
+    mode = st.radio("Map mode", ["📡 Live", "⏯️ Playback"], horizontal=True, key='live_map_mode',
+                    label_visibility='collapsed')
+    if mode == "⏯️ Playback":
+        show_playback(pdk, 'dark' if st.session_state.map_theme == 'dark' else 'light')
+        return
+
+    # Live fleet snapshot (published by the ingester, or read from the database),
+    # shared by every session until the data version changes
+    version = page_cache.data_version()
+    snapshot = page_cache.live_snapshot(version)
 
-    if df_live is None or df_live.empty:
+    if snapshot is None or len(snapshot) == 0:
         st.info("🛰️ No data. Click 'Refresh Data' to fetch.")
         return
 
+    df_live = snapshot.frame()
+    metrics = snapshot.metrics()
+    actual_sync_time = snapshot.sync_time
+
     # Show sync time
     if actual_sync_time:
         st.success(f"Data updated: {actual_sync_time}")
@@ -83,15 +279,8 @@ def show():
     col3.metric("Busiest Region", metrics['busiest'])
 
     # Hardcoded region list to prevent dropdown changes during auto-refresh
-    try:
-        from utils.ingestion import API_SOURCES
-        all_regions = list(API_SOURCES.keys())
-        # Sort with Rapid Bus KL first
-        hardcoded_regions = ['Rapid Bus KL'] + sorted([r for r in all_regions if r != 'Rapid Bus KL'])
-    except ImportError:
-        # Fallback to dynamic list if import fails
-        hardcoded_regions = data_processor.get_sorted_regions(df_live)
-    
+    hardcoded_regions = data_processor.get_region_options()
+
     # Get available regions from current data
     available_regions = data_processor.get_sorted_regions(df_live)
 
@@ -126,6 +315,12 @@ def show():
         # Update session state only if changed
         if selected_region != st.session_state.selected_region:
             st.session_state.selected_region = selected_region
+
+        show_density = st.checkbox(
+            "🔥 Show history density",
+            key='live_map_density',
+            help="Where buses have been, from all stored history (pre-aggregated density tiles)",
+        )
     
     with col_locate:
         # Locate Me button
@@ -137,6 +332,7 @@ def show():
     # Get location if button was clicked
     if st.session_state.get('getting_location', False):
         with st.spinner("🌍 Getting your location..."):
+            from streamlit_js_eval import get_geolocation as js_get_geolocation
             location_data = js_get_geolocation(component_key="geolocation")
 
             if location_data and isinstance(location_data, dict):
@@ -171,67 +367,67 @@ def show():
                     del st.session_state.user_location
                     st.rerun()
 
-    # Filter and process data
-    df_map = data_processor.prepare_map_data(df_live, selected_region)
+            # Nearest vehicles / stops across all regions
+            # Re-indexed once per snapshot (a no-op when this process's ingester already did)
+            spatial_index.update_vehicle_index(snapshot)
+
+            nearest_cols = {
+                'region': 'Region',
+                'distance_m': 'Distance (m)',
+                'bearing_deg': 'Direction (°)',
+            }
+            col_near1, col_near2 = st.columns(2)
+            with col_near1:
+                st.markdown("**🚌 Nearest Vehicles**")
+                near_vehicles = spatial_index.nearest_vehicles(loc['lat'], loc['lon'], k=5)
+                near_vehicles = near_vehicles[['vehicle_id', 'region', 'distance_m', 'bearing_deg']].round(0)
+                st.dataframe(
+                    near_vehicles.rename(columns={'vehicle_id': 'Vehicle', **nearest_cols}),
+                    use_container_width=True,
+                    hide_index=True,
+                )
+            with col_near2:
+                st.markdown("**🚏 Nearest Stops**")
+                with st.spinner("Loading stops..."):
+                    near_stops = spatial_index.nearest_stops(loc['lat'], loc['lon'], k=5)
+                near_stops = near_stops[['stop_name', 'region', 'distance_m', 'bearing_deg']].round(0)
+                st.dataframe(
+                    near_stops.rename(columns={'stop_name': 'Stop', **nearest_cols}),
+                    use_container_width=True,
+                    hide_index=True,
+                )
+
+    # Per-stage render times; the point cap adapts to them (see utils.render_budget)
+    timer = render_budget.RenderTimer('live_map')
+
+    # Filter and process data (prepared once per data version and region)
+    with timer.stage('prepare'):
+        df_map = page_cache.map_frame(version, selected_region)
 
     if df_map.empty:
         st.warning(f"No valid data for {selected_region}")
         return
     
-    # Create formatted columns for tooltip display
-    df_map['speed_display'] = df_map['speed'].round(0).astype(int).astype(str)
-    df_map['bearing_display'] = df_map['bearing'].round(0).astype(int).astype(str)
-
     # Map style based on theme
     map_style = 'dark' if st.session_state.map_theme == 'dark' else 'light'
 
-    # Create bus icon layer
-    icon_layer = pdk.Layer(
-        "ScatterplotLayer",
-        data=df_map,
-        get_position=['longitude', 'latitude'],
-        get_fill_color=[51, 153, 255, 255],
-        get_radius=100,
-        radius_min_pixels=8,
-        radius_max_pixels=15,
-        get_line_color=[255, 255, 255, 200],
-        line_width_min_pixels=2,
-        pickable=True,
-    )
-    
-    # Create arrow layer
-    df_map['arrow_path'] = df_map.apply(
-        lambda row: create_arrow_paths(row['latitude'], row['longitude'], row['bearing'], size=0.0003),
-        axis=1,
-    )
-    
-    arrow_layer = pdk.Layer(
-        "PathLayer",
-        data=df_map,
-        get_path='arrow_path',
-        get_color=[255, 255, 255, 255],
-        width_min_pixels=3,
-        width_max_pixels=5,
-        pickable=False,
-    )
-
-    # Preserve map view state during auto-refresh
-    if 'map_view_state' not in st.session_state:
-        st.session_state.map_view_state = {
+    # Preserve map view state during auto-refresh.  The map opens fitted to
+    # the region's vehicles (no closer than DEFAULT_ZOOM); pydeck doesn't
+    # report the user's zoom back, so the render budget thins for this zoom
+    def region_view():
+        return {
             'latitude': df_map['latitude'].mean(),
             'longitude': df_map['longitude'].mean(),
-            'zoom': DEFAULT_ZOOM,
+            'zoom': render_budget.fit_zoom(df_map['latitude'], df_map['longitude'], DEFAULT_ZOOM),
             'pitch': 0,
         }
+
+    if 'map_view_state' not in st.session_state:
+        st.session_state.map_view_state = region_view()
     
     # Only update view state if region changed
     if st.session_state.selected_region != st.session_state.get('last_viewed_region', None):
-        st.session_state.map_view_state = {
-            'latitude': df_map['latitude'].mean(),
-            'longitude': df_map['longitude'].mean(),
-            'zoom': DEFAULT_ZOOM,
-            'pitch': 0,
-        }
+        st.session_state.map_view_state = region_view()
         st.session_state.last_viewed_region = st.session_state.selected_region
     
     view_state = pdk.ViewState(
@@ -241,9 +437,21 @@ def show():
         pitch=st.session_state.map_view_state['pitch'],
     )
 
+    # Render budget: moving and recently updated vehicles first, thinned at low zoom
+    point_cap = st.session_state.get('map_point_cap', render_budget.MAP_MAX_POINTS)
+    with timer.stage('budget'):
+        df_shown = render_budget.select_points(df_map, point_cap, zoom=st.session_state.map_view_state['zoom'])
+
+    # Bus icon and heading arrow layers, over the history density if requested
+    with timer.stage('layers'):
+        layers = build_fleet_layers(pdk, df_shown)
+    if show_density:
+        with timer.stage('density'):
+            overlay = page_cache.density_overlay(version, selected_region)
+        if overlay is not None:
+            layers.insert(0, build_density_layer(pdk, overlay))
+
     # ===== ADD USER LOCATION MARKER TO MAP =====
-    layers = [icon_layer, arrow_layer]
-    
     if 'user_location' in st.session_state and st.session_state.user_location:
         user_loc = st.session_state.user_location
         
@@ -289,47 +497,82 @@ def show():
         else:
             layers.append(user_marker)
 
-    st.pydeck_chart(
-        pdk.Deck(
-            map_style=map_style,
-            initial_view_state=view_state,
-            layers=layers,
-            tooltip={
-                "html": "<b>Vehicle:</b> {vehicle_id}<br/><b>Speed:</b> {speed_display} km/h<br/><b>Bearing:</b> {bearing_display}°",
-                "style": {"backgroundColor": "steelblue", "color": "white"},
-            },
+    # Serializing the deck is the stage that grows fastest with the points drawn
+    with timer.stage('chart'):
+        st.pydeck_chart(
+            pdk.Deck(
+                map_style=map_style,
+                initial_view_state=view_state,
+                layers=layers,
+                tooltip=FLEET_TOOLTIP,
+            )
         )
-    )
 
-    st.caption(f"Showing {len(df_map)} active vehicles in {selected_region}")
+    # Only the stages that grow with the points drawn steer the cap; a cache
+    # miss in prepare / density is paid once per data version, not per point
+    render_ms = timer.total_ms
+    point_ms = sum(timer.stages[name] for name in ('budget', 'layers', 'chart'))
+    timings = timer.finish()
+    st.session_state.map_point_cap = render_budget.next_cap(point_cap, point_ms)
+    if point_ms > render_budget.MAP_RENDER_BUDGET_MS:
+        print(f"Live map render took {render_ms:,.0f} ms for {len(df_shown)} vehicles ({timings}); "
+              f"point cap {point_cap} -> {st.session_state.map_point_cap}")
+
+    if len(df_shown) < len(df_map):
+        st.caption(f"Showing {len(df_shown):,} of {len(df_map):,} active vehicles in {selected_region} "
+                   f"(moving and recently updated first, within the render budget)")
+    else:
+        st.caption(f"Showing {len(df_map)} active vehicles in {selected_region}")
+    st.caption(f"⏱️ Rendered in {render_ms:,.0f} ms: {timings}")
 
     # ===== ROUTE VIEWER SECTION =====
     # Maps selected_region display names to GTFS static agency slugs
     REGION_TO_SLUG = gtfs_static.STATIC_API_SOURCES
 
     with st.expander("🚌 Route Viewer", expanded=False):
-        vehicle_options = sorted(df_map['vehicle_id'].unique().tolist())
+        # Search across every region; without a query, list this region's vehicles
+        query = st.text_input(
+            "Search Vehicles",
+            placeholder="Vehicle / plate, trip, route number or route name — all regions",
+            key="route_viewer_search",
+        ).strip()
+        matches = vehicle_search.search(
+            query,
+            region=None if query else selected_region,
+            limit=SEARCH_RESULTS if query else None,
+            snapshot=snapshot,
+        )
 
-        if not vehicle_options:
-            st.info("No vehicles available for the selected region.")
+        if matches.empty:
+            st.info("No matching vehicles." if query else "No vehicles available for the selected region.")
         else:
-            selected_vehicle = st.selectbox(
+            match_keys = (matches['region'] + '\x1f' + matches['vehicle_id']).tolist()
+            labels = {
+                key: f"{row.vehicle_id} · {row.route_name} ({row.region})" if row.route_name else f"{row.vehicle_id} ({row.region})"
+                for key, row in zip(match_keys, matches.itertuples(index=False))
+            }
+            selected_key = st.selectbox(
                 "Select Vehicle",
-                options=vehicle_options,
+                options=match_keys,
+                format_func=labels.get,
                 key="route_viewer_vehicle_select",
             )
 
-            if selected_vehicle:
-                # ---- Resolve trip_id / route_id from live snapshot ----
-                vehicle_row = df_map[df_map['vehicle_id'] == selected_vehicle]
-                trip_id = ''
-                route_id = ''
-                if not vehicle_row.empty:
-                    trip_id = str(vehicle_row.iloc[0].get('trip_id', '') or '')
-                    route_id = str(vehicle_row.iloc[0].get('route_id', '') or '')
+            if selected_key:
+                # ---- Resolve region / trip_id / route_id from the search result ----
+                vehicle_row = matches.iloc[match_keys.index(selected_key)]
+                vehicle_region = vehicle_row['region']
+                selected_vehicle = vehicle_row['vehicle_id']
+                trip_id = str(vehicle_row['trip_id'] or '')
+                route_id = str(vehicle_row['route_id'] or '')
+                last_seen = pd.Timestamp(int(vehicle_row['timestamp']), unit='s', tz='UTC').tz_convert(TIMEZONE)
+                st.caption(
+                    f"Last seen {last_seen.strftime('%H:%M:%S')} at "
+                    f"{vehicle_row['latitude']:.5f}, {vehicle_row['longitude']:.5f}"
+                )
 
                 # ---- Determine agency slug for the selected region ----
-                agency_slug = REGION_TO_SLUG.get(selected_region, '')
+                agency_slug = REGION_TO_SLUG.get(vehicle_region, '')
 
                 # ---- Try to fetch planned route shapes from GTFS Static ----
                 planned_shapes = []
@@ -343,8 +586,33 @@ def show():
                     if route_name:
                         st.caption(f"Route: {route_name}")
 
+                # ---- Schedule adherence and upcoming stops ----
+                delay = schedule.get_vehicle_delay(vehicle_region, selected_vehicle)
+                if delay is not None:
+                    minutes = abs(delay) / 60
+                    if minutes < 1:
+                        st.caption("Schedule: on time")
+                    else:
+                        st.caption(f"Schedule: {minutes:.0f} min {'late' if delay > 0 else 'early'}")
+
+                    arrivals = schedule.predict_arrivals(vehicle_region, selected_vehicle)
+                    if not arrivals.empty:
+                        for col in ('scheduled_arrival', 'predicted_arrival'):
+                            arrivals[col] = pd.to_datetime(
+                                arrivals[col], unit='s', utc=True
+                            ).dt.tz_convert(TIMEZONE).dt.strftime('%H:%M')
+                        st.dataframe(
+                            arrivals[['stop_name', 'scheduled_arrival', 'predicted_arrival']].rename(columns={
+                                'stop_name': 'Next Stops',
+                                'scheduled_arrival': 'Scheduled',
+                                'predicted_arrival': 'Predicted',
+                            }),
+                            use_container_width=True,
+                            hide_index=True,
+                        )
+
                 # ---- Fetch historical trail for fallback / table ----
-                trail_df = db.get_vehicle_trail(selected_vehicle, selected_region)
+                trail_df = db.get_vehicle_trail(selected_vehicle, vehicle_region)
 
                 if len(planned_shapes) >= 2:
                     # --- PRIMARY: draw planned route from GTFS Static shapes ---
@@ -0,0 +1,135 @@
+import streamlit as st
+import pandas as pd
+from utils import db, metrics, profiling
+
+# Enrichment / storage stages in pipeline order (fetch_all covers all endpoints in parallel)
+PIPELINE_STAGES = ['fetch_all', 'filter', 'validate', 'map_match', 'motion', 'schedule', 'fleet_snapshot',
+                   'spatial_index', 'search_index', 'geofence', 'trips', 'headways', 'insert']
+
+
+def show():
+    # Imported here so merely loading the page stays cheap
+    import plotly.express as px
+
+    window_label = st.radio(
+        "Window",
+        ["Last hour", "Last 24 hours", "Last 7 days"],
+        horizontal=True,
+        key="pipeline_health_window",
+    )
+    since_seconds = {"Last hour": 3600, "Last 24 hours": 86400, "Last 7 days": 7 * 86400}[window_label]
+
+    df = db.get_pipeline_metrics(since_seconds)
+
+    if df is None or df.empty:
+        st.info("🛰️ No pipeline metrics yet. Refresh data on any page to record an ingest cycle.")
+        return
+
+    totals = df[df['stage'] == 'total']
+    fetches = df[df['stage'] == 'fetch']
+    last_cycle = df['cycle_ts'].max()
+
+    # Headline metrics
+    col1, col2, col3, col4 = st.columns(4)
+    last_total = totals.loc[totals['cycle_ts'] == last_cycle, 'duration_ms']
+    col1.metric("Last Cycle", f"{last_total.iloc[0] / 1000:.2f} s" if len(last_total) else "—")
+    col2.metric("Avg Cycle", f"{totals['duration_ms'].mean() / 1000:.2f} s" if len(totals) else "—")
+    col3.metric("Cycles", totals['cycle_ts'].nunique())
+    error_rate = (fetches['error'].fillna('') != '').mean() if len(fetches) else 0
+    col4.metric("Fetch Error Rate", f"{error_rate:.1%}")
+
+    # Where the cycle time goes
+    st.subheader("⏱️ Stage Time per Cycle")
+    stages = df[df['stage'].isin(PIPELINE_STAGES) & (df['endpoint'].fillna('') == '')].copy()
+    stages['cycle'] = pd.to_datetime(stages['cycle_ts'], unit='s', utc=True).dt.tz_convert(db.TIMEZONE)
+    fig1 = px.bar(
+        stages,
+        x='cycle',
+        y='duration_ms',
+        color='stage',
+        category_orders={'stage': PIPELINE_STAGES},
+        labels={'cycle': 'Cycle', 'duration_ms': 'Duration (ms)', 'stage': 'Stage'},
+    )
+    fig1.update_layout(height=400, bargap=0.1)
+    st.plotly_chart(fig1, use_container_width=True)
+
+    stage_summary = stages.groupby('stage')['duration_ms'].agg(['mean', 'max']).reindex(PIPELINE_STAGES).dropna()
+    stage_summary = stage_summary.round(1).reset_index()
+    stage_summary.columns = ['Stage', 'Avg (ms)', 'Max (ms)']
+    st.dataframe(stage_summary, use_container_width=True, hide_index=True)
+
+    # Per-agency breakdown
+    st.subheader("🛰️ Endpoints")
+    decode = df[df['stage'] == 'decode'].groupby(['region', 'endpoint'])['duration_ms'].mean()
+    endpoint_stats = fetches.assign(failed=fetches['error'].fillna('') != '').groupby(['region', 'endpoint']).agg(
+        fetch_ms=('duration_ms', 'mean'),
+        fetch_p95_ms=('duration_ms', lambda s: s.quantile(0.95)),
+        kb=('bytes', lambda s: s.mean() / 1024),
+        entities=('entities', 'mean'),
+        staleness_s=('staleness_s', 'last'),
+        error_rate=('failed', 'mean'),
+    )
+    endpoint_stats['decode_ms'] = decode.reindex(endpoint_stats.index)
+    endpoint_stats = endpoint_stats.sort_values('fetch_ms', ascending=False).reset_index()
+    endpoint_stats['error_rate'] = (endpoint_stats['error_rate'] * 100).round(1)
+    endpoint_stats = endpoint_stats.round(1).rename(columns={
+        'region': 'Region',
+        'endpoint': 'Endpoint',
+        'fetch_ms': 'Avg Fetch (ms)',
+        'fetch_p95_ms': 'P95 Fetch (ms)',
+        'decode_ms': 'Avg Decode (ms)',
+        'kb': 'Avg Size (KB)',
+        'entities': 'Avg Entities',
+        'staleness_s': 'Staleness (s)',
+        'error_rate': 'Errors (%)',
+    })
+    st.dataframe(endpoint_stats, use_container_width=True, hide_index=True)
+
+    # Positions dropped by the data-quality rules (utils/validation.py)
+    st.subheader("🧹 Data Quality")
+    drops = df[df['stage'].str.startswith('drop_')]
+    if drops.empty:
+        st.caption("No positions dropped by the data-quality rules in this window.")
+    else:
+        drops = drops.assign(rule=drops['stage'].str[len('drop_'):])
+        fig2 = px.bar(
+            drops.groupby(['rule', 'region'])['entities'].sum().reset_index(),
+            x='rule',
+            y='entities',
+            color='region',
+            labels={'rule': 'Rule', 'entities': 'Positions Dropped', 'region': 'Region'},
+        )
+        fig2.update_layout(height=350)
+        st.plotly_chart(fig2, use_container_width=True)
+
+    recent_errors = fetches[fetches['error'].fillna('') != ''].tail(20)
+    if not recent_errors.empty:
+        with st.expander(f"⚠️ Recent Errors ({len(recent_errors)})", expanded=False):
+            recent_errors = recent_errors[['cycle_ts', 'region', 'endpoint', 'error']].copy()
+            recent_errors['cycle_ts'] = pd.to_datetime(
+                recent_errors['cycle_ts'], unit='s', utc=True
+            ).dt.tz_convert(db.TIMEZONE).dt.strftime('%Y-%m-%d %H:%M:%S')
+            st.dataframe(recent_errors, use_container_width=True, hide_index=True)
+
+    # Raw exposition for this process (what /metrics serves)
+    with st.expander("📟 Prometheus Metrics (this process)", expanded=False):
+        st.code(metrics.render_prometheus().strip() or "# no cycles in this process yet", language='text')
+
+    if profiling.is_enabled():
+        profiles = profiling.recent_profiles()
+        with st.expander(f"🐢 Query Profiles ({len(profiles)})", expanded=False):
+            if not profiles:
+                st.caption("No profiled queries yet.")
+            else:
+                summary = pd.DataFrame(profiles)[
+                    ['function', 'wall_ms', 'sql_ms', 'pandas_ms', 'rows_returned', 'peak_memory_bytes',
+                     'peak_memory_shared', 'slow']
+                ]
+                summary['peak_memory_mb'] = (summary.pop('peak_memory_bytes') / 1e6).round(1)
+                st.dataframe(summary.iloc[::-1], use_container_width=True, hide_index=True)
+                slow = [p for p in profiles if p['slow']]
+                if slow:
+                    slowest = max(slow, key=lambda p: p['wall_ms'])
+                    st.markdown(f"**Slowest call:** `{slowest['function']}` ({slowest['wall_ms']:.0f} ms)")
+                    for query in slowest['queries']:
+                        st.code(query.get('explain_analyze') or query['sql'], language='text')
@@ -0,0 +1,183 @@
+import streamlit as st
+import pandas as pd
+from utils import data_processor, db, headways, page_cache, route_stats
+
+# Routes shown in the per-route charts (busiest first)
+TOP_ROUTES = 20
+
+
+def _route_summary(region, live, hourly, trip_headways):
+    """One row per route: active vehicles now, pings, average moving speed,
+    headways recorded and their median."""
+    active = (
+        live[live['route_id'] != ''].groupby('route_id')['vehicle_id'].nunique().rename('active')
+        if len(live) else pd.Series(dtype='int64', name='active')
+    )
+    totals = hourly.groupby('route_id')[['pings', 'moving_pings', 'speed_sum_mps']].sum()
+    totals['avg_speed'] = (totals['speed_sum_mps'] / totals['moving_pings'].where(totals['moving_pings'] > 0) * 3.6).round(1)
+    headway = trip_headways.groupby('route_id')['headway_s'].agg(['size', 'median'])
+    headway.columns = ['headways', 'median_headway']
+    headway['median_headway'] = (headway['median_headway'] / 60).round(1)
+
+    summary = pd.concat([active, totals[['pings', 'avg_speed']], headway], axis=1).rename_axis('route_id').reset_index()
+    summary['active'] = summary['active'].fillna(0).astype(int)
+    summary['pings'] = summary['pings'].fillna(0).astype(int)
+    summary = route_stats.with_route_names(summary.assign(region=region), [region])
+    return summary.sort_values(['active', 'pings'], ascending=False).reset_index(drop=True)
+
+
+def show():
+    # Imported here so merely loading the page stays cheap
+    import plotly.express as px
+
+    # Refresh behaviour (ingestion is only imported when a fetch actually runs)
+    if st.session_state.auto_refresh:
+        with st.spinner('🛰️ Auto-refreshing...'):
+            # At most one ingest cycle per interval, shared by every session
+            page_cache.refresh()
+            st.session_state.last_refresh = True
+    else:
+        # Manual refresh button
+        if st.button("🔄 Refresh Data", type="primary"):
+            with st.spinner('🛰️ Fetching...'):
+                page_cache.refresh(min_interval=0)
+                st.session_state.last_refresh = True
+            st.rerun()
+
+    region = st.selectbox("Select Region", options=data_processor.get_region_options(), key='routes_region')
+
+    # Computed once per data version for every session
+    version = page_cache.data_version()
+    snapshot = page_cache.live_snapshot(version)
+    live = snapshot.frame(region).astype({'route_id': str, 'vehicle_id': str}) if snapshot is not None else pd.DataFrame()
+    hourly = page_cache.route_hourly(version, region)
+    trip_headways = page_cache.route_headways(version, region)
+
+    if live.empty and hourly.empty:
+        st.info("🛰️ No route data for this region yet. Please refresh.")
+        return
+    if hourly.empty:
+        hourly = pd.DataFrame(columns=['route_id', 'hour_ts', 'pings', 'moving_pings', 'speed_sum_mps'])
+    if trip_headways.empty:
+        trip_headways = pd.DataFrame({'route_id': pd.Series(dtype=object), 'headway_s': pd.Series(dtype='float64')})
+
+    summary = _route_summary(region, live, hourly, trip_headways)
+
+    # Headline metrics
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Routes Active Now", int((summary['active'] > 0).sum()))
+    col2.metric("Vehicles on Routes", int(summary['active'].sum()))
+    col3.metric("Routes Seen", len(summary))
+    col4.metric("Median Headway", f"{trip_headways['headway_s'].median() / 60:.0f} min" if len(trip_headways) else "—")
+
+    col_chart1, col_chart2 = st.columns(2)
+
+    with col_chart1:
+        st.subheader("🚌 Active Vehicles by Route")
+        top_active = summary[summary['active'] > 0].head(TOP_ROUTES).sort_values('active')
+        if top_active.empty:
+            st.info("No vehicles on a route right now.")
+        else:
+            fig1 = px.bar(
+                top_active,
+                x='active',
+                y='route_name',
+                orientation='h',
+                labels={'active': 'Vehicles', 'route_name': 'Route'},
+                color_discrete_sequence=['#3399FF'],
+            )
+            fig1.update_layout(height=500, showlegend=False)
+            st.plotly_chart(fig1, use_container_width=True)
+
+    with col_chart2:
+        st.subheader("⏱️ Headway Distribution")
+        if trip_headways.empty:
+            st.info("No completed trips recorded yet.")
+        else:
+            names = summary.set_index('route_id')['route_name']
+            route_options = ['All routes'] + summary.loc[summary['headways'].fillna(0) > 0, 'route_id'].tolist()
+            chosen = st.selectbox(
+                "Route",
+                route_options,
+                format_func=lambda r: r if r == 'All routes' else names.get(r, r),
+                key='routes_headway_route',
+            )
+            data = trip_headways if chosen == 'All routes' else trip_headways[trip_headways['route_id'] == chosen]
+            fig2 = px.histogram(
+                data.assign(headway_min=data['headway_s'] / 60),
+                x='headway_min',
+                nbins=40,
+                labels={'headway_min': 'Headway between trip starts (min)'},
+            )
+            fig2.update_layout(height=420, showlegend=False)
+            st.plotly_chart(fig2, use_container_width=True)
+
+    # Average moving speed by route and local hour of day
+    st.subheader("🕐 Average Speed by Route and Hour")
+    busiest = summary.sort_values('pings', ascending=False).head(TOP_ROUTES)
+    by_hour = hourly[hourly['route_id'].isin(busiest['route_id'])].assign(
+        hour=pd.to_datetime(hourly['hour_ts'], unit='s', utc=True).dt.tz_convert(db.TIMEZONE).dt.hour
+    )
+    by_hour = by_hour.groupby(['route_id', 'hour'])[['moving_pings', 'speed_sum_mps']].sum()
+    by_hour = by_hour[by_hour['moving_pings'] > 0]
+    if by_hour.empty:
+        st.info("No moving vehicles recorded on these routes yet.")
+    else:
+        speed = (by_hour['speed_sum_mps'] / by_hour['moving_pings'] * 3.6).round(1).unstack('hour')
+        speed = speed.reindex(columns=range(24))
+        speed.index = busiest.set_index('route_id')['route_name'].reindex(speed.index)
+        fig3 = px.imshow(
+            speed,
+            aspect='auto',
+            color_continuous_scale='RdYlGn',
+            labels={'x': 'Hour of Day', 'y': 'Route', 'color': 'Avg Speed (km/h)'},
+        )
+        fig3.update_layout(height=max(300, 28 * len(speed)))
+        st.plotly_chart(fig3, use_container_width=True)
+
+    # Bunching and gaps, from the ingesting process's rolling headway history
+    st.subheader("🚦 Bunching & Gaps")
+    spacing = headways.history(region)
+    if spacing.empty:
+        st.info("No headway measurements yet. They are computed during ingestion.")
+    else:
+        flagged = spacing[spacing['status'].isin(['bunched', 'gap'])]
+        trend = flagged.groupby(['cycle_ts', 'status']).size().rename('vehicles').reset_index()
+        trend['cycle'] = pd.to_datetime(trend['cycle_ts'], unit='s', utc=True).dt.tz_convert(db.TIMEZONE)
+        fig4 = px.line(
+            trend,
+            x='cycle',
+            y='vehicles',
+            color='status',
+            labels={'cycle': 'Cycle', 'vehicles': 'Vehicles', 'status': 'Status'},
+        )
+        fig4.update_layout(height=300)
+        st.plotly_chart(fig4, use_container_width=True)
+
+        current = flagged[flagged['cycle_ts'] == spacing['cycle_ts'].max()]
+        if current.empty:
+            st.success("No bunching or gaps in the latest cycle.")
+        else:
+            current = route_stats.with_route_names(current, [region]).sort_values(['status', 'headway_s'])
+            st.dataframe(pd.DataFrame({
+                'Route': current['route_name'],
+                'Vehicle': current['vehicle_id'],
+                'Vehicle Ahead': current['leader_id'],
+                'Status': current['status'].str.title(),
+                'Gap (m)': current['gap_m'].round(0),
+                'Headway (min)': (current['headway_s'] / 60).round(1),
+                'Scheduled (min)': (current['scheduled_headway_s'] / 60).round(1),
+            }), use_container_width=True, hide_index=True)
+
+    # Per-route table
+    st.subheader("📋 Routes")
+    table = summary[['route_id', 'route_name', 'active', 'avg_speed', 'headways', 'median_headway', 'pings']].rename(columns={
+        'route_id': 'Route ID',
+        'route_name': 'Route',
+        'active': 'Active Vehicles',
+        'avg_speed': 'Avg Speed (km/h)',
+        'headways': 'Headways',
+        'median_headway': 'Median Headway (min)',
+        'pings': 'Positions',
+    })
+    st.dataframe(table, use_container_width=True, hide_index=True)
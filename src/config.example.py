@@ -42,6 +42,13 @@ ARROW_OPACITY = 200
 DATA_MAX_AGE = 3600
 DATA_FUTURE_TOLERANCE = 300
 
+# Map matching: snap live positions onto GTFS Static shapes at ingest
+MAP_MATCHING_ENABLED = True
+MAP_MATCH_MAX_OFFSET_M = 200   # positions further than this from the shape stay unmatched
+
+# Schedule adherence: per-vehicle delay against GTFS Static stop_times at ingest
+SCHEDULE_ADHERENCE_ENABLED = True
+
 # API endpoints mapping
 API_SOURCES = {
     'Rapid Bus KL': ['prasarana?category=rapid-bus-kl'],
@@ -63,3 +70,93 @@ API_SOURCES = {
 # API configuration
 API_BASE_URL = 'https://api.data.gov.my/gtfs-realtime/vehicle-position/'
 REQUEST_TIMEOUT = 10
+
+# Pipeline metrics: per-stage timings / per-endpoint counters for the Pipeline Health page
+METRICS_TABLE = 'pipeline_metrics'
+METRICS_RETENTION_SECONDS = 7 * 86400
+METRICS_PORT = None   # e.g. 9108 to serve Prometheus text on http://127.0.0.1:9108/metrics
+
+# Worker processes for fetch / decode / filter (regions are sharded across them);
+# 0 or 1 keeps everything on threads in the ingesting process
+INGEST_WORKERS = 0
+
+# Write buffering: ingest batches are flushed in one transaction when either trigger fires
+WRITE_BUFFER_MAX_ROWS = 50000
+WRITE_BUFFER_MAX_SECONDS = 0      # 0 = flush every cycle (keeps the live map current)
+WRITE_SPOOL_DIR = None            # e.g. 'spool/' to survive crashes with data still buffered
+WRITE_MAX_FLUSH_ATTEMPTS = 3      # then batches that still fail alone are moved to quarantine
+WRITE_QUARANTINE_DIR = None       # None = '<database>.quarantine'
+
+# Record raw GTFS-RT responses (gzip, per endpoint per cycle) for replay; None disables
+FEED_ARCHIVE_DIR = None
+FEED_ARCHIVE_MAX_DAYS = 14                  # whole UTC days older than this are deleted
+FEED_ARCHIVE_MAX_BYTES = 20 * 1024 ** 3     # then oldest days go while larger; None = no cap
+
+# Arrow / Parquet history API served by the ingesting process; None disables
+HISTORY_API_PORT = None   # e.g. 9109 for http://127.0.0.1:9109/history
+HISTORY_BATCH_ROWS = 65536
+
+# Playback keyframes: latest position per vehicle per bucket, upserted on every flush
+KEYFRAMES_ENABLED = True
+KEYFRAME_TABLE = 'fleet_keyframes'
+KEYFRAME_BUCKET_SECONDS = 30
+
+# Trip segmentation: closed trips (trip_id change or silence) go to TRIPS_TABLE
+TRIPS_ENABLED = True
+TRIPS_TABLE = 'trips'
+TRIP_GAP_SECONDS = 900
+
+# Hourly per-route aggregates for the Routes page, updated on every flush
+ROUTE_STATS_ENABLED = True
+ROUTE_STATS_TABLE = 'route_hourly'
+
+# History density tiles: pings per Web Mercator grid cell at every zoom, added on every flush
+DENSITY_TILES_ENABLED = True
+DENSITY_CELL_TABLE = 'density_cells'
+DENSITY_TILE_TABLE = 'density_tiles'
+DENSITY_MIN_ZOOM = 5
+DENSITY_MAX_ZOOM = 13              # ~75 m cells; each extra level roughly triples the stored cells
+DENSITY_SATURATION_PINGS = 2000    # pings per cell at DENSITY_MAX_ZOOM shown in the hottest colour
+TILE_API_PORT = None               # e.g. 9110 for http://127.0.0.1:9110/tiles/{z}/{x}/{y}.png
+
+# Data-quality rules applied after the basic filter (utils/validation.py)
+VALIDATION_RULES = None          # None = all; or e.g. ['outside_malaysia', 'impossible_jump']
+MAX_IMPLIED_SPEED_KMH = 200
+FROZEN_GPS_SECONDS = 900
+SERVICE_AREA_MARGIN_M = 5000
+
+# Geofences: GeoJSON FeatureCollection of Polygon / MultiPolygon features with
+# optional id / name / kind / region properties; kind 'service_area' fences
+# replace the stop-hull check in the data-quality rules
+GEOFENCES_PATH = None            # e.g. 'geofences.geojson'
+GEOFENCE_EVENTS_TABLE = 'geofence_events'
+
+# Bunching / gap detection: headway to the vehicle ahead vs the scheduled headway
+HEADWAYS_ENABLED = True
+HEADWAY_BUNCHING_RATIO = 0.5
+HEADWAY_GAP_RATIO = 1.5
+HEADWAY_HISTORY_SECONDS = 3600   # rolling history kept in memory
+
+# Pages use the ingester's in-process live-fleet snapshot while it is this fresh
+# (seconds), otherwise they read the live view from DuckDB
+FLEET_SNAPSHOT_MAX_AGE = 60
+
+# Page data shared by all dashboard sessions (utils/page_cache.py): entries are
+# keyed by data version and expire after this many seconds at the latest
+PAGE_CACHE_TTL_SECONDS = 300
+# Auto-refresh runs at most one ingest cycle per this many seconds, whatever the number of sessions
+REFRESH_MIN_SECONDS = 15
+
+# Live Map render budget (utils/render_budget.py)
+MAP_MAX_POINTS = 3000          # most vehicles drawn; moving and recently updated ones first
+MAP_MIN_POINTS = 250           # a session's cap never drops below this
+MAP_RENDER_BUDGET_MS = 2000    # point-dependent render time that shrinks the cap when exceeded
+MAP_RECENT_SECONDS = 120       # "recently updated" = within this many seconds of the newest position
+MAP_FULL_DETAIL_ZOOM = 12      # below this zoom, one vehicle per MAP_THIN_CELL_PX screen cell
+MAP_THIN_CELL_PX = 6
+MAP_VIEWPORT_PX = 500          # the map opens at the zoom fitting the region in this many pixels
+
+# Query profiling for utils/db.py (also enabled by TRANSIT_DB_PROFILING=1)
+DB_PROFILING = False
+DB_PROFILE_LOG = 'db_profile.log'   # JSON lines, rotated at 5 MB
+DB_SLOW_QUERY_MS = 500              # calls slower than this also log EXPLAIN ANALYZE
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 
 try:
@@ -10,9 +11,94 @@ except ImportError:
         'myBAS Melaka', 'myBAS Johor', 'myBAS Kuching',
     ]
 
+try:
+    from config import TIMEZONE
+except ImportError:
+    TIMEZONE = 'Asia/Kuala_Lumpur'
+
+MAX_SPEED_KMH = 120
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+CREATED_AT_FORMAT = '%-d %b %Y, %H:%M'
+
+# Memoised formatted strings per format, {fmt: {value: string}}. A full cache
+# is replaced rather than cleared so concurrent sessions never see it shrink.
+FORMAT_CACHE_SIZE = 1_000_000
+_format_cache = {}
+
+def _as_float(series):
+    """Float64 NumPy view of a column, parsing strings only if it isn't numeric already."""
+    if not pd.api.types.is_numeric_dtype(series.dtype):
+        series = pd.to_numeric(series, errors='coerce')
+    return series.to_numpy(dtype='float64', na_value=np.nan)
+
+def speed_kmh(df, speed_column='speed'):
+    """
+    Display speed in km/h as a new float64 array (the input is not modified).
+
+    Where the feed reports 0 (or nothing) and a ``derived_speed`` computed from
+    consecutive pings is available, the derived value is used instead.
+    Rounded to whole km/h and capped at MAX_SPEED_KMH.
+    """
+    values = np.array(_as_float(df[speed_column]), dtype='float64', copy=True)
+    np.nan_to_num(values, copy=False, nan=0.0)
+    if 'derived_speed' in df.columns:
+        derived = _as_float(df['derived_speed'])
+        np.copyto(values, derived, where=(values == 0) & ~np.isnan(derived))
+    values *= 3.6  # m/s to km/h
+    np.round(values, 0, out=values)
+    np.minimum(values, MAX_SPEED_KMH, out=values)
+    return values
+
+def _format_local(values, is_datetime, fmt):
+    if is_datetime:
+        dt = pd.to_datetime(pd.Index(values), utc=True)
+    else:
+        dt = pd.to_datetime(pd.Index(values), unit='s', utc=True)
+    local = dt.tz_convert(TIMEZONE)
+    if fmt == TIMESTAMP_FORMAT:
+        # ISO layout: pandas' C datetime-to-string is ~25x faster than strftime
+        return local.tz_localize(None).astype(str)
+    return local.strftime(fmt)
+
+def format_timestamps(values, fmt=TIMESTAMP_FORMAT):
+    """
+    Format epoch seconds (or naive UTC datetimes) as local-time strings.
+
+    Feed timestamps repeat heavily (a whole batch shares a handful of seconds),
+    so each distinct value is formatted once and remembered across calls;
+    the result is a take from the distinct strings.
+
+    Args:
+        values: Series or array of epoch seconds or datetime64 values
+        fmt: strftime format
+
+    Returns:
+        pandas array of strings, missing values stay missing
+    """
+    codes, uniques = pd.factorize(pd.Series(values), sort=False)
+    is_datetime = pd.api.types.is_datetime64_any_dtype(uniques.dtype)
+
+    if len(uniques) > FORMAT_CACHE_SIZE:
+        # Too many distinct values to be worth remembering
+        formatted = pd.Series(_format_local(uniques, is_datetime, fmt))
+    else:
+        keys = uniques.tolist()
+        cache = _format_cache.get(fmt)
+        missing = [k for k in keys if k not in cache] if cache is not None else keys
+        if missing:
+            if cache is None or len(cache) + len(missing) > FORMAT_CACHE_SIZE:
+                cache = _format_cache[fmt] = {}
+            cache.update(zip(missing, _format_local(missing, is_datetime, fmt)))
+        formatted = pd.Series([cache[k] for k in keys])
+    return formatted.array.take(codes, allow_fill=True)
+
 def convert_speed_to_kmh(df, speed_column='speed'):
     """
     Convert speed from m/s to km/h and cap at reasonable maximum
+
+    Where the feed reports 0 (or nothing) and a ``derived_speed`` computed from
+    consecutive pings is available, the derived value is used instead.
     
     Args:
         df: DataFrame with speed column
@@ -21,11 +107,49 @@ def convert_speed_to_kmh(df, speed_column='speed'):
     Returns:
         DataFrame with converted speed
     """
-    df[speed_column] = pd.to_numeric(df[speed_column], errors='coerce').fillna(0)
-    df[speed_column] = df[speed_column] * 3.6  # m/s to km/h
-    df[speed_column] = df[speed_column].round(0).clip(upper=120)  # Cap at 120 km/h
+    df[speed_column] = speed_kmh(df, speed_column)
     return df
 
+class RegionIndex:
+    """
+    Row positions of a DataFrame grouped by region, built once with a single
+    factorize + stable sort so repeated region selections are slices rather
+    than full-column string comparisons.
+    """
+
+    def __init__(self, df):
+        codes, self.regions = pd.factorize(df['region'])
+        self.order = np.argsort(codes, kind='stable')
+        counts = np.bincount(codes[codes >= 0], minlength=len(self.regions))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]) + np.count_nonzero(codes < 0)
+        self._code = {region: i for i, region in enumerate(self.regions)}
+
+    def rows(self, regions):
+        """Sorted row positions belonging to any of *regions*."""
+        parts = [
+            self.order[self.offsets[self._code[r]]:self.offsets[self._code[r] + 1]]
+            for r in regions if r in self._code
+        ]
+        if not parts:
+            return np.array([], dtype='int64')
+        return np.sort(np.concatenate(parts)) if len(parts) > 1 else parts[0]
+
+def select_regions(df, regions, index=None):
+    """Rows of *df* in *regions* (original order), using *index* if one was built."""
+    if index is None:
+        return df[df['region'].isin(regions)]
+    return df.take(index.rows(regions))
+
+def get_region_options():
+    """
+    Fixed region list for dropdowns (Rapid Bus KL first, rest alphabetical).
+
+    Taken from config rather than the data so the options don't re-order
+    during auto-refresh.
+    """
+    primary = [r for r in ['Rapid Bus KL'] if r in REGIONS]
+    return primary + sorted(r for r in REGIONS if r != 'Rapid Bus KL')
+
 def get_sorted_regions(df):
     """Get available regions sorted with Rapid Bus KL first"""
     primary = ['Rapid Bus KL']
@@ -33,74 +157,68 @@ def get_sorted_regions(df):
     others = sorted([r for r in available if r != 'Rapid Bus KL'])
     return [r for r in primary if r in available] + others
 
-def prepare_map_data(df, region):
+def prepare_map_data(df, region, index=None):
     """
     Optimized data preparation for map display
     Filters, cleans, and validates in one pass
+
+    Region rows are taken once (via *index* when given); coordinates, bearing
+    and speed are converted to float64 arrays without re-parsing columns that
+    are already numeric.
     """
-    # Filter by region
-    df_filtered = df[df['region'] == region].copy()
-    
-    if df_filtered.empty:
+    rows = index.rows([region]) if index is not None else np.flatnonzero((df['region'] == region).to_numpy())
+    if len(rows) == 0:
         return pd.DataFrame()
-    
-    # Convert to numeric and fill defaults in one step
-    df_filtered['latitude'] = pd.to_numeric(df_filtered['latitude'], errors='coerce')
-    df_filtered['longitude'] = pd.to_numeric(df_filtered['longitude'], errors='coerce')
-    df_filtered['bearing'] = pd.to_numeric(df_filtered['bearing'], errors='coerce').fillna(0)
-    df_filtered['speed'] = pd.to_numeric(df_filtered['speed'], errors='coerce').fillna(0)
-    
-    # Convert speed using helper function
-    df_filtered = convert_speed_to_kmh(df_filtered)
-    
+
+    region_df = df.take(rows)
+    lat = _as_float(region_df['latitude'])
+    lon = _as_float(region_df['longitude'])
+
     # Filter invalid coordinates in one operation
-    df_filtered = df_filtered[
-        (df_filtered['latitude'].notna()) &
-        (df_filtered['longitude'].notna()) &
-        (df_filtered['latitude'] != 0) &
-        (df_filtered['longitude'] != 0)
-    ]
-    
-    return df_filtered
+    valid = ~np.isnan(lat) & ~np.isnan(lon) & (lat != 0) & (lon != 0)
+    if not valid.all():
+        region_df, lat, lon = region_df[valid], lat[valid], lon[valid]
+
+    bearing = _as_float(region_df['bearing'])
+    region_df['latitude'] = lat
+    region_df['longitude'] = lon
+    region_df['bearing'] = np.nan_to_num(bearing, nan=0.0)
+    region_df['speed'] = speed_kmh(region_df)
+    return region_df
 
 def format_display_dataframe(df):
-    """Format dataframe for display in data table"""
-    display_df = df.sort_values('timestamp', ascending=False).copy()
-    
-    # Convert speed using helper function
-    display_df = convert_speed_to_kmh(display_df)
-    
-    # Calculate average speed per vehicle
-    avg_speed = display_df.groupby('vehicle_id')['speed'].mean().round(0)
-    display_df['avg_speed'] = display_df['vehicle_id'].map(avg_speed)
-    
-    # Select and rename columns (include created_at_formatted if present)
-    base_cols = [
-        'region', 'vehicle_id', 'latitude', 'longitude',
-        'bearing', 'speed', 'avg_speed', 'timestamp_formatted'
-    ]
-    if 'created_at_formatted' in display_df.columns:
-        base_cols.append('created_at_formatted')
-    display_df = display_df[base_cols]
-
-    rename_map = {
-        'region': 'Region',
-        'vehicle_id': 'Vehicle ID',
-        'latitude': 'Latitude',
-        'longitude': 'Longitude',
-        'bearing': 'Heading (°)',
-        'speed': 'Speed (km/h)',
-        'avg_speed': 'Avg Speed (km/h)',
-        'timestamp_formatted': 'Timestamp',
-        'created_at_formatted': 'Created At',
+    """
+    Format dataframe for display in data table
+
+    Builds the output columns directly from NumPy arrays in display order
+    (newest first) instead of sorting, copying and renaming the full frame.
+    Timestamps are formatted here, for the displayed rows only.
+    """
+    # Newest first; stable so equal timestamps keep their stored order
+    timestamps = _as_float(df['timestamp'])
+    order = np.argsort(-timestamps, kind='stable')
+
+    speed = speed_kmh(df)
+    # Average speed per vehicle via factorize + bincount
+    codes, _ = pd.factorize(df['vehicle_id'])
+    sums = np.bincount(codes, weights=speed)
+    counts = np.bincount(codes)
+    avg_speed = np.round(sums / np.maximum(counts, 1), 0)[codes[order]]
+
+    def taken(col):
+        # Stay in pandas for string columns: .to_numpy() would box every value
+        return df[col].take(order).array
+
+    columns = {
+        'Region': taken('region'),
+        'Vehicle ID': taken('vehicle_id'),
+        'Latitude': np.round(_as_float(df['latitude'])[order], 6),
+        'Longitude': np.round(_as_float(df['longitude'])[order], 6),
+        'Heading (°)': np.round(_as_float(df['bearing'])[order], 1),
+        'Speed (km/h)': speed[order].astype(int),
+        'Avg Speed (km/h)': avg_speed.astype(int),
+        'Timestamp': format_timestamps(timestamps[order]),
     }
-    display_df = display_df.rename(columns=rename_map)
-    
-    # Round numeric columns
-    display_df['Latitude'] = display_df['Latitude'].round(6)
-    display_df['Longitude'] = display_df['Longitude'].round(6)
-    display_df['Heading (°)'] = display_df['Heading (°)'].round(1)
-    display_df['Speed (km/h)'] = display_df['Speed (km/h)'].astype(int)
-    display_df['Avg Speed (km/h)'] = display_df['Avg Speed (km/h)'].astype(int)
-    
-    return display_df.reset_index(drop=True)
\ No newline at end of file
+    if 'created_at' in df.columns:
+        columns['Created At'] = format_timestamps(df['created_at'].take(order), CREATED_AT_FORMAT)
+    return pd.DataFrame(columns, copy=False)
@@ -1,6 +1,10 @@
 import duckdb
 import pandas as pd
 from datetime import datetime, timedelta, timezone
+from utils import profiling
+from utils.keyframes import KEYFRAME_TABLE, KEYFRAME_BUCKET_SECONDS
+from utils.route_stats import ROUTE_STATS_TABLE
+from utils.trips import TRIPS_TABLE
 
 try:
     from config import DATABASE_NAME, DATABASE_TABLE, TIMEZONE, UTC_OFFSET_HOURS
@@ -10,21 +14,31 @@ except ImportError:
     TIMEZONE = 'Asia/Kuala_Lumpur'
     UTC_OFFSET_HOURS = 8
 
+try:
+    from config import METRICS_TABLE
+except ImportError:
+    METRICS_TABLE = 'pipeline_metrics'
+
 def get_connection():
     """Get database connection with timezone set"""
     con = duckdb.connect(DATABASE_NAME)
     con.execute(f"SET TimeZone='{TIMEZONE}'")
-    return con
+    return profiling.wrap_connection(con)
 
-def table_exists():
+# Opt-in query profiling (DB_PROFILING in config.py / TRANSIT_DB_PROFILING=1)
+profiled = profiling.profiled(get_connection)
+
+@profiled
+def table_exists(table_name=DATABASE_TABLE):
     """Check if table exists"""
     con = get_connection()
     result = con.execute(
-        f"SELECT count(*) FROM information_schema.tables WHERE table_name = '{DATABASE_TABLE}'"
+        "SELECT count(*) FROM information_schema.tables WHERE table_name = ?", [table_name]
     ).fetchone()[0]
     con.close()
     return result > 0
 
+@profiled
 def get_live_data_optimized():
     """
     Get latest live data for display (last 60 seconds, deduplicated by vehicle)
@@ -78,12 +92,9 @@ def get_live_data_optimized():
         
         con.close()
         
-        # Format timestamp column
+        # Epoch seconds; display formatting happens in data_processor.format_timestamps
         if 'timestamp' in df.columns:
             df['timestamp'] = pd.to_numeric(df['timestamp'], errors='coerce')
-            df['timestamp_formatted'] = pd.to_datetime(
-                df['timestamp'], unit='s', utc=True
-            ).dt.tz_convert(TIMEZONE).dt.strftime('%Y-%m-%d %H:%M:%S')
         
         # Ensure trip_id / route_id columns are present (they may be absent on older DBs
         # before the migration runs for the first time)
@@ -106,6 +117,7 @@ def get_live_data_optimized():
         con.close()
         raise e
 
+@profiled
 def get_vehicle_trail(vehicle_id, region, limit=50):
     """
     Get historical positions for a specific vehicle in a region, ordered by timestamp ASC.
@@ -162,6 +174,7 @@ def get_vehicle_trail(vehicle_id, region, limit=50):
         raise e
 
 
+@profiled
 def get_historical_data():
     """
     Get ALL historical data for analytics and data table
@@ -178,8 +191,11 @@ def get_historical_data():
     con = get_connection()
     
     try:
-        # Get all historical data
-        df = con.execute(f"SELECT * FROM {DATABASE_TABLE}").df()
+        # Get all historical data, with timestamp cast to epoch seconds in DuckDB
+        # rather than parsed from strings in pandas
+        df = con.execute(
+            f"SELECT * REPLACE (TRY_CAST(timestamp AS BIGINT) AS timestamp) FROM {DATABASE_TABLE}"
+        ).df()
         
         if df.empty:
             con.close()
@@ -192,25 +208,8 @@ def get_historical_data():
         
         con.close()
         
-        # Format timestamp column once - fix deprecation warning by converting to numeric first
-        if 'timestamp' in df.columns:
-            df['timestamp'] = pd.to_numeric(df['timestamp'], errors='coerce')
-            df['timestamp_formatted'] = pd.to_datetime(
-                df['timestamp'], unit='s', utc=True
-            ).dt.tz_convert(TIMEZONE).dt.strftime('%Y-%m-%d %H:%M:%S')
-        
-        # Format insert_timestamp for display
-        if 'insert_timestamp' in df.columns:
-            df['insert_timestamp'] = pd.to_numeric(df['insert_timestamp'], errors='coerce')
-            df['insert_timestamp_formatted'] = pd.to_datetime(
-                df['insert_timestamp'], unit='s', utc=True
-            ).dt.tz_convert(TIMEZONE).dt.strftime('%Y-%m-%d %H:%M:%S')
-
-        # Format created_at for display
-        if 'created_at' in df.columns:
-            df['created_at_formatted'] = pd.to_datetime(
-                df['created_at'], utc=True, errors='coerce'
-            ).dt.tz_convert(TIMEZONE).dt.strftime('%-d %b %Y, %H:%M')
+        # Timestamps stay typed (epoch seconds / TIMESTAMP); only the rows that
+        # are displayed get formatted, see data_processor.format_timestamps
 
         # Calculate metrics (only regions for historical data)
         metrics = {
@@ -221,4 +220,157 @@ def get_historical_data():
         
     except Exception as e:
         con.close()
-        raise e
\ No newline at end of file
+        raise e
+
+@profiled
+def get_pipeline_metrics(since_seconds=3600):
+    """
+    Get ingestion pipeline measurements recorded in the last *since_seconds*.
+
+    Returns:
+        DataFrame with one row per stage / endpoint measurement
+        (cycle_ts, stage, region, endpoint, duration_ms, bytes, entities,
+        staleness_s, error); empty if nothing has been recorded yet
+    """
+    if not table_exists(METRICS_TABLE):
+        return pd.DataFrame()
+
+    con = get_connection()
+    try:
+        df = con.execute(
+            f"""
+            SELECT * FROM {METRICS_TABLE}
+            WHERE cycle_ts >= (SELECT MAX(cycle_ts) FROM {METRICS_TABLE}) - ?
+            ORDER BY cycle_ts
+            """,
+            [int(since_seconds)],
+        ).df()
+        con.close()
+        return df
+    except Exception as e:
+        con.close()
+        raise e
+
+@profiled
+def get_playback_range():
+    """
+    Time span covered by the playback keyframes.
+
+    Returns:
+        tuple: (first_bucket_ts, last_bucket_ts) in epoch seconds, or (None, None)
+    """
+    if not table_exists(KEYFRAME_TABLE):
+        return None, None
+
+    con = get_connection()
+    try:
+        first, last = con.execute(f"SELECT MIN(bucket_ts), MAX(bucket_ts) FROM {KEYFRAME_TABLE}").fetchone()
+        con.close()
+        return first, last
+    except Exception as e:
+        con.close()
+        raise e
+
+@profiled
+def get_fleet_at(ts, window=60):
+    """
+    Fleet as it was at *ts*: the latest position per vehicle in the *window*
+    seconds up to it, read from the keyframes covering that window only.
+
+    Args:
+        ts: Epoch seconds
+        window: Look-back in seconds (60 matches the live map)
+
+    Returns:
+        DataFrame with columns region, vehicle_id, latitude, longitude,
+        bearing, speed, derived_speed, timestamp (epoch seconds)
+    """
+    if not table_exists(KEYFRAME_TABLE):
+        return pd.DataFrame()
+
+    ts, window = int(ts), int(window)
+    first_bucket = (ts - window) // KEYFRAME_BUCKET_SECONDS * KEYFRAME_BUCKET_SECONDS
+    con = get_connection()
+    try:
+        df = con.execute(
+            f"""
+            SELECT * EXCLUDE (bucket_ts) FROM {KEYFRAME_TABLE}
+            WHERE bucket_ts BETWEEN ? AND ? AND timestamp BETWEEN ? AND ?
+            QUALIFY ROW_NUMBER() OVER (PARTITION BY region, vehicle_id ORDER BY timestamp DESC) = 1
+            """,
+            [first_bucket, ts, ts - window, ts],
+        ).df()
+        con.close()
+        return df
+    except Exception as e:
+        con.close()
+        raise e
+
+@profiled
+def get_route_hourly(region):
+    """
+    Hourly route aggregates for *region* (see utils/route_stats.py).
+
+    Returns:
+        DataFrame with columns region, route_id, hour_ts (epoch seconds, UTC
+        hour start), pings, moving_pings, speed_sum_mps
+    """
+    if not table_exists(ROUTE_STATS_TABLE):
+        return pd.DataFrame()
+
+    con = get_connection()
+    try:
+        df = con.execute(f"SELECT * FROM {ROUTE_STATS_TABLE} WHERE region = ?", [region]).df()
+        con.close()
+        return df
+    except Exception as e:
+        con.close()
+        raise e
+
+@profiled
+def get_route_headways(region, since_seconds=7 * 86400, max_headway=3 * 3600):
+    """
+    Gaps between successive trip starts on each route of *region*, from the
+    trips table.  Trips are compared within their shape (a route runs one
+    shape per direction), so the two directions of a route don't halve each
+    other's headways; trips stored before shape_id was recorded share one
+    partition per route.
+
+    Args:
+        region: Region name
+        since_seconds: Only trips that started this long before the newest one
+        max_headway: Longer gaps (overnight, service breaks) are dropped
+
+    Returns:
+        DataFrame with columns route_id, start_ts, headway_s
+    """
+    if not table_exists(TRIPS_TABLE):
+        return pd.DataFrame()
+
+    con = get_connection()
+    try:
+        has_shape = con.execute(
+            "SELECT count(*) FROM information_schema.columns WHERE table_name = ? AND column_name = 'shape_id'",
+            [TRIPS_TABLE],
+        ).fetchone()[0] > 0
+        direction = "COALESCE(shape_id, '')" if has_shape else "''"
+        df = con.execute(
+            f"""
+            SELECT route_id, start_ts, headway_s FROM (
+                SELECT route_id, start_ts,
+                       start_ts - LAG(start_ts) OVER (
+                           PARTITION BY route_id, {direction} ORDER BY start_ts
+                       ) AS headway_s
+                FROM {TRIPS_TABLE}
+                WHERE region = ? AND route_id <> ''
+                  AND start_ts >= (SELECT MAX(start_ts) FROM {TRIPS_TABLE} WHERE region = ?) - ?
+            )
+            WHERE headway_s > 0 AND headway_s <= ?
+            """,
+            [region, region, int(since_seconds), int(max_headway)],
+        ).df()
+        con.close()
+        return df
+    except Exception as e:
+        con.close()
+        raise e
@@ -0,0 +1,331 @@
+"""
+density_tiles.py
+----------------
+Where buses have been: historical ping density as slippy-map PNG tiles.
+
+``density_cells`` counts pings per grid cell at every zoom from
+DENSITY_MIN_ZOOM to DENSITY_MAX_ZOOM, in Web Mercator tile space.  Each
+256 px tile is split into CELLS_PER_TILE × CELLS_PER_TILE cells of CELL_PX
+pixels.  ``density_tiles`` holds each tile's total pings, so a tile's total
+changes exactly when one of its cells does.  The writer folds in the rows
+each flush actually inserted, in the same transaction, as it does for
+``route_hourly`` (utils/route_stats.py).  The table is backfilled from the
+positions table when first created.  Counts are only ever added, so tiles
+cover the whole history at a size that depends on the area covered, not on
+the number of pings.
+
+Tiles are coloured on a log scale that saturates at DENSITY_SATURATION_PINGS
+per cell at DENSITY_MAX_ZOOM.  The limit doubles per zoom level out, because
+routes are lines and a cell's count roughly doubles with each level.  The scale
+is fixed, so a tile's image depends only on its own cells.  A rendered tile
+is kept until its total changes.  PNGs are encoded with zlib alone.
+
+Set TILE_API_PORT and the ingester serves ``GET /tiles/{z}/{x}/{y}.png``
+(with an ETag) for map clients.  DuckDB allows only one writing process, so
+the endpoint runs next to ``/history``.  The Live Map uses
+:func:`render_area`, one stitched image per region, as a BitmapLayer.
+"""
+
+import re
+import struct
+import zlib
+
+import duckdb
+import numpy as np
+
+from utils import geo, http_endpoint, schema
+
+try:
+    from config import DATABASE_NAME, DATABASE_TABLE
+except ImportError:
+    DATABASE_NAME = 'agustiar_analytics.duckdb'
+    DATABASE_TABLE = 'live_buses'
+
+try:
+    from config import DENSITY_TILES_ENABLED, DENSITY_CELL_TABLE, DENSITY_TILE_TABLE
+except ImportError:
+    DENSITY_TILES_ENABLED = True
+    DENSITY_CELL_TABLE = 'density_cells'
+    DENSITY_TILE_TABLE = 'density_tiles'
+
+try:
+    from config import DENSITY_MIN_ZOOM, DENSITY_MAX_ZOOM, DENSITY_SATURATION_PINGS
+except ImportError:
+    DENSITY_MIN_ZOOM = 5    # all of Malaysia in a few tiles
+    DENSITY_MAX_ZOOM = 13   # ~75 m cells; every extra level roughly triples the cells
+    DENSITY_SATURATION_PINGS = 2000
+
+try:
+    from config import TILE_API_PORT
+except ImportError:
+    TILE_API_PORT = None
+
+TILE_SIZE = 256
+CELL_PX = 4
+CELLS_PER_TILE = TILE_SIZE // CELL_PX
+
+# Rendered tiles kept in memory; the cache is replaced rather than cleared when full
+TILE_CACHE_SIZE = 2048
+
+# Colour ramp (position on the log scale -> RGBA); empty cells stay transparent
+_RAMP = [
+    (0.0, (65, 105, 225, 90)),
+    (0.4, (0, 200, 200, 150)),
+    (0.7, (255, 215, 0, 200)),
+    (1.0, (220, 20, 60, 235)),
+]
+_PALETTE = np.stack([
+    np.interp(np.linspace(0, 1, 256), [p for p, _ in _RAMP], [c[i] for _, c in _RAMP])
+    for i in range(4)
+], axis=1).round().astype('uint8')
+_PALETTE[0] = 0
+
+
+# ---------------------------------------------------------------------------
+# Aggregation (called by the writer)
+# ---------------------------------------------------------------------------
+
+def upsert(con, source):
+    """
+    Add the positions in *source* (a table of newly inserted rows) to the
+    density cells and tile totals at every zoom.  Runs in the caller's
+    transaction.
+    """
+    if not {'latitude', 'longitude'} <= schema.columns(con, source):
+        return
+    cells = 2 ** DENSITY_MAX_ZOOM * CELLS_PER_TILE
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE new_density_cells AS
+        SELECT zoom, cx >> ({DENSITY_MAX_ZOOM} - zoom) AS cx, cy >> ({DENSITY_MAX_ZOOM} - zoom) AS cy,
+               sum(pings) AS pings
+        FROM (
+            SELECT LEAST(CAST(floor((lon + 180) / 360 * {cells}) AS INTEGER), {cells - 1}) AS cx,
+                   LEAST(CAST(floor((0.5 - ln(tan(pi() / 4 + radians(lat) / 2)) / (2 * pi())) * {cells})
+                              AS INTEGER), {cells - 1}) AS cy,
+                   count(*) AS pings
+            FROM (
+                SELECT TRY_CAST(longitude AS DOUBLE) AS lon,
+                       LEAST(GREATEST(TRY_CAST(latitude AS DOUBLE), -{geo.MERCATOR_MAX_LAT}), {geo.MERCATOR_MAX_LAT}) AS lat
+                FROM {source}
+            )
+            WHERE lat IS NOT NULL AND lon BETWEEN -180 AND 180 AND NOT (lat = 0 AND lon = 0)
+            GROUP BY ALL
+        ), range({DENSITY_MIN_ZOOM}, {DENSITY_MAX_ZOOM + 1}) zooms(zoom)
+        GROUP BY ALL
+    """)
+    con.execute(f"""
+        INSERT INTO {DENSITY_CELL_TABLE} (zoom, cx, cy, pings)
+        SELECT zoom, cx, cy, pings FROM new_density_cells
+        ON CONFLICT (zoom, cx, cy) DO UPDATE SET pings = {DENSITY_CELL_TABLE}.pings + excluded.pings
+    """)
+    con.execute(f"""
+        INSERT INTO {DENSITY_TILE_TABLE} (zoom, tx, ty, pings)
+        SELECT zoom, cx // {CELLS_PER_TILE}, cy // {CELLS_PER_TILE}, sum(pings)
+        FROM new_density_cells
+        GROUP BY ALL
+        ON CONFLICT (zoom, tx, ty) DO UPDATE SET pings = {DENSITY_TILE_TABLE}.pings + excluded.pings
+    """)
+    con.execute("DROP TABLE new_density_cells")
+
+
+def ensure_table(con, source=DATABASE_TABLE):
+    """
+    Create the density tables if they are missing, backfilling them from
+    *source* (the positions table) when that already holds history.
+    """
+    if schema.table_exists(con, DENSITY_CELL_TABLE) and schema.table_exists(con, DENSITY_TILE_TABLE):
+        return
+    con.execute(f"DROP TABLE IF EXISTS {DENSITY_CELL_TABLE}")
+    con.execute(f"DROP TABLE IF EXISTS {DENSITY_TILE_TABLE}")
+    con.execute(f"""
+        CREATE TABLE {DENSITY_CELL_TABLE} (
+            zoom INTEGER,
+            cx INTEGER,
+            cy INTEGER,
+            pings BIGINT,
+            PRIMARY KEY (zoom, cx, cy)
+        )
+    """)
+    con.execute(f"""
+        CREATE TABLE {DENSITY_TILE_TABLE} (
+            zoom INTEGER,
+            tx INTEGER,
+            ty INTEGER,
+            pings BIGINT,
+            PRIMARY KEY (zoom, tx, ty)
+        )
+    """)
+    if schema.table_exists(con, source):
+        print(f"Backfilling {DENSITY_CELL_TABLE} from {source}...")
+        upsert(con, source)
+
+
+# ---------------------------------------------------------------------------
+# Rendering
+# ---------------------------------------------------------------------------
+
+def encode_png(rgba):
+    """8-bit RGBA PNG bytes for an (height, width, 4) uint8 array."""
+    height, width = rgba.shape[:2]
+    # Every scanline starts with filter type 0 (none)
+    raw = np.zeros((height, 1 + width * 4), dtype='uint8')
+    raw[:, 1:] = rgba.reshape(height, -1)
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw.tobytes(), 6))
+            + chunk(b'IEND', b''))
+
+
+def colorize(counts, zoom):
+    """RGBA image (CELL_PX pixels per cell) for a grid of ping counts at *zoom*."""
+    saturation = DENSITY_SATURATION_PINGS * 2.0 ** (DENSITY_MAX_ZOOM - zoom)
+    level = np.log1p(counts) / np.log1p(saturation)
+    index = np.clip(np.round(level * 255), 0, 255).astype('uint8')
+    # Any pings at all get a visible colour
+    index[(counts > 0) & (index == 0)] = 1
+    rgba = _PALETTE[index]
+    return np.repeat(np.repeat(rgba, CELL_PX, axis=0), CELL_PX, axis=1)
+
+
+def read_cells(con, zoom, cx0, cy0, width, height):
+    """Ping counts of cells [cx0, cx0 + width) × [cy0, cy0 + height) at *zoom*, as a (height, width) array."""
+    rows = con.execute(
+        f"""
+        SELECT cx - ? AS col, cy - ? AS row, pings FROM {DENSITY_CELL_TABLE}
+        WHERE zoom = ? AND cx >= ? AND cx < ? AND cy >= ? AND cy < ?
+        """,
+        [cx0, cy0, zoom, cx0, cx0 + width, cy0, cy0 + height],
+    ).fetchnumpy()
+    counts = np.zeros((height, width), dtype='int64')
+    counts[np.asarray(rows['row'], dtype='int64'), np.asarray(rows['col'], dtype='int64')] = rows['pings']
+    return counts
+
+
+EMPTY_TILE = encode_png(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype='uint8'))
+
+_tile_cache = {}
+
+
+def tile_png(z, x, y):
+    """
+    PNG for tile *z*/*x*/*y* and its total pings (0 for an empty tile).
+
+    Raises:
+        ValueError: for a zoom outside DENSITY_MIN_ZOOM..DENSITY_MAX_ZOOM or
+            a tile outside the world
+    """
+    global _tile_cache
+    if not DENSITY_MIN_ZOOM <= z <= DENSITY_MAX_ZOOM:
+        raise ValueError(f"Zoom must be between {DENSITY_MIN_ZOOM} and {DENSITY_MAX_ZOOM}")
+    if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise ValueError(f"No tile {z}/{x}/{y}")
+
+    con = duckdb.connect(DATABASE_NAME)
+    try:
+        if not schema.table_exists(con, DENSITY_TILE_TABLE):
+            return EMPTY_TILE, 0
+        row = con.execute(
+            f"SELECT pings FROM {DENSITY_TILE_TABLE} WHERE zoom = ? AND tx = ? AND ty = ?", [z, x, y]
+        ).fetchone()
+        if row is None:
+            return EMPTY_TILE, 0
+        pings = int(row[0])
+        cached = _tile_cache.get((z, x, y))
+        if cached is not None and cached[0] == pings:
+            return cached[1], pings
+        counts = read_cells(con, z, x * CELLS_PER_TILE, y * CELLS_PER_TILE, CELLS_PER_TILE, CELLS_PER_TILE)
+    finally:
+        con.close()
+
+    png = encode_png(colorize(counts, z))
+    if len(_tile_cache) >= TILE_CACHE_SIZE:
+        _tile_cache = {}
+    _tile_cache[(z, x, y)] = (pings, png)
+    return png, pings
+
+
+def render_area(lat_min, lon_min, lat_max, lon_max, max_px=1024, margin=0.1):
+    """
+    One density image covering a bounding box (plus *margin* of its size on
+    each side), at the most detailed zoom that fits in *max_px* pixels.
+
+    Returns:
+        tuple: (PNG bytes, [west, south, east, north] of the image, zoom),
+            or None if there are no pings in the area
+    """
+    x0, y1 = geo.to_web_mercator(lat_min, lon_min)
+    x1, y0 = geo.to_web_mercator(lat_max, lon_max)
+    pad_x, pad_y = (x1 - x0) * margin, (y1 - y0) * margin
+    x0, x1, y0, y1 = max(x0 - pad_x, 0.0), min(x1 + pad_x, 1.0), max(y0 - pad_y, 0.0), min(y1 + pad_y, 1.0)
+
+    zoom = DENSITY_MIN_ZOOM
+    for z in range(DENSITY_MAX_ZOOM, DENSITY_MIN_ZOOM - 1, -1):
+        if max(x1 - x0, y1 - y0) * 2 ** z * TILE_SIZE <= max_px:
+            zoom = z
+            break
+    scale = 2 ** zoom * CELLS_PER_TILE
+    cx0, cy0 = int(x0 * scale), int(y0 * scale)
+    width, height = int(x1 * scale) - cx0 + 1, int(y1 * scale) - cy0 + 1
+
+    con = duckdb.connect(DATABASE_NAME)
+    try:
+        if not schema.table_exists(con, DENSITY_CELL_TABLE):
+            return None
+        counts = read_cells(con, zoom, cx0, cy0, width, height)
+    finally:
+        con.close()
+    if not counts.any():
+        return None
+
+    north, west = geo.from_web_mercator(cx0 / scale, cy0 / scale)
+    south, east = geo.from_web_mercator((cx0 + width) / scale, (cy0 + height) / scale)
+    bounds = [float(west), float(south), float(east), float(north)]
+    return encode_png(colorize(counts, zoom)), bounds, zoom
+
+
+# ---------------------------------------------------------------------------
+# HTTP endpoint
+# ---------------------------------------------------------------------------
+
+_TILE_PATH = re.compile(r'^/tiles/(\d+)/(\d+)/(\d+)\.png$')
+
+
+class _TileHandler(http_endpoint.QuietHandler):
+
+    def do_GET(self):
+        match = _TILE_PATH.match(self.path.split('?', 1)[0])
+        if match is None:
+            self.send_error(404)
+            return
+        try:
+            png, pings = tile_png(*(int(v) for v in match.groups()))
+        except ValueError as e:
+            self.send_error(404, str(e))
+            return
+
+        etag = f'"{pings}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(png)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('ETag', etag)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        try:
+            self.wfile.write(png)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def start_http_server(port, host='127.0.0.1'):
+    """Serve ``/tiles/{z}/{x}/{y}.png`` on *host*:*port* from a daemon thread (idempotent)."""
+    return http_endpoint.serve(_TileHandler, port, host, name='tiles-http')
@@ -0,0 +1,249 @@
+"""
+feed_archive.py
+---------------
+Record raw GTFS-RT responses and replay them through the ingest pipeline.
+
+Recording (set ``FEED_ARCHIVE_DIR`` in config.py) stores every successful
+response as gzip-compressed protobuf, one file per endpoint per cycle, with a
+JSON-lines manifest per UTC day::
+
+    <archive>/20250101/manifest.jsonl
+    <archive>/20250101/1735689600_mybas_johor.pb.gz
+
+Whole days are deleted once older than ``FEED_ARCHIVE_MAX_DAYS``, and the
+oldest days go first while the archive is larger than
+``FEED_ARCHIVE_MAX_BYTES``; the recorder checks at most every
+PRUNE_INTERVAL_SECONDS.  The current day is never deleted.
+
+Replay feeds those payloads through the same decode → filter → enrich → store
+path as a live fetch, one recorded cycle at a time, using the recorded cycle
+time as "now".  Use it to backfill a fresh DuckDB, load-test, or reproduce a
+bad feed without network access::
+
+    cd src
+    python -m utils.feed_archive /path/to/archive --speed 10
+    python -m utils.feed_archive /path/to/archive --speed max --database backfill.duckdb
+"""
+
+import argparse
+import gzip
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timezone
+
+try:
+    from config import FEED_ARCHIVE_MAX_DAYS, FEED_ARCHIVE_MAX_BYTES
+except ImportError:
+    FEED_ARCHIVE_MAX_DAYS = 14
+    FEED_ARCHIVE_MAX_BYTES = 20 * 1024 ** 3   # None for no size limit
+
+MANIFEST = 'manifest.jsonl'
+PRUNE_INTERVAL_SECONDS = 3600
+
+_lock = threading.Lock()
+_last_prune = {}   # archive_dir -> cycle_ts of the last prune
+
+
+def _safe(text):
+    return ''.join(c if c.isalnum() else '_' for c in text)
+
+
+# ---------------------------------------------------------------------------
+# Recording
+# ---------------------------------------------------------------------------
+
+def record(archive_dir, region, endpoint, content, cycle_ts):
+    """
+    Archive one endpoint's raw response for the cycle starting at *cycle_ts*.
+    Errors are printed, never raised, so recording can't break ingestion.
+    """
+    try:
+        day = datetime.fromtimestamp(cycle_ts, tz=timezone.utc).strftime('%Y%m%d')
+        day_dir = os.path.join(archive_dir, day)
+        os.makedirs(day_dir, exist_ok=True)
+
+        filename = f'{int(cycle_ts)}_{_safe(endpoint)}.pb.gz'
+        with open(os.path.join(day_dir, filename), 'wb') as fh:
+            fh.write(gzip.compress(content, compresslevel=6))
+
+        entry = {
+            'cycle_ts': int(cycle_ts), 'fetched_at': round(time.time(), 3),
+            'region': region, 'endpoint': endpoint, 'file': filename, 'bytes': len(content),
+        }
+        with _lock, open(os.path.join(day_dir, MANIFEST), 'a') as fh:
+            fh.write(json.dumps(entry) + '\n')
+    except OSError as e:
+        print(f"Feed archive error: {e}")
+        return
+
+    with _lock:
+        due = cycle_ts - _last_prune.get(archive_dir, 0) >= PRUNE_INTERVAL_SECONDS
+        if due:
+            _last_prune[archive_dir] = cycle_ts
+    if due:
+        prune(archive_dir, cycle_ts)
+
+
+def _day_dirs(archive_dir):
+    return sorted(d for d in os.listdir(archive_dir) if len(d) == 8 and d.isdigit()
+                  and os.path.isdir(os.path.join(archive_dir, d)))
+
+
+def _dir_bytes(path):
+    total = 0
+    for entry in os.scandir(path):
+        try:
+            total += entry.stat().st_size
+        except OSError:
+            pass
+    return total
+
+
+def prune(archive_dir, now=None, max_days=None, max_bytes=None):
+    """
+    Delete archived days older than *max_days*, then the oldest remaining
+    days while the archive exceeds *max_bytes*.  Both default to
+    FEED_ARCHIVE_MAX_DAYS / FEED_ARCHIVE_MAX_BYTES, where None or 0 disables
+    the limit.  The day containing *now* is always kept.
+
+    Returns:
+        Names of the deleted day directories
+    """
+    now = time.time() if now is None else now
+    max_days = FEED_ARCHIVE_MAX_DAYS if max_days is None else max_days
+    max_bytes = FEED_ARCHIVE_MAX_BYTES if max_bytes is None else max_bytes
+    today = datetime.fromtimestamp(now, tz=timezone.utc).strftime('%Y%m%d')
+    try:
+        days = [d for d in _day_dirs(archive_dir) if d < today]
+    except OSError as e:
+        print(f"Feed archive error: {e}")
+        return []
+
+    deleted = []
+    if max_days:
+        cutoff = datetime.fromtimestamp(now - max_days * 86400, tz=timezone.utc).strftime('%Y%m%d')
+        deleted = [d for d in days if d < cutoff]
+    if max_bytes:
+        sizes = {d: _dir_bytes(os.path.join(archive_dir, d)) for d in _day_dirs(archive_dir) if d not in deleted}
+        total = sum(sizes.values())
+        for d in days:
+            if total <= max_bytes:
+                break
+            if d not in deleted:
+                deleted.append(d)
+                total -= sizes[d]
+
+    for d in deleted:
+        shutil.rmtree(os.path.join(archive_dir, d), ignore_errors=True)
+    if deleted:
+        print(f"Feed archive: deleted {len(deleted)} day(s) ({deleted[0]} .. {deleted[-1]})")
+    return deleted
+
+
+# ---------------------------------------------------------------------------
+# Reading
+# ---------------------------------------------------------------------------
+
+def load_cycles(archive_dir, start=None, end=None):
+    """
+    Return archived cycles in time order as a list of
+    ``(cycle_ts, {(region, endpoint): path})``, optionally limited to
+    ``start <= cycle_ts <= end``.
+    """
+    cycles = {}
+    for day in sorted(os.listdir(archive_dir)):
+        manifest = os.path.join(archive_dir, day, MANIFEST)
+        if not os.path.isfile(manifest):
+            continue
+        with open(manifest) as fh:
+            for line in fh:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # torn last line from an interrupted write
+                ts = entry['cycle_ts']
+                if (start is not None and ts < start) or (end is not None and ts > end):
+                    continue
+                path = os.path.join(archive_dir, day, entry['file'])
+                cycles.setdefault(ts, {})[(entry['region'], entry['endpoint'])] = path
+    return sorted(cycles.items())
+
+
+def read_payload(path):
+    with gzip.open(path, 'rb') as fh:
+        return fh.read()
+
+
+# ---------------------------------------------------------------------------
+# Replay
+# ---------------------------------------------------------------------------
+
+def replay(archive_dir, speed=1.0, start=None, end=None):
+    """
+    Run every archived cycle through the ingest pipeline.
+
+    Args:
+        archive_dir: Directory written by :func:`record`
+        speed: 1.0 replays at recorded pace, N at N times faster, None or 0
+            as fast as possible
+        start, end: Optional unix-time bounds on the cycles replayed
+
+    Returns:
+        Number of cycles replayed
+    """
+    from utils import ingestion, writer  # deferred: ingestion imports this module
+
+    cycles = load_cycles(archive_dir, start, end)
+    if not cycles:
+        print(f"No archived cycles in {archive_dir}")
+        return 0
+
+    first_ts = cycles[0][0]
+    wall_start = time.monotonic()
+    for i, (cycle_ts, paths) in enumerate(cycles, 1):
+        if speed:
+            delay = (cycle_ts - first_ts) / speed - (time.monotonic() - wall_start)
+            if delay > 0:
+                time.sleep(delay)
+
+        def fetch(name, endpoint, cycle, paths=paths):
+            path = paths.get((name, endpoint))
+            if path is None:
+                # Not archived: the original fetch failed or the endpoint is new
+                cycle.record('fetch', name, endpoint, error='not archived')
+                return []
+            return ingestion._ingest_payload(name, endpoint, read_payload(path), cycle)
+
+        print(f"Replaying cycle {i}/{len(cycles)} "
+              f"({datetime.fromtimestamp(cycle_ts, tz=timezone.utc):%Y-%m-%d %H:%M:%S} UTC, "
+              f"{len(paths)} endpoints)")
+        ingestion.fetch_and_store_transit_data(fetch=fetch, current_unix=cycle_ts)
+    writer.close_all()   # commit anything still buffered
+    return len(cycles)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay archived GTFS-RT feeds through the ingest pipeline.')
+    parser.add_argument('archive_dir')
+    parser.add_argument('--speed', default='1', help="replay speed multiplier, or 'max'")
+    parser.add_argument('--start', type=int, help='first cycle (unix time)')
+    parser.add_argument('--end', type=int, help='last cycle (unix time)')
+    parser.add_argument('--database', help='DuckDB file to write to instead of DATABASE_NAME')
+    args = parser.parse_args(argv)
+
+    if args.database:
+        from utils import db, density_tiles, history_api, ingestion
+        ingestion.DATABASE_NAME = db.DATABASE_NAME = args.database
+        density_tiles.DATABASE_NAME = history_api.DATABASE_NAME = args.database
+
+    speed = None if args.speed == 'max' else float(args.speed)
+    start = time.perf_counter()
+    n_cycles = replay(args.archive_dir, speed=speed, start=args.start, end=args.end)
+    print(f"✓ Replayed {n_cycles} cycles in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""
+fleet.py
+--------
+Process-wide, versioned snapshot of the live fleet.
+
+The ingester publishes a :class:`FleetSnapshot` after every cycle.  It holds the
+latest position per vehicle as a struct of arrays:
+
+- float32 coordinates, bearing and speed
+- int64 timestamps
+- dictionary-encoded (categorical) ids
+
+Rows are sorted by region, so each region is a precomputed contiguous slice.
+The arrays are read-only, so pages can share them without copying; a new
+cycle publishes a new snapshot instead of mutating the current one.
+
+A process that hasn't ingested recently (e.g. a dashboard next to a
+separate ingester) falls back to building the snapshot from
+``db.get_live_data_optimized()``.
+"""
+
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils import db
+
+try:
+    from config import TIMEZONE
+except ImportError:
+    TIMEZONE = 'Asia/Kuala_Lumpur'
+
+try:
+    from config import FLEET_SNAPSHOT_MAX_AGE
+except ImportError:
+    FLEET_SNAPSHOT_MAX_AGE = 60   # seconds before pages fall back to the database
+
+# Same window as db.get_live_data_optimized
+LIVE_WINDOW_SECONDS = 60
+
+NUMERIC_COLUMNS = {
+    'latitude': 'float32',
+    'longitude': 'float32',
+    'bearing': 'float32',
+    'speed': 'float32',
+    'derived_speed': 'float32',
+    'timestamp': 'int64',
+}
+ID_COLUMNS = ['region', 'vehicle_id', 'trip_id', 'route_id']
+
+
+def _readonly(values):
+    values.flags.writeable = False
+    return values
+
+
+class FleetSnapshot:
+    """
+    Latest position per vehicle, sorted by region.
+
+    Attributes:
+        version: Increments with every published snapshot
+        columns: {name: read-only ndarray or pd.Categorical}, see
+            NUMERIC_COLUMNS / ID_COLUMNS
+        slices: {region: slice} into every column
+        sync_ts: Newest position timestamp (epoch seconds)
+        published_at: time.time() when the snapshot was built
+    """
+
+    def __init__(self, columns, slices, version, sync_ts):
+        self.columns = columns
+        self.slices = slices
+        self.version = version
+        self.sync_ts = sync_ts
+        self.published_at = time.time()
+
+    @classmethod
+    def from_frame(cls, df, version=0):
+        """
+        Build a snapshot from positions in *df* (an ingest batch, the previous
+        snapshot's frame, or the live query): latest row per vehicle, within
+        LIVE_WINDOW_SECONDS of the newest timestamp.
+        """
+        ts = pd.to_numeric(df['timestamp'], errors='coerce') if len(df) else pd.Series(dtype='float64')
+        keep = ts.notna().to_numpy()
+        if keep.any():
+            sync_ts = int(ts.max())
+            keep = keep & (ts >= sync_ts - LIVE_WINDOW_SECONDS).to_numpy()
+        else:
+            sync_ts = None
+        df, ts = df[keep], ts[keep].astype('int64')
+
+        # Latest per vehicle (same partition as the live query), then group by region
+        latest = ts.to_numpy().argsort(kind='stable')
+        latest = latest[~df['vehicle_id'].take(latest).duplicated(keep='last').to_numpy()]
+        region_codes, regions = pd.factorize(df['region'].take(latest).fillna(''), sort=True)
+        order = latest[np.argsort(region_codes, kind='stable')]
+        counts = np.bincount(region_codes, minlength=len(regions))
+        bounds = np.concatenate([[0], np.cumsum(counts)])
+        slices = {region: slice(int(bounds[i]), int(bounds[i + 1])) for i, region in enumerate(regions)}
+
+        columns = {}
+        for col in ID_COLUMNS:
+            values = df[col].take(order) if col in df.columns else pd.Series('', index=range(len(order)))
+            columns[col] = pd.Categorical(values.fillna('').astype(str).to_numpy())
+        for col, dtype in NUMERIC_COLUMNS.items():
+            if col == 'timestamp':
+                values = ts.to_numpy()[order]
+            elif col in df.columns:
+                values = pd.to_numeric(df[col].take(order), errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+            else:
+                values = np.full(len(order), np.nan)
+            columns[col] = _readonly(np.ascontiguousarray(values, dtype=dtype))
+        return cls(columns, slices, version, sync_ts)
+
+    def __len__(self):
+        return len(self.columns['timestamp'])
+
+    @property
+    def nbytes(self):
+        """Bytes held by the arrays (ids count their codes plus dictionary)."""
+        total = 0
+        for values in self.columns.values():
+            if isinstance(values, pd.Categorical):
+                total += values.codes.nbytes + int(values.categories.memory_usage(deep=True))
+            else:
+                total += values.nbytes
+        return total
+
+    @property
+    def regions(self):
+        return list(self.slices)
+
+    @property
+    def sync_time(self):
+        """Newest position time as the dashboard shows it, e.g. '1 Jan 2025 08:00:00'."""
+        if self.sync_ts is None:
+            return None
+        return pd.Timestamp(self.sync_ts, unit='s', tz='UTC').tz_convert(TIMEZONE).strftime('%-d %b %Y %H:%M:%S')
+
+    def metrics(self):
+        """Live Map metrics: total vehicles, regions present and busiest region."""
+        counts = {region: s.stop - s.start for region, s in self.slices.items()}
+        return {
+            'total': len(self),
+            'regions': len(counts),
+            'busiest': max(counts, key=counts.get) if counts else 'N/A',
+        }
+
+    def frame(self, region=None):
+        """
+        DataFrame over the snapshot arrays (all vehicles, or one region's
+        slice) without copying them.  Ids are categorical.
+        """
+        if region is None:
+            rows = slice(None)
+        else:
+            rows = self.slices.get(region, slice(0, 0))
+        return pd.DataFrame({name: values[rows] for name, values in self.columns.items()}, copy=False)
+
+
+# ---------------------------------------------------------------------------
+# Process-wide snapshot
+# ---------------------------------------------------------------------------
+
+_snapshot = None
+_lock = threading.Lock()
+
+
+def publish(df):
+    """
+    Merge an ingest batch into the live snapshot and publish the result as
+    the next version.  Vehicles missing from *df* (e.g. their endpoint failed
+    this cycle) are kept until they fall out of the live window.
+    """
+    global _snapshot
+    with _lock:
+        prev = _snapshot
+        if prev is not None and len(prev):
+            cols = [c for c in ID_COLUMNS + list(NUMERIC_COLUMNS) if c in df.columns]
+            df = pd.concat([prev.frame(), df[cols]], ignore_index=True)
+        _snapshot = FleetSnapshot.from_frame(df, version=prev.version + 1 if prev else 1)
+        return _snapshot
+
+
+def current():
+    """The last published snapshot, or None if this process hasn't ingested."""
+    return _snapshot
+
+
+def get_snapshot():
+    """
+    The live fleet for pages: the published snapshot while it is fresh
+    (FLEET_SNAPSHOT_MAX_AGE), otherwise one built from the database.
+
+    Returns:
+        FleetSnapshot, or None if there is no live data
+    """
+    snap = _snapshot
+    if snap is not None and time.time() - snap.published_at <= FLEET_SNAPSHOT_MAX_AGE:
+        return snap
+
+    df, _, _ = db.get_live_data_optimized()
+    if df is None or df.empty:
+        return None
+    return FleetSnapshot.from_frame(df)
@@ -0,0 +1,125 @@
+"""
+geo.py
+------
+Small vectorised geometry helpers shared by the ingest stages.
+
+All functions accept scalars or NumPy arrays (broadcasting applies) and work in
+degrees for angles and metres for distances.
+"""
+
+import numpy as np
+
+EARTH_RADIUS_M = 6_371_008.8
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance in metres between two (lat, lon) points."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype='float64')) for v in (lat1, lon1, lat2, lon2))
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def initial_bearing_deg(lat1, lon1, lat2, lon2):
+    """Initial bearing (0-360, clockwise from north) from point 1 towards point 2."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype='float64')) for v in (lat1, lon1, lat2, lon2))
+    dlon = lon2 - lon1
+    x = np.sin(dlon) * np.cos(lat2)
+    y = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(dlon)
+    return (np.degrees(np.arctan2(x, y)) + 360.0) % 360.0
+
+
+def project_local(lat, lon, ref_lat):
+    """
+    Equirectangular projection to metres around *ref_lat*.
+
+    Accurate to well under a metre over a single agency's service area, which is
+    all the nearest-segment and grid searches need.
+    """
+    k = np.radians(1.0) * EARTH_RADIUS_M
+    x = np.asarray(lon, dtype='float64') * k * np.cos(np.radians(ref_lat))
+    y = np.asarray(lat, dtype='float64') * k
+    return x, y
+
+
+def unproject_local(x, y, ref_lat):
+    """Inverse of :func:`project_local`; returns (lat, lon)."""
+    k = np.radians(1.0) * EARTH_RADIUS_M
+    lat = np.asarray(y, dtype='float64') / k
+    lon = np.asarray(x, dtype='float64') / (k * np.cos(np.radians(ref_lat)))
+    return lat, lon
+
+
+# Web Mercator is cut off at the latitude that makes the world square
+MERCATOR_MAX_LAT = 85.0511287798
+
+
+def to_web_mercator(lat, lon):
+    """
+    Web Mercator (slippy-map) coordinates normalised to [0, 1]: x grows
+    eastwards from 180°W, y southwards from MERCATOR_MAX_LAT.  Multiply by
+    2**zoom for tile coordinates.
+    """
+    lat = np.radians(np.clip(np.asarray(lat, dtype='float64'), -MERCATOR_MAX_LAT, MERCATOR_MAX_LAT))
+    x = (np.asarray(lon, dtype='float64') + 180.0) / 360.0
+    y = 0.5 - np.log(np.tan(np.pi / 4 + lat / 2)) / (2 * np.pi)
+    return x, y
+
+
+def from_web_mercator(x, y):
+    """Inverse of :func:`to_web_mercator`; returns (lat, lon)."""
+    lon = np.asarray(x, dtype='float64') * 360.0 - 180.0
+    lat = np.degrees(2 * np.arctan(np.exp((0.5 - np.asarray(y, dtype='float64')) * 2 * np.pi)) - np.pi / 2)
+    return lat, lon
+
+
+def convex_hull(x, y):
+    """
+    Indices of the convex hull of points (x, y), counter-clockwise
+    (Andrew's monotone chain).  Fewer than three distinct points return
+    what there is.
+    """
+    x, y = np.asarray(x, dtype='float64'), np.asarray(y, dtype='float64')
+    order = np.lexsort((y, x))
+    _, first = np.unique(np.column_stack([x[order], y[order]]), axis=0, return_index=True)
+    order = order[np.sort(first)]
+    if len(order) < 3:
+        return order
+
+    def cross(o, a, b):
+        return (x[a] - x[o]) * (y[b] - y[o]) - (y[a] - y[o]) * (x[b] - x[o])
+
+    lower, upper = [], []
+    for i in order:
+        while len(lower) >= 2 and cross(lower[-2], lower[-1], i) <= 0:
+            lower.pop()
+        lower.append(i)
+    for i in order[::-1]:
+        while len(upper) >= 2 and cross(upper[-2], upper[-1], i) <= 0:
+            upper.pop()
+        upper.append(i)
+    return np.array(lower[:-1] + upper[:-1], dtype='int64')
+
+
+def points_in_polygon(x, y, px, py):
+    """
+    Even-odd test of points (x, y) against the closed ring (px, py), in one
+    (points × edges) pass.  Use planar coordinates (see project_local).
+    """
+    x, y = np.asarray(x, dtype='float64')[:, None], np.asarray(y, dtype='float64')[:, None]
+    ax, ay = np.asarray(px, dtype='float64'), np.asarray(py, dtype='float64')
+    bx, by = np.roll(ax, -1), np.roll(ay, -1)
+    straddles = (ay > y) != (by > y)
+    x_cross = ax + (bx - ax) * (y - ay) / np.where(by != ay, by - ay, 1.0)
+    return ((straddles & (x < x_cross)).sum(axis=1) % 2) == 1
+
+
+def distance_to_ring(x, y, px, py):
+    """Distance from points (x, y) to the nearest edge of the closed ring (px, py)."""
+    x, y = np.asarray(x, dtype='float64')[:, None], np.asarray(y, dtype='float64')[:, None]
+    ax, ay = np.asarray(px, dtype='float64'), np.asarray(py, dtype='float64')
+    dx, dy = np.roll(ax, -1) - ax, np.roll(ay, -1) - ay
+    len2 = dx * dx + dy * dy
+    t = np.clip(((x - ax) * dx + (y - ay) * dy) / np.where(len2 > 0, len2, 1.0), 0.0, 1.0)
+    return np.hypot(ax + t * dx - x, ay + t * dy - y).min(axis=1)
@@ -0,0 +1,342 @@
+"""
+geofence.py
+-----------
+Named polygons (depots, zones, service areas) loaded from a GeoJSON file, with
+batch point-in-polygon tests and per-vehicle enter / exit events.
+
+Polygon edges are bucketed into latitude bands of BAND_DEG, stored CSR-style
+like spatial_index.py's grid (sorted band keys + the edges in each band).  A
+ray-casting test only needs the edges crossing the point's latitude, so a
+batch is answered by expanding every point against the few edges of its band
+and counting crossings per (point, fence) with one ``np.unique`` — no Python
+loop over points or polygons.  Holes and MultiPolygons fall out of the
+even-odd rule.
+
+Each feature's properties may set ``id``, ``name``, ``kind`` (e.g. ``depot``,
+``zone`` or ``service_area``) and ``region`` (limit the fence to one region's
+vehicles).  The file is re-read when its modification time changes.
+
+Which fences each vehicle is inside is kept in memory between cycles (like
+motion.py's per-vehicle state); every ingest batch compares the latest ping
+per vehicle with it and returns ``enter`` / ``exit`` events for the ingester
+to store in GEOFENCE_EVENTS_TABLE.  State for vehicles quiet for longer than
+DATA_MAX_AGE is dropped without an exit event.
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    from config import DATA_MAX_AGE
+except ImportError:
+    DATA_MAX_AGE = 3600
+
+try:
+    from config import GEOFENCES_PATH, GEOFENCE_EVENTS_TABLE
+except ImportError:
+    GEOFENCES_PATH = None          # GeoJSON FeatureCollection; None disables geofencing
+    GEOFENCE_EVENTS_TABLE = 'geofence_events'
+
+# ~1.1 km bands at Malaysian latitudes
+BAND_DEG = 0.01
+
+FENCE_COLUMNS = ['fence_id', 'name', 'kind', 'region']
+EVENT_COLUMNS = ['ts', 'region', 'vehicle_id', 'fence_id', 'fence_name', 'kind', 'event', 'dwell_s']
+
+
+class GeofenceIndex:
+    """
+    Band index over the edges of a set of fences.
+
+    *fences* is a list of dicts with FENCE_COLUMNS keys plus ``rings``, a list
+    of (lon, lat) coordinate arrays (outer rings and holes alike).
+    """
+
+    def __init__(self, fences, band_deg=BAND_DEG):
+        self.band_deg = band_deg
+        self.fences = pd.DataFrame([{c: str(f.get(c) or '') for c in FENCE_COLUMNS} for f in fences],
+                                   columns=FENCE_COLUMNS)
+
+        ax, ay, bx, by, owner = [], [], [], [], []
+        for i, fence in enumerate(fences):
+            for lon, lat in fence['rings']:
+                lon, lat = np.asarray(lon, dtype='float64'), np.asarray(lat, dtype='float64')
+                ax.append(lon)
+                ay.append(lat)
+                bx.append(np.roll(lon, -1))
+                by.append(np.roll(lat, -1))
+                owner.append(np.full(len(lon), i, dtype='int64'))
+        if ax:
+            ax, ay, bx, by, owner = (np.concatenate(a) for a in (ax, ay, bx, by, owner))
+        else:
+            ax = ay = bx = by = np.empty(0)
+            owner = np.empty(0, dtype='int64')
+
+        # Horizontal edges never cross a ray along the latitude
+        keep = ay != by
+        self.ax, self.ay, self.bx, self.by, self.owner = ax[keep], ay[keep], bx[keep], by[keep], owner[keep]
+
+        # Register each edge in every band its latitude range touches
+        lo = np.floor(np.minimum(self.ay, self.by) / band_deg).astype('int64')
+        hi = np.floor(np.maximum(self.ay, self.by) / band_deg).astype('int64')
+        counts = hi - lo + 1
+        edge = np.repeat(np.arange(len(lo)), counts)
+        band = np.repeat(lo, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+        order = np.argsort(band, kind='stable')
+        self.band_keys, self.band_edges = band[order], edge[order]
+
+    def __len__(self):
+        return len(self.fences)
+
+    def contains(self, lat, lon):
+        """
+        Every (point, fence) pair with the point inside the fence.
+
+        Returns:
+            (point positions, fence positions) as two int arrays
+        """
+        lat, lon = np.asarray(lat, dtype='float64'), np.asarray(lon, dtype='float64')
+        empty = (np.empty(0, dtype='int64'), np.empty(0, dtype='int64'))
+        if len(self.band_keys) == 0 or len(lat) == 0:
+            return empty
+
+        valid = np.flatnonzero(~np.isnan(lat) & ~np.isnan(lon))
+        band = np.floor(lat[valid] / self.band_deg).astype('int64')
+        lo = np.searchsorted(self.band_keys, band, side='left')
+        counts = np.searchsorted(self.band_keys, band, side='right') - lo
+        if counts.sum() == 0:
+            return empty
+
+        point = np.repeat(valid, counts)
+        edge = self.band_edges[np.repeat(lo, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))]
+        y, x = lat[point], lon[point]
+        ax, ay, bx, by = self.ax[edge], self.ay[edge], self.bx[edge], self.by[edge]
+        crosses = ((ay > y) != (by > y)) & (x < ax + (bx - ax) * (y - ay) / (by - ay))
+
+        # Odd number of crossings per (point, fence) = inside
+        n_fences = len(self.fences)
+        keys, hits = np.unique(point[crosses] * n_fences + self.owner[edge[crosses]], return_counts=True)
+        inside = keys[hits % 2 == 1]
+        return inside // n_fences, inside % n_fences
+
+    def _applies(self, fence, region):
+        """Mask of fence positions that apply to vehicles of *region*."""
+        fence_region = self.fences['region'].to_numpy()[fence]
+        return (fence_region == '') | (fence_region == region)
+
+    def has(self, kind, region):
+        """True if a fence of *kind* applies to *region*."""
+        fences = self.fences
+        return bool(((fences['kind'] == kind) & fences['region'].isin(['', region])).any())
+
+    def inside_any(self, lat, lon, kind, region):
+        """Per point: inside at least one fence of *kind* applying to *region*."""
+        point, fence = self.contains(lat, lon)
+        match = (self.fences['kind'].to_numpy()[fence] == kind) & self._applies(fence, region)
+        result = np.zeros(len(np.asarray(lat)), dtype=bool)
+        result[point[match]] = True
+        return result
+
+
+def _rings(geometry):
+    if geometry is None:
+        return []
+    if geometry.get('type') == 'Polygon':
+        polygons = [geometry['coordinates']]
+    elif geometry.get('type') == 'MultiPolygon':
+        polygons = geometry['coordinates']
+    else:
+        return []
+    rings = []
+    for polygon in polygons:
+        for ring in polygon:
+            coords = np.asarray(ring, dtype='float64')
+            if len(coords) >= 3:
+                rings.append((coords[:, 0], coords[:, 1]))
+    return rings
+
+
+def load_geojson(path):
+    """
+    Build a GeofenceIndex from a GeoJSON FeatureCollection of Polygon /
+    MultiPolygon features; other geometry types are skipped.
+
+    Raises:
+        ValueError: Two features share an id (membership is keyed by it; put
+            several polygons under one id as a MultiPolygon instead)
+    """
+    with open(path, encoding='utf-8') as f:
+        collection = json.load(f)
+
+    fences = []
+    seen = set()
+    for i, feature in enumerate(collection.get('features', [])):
+        rings = _rings(feature.get('geometry'))
+        if not rings:
+            continue
+        properties = feature.get('properties') or {}
+        fence_id = str(properties.get('id') or feature.get('id') or f'fence-{i}')
+        if fence_id in seen:
+            raise ValueError(f"{path}: duplicate geofence id {fence_id!r}")
+        seen.add(fence_id)
+        fences.append({
+            'fence_id': fence_id,
+            'name': properties.get('name') or fence_id,
+            'kind': properties.get('kind') or 'zone',
+            'region': properties.get('region') or '',
+            'rings': rings,
+        })
+    return GeofenceIndex(fences)
+
+
+_INDEX = {'key': None, 'index': None}
+
+
+def get_index():
+    """
+    Return the GeofenceIndex for GEOFENCES_PATH, or None when geofencing is
+    disabled or the file can't be read.  Reloaded when the file changes.
+    """
+    if not GEOFENCES_PATH:
+        return None
+    try:
+        key = (GEOFENCES_PATH, os.path.getmtime(GEOFENCES_PATH))
+    except OSError as e:
+        key = (GEOFENCES_PATH, None)
+        if _INDEX['key'] != key:
+            print(f"Geofences unavailable: {e}")
+            _INDEX.update(key=key, index=None)
+        return None
+
+    if _INDEX['key'] != key:
+        try:
+            index = load_geojson(GEOFENCES_PATH)
+            print(f"✓ Loaded {len(index)} geofences from {GEOFENCES_PATH}")
+        except Exception as e:
+            print(f"Geofences unavailable: {e}")
+            index = None
+        _INDEX.update(key=key, index=index)
+    return _INDEX['index']
+
+
+# ---------------------------------------------------------------------------
+# Per-vehicle membership, updated every ingest batch
+# ---------------------------------------------------------------------------
+
+# (region, vehicle_id, fence_id) key -> since when the vehicle is inside
+_INSIDE = pd.DataFrame(
+    {
+        'vehicle_key': pd.Series(dtype=object),
+        'region': pd.Series(dtype=object),
+        'vehicle_id': pd.Series(dtype=object),
+        'fence_id': pd.Series(dtype=object),
+        'since': pd.Series(dtype='int64'),
+        'last_ts': pd.Series(dtype='int64'),
+    },
+    index=pd.Index([], dtype=object, name='key'),
+)
+
+
+def reset_state():
+    """Forget which fences vehicles are in (used by replay and tests)."""
+    global _INSIDE
+    _INSIDE = _INSIDE.iloc[0:0]
+
+
+def vehicles_in(fence_id=None):
+    """Vehicles currently inside *fence_id* (or any fence), with entry time."""
+    inside = _INSIDE if fence_id is None else _INSIDE[_INSIDE['fence_id'] == fence_id]
+    return inside[['region', 'vehicle_id', 'fence_id', 'since', 'last_ts']].reset_index(drop=True)
+
+
+def update_geofences(df, current_unix, index=None):
+    """
+    Test each vehicle's latest ping in an ingest batch against the fences and
+    advance the membership state.
+
+    Args:
+        df: DataFrame with region, vehicle_id, latitude, longitude, timestamp
+        current_unix: Cycle time
+        index: GeofenceIndex to use instead of get_index()
+
+    Returns:
+        DataFrame of enter / exit events (EVENT_COLUMNS), possibly empty
+    """
+    global _INSIDE
+
+    index = index if index is not None else get_index()
+    if index is None or df.empty:
+        return pd.DataFrame(columns=EVENT_COLUMNS)
+
+    # Latest ping per vehicle
+    ts = pd.to_numeric(df['timestamp'], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    vehicle_key = (df['region'].astype(str) + '\x1f' + df['vehicle_id'].astype(str)).to_numpy()
+    order = np.argsort(ts, kind='stable')
+    order = order[~pd.Series(vehicle_key[order]).duplicated(keep='last').to_numpy() & ~np.isnan(ts[order])]
+    vehicle_key, ts = vehicle_key[order], ts[order].astype('int64')
+    region = df['region'].astype(str).to_numpy()[order]
+    vehicle_id = df['vehicle_id'].astype(str).to_numpy()[order]
+    lat = pd.to_numeric(df['latitude'], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)[order]
+    lon = pd.to_numeric(df['longitude'], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)[order]
+
+    point, fence = index.contains(lat, lon)
+    keep = index._applies(fence, region[point])
+    point, fence = point[keep], fence[keep]
+    fence_ids = index.fences['fence_id'].to_numpy()
+    current = pd.DataFrame(
+        {
+            'vehicle_key': vehicle_key[point],
+            'region': region[point],
+            'vehicle_id': vehicle_id[point],
+            'fence_id': fence_ids[fence],
+            'since': ts[point],
+            'last_ts': ts[point],
+        },
+        index=pd.Index(vehicle_key[point] + '\x1f' + fence_ids[fence], name='key'),
+    )
+
+    # Previous memberships of the vehicles in this batch
+    in_batch = pd.Index(vehicle_key).get_indexer(_INSIDE['vehicle_key']) >= 0
+    previous = _INSIDE[in_batch]
+    known = previous.index.get_indexer(current.index)
+    entered = current[known < 0]
+    exited = previous[current.index.get_indexer(previous.index) < 0]
+    current.loc[known >= 0, 'since'] = previous['since'].to_numpy()[known[known >= 0]]
+
+    batch_ts = pd.Series(ts, index=vehicle_key)
+    exit_ts = batch_ts.reindex(exited['vehicle_key']).to_numpy(dtype='int64')
+    fences = index.fences.set_index('fence_id')
+    events = pd.concat([
+        pd.DataFrame({'ts': entered['since'].to_numpy(), 'region': entered['region'].to_numpy(),
+                      'vehicle_id': entered['vehicle_id'].to_numpy(), 'fence_id': entered['fence_id'].to_numpy(),
+                      'event': 'enter', 'dwell_s': np.nan}),
+        pd.DataFrame({'ts': exit_ts, 'region': exited['region'].to_numpy(),
+                      'vehicle_id': exited['vehicle_id'].to_numpy(), 'fence_id': exited['fence_id'].to_numpy(),
+                      'event': 'exit', 'dwell_s': (exit_ts - exited['since'].to_numpy()).astype('float64')}),
+    ], ignore_index=True)
+    known_fence = events['fence_id'].isin(fences.index)
+    events['fence_name'] = events['fence_id'].map(fences['name']).where(known_fence, events['fence_id'])
+    events['kind'] = events['fence_id'].map(fences['kind']).where(known_fence, '')
+
+    merged = pd.concat([_INSIDE[~in_batch], current])
+    _INSIDE = merged[merged['last_ts'] >= current_unix - DATA_MAX_AGE]
+    return events[EVENT_COLUMNS]
+
+
+def store(con, events):
+    """Append geofence events to GEOFENCE_EVENTS_TABLE on *con*, creating it if needed."""
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {GEOFENCE_EVENTS_TABLE} (
+            ts BIGINT, region VARCHAR, vehicle_id VARCHAR, fence_id VARCHAR,
+            fence_name VARCHAR, kind VARCHAR, event VARCHAR, dwell_s DOUBLE
+        )
+    """)
+    if len(events):
+        con.register('new_geofence_events', events)
+        try:
+            con.execute(f"INSERT INTO {GEOFENCE_EVENTS_TABLE} SELECT {', '.join(EVENT_COLUMNS)} FROM new_geofence_events")
+        finally:
+            con.unregister('new_geofence_events')
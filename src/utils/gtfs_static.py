@@ -13,7 +13,7 @@ import os
 import time
 import zipfile
 import csv
-import requests
+import pandas as pd
 
 # ---------------------------------------------------------------------------
 # Agency slugs — mirrors API_SOURCES in ingestion.py
@@ -39,6 +39,8 @@ STATIC_API_SOURCES = {
 STATIC_API_BASE_URL = 'https://api.data.gov.my/gtfs-static/'
 CACHE_TTL_SECONDS = 86400          # 24 hours
 REQUEST_TIMEOUT = 30
+RETRY_FAILED_AFTER_SECONDS = 600   # don't retry a broken feed on every ingest cycle
+CACHE_DIR = '/tmp'
 
 
 # ---------------------------------------------------------------------------
@@ -52,7 +54,7 @@ def _slug_safe(agency_slug: str) -> str:
 
 def get_cached_path(agency_slug: str) -> str:
     """Return the local file path where the ZIP for *agency_slug* is cached."""
-    return f"/tmp/gtfs_static_{_slug_safe(agency_slug)}.zip"
+    return os.path.join(CACHE_DIR, f"gtfs_static_{_slug_safe(agency_slug)}.zip")
 
 
 def is_cache_fresh(agency_slug: str) -> bool:
@@ -70,6 +72,8 @@ def download_static_gtfs(agency_slug: str) -> str:
 
     Returns the cache path on success, raises on HTTP or IO errors.
     """
+    import requests  # deferred: only needed when the cache is stale
+
     url = f"{STATIC_API_BASE_URL}{agency_slug}"
     response = requests.get(url, timeout=REQUEST_TIMEOUT)
     response.raise_for_status()
@@ -113,10 +117,89 @@ def _read_csv_from_zip(zf: zipfile.ZipFile, filename: str):
         return list(reader)
 
 
+def _read_frame_from_zip(zf: zipfile.ZipFile, filename: str, columns=None) -> pd.DataFrame:
+    """
+    Read *filename* from an open ZipFile into a DataFrame of strings.
+
+    Used for the large tables (shapes.txt, stop_times.txt) where a list of dicts
+    per row is too slow and too big.  Only *columns* are parsed when given;
+    columns missing from the file are simply absent from the result.
+    """
+    names = zf.namelist()
+    match = next((n for n in names if n.endswith(filename)), None)
+    if match is None:
+        return pd.DataFrame()
+
+    usecols = (lambda c: c.strip() in columns) if columns else None
+    with zf.open(match) as raw:
+        df = pd.read_csv(raw, usecols=usecols, dtype=str, keep_default_na=False, encoding='utf-8-sig')
+    df.columns = [c.strip() for c in df.columns]
+    return df
+
+
 # ---------------------------------------------------------------------------
 # Public API
 # ---------------------------------------------------------------------------
 
+def cache_version(agency_slug: str) -> float:
+    """
+    Return the modification time of the cached ZIP for *agency_slug*, or 0.0.
+
+    In-memory indexes built from a ZIP are keyed on this so they are rebuilt
+    whenever a fresh copy is downloaded.
+    """
+    path = get_cached_path(agency_slug)
+    return os.path.getmtime(path) if os.path.exists(path) else 0.0
+
+
+_INDEX_CACHE = {}   # (kind, agency_slug) -> (cache_version, index)
+_FAILED = {}        # (kind, agency_slug) -> unix time of the last failed build
+
+
+def get_cached_index(agency_slug: str, kind: str, build):
+    """
+    Return an in-memory index derived from the GTFS Static ZIP of *agency_slug*.
+
+    *build(agency_slug)* is called on first use and again whenever a fresh ZIP
+    is downloaded; its result (which may be None) is cached under *kind*.
+    Failures are logged and not retried for RETRY_FAILED_AFTER_SECONDS, so a
+    broken feed doesn't stall every ingest cycle.
+    """
+    key = (kind, agency_slug)
+    if time.time() - _FAILED.get(key, 0) < RETRY_FAILED_AFTER_SECONDS:
+        return None
+
+    try:
+        if not is_cache_fresh(agency_slug):
+            download_static_gtfs(agency_slug)
+        version = cache_version(agency_slug)
+        cached = _INDEX_CACHE.get(key)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        index = build(agency_slug)
+        _INDEX_CACHE[key] = (version, index)
+        return index
+    except Exception as e:
+        print(f"GTFS Static {kind} index unavailable for {agency_slug}: {e}")
+        _FAILED[key] = time.time()
+        return None
+
+
+def load_table(agency_slug: str, filename: str, columns=None) -> pd.DataFrame:
+    """
+    Return *filename* from the GTFS Static ZIP for *agency_slug* as a DataFrame
+    of stripped strings, downloading the ZIP first if the cache is stale.
+
+    Raises on download or parsing errors so callers can decide how to degrade.
+    """
+    with _load_zip(agency_slug) as zf:
+        df = _read_frame_from_zip(zf, filename, columns)
+    for col in df.columns:
+        df[col] = df[col].str.strip()
+    return df
+
+
 def get_shapes_for_trip(agency_slug: str, trip_id: str) -> list:
     """
     Return an ordered list of [lon, lat] pairs representing the planned route
@@ -181,6 +264,27 @@ def get_shapes_for_trip(agency_slug: str, trip_id: str) -> list:
         return []
 
 
+def _build_route_table(agency_slug: str) -> pd.DataFrame:
+    routes = load_table(agency_slug, 'routes.txt', ['route_id', 'route_short_name', 'route_long_name'])
+    for col in ('route_id', 'route_short_name', 'route_long_name'):
+        if col not in routes.columns:
+            routes[col] = ''
+    short, long_ = routes['route_short_name'], routes['route_long_name']
+    routes['route_name'] = short.where(long_ == '', short + ' — ' + long_).where(short != '', long_)
+    return routes.drop_duplicates('route_id').set_index('route_id')[['route_short_name', 'route_long_name', 'route_name']]
+
+
+def get_route_table(agency_slug: str):
+    """
+    Return routes.txt for *agency_slug* as a DataFrame indexed by route_id with
+    route_short_name, route_long_name and route_name columns.
+
+    Parsed once per downloaded ZIP (see get_cached_index), so callers can join
+    or look up route names freely.  Returns None if the feed is unavailable.
+    """
+    return get_cached_index(agency_slug, 'routes', _build_route_table)
+
+
 def get_route_name(agency_slug: str, route_id: str) -> str:
     """
     Return a human-readable route name string for *route_id* within *agency_slug*.
@@ -191,21 +295,10 @@ def get_route_name(agency_slug: str, route_id: str) -> str:
     if not route_id:
         return ''
 
+    routes = get_route_table(agency_slug)
+    if routes is None:
+        return ''
     try:
-        with _load_zip(agency_slug) as zf:
-            routes = _read_csv_from_zip(zf, 'routes.txt')
-            if not routes:
-                return ''
-
-            for row in routes:
-                if row.get('route_id', '').strip() == route_id.strip():
-                    short = row.get('route_short_name', '').strip()
-                    long_ = row.get('route_long_name', '').strip()
-                    if short and long_:
-                        return f"{short} — {long_}"
-                    return short or long_
-
-    except Exception:
+        return routes.at[route_id.strip(), 'route_name']
+    except KeyError:
         return ''
-
-    return ''
@@ -0,0 +1,331 @@
+"""
+headways.py
+-----------
+Headway and bunching detection along route shapes.
+
+A GTFS shape is one route in one direction, so every ingest cycle the matched
+vehicles are grouped by (region, shape_id) and sorted by ``shape_dist_m``; the
+gap to the vehicle ahead is then a single diff over the whole country rather
+than a loop per route.  Gaps in metres are turned into time headways at the
+shape's median moving speed this cycle and compared with the scheduled
+headway of the shape at that time of day (successive first departures of its
+trips in stop_times.txt that run on that day per calendar.txt /
+calendar_dates.txt):
+
+- ``bunched``: headway below HEADWAY_BUNCHING_RATIO × scheduled
+- ``gap``:     headway above HEADWAY_GAP_RATIO × scheduled
+
+Where there is no schedule, vehicles closer than BUNCHING_DISTANCE_M are
+flagged as bunched.  The last HEADWAY_HISTORY_SECONDS of results are kept in
+memory (like schedule.py's per-vehicle state) for the Routes page.
+"""
+
+import threading
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from utils import gtfs_static, map_matching, schedule
+
+try:
+    from config import UTC_OFFSET_HOURS
+except ImportError:
+    UTC_OFFSET_HOURS = 8
+
+try:
+    from config import HEADWAYS_ENABLED, HEADWAY_BUNCHING_RATIO, HEADWAY_GAP_RATIO, HEADWAY_HISTORY_SECONDS
+except ImportError:
+    HEADWAYS_ENABLED = True
+    HEADWAY_BUNCHING_RATIO = 0.5   # of the scheduled headway
+    HEADWAY_GAP_RATIO = 1.5
+    HEADWAY_HISTORY_SECONDS = 3600
+
+SECONDS_PER_DAY = 86400
+
+# Fallback when a shape has no schedule: closer than this counts as bunched
+BUNCHING_DISTANCE_M = 300
+# Speed used to turn gaps into headways: the shape's median moving speed,
+# floored so a stopped shape doesn't produce huge headways
+MIN_SPEED_MPS = 2.0
+DEFAULT_SPEED_MPS = 5.0
+
+HEADWAY_COLUMNS = ['cycle_ts', 'region', 'route_id', 'shape_id', 'vehicle_id', 'leader_id',
+                   'gap_m', 'headway_s', 'scheduled_headway_s', 'status']
+
+
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+
+def _gtfs_date(values):
+    """'YYYYMMDD' strings -> int array (0 where unparseable)."""
+    return pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').fillna(0).to_numpy(dtype='int64')
+
+
+class ScheduledHeadways:
+    """
+    First departure (time of day) of every trip running on a service date,
+    sorted by (shape, time), so the scheduled headway of any shape at any
+    time is one binary search.
+
+    Only trips whose service_id is active on the date (calendar.txt with
+    calendar_dates.txt exceptions) are counted, so weekday and weekend
+    timetables aren't merged into one.  Feeds without either file count
+    every trip on every date.
+    """
+
+    def __init__(self, table, shape_index, trips=None, calendar=None, calendar_dates=None):
+        counts = np.diff(table.offsets)
+        has_stops = counts > 0
+        first_dep = table.departure_s[table.offsets[:-1][has_stops]].astype('int64')
+        trip_ids = table.trip_ids[has_stops]
+        shape = pd.Series(trip_ids).map(shape_index.trip_shape).to_numpy(dtype='float64', na_value=np.nan)
+        ok = ~np.isnan(shape) & (first_dep >= 0)
+        self.trip_shape = shape[ok].astype('int64')
+        self.trip_departure = first_dep[ok]
+        self.shape_ids = pd.Index(shape_index.shape_ids)
+
+        trips = trips if trips is not None and 'service_id' in trips.columns else pd.DataFrame(columns=['trip_id', 'service_id'])
+        service_of_trip = trips.drop_duplicates('trip_id').set_index('trip_id')['service_id']
+        service = pd.Series(trip_ids[ok]).map(service_of_trip).fillna('').to_numpy(dtype=object)
+        self.trip_service, service_ids = pd.factorize(service)
+        self.service_ids = pd.Index(service_ids)
+
+        calendar = calendar if calendar is not None and len(calendar) else None
+        calendar_dates = calendar_dates if calendar_dates is not None and len(calendar_dates) else None
+        self.has_calendar = calendar is not None or calendar_dates is not None
+        self.cal_service = self.exc_service = None
+        if calendar is not None:
+            self.cal_service = self.service_ids.get_indexer(calendar['service_id'].to_numpy())
+            self.cal_start = _gtfs_date(calendar['start_date'].to_numpy())
+            self.cal_end = _gtfs_date(calendar['end_date'].to_numpy())
+            self.cal_days = np.column_stack([
+                calendar[day].to_numpy() == '1' if day in calendar.columns else np.zeros(len(calendar), dtype=bool)
+                for day in WEEKDAYS
+            ])
+        if calendar_dates is not None:
+            self.exc_service = self.service_ids.get_indexer(calendar_dates['service_id'].to_numpy())
+            self.exc_date = _gtfs_date(calendar_dates['date'].to_numpy())
+            self.exc_type = calendar_dates['exception_type'].to_numpy()
+
+        self._by_date = {}
+        self._all = self._sorted_keys(np.ones(len(self.trip_shape), dtype=bool), self.trip_departure)
+
+    def services_on(self, service_date):
+        """Boolean mask over service_ids of the services running on *service_date*."""
+        active = np.zeros(len(self.service_ids), dtype=bool)
+        if not self.has_calendar:
+            active[:] = True
+            return active
+        day = int(service_date.strftime('%Y%m%d'))
+        if self.cal_service is not None:
+            running = (self.cal_start <= day) & (day <= self.cal_end) & self.cal_days[:, service_date.weekday()]
+            running &= self.cal_service >= 0
+            active[self.cal_service[running]] = True
+        if self.exc_service is not None:
+            today = (self.exc_date == day) & (self.exc_service >= 0)
+            active[self.exc_service[today & (self.exc_type == '1')]] = True
+            active[self.exc_service[today & (self.exc_type == '2')]] = False
+        return active
+
+    def _sorted_keys(self, running, departure):
+        # Trips repeated across calendars share a departure; count it once
+        keys = np.unique(self.trip_shape[running] * SECONDS_PER_DAY + departure[running] % SECONDS_PER_DAY)
+        return keys, keys // SECONDS_PER_DAY, keys % SECONDS_PER_DAY
+
+    def _keys_on(self, service_date):
+        """(keys, shape, departure) of the trips running on *service_date*, cached."""
+        cached = self._by_date.get(service_date)
+        if cached is None:
+            # Departures past 24:00:00 belong to the previous day's service
+            today = self.services_on(service_date)[self.trip_service] & (self.trip_departure < SECONDS_PER_DAY)
+            yesterday = self.services_on(service_date - timedelta(days=1))[self.trip_service] \
+                & (self.trip_departure >= SECONDS_PER_DAY)
+            cached = self._sorted_keys(today | yesterday, self.trip_departure)
+            if len(self._by_date) >= 4:
+                self._by_date.clear()
+            self._by_date[service_date] = cached
+        return cached
+
+    def at(self, shape_ids, time_of_day, service_date=None):
+        """
+        Scheduled headway in seconds for each (shape_id, seconds after local
+        midnight): the gap between the departures either side of that time.
+        NaN outside the shape's service hours or for unknown shapes.
+
+        Args:
+            service_date: Local date (datetime.date) whose services count;
+                None counts every trip regardless of calendar
+        """
+        keys, key_shape, departure = self._all if service_date is None else self._keys_on(service_date)
+        shape = self.shape_ids.get_indexer(pd.Index(shape_ids))
+        j = np.searchsorted(keys, shape * SECONDS_PER_DAY + time_of_day, side='right')
+        n = len(keys)
+        prev, nxt = np.clip(j - 1, 0, max(n - 1, 0)), np.clip(j, 0, max(n - 1, 0))
+        valid = (shape >= 0) & (j >= 1) & (j < n)
+        if n:
+            valid &= (key_shape[prev] == shape) & (key_shape[nxt] == shape)
+            return np.where(valid, (departure[nxt] - departure[prev]).astype('float64'), np.nan)
+        return np.full(len(shape), np.nan)
+
+
+def _build_scheduled_headways(agency_slug):
+    table = schedule.get_stop_time_table(agency_slug)
+    shape_index = map_matching.get_shape_index(agency_slug)
+    if table is None or shape_index is None:
+        return None
+    trips = gtfs_static.load_table(agency_slug, 'trips.txt', ['trip_id', 'service_id'])
+    calendar = gtfs_static.load_table(agency_slug, 'calendar.txt', ['service_id', 'start_date', 'end_date'] + WEEKDAYS)
+    calendar_dates = gtfs_static.load_table(agency_slug, 'calendar_dates.txt', ['service_id', 'date', 'exception_type'])
+    return ScheduledHeadways(table, shape_index, trips, calendar, calendar_dates)
+
+
+def get_scheduled_headways(agency_slug):
+    """Return the ScheduledHeadways for *agency_slug*, or None if unavailable."""
+    return gtfs_static.get_cached_index(agency_slug, 'headways', _build_scheduled_headways)
+
+
+def _effective_speed(df):
+    """Reported speed, or derived speed where the feed reports 0 / nothing (m/s)."""
+    speed = pd.to_numeric(df['speed'], errors='coerce').to_numpy(dtype='float64', na_value=np.nan) \
+        if 'speed' in df.columns else np.full(len(df), np.nan)
+    if 'derived_speed' in df.columns:
+        derived = pd.to_numeric(df['derived_speed'], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+        speed = np.where((np.nan_to_num(speed) == 0) & ~np.isnan(derived), derived, speed)
+    return speed
+
+
+def compute_headways(df, cycle_ts):
+    """
+    Gap to the vehicle ahead for every matched vehicle in an ingest batch.
+
+    Args:
+        df: DataFrame with region, vehicle_id, route_id, shape_id,
+            shape_dist_m, timestamp and speed / derived_speed
+        cycle_ts: Cycle time, stored with the results
+
+    Returns:
+        DataFrame with HEADWAY_COLUMNS, one row per vehicle that has a
+        vehicle ahead on its shape
+    """
+    if df.empty or 'shape_dist_m' not in df.columns:
+        return pd.DataFrame(columns=HEADWAY_COLUMNS)
+
+    dist = pd.to_numeric(df['shape_dist_m'], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    shape_id = df['shape_id'].fillna('').astype(str).to_numpy()
+    matched = ~np.isnan(dist) & (shape_id != '')
+    if not matched.any():
+        return pd.DataFrame(columns=HEADWAY_COLUMNS)
+
+    rows = df[matched]
+    ts = pd.to_numeric(rows['timestamp'], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    # Latest position per vehicle
+    latest = np.argsort(ts, kind='stable')
+    latest = latest[~(rows['region'].astype(str) + '\x1f' + rows['vehicle_id'].astype(str)).take(latest)
+                    .duplicated(keep='last').to_numpy()]
+    rows, dist, ts = rows.take(latest), dist[matched][latest], ts[latest]
+
+    # Sort every shape's vehicles by distance along it
+    group, _ = pd.factorize(rows['region'].astype(str) + '\x1f' + rows['shape_id'].astype(str))
+    order = np.lexsort((dist, group))
+    group, dist, ts = group[order], dist[order], ts[order]
+    rows = rows.take(order)
+    speed = _effective_speed(rows)
+
+    # The vehicle ahead is the next one in the same group
+    has_leader = np.r_[group[1:] == group[:-1], False]
+    follower = np.flatnonzero(has_leader)
+    leader = follower + 1
+    gap_m = dist[leader] - dist[follower]
+
+    # Typical moving speed per shape this cycle
+    moving = speed > 0
+    shape_speed = pd.Series(speed[moving]).groupby(group[moving]).median()
+    group_speed = shape_speed.reindex(range(group.max() + 1)).to_numpy(dtype='float64', na_value=np.nan)
+    follower_speed = np.nan_to_num(group_speed[group[follower]], nan=DEFAULT_SPEED_MPS)
+    headway_s = gap_m / np.maximum(follower_speed, MIN_SPEED_MPS)
+
+    region = rows['region'].astype(str).to_numpy()[follower]
+    shapes = rows['shape_id'].astype(str).to_numpy()[follower]
+    scheduled = np.full(len(follower), np.nan)
+    local = ts[follower] + UTC_OFFSET_HOURS * 3600
+    time_of_day = (local % SECONDS_PER_DAY).astype('int64')
+    local_day = np.where(np.isnan(local), -1, local // SECONDS_PER_DAY).astype('int64')
+    for name in pd.unique(region):
+        agency_slug = gtfs_static.STATIC_API_SOURCES.get(name)
+        table = get_scheduled_headways(agency_slug) if agency_slug else None
+        if table is None:
+            continue
+        for day in np.unique(local_day[(region == name) & (local_day >= 0)]):
+            rows_on_day = (region == name) & (local_day == day)
+            service_date = date(1970, 1, 1) + timedelta(days=int(day))
+            scheduled[rows_on_day] = table.at(shapes[rows_on_day], time_of_day[rows_on_day], service_date)
+
+    ratio = headway_s / scheduled
+    status = np.where(
+        np.isnan(scheduled),
+        np.where(gap_m < BUNCHING_DISTANCE_M, 'bunched', ''),
+        np.where(ratio < HEADWAY_BUNCHING_RATIO, 'bunched', np.where(ratio > HEADWAY_GAP_RATIO, 'gap', 'ok')),
+    )
+
+    vehicle = rows['vehicle_id'].astype(str).to_numpy()
+    route = rows['route_id'].fillna('').astype(str).to_numpy() if 'route_id' in rows.columns \
+        else np.full(len(rows), '', dtype=object)
+    return pd.DataFrame({
+        'cycle_ts': np.full(len(follower), int(cycle_ts), dtype='int64'),
+        'region': region,
+        'route_id': route[follower],
+        'shape_id': shapes,
+        'vehicle_id': vehicle[follower],
+        'leader_id': vehicle[leader],
+        'gap_m': np.round(gap_m, 1),
+        'headway_s': np.round(headway_s),
+        'scheduled_headway_s': scheduled,
+        'status': status,
+    })
+
+
+# ---------------------------------------------------------------------------
+# Rolling history, updated every ingest batch
+# ---------------------------------------------------------------------------
+
+_HISTORY = []   # [(cycle_ts, DataFrame)] oldest first
+_lock = threading.Lock()
+
+
+def reset_state():
+    """Forget the rolling history (used by replay and benchmarks)."""
+    with _lock:
+        _HISTORY.clear()
+
+
+def update_headways(df, current_unix):
+    """
+    Compute this cycle's headways and add them to the rolling history.
+
+    Returns:
+        This cycle's headways (see compute_headways)
+    """
+    result = compute_headways(df, current_unix)
+    with _lock:
+        _HISTORY.append((current_unix, result))
+        while _HISTORY and _HISTORY[0][0] < current_unix - HEADWAY_HISTORY_SECONDS:
+            _HISTORY.pop(0)
+    return result
+
+
+def latest(region=None):
+    """The most recent cycle's headways, optionally for one region."""
+    with _lock:
+        result = _HISTORY[-1][1] if _HISTORY else pd.DataFrame(columns=HEADWAY_COLUMNS)
+    return result if region is None else result[result['region'] == region]
+
+
+def history(region=None):
+    """All headways in the rolling history, optionally for one region."""
+    with _lock:
+        frames = [frame for _, frame in _HISTORY if len(frame)]
+    if not frames:
+        return pd.DataFrame(columns=HEADWAY_COLUMNS)
+    result = pd.concat(frames, ignore_index=True)
+    return result if region is None else result[result['region'] == region].reset_index(drop=True)
@@ -0,0 +1,224 @@
+"""
+history_api.py
+--------------
+Arrow-native read API over the positions history, for consumers outside the
+dashboard (notebooks, the data team's jobs) that would otherwise copy the
+``.duckdb`` file while it is being written.
+
+DuckDB lets only one process open the file for writing, so the API runs inside
+the ingesting process.  Set ``HISTORY_API_PORT`` and the ingester serves it
+next to ``/metrics``.  Each request gets its own connection to the shared
+database instance and reads an MVCC snapshot, so it never blocks ingest
+writes.
+
+Results are streamed in ``HISTORY_BATCH_ROWS`` record batches from DuckDB's
+record batch reader, and never materialised whole:
+
+    GET /history?start=1735689600&end=1735693200&region=myBAS+Johor&columns=vehicle_id,latitude,longitude
+    GET /history?...&format=parquet
+
+In-process callers use :func:`read_history` directly.  Filters are pushed
+into the SQL: time bounds also constrain the BIGINT ``insert_timestamp`` so
+DuckDB can skip whole row groups (rows stamped by the schema migration are
+exempt from the upper bound), and only the requested columns are read.
+"""
+
+from urllib.parse import parse_qs, urlparse
+
+import duckdb
+import pyarrow as pa
+
+from utils import http_endpoint
+
+try:
+    from config import DATABASE_NAME, DATABASE_TABLE, DATA_MAX_AGE, DATA_FUTURE_TOLERANCE
+except ImportError:
+    DATABASE_NAME = 'agustiar_analytics.duckdb'
+    DATABASE_TABLE = 'live_buses'
+    DATA_MAX_AGE = 3600
+    DATA_FUTURE_TOLERANCE = 300
+
+try:
+    from config import HISTORY_BATCH_ROWS
+except ImportError:
+    HISTORY_BATCH_ROWS = 65_536
+
+
+# (database, table) -> insert_timestamp of rows that predate the column
+_MIGRATION_STAMPS = {}
+
+
+def _migration_stamp(con):
+    """
+    insert_timestamp given to every row that existed when the column was
+    added (the table's earliest value; the schema migration stamps them all
+    with the migration time).  Cached once known, None for an empty table.
+    """
+    key = (DATABASE_NAME, DATABASE_TABLE)
+    if key not in _MIGRATION_STAMPS:
+        stamp = con.execute(f"SELECT MIN(insert_timestamp) FROM {DATABASE_TABLE}").fetchone()[0]
+        if stamp is None:
+            return None
+        _MIGRATION_STAMPS[key] = int(stamp)
+    return _MIGRATION_STAMPS[key]
+
+
+def _table_columns(con):
+    return con.execute(
+        "SELECT column_name FROM information_schema.columns WHERE table_name = ? ORDER BY ordinal_position",
+        [DATABASE_TABLE],
+    ).df()['column_name'].tolist()
+
+
+def read_history(start=None, end=None, regions=None, vehicle_ids=None, columns=None,
+                 batch_rows=HISTORY_BATCH_ROWS):
+    """
+    Stream stored positions as Arrow record batches.
+
+    Args:
+        start, end: Inclusive unix-time bounds on the position timestamp
+        regions: Optional list of region names
+        vehicle_ids: Optional list of vehicle ids
+        columns: Optional list of columns (default: all)
+        batch_rows: Maximum rows per record batch
+
+    Returns:
+        pyarrow.RecordBatchReader in storage (≈ insertion) order - no ORDER
+        BY, so nothing is buffered beyond one batch; the underlying
+        connection closes when the reader is exhausted or garbage collected
+
+    Raises:
+        ValueError: for unknown columns or if the table doesn't exist yet
+    """
+    con = duckdb.connect(DATABASE_NAME)
+    try:
+        available = _table_columns(con)
+        if not available:
+            raise ValueError(f"Table {DATABASE_TABLE} does not exist yet")
+        columns = list(columns) if columns else available
+        unknown = [c for c in columns if c not in available]
+        if unknown:
+            raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+
+        # Ingest only accepts rows whose timestamp is within DATA_FUTURE_TOLERANCE /
+        # DATA_MAX_AGE of their insert time, so the time bounds can be mirrored on
+        # the BIGINT insert_timestamp, letting DuckDB prune row groups by zone map.
+        # Rows from before the column existed all carry the migration time
+        # instead, which can be any time after their timestamp: they still
+        # satisfy the lower bound (inserted no earlier than timestamp - tolerance)
+        # but are let through the upper one explicitly.
+        where, params = [], []
+        if start is not None:
+            where.append("CAST(timestamp AS BIGINT) >= ?")
+            params.append(int(start))
+            where.append("insert_timestamp >= ?")
+            params.append(int(start) - DATA_FUTURE_TOLERANCE)
+        if end is not None:
+            where.append("CAST(timestamp AS BIGINT) <= ?")
+            params.append(int(end))
+            migrated = _migration_stamp(con)
+            if migrated is None or migrated <= int(end) + DATA_MAX_AGE:
+                where.append("insert_timestamp <= ?")
+                params.append(int(end) + DATA_MAX_AGE)
+            else:
+                where.append("(insert_timestamp <= ? OR insert_timestamp = ?)")
+                params.extend([int(end) + DATA_MAX_AGE, migrated])
+        if regions:
+            where.append(f"region IN ({', '.join('?' * len(regions))})")
+            params.extend(regions)
+        if vehicle_ids:
+            where.append(f"vehicle_id IN ({', '.join('?' * len(vehicle_ids))})")
+            params.extend(vehicle_ids)
+
+        query = f"SELECT {', '.join(columns)} FROM {DATABASE_TABLE}"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+
+        reader = con.execute(query, params).fetch_record_batch(batch_rows)
+    except Exception:
+        con.close()
+        raise
+
+    def batches():
+        try:
+            yield from reader
+        finally:
+            con.close()
+
+    return pa.RecordBatchReader.from_batches(reader.schema, batches())
+
+
+def _write(sink, reader, fmt):
+    rows = 0
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        with pq.ParquetWriter(sink, reader.schema, compression='zstd') as writer:
+            for batch in reader:
+                writer.write_batch(batch)
+                rows += batch.num_rows
+    else:
+        with pa.ipc.new_stream(sink, reader.schema) as writer:
+            for batch in reader:
+                writer.write_batch(batch)
+                rows += batch.num_rows
+    return rows
+
+
+def write_history(sink, fmt='arrow', **filters):
+    """
+    Write :func:`read_history` output to a file-like *sink* as an Arrow IPC
+    stream (``fmt='arrow'``) or Parquet (``fmt='parquet'``), batch by batch.
+
+    Returns:
+        Number of rows written
+    """
+    if fmt not in ('arrow', 'parquet'):
+        raise ValueError(f"Unknown format: {fmt}")
+    return _write(sink, read_history(**filters), fmt)
+
+
+# ---------------------------------------------------------------------------
+# HTTP endpoint
+# ---------------------------------------------------------------------------
+
+class _HistoryHandler(http_endpoint.QuietHandler):
+    # HTTP/1.0: the body is streamed without Content-Length and ends at close
+    protocol_version = 'HTTP/1.0'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/history':
+            self.send_error(404)
+            return
+
+        query = parse_qs(url.query)
+        try:
+            fmt = query.get('format', ['arrow'])[0]
+            filters = {
+                'start': int(query['start'][0]) if 'start' in query else None,
+                'end': int(query['end'][0]) if 'end' in query else None,
+                'regions': query.get('region'),
+                'vehicle_ids': query.get('vehicle_id'),
+                'columns': query['columns'][0].split(',') if 'columns' in query else None,
+            }
+            if fmt not in ('arrow', 'parquet'):
+                raise ValueError(f"Unknown format: {fmt}")
+            # Opened before the 200 so bad filters still get a 400
+            reader = read_history(**filters)
+        except (ValueError, KeyError) as e:
+            self.send_error(400, str(e))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/vnd.apache.parquet' if fmt == 'parquet'
+                         else 'application/vnd.apache.arrow.stream')
+        self.end_headers()
+        try:
+            _write(self.wfile, reader, fmt)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def start_http_server(port, host='127.0.0.1'):
+    """Serve ``/history`` on *host*:*port* from a daemon thread (idempotent)."""
+    return http_endpoint.serve(_HistoryHandler, port, host, name='history-http')
@@ -0,0 +1,38 @@
+"""
+http_endpoint.py
+----------------
+Standard-library HTTP servers run beside the ingester (metrics.py's
+``/metrics``, history_api.py's ``/history`` and density_tiles.py's
+``/tiles``).  Each module only defines its handler; serve() starts it once
+per process on a daemon thread.
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_servers = {}   # handler class -> running ThreadingHTTPServer
+_lock = threading.Lock()
+
+
+class QuietHandler(BaseHTTPRequestHandler):
+    """Request handler that doesn't log every request to stderr."""
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(handler, port, host='127.0.0.1', name='http'):
+    """
+    Serve *handler* on *host*:*port* from a daemon thread named *name*.
+
+    Idempotent per handler class: later calls return the running server.
+
+    Returns:
+        ThreadingHTTPServer (``server_address`` has the bound port when *port* is 0)
+    """
+    with _lock:
+        server = _servers.get(handler)
+        if server is None:
+            server = _servers[handler] = ThreadingHTTPServer((host, port), handler)
+            threading.Thread(target=server.serve_forever, daemon=True, name=name).start()
+        return server
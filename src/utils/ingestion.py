@@ -2,10 +2,15 @@ import requests
 import pandas as pd
 from google.transit import gtfs_realtime_pb2
 from google.protobuf.json_format import MessageToDict
-import duckdb
+import atexit
+import multiprocessing
 import time
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import pyarrow as pa
+from utils import density_tiles, feed_archive, fleet, geofence, headways, history_api, map_matching, metrics, motion, schedule, spatial_index, trips, validation, vehicle_search, writer
+from utils.writer import DERIVED_COLUMNS
 
 # Constants
 API_SOURCES = {
@@ -27,6 +32,8 @@ API_SOURCES = {
 
 API_BASE_URL = 'https://api.data.gov.my/gtfs-realtime/vehicle-position/'
 REQUEST_TIMEOUT = 10
+# Concurrent endpoint fetches (per worker process when INGEST_WORKERS > 1)
+FETCH_THREADS = 10
 
 try:
     from config import DATABASE_NAME, DATABASE_TABLE, DATA_MAX_AGE, DATA_FUTURE_TOLERANCE
@@ -36,73 +43,119 @@ except ImportError:
     DATA_MAX_AGE = 3600
     DATA_FUTURE_TOLERANCE = 300
 
-def _fetch_endpoint(name, endpoint):
+try:
+    from config import MAP_MATCHING_ENABLED, SCHEDULE_ADHERENCE_ENABLED
+except ImportError:
+    MAP_MATCHING_ENABLED = True
+    SCHEDULE_ADHERENCE_ENABLED = True
+
+try:
+    from config import METRICS_TABLE, METRICS_PORT, METRICS_RETENTION_SECONDS
+except ImportError:
+    METRICS_TABLE = 'pipeline_metrics'
+    METRICS_PORT = None
+    METRICS_RETENTION_SECONDS = 7 * 86400
+
+try:
+    from config import FEED_ARCHIVE_DIR
+except ImportError:
+    FEED_ARCHIVE_DIR = None
+
+try:
+    from config import HISTORY_API_PORT
+except ImportError:
+    HISTORY_API_PORT = None
+
+try:
+    from config import INGEST_WORKERS
+except ImportError:
+    INGEST_WORKERS = 0   # 0 or 1: fetch and decode on threads in this process
+
+def _decode_feed(name, content, endpoint=''):
+    """
+    Decode a GTFS Realtime FeedMessage payload into a list of vehicle dicts,
+    each tagged with the *endpoint* it came from.
+
+    Returns (vehicles, entity_count, header_timestamp).
+    """
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.ParseFromString(content)
+
+    vehicles = []
+    for entity in feed.entity:
+        if entity.HasField('vehicle'):
+            v = MessageToDict(entity.vehicle)
+            pos = v.get('position', {})
+            vehicle_info = v.get('vehicle', {})
+
+            trip_info = v.get('trip', {})
+            vehicles.append({
+                'region': name,
+                'endpoint': endpoint,
+                'latitude': pos.get('latitude'),
+                'longitude': pos.get('longitude'),
+                'bearing': pos.get('bearing', 0),
+                'speed': pos.get('speed', 0),
+                'vehicle_id': vehicle_info.get('id', 'Unknown'),
+                'timestamp': v.get('timestamp'),
+                'trip_id': trip_info.get('tripId', ''),
+                'route_id': trip_info.get('routeId', ''),
+            })
+    header_ts = feed.header.timestamp if feed.header.HasField('timestamp') else None
+    return vehicles, len(feed.entity), header_ts
+
+def _ingest_payload(name, endpoint, content, cycle, fetch_ms=None):
+    """
+    Decode one endpoint's FeedMessage *content* and record its decode time,
+    payload size, entity count and feed staleness against *cycle*.
+    Returns a list of vehicle dicts.
+    """
+    with cycle.stage('decode', name, endpoint):
+        vehicles, entity_count, header_ts = _decode_feed(name, content, endpoint)
+    staleness = cycle.cycle_ts - header_ts if header_ts else None
+    cycle.record('fetch', name, endpoint, duration_ms=fetch_ms, n_bytes=len(content),
+                 entities=entity_count, staleness_s=staleness)
+    return vehicles
+
+def _fetch_endpoint(name, endpoint, cycle=None, base_url=None, archive_dir=None):
     """
     Fetch vehicle data from a single API endpoint.
     Returns a list of vehicle dicts, or an empty list on error.
+
+    When *cycle* (a metrics.Cycle) is given, fetch and decode timings, payload
+    size, entity count, feed staleness and errors are recorded against it.
+    Successful responses are archived when FEED_ARCHIVE_DIR is set.
+
+    *base_url* / *archive_dir* override API_BASE_URL / FEED_ARCHIVE_DIR
+    (worker processes are handed the parent's values; '' disables archiving).
     """
-    url = f'{API_BASE_URL}{endpoint}'
+    base_url = API_BASE_URL if base_url is None else base_url
+    archive_dir = FEED_ARCHIVE_DIR if archive_dir is None else archive_dir
+    url = f'{base_url}{endpoint}'
+    cycle = cycle or metrics.Cycle(time.time())
+    start = time.perf_counter()
     try:
         response = requests.get(url, timeout=REQUEST_TIMEOUT)
-        if response.status_code == 200:
-            feed = gtfs_realtime_pb2.FeedMessage()
-            feed.ParseFromString(response.content)
-
-            vehicles = []
-            for entity in feed.entity:
-                if entity.HasField('vehicle'):
-                    v = MessageToDict(entity.vehicle)
-                    pos = v.get('position', {})
-                    vehicle_info = v.get('vehicle', {})
-
-                    trip_info = v.get('trip', {})
-                    vehicles.append({
-                        'region': name,
-                        'latitude': pos.get('latitude'),
-                        'longitude': pos.get('longitude'),
-                        'bearing': pos.get('bearing', 0),
-                        'speed': pos.get('speed', 0),
-                        'vehicle_id': vehicle_info.get('id', 'Unknown'),
-                        'timestamp': v.get('timestamp'),
-                        'trip_id': trip_info.get('tripId', ''),
-                        'route_id': trip_info.get('routeId', ''),
-                    })
-            return vehicles
+        fetch_ms = (time.perf_counter() - start) * 1000
+        if response.status_code != 200:
+            cycle.record('fetch', name, endpoint, duration_ms=fetch_ms,
+                         n_bytes=len(response.content), error=f'HTTP {response.status_code}')
+            return []
+
+        if archive_dir:
+            feed_archive.record(archive_dir, name, endpoint, response.content, cycle.cycle_ts)
+        return _ingest_payload(name, endpoint, response.content, cycle, fetch_ms)
     except Exception as e:
         print(f"Error fetching {name} ({endpoint}): {e}")
+        cycle.record('fetch', name, endpoint, duration_ms=(time.perf_counter() - start) * 1000,
+                     error=type(e).__name__)
     return []
 
-def fetch_and_store_transit_data():
-    """
-    Fetch live transit data from Malaysia GTFS API and store in DuckDB
-    - Fetches data from all configured regions
-    - Filters invalid/stale data
-    - Deduplicates before inserting
-    """
-    all_vehicle_data = []
-    current_unix = int(time.time())
-
-    # ===== Step 1: Fetch data from all API endpoints =====
-    tasks = [
-        (name, endpoint)
-        for name, endpoints in API_SOURCES.items()
-        for endpoint in endpoints
-    ]
-
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        future_to_task = {
-            executor.submit(_fetch_endpoint, name, endpoint): (name, endpoint)
-            for name, endpoint in tasks
-        }
-        for future in as_completed(future_to_task):
-            all_vehicle_data.extend(future.result())
-
-    if not all_vehicle_data:
-        print("No vehicle data fetched")
-        return
-
-    # ===== Step 2: Clean and filter data =====
-    df = pd.DataFrame(all_vehicle_data)
+def _filter_vehicles(vehicles, current_unix):
+    """Build a DataFrame from decoded vehicle dicts, dropping bad coordinates and stale timestamps."""
+    if not vehicles:
+        return pd.DataFrame()
+    df = pd.DataFrame(vehicles)
 
     # Convert to numeric for filtering
     df['latitude'] = pd.to_numeric(df['latitude'], errors='coerce')
@@ -110,7 +163,7 @@ def fetch_and_store_transit_data():
     df['timestamp_num'] = pd.to_numeric(df['timestamp'], errors='coerce')
 
     # Filter invalid coordinates and timestamps
-    df = df[
+    return df[
         (df['latitude'] != 0) &
         (df['longitude'] != 0) &
         (df['timestamp_num'].notna()) &
@@ -118,72 +171,280 @@ def fetch_and_store_transit_data():
         (df['timestamp_num'] >= current_unix - DATA_MAX_AGE)
     ].drop(columns=['timestamp_num']).copy()
 
+# ---------------------------------------------------------------------------
+# Region sharding across processes (INGEST_WORKERS > 1)
+# ---------------------------------------------------------------------------
+
+_pool = None
+
+def _shutdown_pool():
+    """Stop the current worker pool, if any (also registered once for interpreter exit)."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+atexit.register(_shutdown_pool)
+
+def _get_pool():
+    """Long-lived worker pool; 'spawn' so workers never inherit Streamlit's threads."""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=INGEST_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+def _fetch_region_shard(sources, current_unix, base_url, archive_dir):
+    """
+    Worker-process task: fetch, decode and filter a shard of regions.
+
+    Args:
+        sources: [(region name, [endpoints])] for this shard
+        current_unix: Cycle time
+        base_url: The parent's API_BASE_URL
+        archive_dir: The parent's FEED_ARCHIVE_DIR ('' disables archiving)
+
+    The shard's endpoints are fetched concurrently on threads, so sharding
+    adds decode / filter CPU without lowering the number of HTTP requests
+    in flight.
+
+    Returns (Arrow IPC stream bytes, metric rows) - the stateful enrichment
+    stages and the database write stay in the parent process.
+    """
+    cycle = metrics.Cycle(current_unix)
+    tasks = [(name, endpoint) for name, endpoints in sources for endpoint in endpoints]
+    vehicles = []
+    with ThreadPoolExecutor(max_workers=max(1, min(FETCH_THREADS, len(tasks)))) as executor:
+        futures = [
+            executor.submit(_fetch_endpoint, name, endpoint, cycle, base_url, archive_dir)
+            for name, endpoint in tasks
+        ]
+        for future in as_completed(futures):
+            vehicles.extend(future.result())
+    df = _filter_vehicles(vehicles, current_unix)
+    if df.empty:
+        return b'', cycle.rows
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as stream:
+        stream.write_table(table)
+    return sink.getvalue().to_pybytes(), cycle.rows
+
+def _fetch_sharded(cycle, current_unix):
+    """
+    Split the regions into INGEST_WORKERS shards, run _fetch_region_shard
+    for each on the worker pool and merge the results into *cycle*.
+    Returns the filtered DataFrame, or None if the pool is unavailable (the
+    caller then fetches in-process).
+    """
+    sources = list(API_SOURCES.items())
+    shards = [sources[i::INGEST_WORKERS] for i in range(INGEST_WORKERS) if sources[i::INGEST_WORKERS]]
+    try:
+        futures = [
+            _get_pool().submit(_fetch_region_shard, shard, current_unix, API_BASE_URL, FEED_ARCHIVE_DIR or '')
+            for shard in shards
+        ]
+        tables = []
+        for future in as_completed(futures):
+            payload, rows = future.result()
+            cycle.extend(rows)
+            if payload:
+                tables.append(pa.ipc.open_stream(payload).read_all())
+    except (BrokenProcessPool, OSError) as e:
+        print(f"Worker pool unavailable, fetching in-process: {e}")
+        _shutdown_pool()
+        return None
+
+    if not tables:
+        return pd.DataFrame()
+    return pa.concat_tables(tables, promote_options='permissive').to_pandas()
+
+def _store_metrics(metrics_df):
+    """Append one cycle's measurements to the metrics table and trim old rows."""
+    if metrics_df.empty:
+        return
+    try:
+        w = writer.get_writer(DATABASE_NAME, DATABASE_TABLE)
+        with w.connection() as con:
+            con.execute(f"""
+                CREATE TABLE IF NOT EXISTS {METRICS_TABLE} (
+                    cycle_ts BIGINT, stage VARCHAR, region VARCHAR, endpoint VARCHAR,
+                    duration_ms DOUBLE, bytes BIGINT, entities BIGINT,
+                    staleness_s DOUBLE, error VARCHAR
+                )
+            """)
+            con.execute(f"INSERT INTO {METRICS_TABLE} SELECT * FROM metrics_df")
+            con.execute(
+                f"DELETE FROM {METRICS_TABLE} WHERE cycle_ts < ?",
+                [int(metrics_df['cycle_ts'].iloc[0]) - METRICS_RETENTION_SECONDS],
+            )
+    except Exception as e:
+        print(f"Metrics error: {e}")
+
+def _store_geofence_events(events):
+    """Append this cycle's geofence enter / exit events to their table."""
+    if events.empty:
+        return
+    try:
+        w = writer.get_writer(DATABASE_NAME, DATABASE_TABLE)
+        with w.connection() as con:
+            geofence.store(con, events)
+    except Exception as e:
+        print(f"Geofence error: {e}")
+
+def fetch_and_store_transit_data(fetch=None, current_unix=None):
+    """
+    Fetch live transit data from Malaysia GTFS API and store in DuckDB
+    - Fetches data from all configured regions
+    - Filters invalid/stale data
+    - Snaps positions onto their trip's GTFS Static shape
+    - Derives speed / heading / dwell from each vehicle's previous ping
+    - Computes schedule delay from GTFS Static stop_times
+    - Segments pings into trips, buffering trips as they close
+    - Measures headways along each shape and flags bunching / gaps
+    - Deduplicates and inserts through the buffered writer (utils/writer.py)
+
+    Per-stage timings and per-endpoint counters are written to the metrics
+    table and exposed on /metrics when METRICS_PORT is set.  The Arrow /
+    Parquet history API is served when HISTORY_API_PORT is set, history
+    density tiles when TILE_API_PORT is set.
+
+    Args:
+        fetch: Callable (name, endpoint, cycle) -> list of vehicle dicts used
+            instead of the HTTP fetch (feed_archive replay passes one)
+        current_unix: Cycle time; defaults to now (replay passes the
+            recorded fetch time so age filters see the original clock)
+    """
+    current_unix = int(time.time()) if current_unix is None else int(current_unix)
+    cycle = metrics.Cycle(current_unix)
+    if METRICS_PORT:
+        metrics.start_http_server(METRICS_PORT)
+    if HISTORY_API_PORT:
+        history_api.start_http_server(HISTORY_API_PORT)
+    if density_tiles.TILE_API_PORT:
+        density_tiles.start_http_server(density_tiles.TILE_API_PORT)
+
+    try:
+        with cycle.stage('total'):
+            _run_cycle(cycle, current_unix, fetch or _fetch_endpoint)
+    finally:
+        _store_metrics(cycle.finish())
+
+def _run_cycle(cycle, current_unix, fetch=_fetch_endpoint):
+    """One fetch → filter → enrich → store pass, timed stage by stage into *cycle*."""
+    all_vehicle_data = []
+
+    # ===== Step 1: Fetch data from all API endpoints =====
+    # With INGEST_WORKERS > 1 regions are sharded across worker processes,
+    # which also run Step 2 and hand back filtered Arrow batches.
+    df = None
+    if INGEST_WORKERS > 1 and fetch is _fetch_endpoint:
+        with cycle.stage('fetch_all'):
+            df = _fetch_sharded(cycle, current_unix)
+
+    if df is None:
+        tasks = [
+            (name, endpoint)
+            for name, endpoints in API_SOURCES.items()
+            for endpoint in endpoints
+        ]
+
+        with cycle.stage('fetch_all'), ThreadPoolExecutor(max_workers=FETCH_THREADS) as executor:
+            future_to_task = {
+                executor.submit(fetch, name, endpoint, cycle): (name, endpoint)
+                for name, endpoint in tasks
+            }
+            for future in as_completed(future_to_task):
+                all_vehicle_data.extend(future.result())
+
+        if not all_vehicle_data:
+            print("No vehicle data fetched")
+            return
+
+        # ===== Step 2: Clean and filter data =====
+        with cycle.stage('filter'):
+            df = _filter_vehicles(all_vehicle_data, current_unix)
+    cycle.record('filter_output', entities=len(df))
+
     if df.empty:
         print("No valid vehicle data after filtering")
         return
 
-    df['insert_timestamp'] = current_unix
-    df['created_at'] = datetime.utcnow()
+    # ===== Step 3: Drop positions failing the data-quality rules =====
+    with cycle.stage('validate'):
+        df = validation.validate(df, current_unix, cycle)
+    cycle.record('validate_output', entities=len(df))
 
-    # ===== Step 3: Store in database with deduplication =====
-    try:
-        con = duckdb.connect(DATABASE_NAME)
+    if df.empty:
+        print("No valid vehicle data after data-quality checks")
+        return
+
+    # ===== Step 4: Snap positions to their planned route shape =====
+    with cycle.stage('map_match'):
+        if MAP_MATCHING_ENABLED:
+            df = map_matching.snap_to_shapes(df)
+        else:
+            for col in map_matching.MATCH_COLUMNS:
+                df[col] = '' if DERIVED_COLUMNS[col] == 'VARCHAR' else float('nan')
 
-        table_exists = con.execute(
-            f"SELECT count(*) FROM information_schema.tables WHERE table_name = '{DATABASE_TABLE}'"
-        ).fetchone()[0] > 0
+    # ===== Step 5: Derive speed, heading and dwell from consecutive pings =====
+    with cycle.stage('motion'):
+        df = motion.derive_motion(df)
 
-        if not table_exists:
-            con.execute(f"CREATE TABLE {DATABASE_TABLE} AS SELECT * FROM df")
-            print(f"✓ Created table and synced {len(df)} vehicles")
+    # ===== Step 6: Compare against the GTFS Static schedule =====
+    with cycle.stage('schedule'):
+        if SCHEDULE_ADHERENCE_ENABLED:
+            df = schedule.update_adherence(df)
         else:
-            # Ensure insert_timestamp column exists (for migration)
-            columns = con.execute(
-                f"SELECT column_name FROM information_schema.columns WHERE table_name = '{DATABASE_TABLE}'"
-            ).df()['column_name'].tolist()
+            df['schedule_delay_s'] = float('nan')
 
-            if 'insert_timestamp' not in columns:
-                con.execute(f"ALTER TABLE {DATABASE_TABLE} ADD COLUMN insert_timestamp BIGINT")
-                con.execute(f"UPDATE {DATABASE_TABLE} SET insert_timestamp = {current_unix} WHERE insert_timestamp IS NULL")
+    # Columnar live-fleet snapshot the dashboard pages read from
+    with cycle.stage('fleet_snapshot'):
+        snapshot = fleet.publish(df)
 
-            if 'created_at' not in columns:
-                con.execute(f"ALTER TABLE {DATABASE_TABLE} ADD COLUMN created_at TIMESTAMP")
-                con.execute(f"UPDATE {DATABASE_TABLE} SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL")
+    # Live-vehicle index for the Locate Me nearest-vehicle query, from the
+    # snapshot so vehicles whose endpoint failed this cycle stay in it
+    with cycle.stage('spatial_index'):
+        spatial_index.update_vehicle_index(snapshot)
 
-            if 'trip_id' not in columns:
-                con.execute(f"ALTER TABLE {DATABASE_TABLE} ADD COLUMN trip_id VARCHAR")
-                con.execute(f"UPDATE {DATABASE_TABLE} SET trip_id = '' WHERE trip_id IS NULL")
+    # Vehicle / trip / route search index for the Route Viewer
+    with cycle.stage('search_index'):
+        vehicle_search.update(snapshot)
 
-            if 'route_id' not in columns:
-                con.execute(f"ALTER TABLE {DATABASE_TABLE} ADD COLUMN route_id VARCHAR")
-                con.execute(f"UPDATE {DATABASE_TABLE} SET route_id = '' WHERE route_id IS NULL")
+    # ===== Step 7: Geofence enter / exit events =====
+    if geofence.GEOFENCES_PATH:
+        with cycle.stage('geofence'):
+            events = geofence.update_geofences(df, current_unix)
+        cycle.record('geofence_events', entities=len(events))
+        _store_geofence_events(events)
 
-            # Insert only non-duplicate records
-            con.execute(f"""
-                INSERT INTO {DATABASE_TABLE}
-                SELECT df.* FROM df
-                WHERE NOT EXISTS (
-                    SELECT 1 FROM {DATABASE_TABLE} existing
-                    WHERE existing.region = df.region
-                    AND existing.vehicle_id = df.vehicle_id
-                    AND existing.timestamp = df.timestamp
-                    AND existing.latitude = df.latitude
-                    AND existing.longitude = df.longitude
-                    AND existing.bearing = df.bearing
-                    AND existing.speed = df.speed
-                )
-            """)
+    # ===== Step 8: Segment pings into trips; closed ones are written with the positions =====
+    closed = None
+    if trips.TRIPS_ENABLED:
+        with cycle.stage('trips'):
+            closed = trips.update_trips(df, current_unix)
+        cycle.record('trips_output', entities=len(closed))
 
-            inserted_count = con.execute("SELECT changes()").fetchone()[0]
+    # ===== Step 9: Headways to the vehicle ahead on each shape, bunching and gaps =====
+    if headways.HEADWAYS_ENABLED:
+        with cycle.stage('headways'):
+            spacing = headways.update_headways(df, current_unix)
+        cycle.record('bunched', entities=int((spacing['status'] == 'bunched').sum()))
 
-            if inserted_count > 0:
-                print(f"✓ Inserted {inserted_count} new vehicles (skipped duplicates)")
-            else:
-                print(f"⚠ No new data inserted (all records were duplicates)")
+    df['insert_timestamp'] = current_unix
+    df['created_at'] = datetime.utcnow()
 
-        con.close()
+    # ===== Step 10: Buffer, and store in database with deduplication on flush =====
+    try:
+        w = writer.get_writer(DATABASE_NAME, DATABASE_TABLE)
+        with cycle.stage('insert'):
+            inserted_count = w.append(df, current_unix, closed_trips=closed)
+        if inserted_count is not None:
+            cycle.record('insert_output', entities=inserted_count)
+        cycle.record('write_buffer', entities=w.buffered_rows)
     except Exception as e:
         print(f"Database error: {e}")
+        cycle.record('insert', error=type(e).__name__)
 
 if __name__ == "__main__":
     fetch_and_store_transit_data()
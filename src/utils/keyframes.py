@@ -0,0 +1,83 @@
+"""
+keyframes.py
+------------
+Time-bucketed snapshot index for map playback.
+
+For every ``KEYFRAME_BUCKET_SECONDS`` bucket the keyframe table keeps the
+latest position of each vehicle seen in it, keyed by
+``(bucket_ts, region, vehicle_id)``.  Rows are stored in bucket order, so the
+fleet at any past time is a range read that DuckDB's zone maps narrow to the
+few row groups covering the live window, instead of a window function over
+the whole positions table; see ``db.get_fleet_at``.
+
+The writer upserts each flushed batch in the same transaction as the insert.
+When the table is first created it is backfilled from the existing history.
+"""
+
+from utils import schema
+
+try:
+    from config import DATABASE_TABLE
+except ImportError:
+    DATABASE_TABLE = 'live_buses'
+
+try:
+    from config import KEYFRAMES_ENABLED, KEYFRAME_TABLE, KEYFRAME_BUCKET_SECONDS
+except ImportError:
+    KEYFRAMES_ENABLED = True
+    KEYFRAME_TABLE = 'fleet_keyframes'
+    KEYFRAME_BUCKET_SECONDS = 30
+
+# Position columns kept per keyframe (cast to DOUBLE; NULL when the source lacks them)
+VALUE_COLUMNS = ['latitude', 'longitude', 'bearing', 'speed', 'derived_speed']
+
+
+def upsert(con, source):
+    """
+    Fold positions from *source* (a table or registered Arrow batch) into the
+    keyframe table, keeping the latest position per vehicle per bucket.
+    Runs in the caller's transaction.
+    """
+    available = schema.columns(con, source)
+    values = ', '.join(
+        f"TRY_CAST({col} AS DOUBLE) AS {col}" if col in available else f"CAST(NULL AS DOUBLE) AS {col}"
+        for col in VALUE_COLUMNS
+    )
+    updates = ', '.join(f"{col} = excluded.{col}" for col in VALUE_COLUMNS + ['timestamp'])
+    con.execute(f"""
+        INSERT INTO {KEYFRAME_TABLE} (bucket_ts, region, vehicle_id, {', '.join(VALUE_COLUMNS)}, timestamp)
+        SELECT bucket_ts, region, vehicle_id, {', '.join(VALUE_COLUMNS)}, ts
+        FROM (
+            SELECT (ts // {KEYFRAME_BUCKET_SECONDS}) * {KEYFRAME_BUCKET_SECONDS} AS bucket_ts,
+                   region, vehicle_id, {values}, ts
+            FROM (SELECT *, TRY_CAST(timestamp AS BIGINT) AS ts FROM {source})
+            WHERE ts IS NOT NULL
+            QUALIFY ROW_NUMBER() OVER (PARTITION BY bucket_ts, region, vehicle_id ORDER BY ts DESC) = 1
+        )
+        -- Stored in bucket order so zone maps can prune a seek to a few row groups
+        ORDER BY bucket_ts
+        ON CONFLICT (bucket_ts, region, vehicle_id) DO UPDATE SET {updates}
+        WHERE excluded.timestamp > {KEYFRAME_TABLE}.timestamp
+    """)
+
+
+def ensure_table(con, source=DATABASE_TABLE):
+    """
+    Create the keyframe table if it is missing, backfilling it from *source*
+    (the positions table) when that already holds history.
+    """
+    if schema.table_exists(con, KEYFRAME_TABLE):
+        return
+    con.execute(f"""
+        CREATE TABLE {KEYFRAME_TABLE} (
+            bucket_ts BIGINT,
+            region VARCHAR,
+            vehicle_id VARCHAR,
+            {' '.join(f'{col} DOUBLE,' for col in VALUE_COLUMNS)}
+            timestamp BIGINT,
+            PRIMARY KEY (bucket_ts, region, vehicle_id)
+        )
+    """)
+    if schema.table_exists(con, source):
+        print(f"Backfilling {KEYFRAME_TABLE} from {source}...")
+        upsert(con, source)
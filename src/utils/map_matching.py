@@ -0,0 +1,256 @@
+"""
+map_matching.py
+---------------
+Snap live GTFS Realtime positions onto the planned shape of their trip.
+
+For every agency the GTFS Static shapes are turned into a flat table of line
+segments (in local metres) plus a uniform grid that maps
+(shape, cell_x, cell_y) -> segments crossing that cell.  A batch of positions is
+matched in one vectorised pass:
+
+  1. trip_id -> shape via trips.txt
+  2. look up the 3x3 grid neighbourhood of each point for its own shape
+  3. project the point onto every candidate segment and keep the closest
+
+Positions further than ``MAP_MATCH_MAX_OFFSET_M`` from their shape (or without
+a shape) are left unmatched (NaN).
+"""
+
+import numpy as np
+import pandas as pd
+
+from utils import geo, gtfs_static
+
+try:
+    from config import MAP_MATCH_MAX_OFFSET_M
+except ImportError:
+    MAP_MATCH_MAX_OFFSET_M = 200
+
+MATCH_COLUMNS = ['shape_id', 'shape_dist_m', 'cross_track_m', 'snapped_latitude', 'snapped_longitude']
+
+# Cell offsets for the 3x3 neighbourhood search
+_NEIGHBOURS = np.array([(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)], dtype='int64')
+
+
+class ShapeIndex:
+    """
+    Segment table and grid for all shapes of a single agency.
+
+    Attributes are plain NumPy arrays; ``trip_shape`` is a Series mapping
+    trip_id -> shape number so a whole batch can be resolved with ``.map``.
+    """
+
+    def __init__(self, shapes, trips, cell_m=MAP_MATCH_MAX_OFFSET_M):
+        self.cell_m = float(cell_m)
+
+        shapes = shapes.copy()
+        shapes['lat'] = pd.to_numeric(shapes['shape_pt_lat'], errors='coerce')
+        shapes['lon'] = pd.to_numeric(shapes['shape_pt_lon'], errors='coerce')
+        shapes['seq'] = pd.to_numeric(shapes['shape_pt_sequence'], errors='coerce')
+        shapes = shapes.dropna(subset=['lat', 'lon', 'seq'])
+        shapes = shapes.sort_values(['shape_id', 'seq'], kind='stable')
+
+        shape_codes, self.shape_ids = pd.factorize(shapes['shape_id'], sort=True)
+        self.ref_lat = float(shapes['lat'].mean()) if len(shapes) else 0.0
+
+        x, y = geo.project_local(shapes['lat'].to_numpy(), shapes['lon'].to_numpy(), self.ref_lat)
+        self.origin_x = float(x.min()) if len(x) else 0.0
+        self.origin_y = float(y.min()) if len(y) else 0.0
+        x = x - self.origin_x
+        y = y - self.origin_y
+
+        # Consecutive points of the same shape form a segment
+        same = shape_codes[1:] == shape_codes[:-1]
+        self.seg_shape = shape_codes[:-1][same].astype('int64')
+        self.ax, self.ay = x[:-1][same], y[:-1][same]
+        self.bx, self.by = x[1:][same], y[1:][same]
+        self.seg_len = np.hypot(self.bx - self.ax, self.by - self.ay)
+
+        # Distance along the shape at the start of each segment
+        cum = np.cumsum(self.seg_len)
+        starts = np.r_[True, self.seg_shape[1:] != self.seg_shape[:-1]] if len(cum) else np.array([], dtype=bool)
+        shape_offset = np.maximum.accumulate(np.where(starts, cum - self.seg_len, 0.0)) if len(cum) else cum
+        self.seg_cum = cum - self.seg_len - shape_offset
+
+        self._build_grid()
+
+        trip_shape = pd.Series(np.arange(len(self.shape_ids)), index=self.shape_ids)
+        trips = trips[trips['shape_id'].isin(trip_shape.index)]
+        self.trip_shape = pd.Series(
+            trip_shape.loc[trips['shape_id']].to_numpy(), index=trips['trip_id'].to_numpy()
+        )
+        self.trip_shape = self.trip_shape[~self.trip_shape.index.duplicated()]
+
+    def _cell_key(self, shape, cx, cy):
+        # Cells are non-negative relative to the grid origin; clipping keeps
+        # far-away points from aliasing into another shape's key space
+        cx = np.clip(cx + 1, 0, (1 << 20) - 1)
+        cy = np.clip(cy + 1, 0, (1 << 20) - 1)
+        return (shape << 40) | (cx << 20) | cy
+
+    def _build_grid(self):
+        """
+        Register every segment in the grid cells it passes through.
+
+        Segments are first cut into pieces of at most one cell so each piece's
+        bounding box covers no more than 2x2 cells; bucketing a long diagonal
+        segment (e.g. a rail shape with sparse points) by its own bounding box
+        would register it in a number of cells quadratic in its length.
+        """
+        pieces = np.maximum(np.ceil(self.seg_len / self.cell_m), 1).astype('int64')
+        piece_seg = np.repeat(np.arange(len(pieces)), pieces)
+        k = np.arange(pieces.sum()) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+        t0, t1 = k / pieces[piece_seg], (k + 1) / pieces[piece_seg]
+        dx, dy = (self.bx - self.ax)[piece_seg], (self.by - self.ay)[piece_seg]
+        px0, px1 = self.ax[piece_seg] + t0 * dx, self.ax[piece_seg] + t1 * dx
+        py0, py1 = self.ay[piece_seg] + t0 * dy, self.ay[piece_seg] + t1 * dy
+
+        x0 = np.floor(np.minimum(px0, px1) / self.cell_m).astype('int64')
+        x1 = np.floor(np.maximum(px0, px1) / self.cell_m).astype('int64')
+        y0 = np.floor(np.minimum(py0, py1) / self.cell_m).astype('int64')
+        y1 = np.floor(np.maximum(py0, py1) / self.cell_m).astype('int64')
+        nx, ny = x1 - x0 + 1, y1 - y0 + 1
+        counts = nx * ny
+
+        piece = np.repeat(np.arange(len(counts)), counts)
+        # Position of each emitted cell within its piece's bounding box
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cx = x0[piece] + within % nx[piece]
+        cy = y0[piece] + within // nx[piece]
+        seg = piece_seg[piece]
+
+        keys = self._cell_key(self.seg_shape[seg], cx, cy)
+        # Sorted by cell, then segment; consecutive pieces share cells, so drop repeats
+        order = np.lexsort((seg, keys))
+        keys, seg = keys[order], seg[order]
+        first = np.r_[True, (keys[1:] != keys[:-1]) | (seg[1:] != seg[:-1])] if len(keys) else np.array([], dtype=bool)
+        self.cell_keys = keys[first]
+        self.cell_segs = seg[first]
+
+    def match(self, trip_ids, lat, lon):
+        """
+        Match points to their trip's shape.
+
+        Args:
+            trip_ids: array-like of trip_id strings
+            lat, lon: float arrays of the same length
+
+        Returns:
+            DataFrame with MATCH_COLUMNS, one row per input point (NaN/'' when
+            the point could not be matched)
+        """
+        shape = pd.Series(trip_ids).map(self.trip_shape).to_numpy(dtype='float64', na_value=np.nan)
+        return self.match_shapes(shape, lat, lon)
+
+    def match_shapes(self, shape, lat, lon):
+        """
+        Same as :meth:`match` but with shape numbers (positions in
+        ``shape_ids``, NaN for none) already resolved.
+        """
+        n = len(lat)
+        result = {
+            'shape_id': np.full(n, '', dtype=object),
+            'shape_dist_m': np.full(n, np.nan),
+            'cross_track_m': np.full(n, np.nan),
+            'snapped_latitude': np.full(n, np.nan),
+            'snapped_longitude': np.full(n, np.nan),
+        }
+
+        pts = np.flatnonzero(~np.isnan(shape))
+        if len(pts) == 0 or len(self.cell_keys) == 0:
+            return pd.DataFrame(result)
+
+        px, py = geo.project_local(np.asarray(lat)[pts], np.asarray(lon)[pts], self.ref_lat)
+        px = px - self.origin_x
+        py = py - self.origin_y
+        pshape = shape[pts].astype('int64')
+
+        # Candidate segments from the 3x3 neighbourhood of each point's cell
+        cx = np.floor(px / self.cell_m).astype('int64')[:, None] + _NEIGHBOURS[:, 0]
+        cy = np.floor(py / self.cell_m).astype('int64')[:, None] + _NEIGHBOURS[:, 1]
+        keys = self._cell_key(pshape[:, None], cx, cy).ravel()
+        lo = np.searchsorted(self.cell_keys, keys, side='left')
+        hi = np.searchsorted(self.cell_keys, keys, side='right')
+        counts = hi - lo
+        if counts.sum() == 0:
+            return pd.DataFrame(result)
+
+        cand_pt = np.repeat(np.repeat(np.arange(len(pts)), len(_NEIGHBOURS)), counts)
+        cand_pos = np.repeat(lo, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+        cand_seg = self.cell_segs[cand_pos]
+
+        # Vectorised point-to-segment projection
+        ax, ay = self.ax[cand_seg], self.ay[cand_seg]
+        dx, dy = self.bx[cand_seg] - ax, self.by[cand_seg] - ay
+        len2 = dx * dx + dy * dy
+        t = np.where(len2 > 0, ((px[cand_pt] - ax) * dx + (py[cand_pt] - ay) * dy) / np.where(len2 > 0, len2, 1), 0)
+        t = np.clip(t, 0.0, 1.0)
+        qx, qy = ax + t * dx, ay + t * dy
+        d2 = (px[cand_pt] - qx) ** 2 + (py[cand_pt] - qy) ** 2
+
+        # Closest candidate per point
+        order = np.lexsort((d2, cand_pt))
+        first = order[np.r_[True, cand_pt[order][1:] != cand_pt[order][:-1]]]
+        best_pt = cand_pt[first]
+        cross = np.sqrt(d2[first])
+        ok = cross <= self.cell_m
+        best_pt, first, cross = best_pt[ok], first[ok], cross[ok]
+
+        rows = pts[best_pt]
+        seg = cand_seg[first]
+        snap_lat, snap_lon = geo.unproject_local(qx[first] + self.origin_x, qy[first] + self.origin_y, self.ref_lat)
+        result['shape_id'][rows] = self.shape_ids[self.seg_shape[seg]]
+        result['shape_dist_m'][rows] = self.seg_cum[seg] + t[first] * self.seg_len[seg]
+        result['cross_track_m'][rows] = cross
+        result['snapped_latitude'][rows] = snap_lat
+        result['snapped_longitude'][rows] = snap_lon
+        return pd.DataFrame(result)
+
+
+def _build_shape_index(agency_slug):
+    shapes = gtfs_static.load_table(
+        agency_slug, 'shapes.txt', ['shape_id', 'shape_pt_lat', 'shape_pt_lon', 'shape_pt_sequence']
+    )
+    trips = gtfs_static.load_table(agency_slug, 'trips.txt', ['trip_id', 'shape_id'])
+    if shapes.empty or trips.empty or 'shape_id' not in trips.columns:
+        return None
+    return ShapeIndex(shapes, trips)
+
+
+def get_shape_index(agency_slug):
+    """
+    Return the ShapeIndex for *agency_slug*, or None if the agency has no
+    usable shapes or its GTFS Static ZIP cannot be loaded.
+    """
+    return gtfs_static.get_cached_index(agency_slug, 'shapes', _build_shape_index)
+
+
+def snap_to_shapes(df):
+    """
+    Add MATCH_COLUMNS to an ingest batch by snapping each row onto its trip's
+    shape.  Rows that cannot be matched keep NaN distances and an empty shape_id.
+
+    Args:
+        df: DataFrame with region, trip_id, latitude, longitude
+
+    Returns:
+        The same DataFrame with the match columns added
+    """
+    for col in MATCH_COLUMNS:
+        df[col] = '' if col == 'shape_id' else np.nan
+
+    for region, idx in df.groupby('region', sort=False).groups.items():
+        agency_slug = gtfs_static.STATIC_API_SOURCES.get(region)
+        index = get_shape_index(agency_slug) if agency_slug else None
+        if index is None:
+            continue
+        rows = df.loc[idx]
+        matched = index.match(
+            rows['trip_id'].to_numpy(),
+            rows['latitude'].to_numpy(dtype='float64'),
+            rows['longitude'].to_numpy(dtype='float64'),
+        )
+        for col in MATCH_COLUMNS:
+            df.loc[idx, col] = matched[col].to_numpy()
+
+    return df
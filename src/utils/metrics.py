@@ -0,0 +1,170 @@
+"""
+metrics.py
+----------
+Lightweight instrumentation for the ingestion pipeline.
+
+Each ingest cycle collects per-stage timings and per-endpoint counters in a
+:class:`Cycle`.  When the cycle finishes its rows are:
+
+  - folded into a process-wide registry exposed in Prometheus text format
+    (``render_prometheus`` / ``start_http_server``), and
+  - returned as a DataFrame for the ``pipeline_metrics`` DuckDB table that
+    backs the Pipeline Health page.
+
+No external dependency is needed; the HTTP endpoint uses the standard library.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+from utils import http_endpoint
+
+METRIC_COLUMNS = [
+    'cycle_ts', 'stage', 'region', 'endpoint', 'duration_ms',
+    'bytes', 'entities', 'staleness_s', 'error',
+]
+
+_lock = threading.Lock()
+# (name, labels) -> value; labels is a sorted tuple of (key, value) pairs
+_counters = {}
+_gauges = {}
+_help = {
+    'transit_ingest_stage_seconds_total': ('counter', 'Cumulative time spent per ingest stage'),
+    'transit_ingest_stage_runs_total': ('counter', 'Number of times each ingest stage ran'),
+    'transit_ingest_bytes_total': ('counter', 'Bytes downloaded per endpoint'),
+    'transit_ingest_entities_total': ('counter', 'Feed entities decoded per endpoint'),
+    'transit_ingest_errors_total': ('counter', 'Failed fetches per endpoint'),
+    'transit_ingest_fetches_total': ('counter', 'Fetch attempts per endpoint'),
+    'transit_ingest_last_stage_seconds': ('gauge', 'Duration of each stage in the last cycle'),
+    'transit_ingest_feed_staleness_seconds': ('gauge', 'Age of the feed header at fetch time'),
+    'transit_ingest_last_cycle_timestamp': ('gauge', 'Unix time of the last completed cycle'),
+    'transit_validation_dropped_total': ('counter', 'Positions dropped by each data-quality rule'),
+    'transit_render_stage_seconds_total': ('counter', 'Cumulative dashboard render time per page stage'),
+    'transit_render_stage_runs_total': ('counter', 'Number of times each page render stage ran'),
+    'transit_render_last_stage_seconds': ('gauge', 'Duration of each page stage in the last render'),
+}
+
+
+def _labels(**labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v not in (None, '')))
+
+
+def inc(name, value=1, **labels):
+    """Add *value* to a counter."""
+    key = (name, _labels(**labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    """Set a gauge to *value*."""
+    with _lock:
+        _gauges[(name, _labels(**labels))] = value
+
+
+class Cycle:
+    """Per-stage / per-endpoint measurements for one ingest cycle."""
+
+    def __init__(self, cycle_ts):
+        self.cycle_ts = int(cycle_ts)
+        self.rows = []
+        self._lock = threading.Lock()
+
+    def record(self, stage, region='', endpoint='', duration_ms=None, n_bytes=None,
+               entities=None, staleness_s=None, error=''):
+        """Append a measurement row (fetch threads call this concurrently)."""
+        with self._lock:
+            self.rows.append({
+                'cycle_ts': self.cycle_ts, 'stage': stage, 'region': region, 'endpoint': endpoint,
+                'duration_ms': duration_ms, 'bytes': n_bytes, 'entities': entities,
+                'staleness_s': staleness_s, 'error': error,
+            })
+
+    def extend(self, rows):
+        """Append rows recorded by another Cycle (e.g. in a worker process)."""
+        with self._lock:
+            self.rows.extend(rows)
+
+    @contextmanager
+    def stage(self, stage, region='', endpoint=''):
+        """Time a block and record it as *stage*."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, region, endpoint, duration_ms=(time.perf_counter() - start) * 1000)
+
+    def finish(self):
+        """
+        Fold this cycle into the Prometheus registry and return its rows as a
+        DataFrame with METRIC_COLUMNS.
+        """
+        df = pd.DataFrame(self.rows, columns=METRIC_COLUMNS)
+        for row in self.rows:
+            labels = {'stage': row['stage'], 'region': row['region'], 'endpoint': row['endpoint']}
+            if row['duration_ms'] is not None:
+                inc('transit_ingest_stage_seconds_total', row['duration_ms'] / 1000, **labels)
+                inc('transit_ingest_stage_runs_total', **labels)
+                set_gauge('transit_ingest_last_stage_seconds', row['duration_ms'] / 1000, **labels)
+            endpoint_labels = {'region': row['region'], 'endpoint': row['endpoint']}
+            if row['stage'] == 'fetch':
+                inc('transit_ingest_fetches_total', **endpoint_labels)
+                if row['error']:
+                    inc('transit_ingest_errors_total', **endpoint_labels)
+            if row['bytes'] is not None:
+                inc('transit_ingest_bytes_total', row['bytes'], **endpoint_labels)
+            if row['entities'] is not None and row['endpoint']:
+                inc('transit_ingest_entities_total', row['entities'], **endpoint_labels)
+            if row['staleness_s'] is not None:
+                set_gauge('transit_ingest_feed_staleness_seconds', row['staleness_s'], **endpoint_labels)
+        set_gauge('transit_ingest_last_cycle_timestamp', self.cycle_ts)
+        return df
+
+
+# ---------------------------------------------------------------------------
+# Prometheus exposition
+# ---------------------------------------------------------------------------
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus():
+    """Return all metrics in the Prometheus text exposition format."""
+    with _lock:
+        series = list(_counters.items()) + list(_gauges.items())
+
+    by_name = {}
+    for (name, labels), value in series:
+        by_name.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name in sorted(by_name):
+        kind, help_text = _help.get(name, ('untyped', ''))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in sorted(by_name[name]):
+            label_str = ','.join(f'{k}="{_escape(v)}"' for k, v in labels)
+            lines.append(f"{name}{{{label_str}}} {value}" if label_str else f"{name} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(http_endpoint.QuietHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_http_server(port, host='127.0.0.1'):
+    """Serve ``/metrics`` on *host*:*port* from a daemon thread (idempotent)."""
+    return http_endpoint.serve(_MetricsHandler, port, host, name='metrics-http')
@@ -0,0 +1,146 @@
+"""
+motion.py
+---------
+Derive speed, heading and dwell time from consecutive pings of each vehicle.
+
+Many feeds (notably myBAS) report ``speed = 0`` for every vehicle, so the
+ingester computes its own kinematics at write time.  The last accepted ping per
+(region, vehicle_id) is kept in memory between cycles; each new batch is
+processed in one vectorised pass (sort by vehicle and time, shift, haversine)
+and the results are stored as columns so analytics never need a self-join over
+history.
+"""
+
+import numpy as np
+import pandas as pd
+
+from utils import geo
+
+try:
+    from config import DATA_MAX_AGE
+except ImportError:
+    DATA_MAX_AGE = 3600
+
+# Pings further apart than this are not used to derive speed
+MAX_PING_GAP_SECONDS = 300
+# A vehicle that moved less than this between pings is considered stopped
+STOP_RADIUS_M = 15
+
+MOTION_COLUMNS = ['derived_speed', 'derived_bearing', 'dwell_seconds']
+
+# (region, vehicle_id) key -> last accepted ping
+_STATE = pd.DataFrame(
+    {
+        'latitude': pd.Series(dtype='float64'),
+        'longitude': pd.Series(dtype='float64'),
+        'timestamp': pd.Series(dtype='int64'),
+        'stopped_since': pd.Series(dtype='float64'),
+    },
+    index=pd.Index([], dtype=object, name='key'),
+)
+
+
+def _vehicle_key(df):
+    return df['region'].astype(str) + '\x1f' + df['vehicle_id'].astype(str)
+
+
+def reset_state():
+    """Forget all previously seen positions (used by replay and tests)."""
+    global _STATE
+    _STATE = _STATE.iloc[0:0]
+
+
+def last_known(df):
+    """
+    Last accepted ping (latitude, longitude, timestamp, stopped_since) for
+    each row's vehicle, aligned with *df*; NaN for vehicles not seen yet.
+    """
+    return _STATE.reindex(_vehicle_key(df).to_numpy())
+
+
+def derive_motion(df):
+    """
+    Add MOTION_COLUMNS to an ingest batch and advance the per-vehicle state.
+
+    - derived_speed: haversine distance / elapsed time since the previous ping (m/s)
+    - derived_bearing: heading from the previous ping (degrees), NaN while stopped
+    - dwell_seconds: how long the vehicle has been within STOP_RADIUS_M, 0 when moving
+
+    Columns are NaN for a vehicle's first ping, for pings more than
+    MAX_PING_GAP_SECONDS after the previous one, and for repeats of a ping that
+    was already processed.
+
+    Args:
+        df: DataFrame with region, vehicle_id, latitude, longitude, timestamp
+
+    Returns:
+        The same DataFrame with the motion columns added
+    """
+    global _STATE
+
+    for col in MOTION_COLUMNS:
+        df[col] = np.nan
+    if df.empty:
+        return df
+
+    batch = pd.DataFrame({
+        'key': _vehicle_key(df).to_numpy(),
+        'latitude': df['latitude'].to_numpy(dtype='float64'),
+        'longitude': df['longitude'].to_numpy(dtype='float64'),
+        'timestamp': pd.to_numeric(df['timestamp'], errors='coerce').to_numpy(dtype='float64'),
+        'row': np.arange(len(df)),
+    })
+    batch = batch.dropna(subset=['timestamp'])
+
+    # Drop pings already seen (same or older timestamp than the stored state,
+    # or repeated within the batch) — the feed re-serves unchanged positions
+    last_ts = batch['key'].map(_STATE['timestamp']).to_numpy(dtype='float64', na_value=np.nan)
+    batch = batch[~(batch['timestamp'].to_numpy() <= last_ts)]
+    batch = batch.sort_values(['key', 'timestamp'], kind='stable').drop_duplicates(['key', 'timestamp'])
+    if batch.empty:
+        return df
+
+    # Previous ping: the row before in the batch, or the stored state for the first row per vehicle
+    first = batch['key'].to_numpy() != np.r_[None, batch['key'].to_numpy()[:-1]]
+    state = _STATE.reindex(batch['key'])
+    prev_lat = np.where(first, state['latitude'].to_numpy(), np.r_[np.nan, batch['latitude'].to_numpy()[:-1]])
+    prev_lon = np.where(first, state['longitude'].to_numpy(), np.r_[np.nan, batch['longitude'].to_numpy()[:-1]])
+    prev_ts = np.where(first, state['timestamp'].to_numpy(dtype='float64'), np.r_[np.nan, batch['timestamp'].to_numpy()[:-1]])
+
+    lat, lon, ts = batch['latitude'].to_numpy(), batch['longitude'].to_numpy(), batch['timestamp'].to_numpy()
+    dt = ts - prev_ts
+    valid = (dt > 0) & (dt <= MAX_PING_GAP_SECONDS)
+    dist = geo.haversine_m(prev_lat, prev_lon, lat, lon)
+    stopped = valid & (dist < STOP_RADIUS_M)
+
+    speed = np.where(valid, dist / np.where(valid, dt, 1), np.nan)
+    bearing = np.where(valid & ~stopped, geo.initial_bearing_deg(prev_lat, prev_lon, lat, lon), np.nan)
+
+    # Dwell: each stopped run is anchored at the timestamp of the ping before it
+    # (or carries the stored anchor if the vehicle was already stopped)
+    prev_stopped = np.where(first, ~np.isnan(state['stopped_since'].to_numpy()), np.r_[False, stopped[:-1]])
+    anchor = np.where(stopped & ~prev_stopped, prev_ts, np.nan)
+    anchor = np.where(first & stopped & prev_stopped, state['stopped_since'].to_numpy(), anchor)
+    anchor = pd.Series(anchor).groupby(batch['key'].to_numpy()).ffill().to_numpy()
+    anchor = np.where(stopped, anchor, np.nan)
+    dwell = np.where(valid, np.where(stopped, ts - anchor, 0.0), np.nan)
+
+    rows = batch['row'].to_numpy()
+    df.iloc[rows, df.columns.get_loc('derived_speed')] = speed
+    df.iloc[rows, df.columns.get_loc('derived_bearing')] = bearing
+    df.iloc[rows, df.columns.get_loc('dwell_seconds')] = dwell
+
+    # ---- Advance state: last ping per vehicle, dropping vehicles gone quiet ----
+    last = np.r_[batch['key'].to_numpy()[1:] != batch['key'].to_numpy()[:-1], True]
+    update = pd.DataFrame(
+        {
+            'latitude': lat[last],
+            'longitude': lon[last],
+            'timestamp': ts[last].astype('int64'),
+            'stopped_since': anchor[last],
+        },
+        index=pd.Index(batch['key'].to_numpy()[last], name='key'),
+    )
+    merged = pd.concat([_STATE[~_STATE.index.isin(update.index)], update])
+    _STATE = merged[merged['timestamp'] >= ts.max() - DATA_MAX_AGE]
+    return df
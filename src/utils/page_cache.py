@@ -0,0 +1,230 @@
+"""
+page_cache.py
+-------------
+Page data shared by every dashboard session.
+
+Streamlit reruns a page's script for every session on every interaction and
+every auto-refresh, so with N dashboards open each refresh used to run N
+ingest cycles, N full history reads and N copies of the same aggregations.
+The functions here compute each page's data once per *data version* and
+serve it to all sessions of the process:
+
+- data_version(): changes whenever new positions are published or stored
+  (the in-process fleet snapshot version plus the DuckDB file / WAL stamp,
+  so it also follows a separate ingester process)
+- live_snapshot(), history(), table_page(): the live fleet, the full history
+  and formatted Data Table pages, shared read-only (st.cache_resource, no
+  copy per session)
+- map_frame(), analytics(), density_overlay(), route_hourly(),
+  route_headways(): prepared per-region map frames, the Analytics
+  aggregates, the history density image and the Routes page's reads
+  (st.cache_data, each session gets its own copy)
+- refresh(): at most one ingest cycle per REFRESH_MIN_SECONDS, however many
+  sessions ask for it
+
+Every cached function takes the version as its first argument, so a new
+ingest simply misses and superseded versions age out (PAGE_CACHE_TTL_SECONDS,
+max_entries).  Streamlit holds a lock per cache key while a function runs,
+so sessions that miss together wait for one computation instead of each
+running their own.
+"""
+
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils import data_processor, db, density_tiles, fleet
+
+try:
+    from config import PAGE_CACHE_TTL_SECONDS
+except ImportError:
+    PAGE_CACHE_TTL_SECONDS = 300   # safety net; versions normally change every cycle
+
+try:
+    from config import REFRESH_MIN_SECONDS
+except ImportError:
+    REFRESH_MIN_SECONDS = 15   # auto-refresh reruns every 20 s
+
+
+def data_version():
+    """
+    Cheap token that changes whenever there is new data for the pages.
+
+    Returns:
+        tuple: (published snapshot version, (mtime_ns, size) of the
+            database file and of its WAL, None where missing)
+    """
+    snap = fleet.current()
+    stamps = []
+    for path in (db.DATABASE_NAME, db.DATABASE_NAME + '.wal'):
+        try:
+            stat = os.stat(path)
+            stamps.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            stamps.append(None)
+    return (snap.version if snap is not None else 0, tuple(stamps))
+
+
+# ---------------------------------------------------------------------------
+# Shared sources (read-only, never copied)
+# ---------------------------------------------------------------------------
+
+@st.cache_resource(ttl=PAGE_CACHE_TTL_SECONDS, max_entries=2, show_spinner=False)
+def live_snapshot(version):
+    """fleet.get_snapshot() for *version* (a FleetSnapshot, or None)."""
+    return fleet.get_snapshot()
+
+
+@st.cache_resource(ttl=PAGE_CACHE_TTL_SECONDS, max_entries=2, show_spinner=False)
+def history(version):
+    """
+    Full history for *version*.  Callers must not modify the frame.
+
+    Returns:
+        tuple: (DataFrame or None, sync time string, data_processor.RegionIndex or None)
+    """
+    df, _, sync_time = db.get_historical_data()
+    if df is None or df.empty:
+        return None, sync_time, None
+    return df, sync_time, data_processor.RegionIndex(df)
+
+
+# ---------------------------------------------------------------------------
+# Prepared page data
+# ---------------------------------------------------------------------------
+
+@st.cache_data(ttl=PAGE_CACHE_TTL_SECONDS, max_entries=64, show_spinner=False)
+def map_frame(version, region):
+    """data_processor.prepare_map_data for one region of the live snapshot."""
+    snapshot = live_snapshot(version)
+    if snapshot is None:
+        return pd.DataFrame()
+    return data_processor.prepare_map_data(snapshot.frame(region), region)
+
+
+@st.cache_data(ttl=PAGE_CACHE_TTL_SECONDS, max_entries=64, show_spinner=False)
+def density_overlay(version, region):
+    """
+    density_tiles.render_area over the extent of a region's live vehicles:
+    (PNG bytes, [west, south, east, north], zoom), or None.
+    """
+    df_map = map_frame(version, region)
+    if df_map.empty:
+        return None
+    return density_tiles.render_area(df_map['latitude'].min(), df_map['longitude'].min(),
+                                     df_map['latitude'].max(), df_map['longitude'].max())
+
+
+@st.cache_data(ttl=PAGE_CACHE_TTL_SECONDS, max_entries=4, show_spinner=False)
+def analytics(version):
+    """
+    Analytics page aggregates over the full history (speeds in km/h).
+
+    Returns:
+        dict with region_counts (Region, Count), avg_speed_per_vehicle
+        (vehicle_id, avg_speed), vehicle_avg_speeds (vehicle_id, region,
+        avg_speed), total_vehicles and moving_speed (max / min / avg /
+        median over moving pings, None without any) - or None without history
+    """
+    df, _, _ = history(version)
+    if df is None:
+        return None
+    df = pd.DataFrame({
+        'region': df['region'],
+        'vehicle_id': df['vehicle_id'],
+        'speed': data_processor.speed_kmh(df),
+    })
+
+    region_counts = df.groupby('region')['vehicle_id'].nunique().reset_index()
+    region_counts.columns = ['Region', 'Count']
+    avg_speed_per_vehicle = df.groupby('vehicle_id')['speed'].mean().reset_index()
+    avg_speed_per_vehicle.columns = ['vehicle_id', 'avg_speed']
+    vehicle_avg_speeds = df.groupby(['vehicle_id', 'region'])['speed'].mean().reset_index()
+    vehicle_avg_speeds.columns = ['vehicle_id', 'region', 'avg_speed']
+
+    moving = df['speed'].to_numpy()
+    moving = moving[moving > 0]
+    moving_speed = None
+    if len(moving):
+        moving_speed = {
+            'max': float(moving.max()),
+            'min': float(moving.min()),
+            'avg': float(moving.mean()),
+            'median': float(np.median(moving)),
+        }
+    return {
+        'region_counts': region_counts.sort_values('Count', ascending=True),
+        'avg_speed_per_vehicle': avg_speed_per_vehicle,
+        'vehicle_avg_speeds': vehicle_avg_speeds,
+        'total_vehicles': int(df['vehicle_id'].nunique()),
+        'moving_speed': moving_speed,
+    }
+
+
+@st.cache_data(ttl=PAGE_CACHE_TTL_SECONDS, max_entries=64, show_spinner=False)
+def route_hourly(version, region):
+    """db.get_route_hourly for *region* (empty DataFrame without route stats)."""
+    return db.get_route_hourly(region)
+
+
+@st.cache_data(ttl=PAGE_CACHE_TTL_SECONDS, max_entries=64, show_spinner=False)
+def route_headways(version, region):
+    """db.get_route_headways for *region* (empty DataFrame without trips)."""
+    return db.get_route_headways(region)
+
+
+@st.cache_data(ttl=PAGE_CACHE_TTL_SECONDS, max_entries=4, show_spinner=False)
+def history_regions(version):
+    """Regions present in the history, Rapid Bus KL first."""
+    df, _, index = history(version)
+    if df is None:
+        return []
+    return data_processor.get_sorted_regions(pd.DataFrame({'region': index.regions}))
+
+
+@st.cache_resource(ttl=PAGE_CACHE_TTL_SECONDS, max_entries=16, show_spinner=False)
+def table_page(version, regions):
+    """
+    Formatted Data Table rows for a tuple of *regions*, with the CSV
+    download.  Shared read-only: callers must not modify the frame.
+
+    Returns:
+        tuple: (display DataFrame, CSV bytes)
+    """
+    df, _, index = history(version)
+    if df is None:
+        return pd.DataFrame(), b''
+    display_df = data_processor.format_display_dataframe(data_processor.select_regions(df, list(regions), index))
+    return display_df, display_df.to_csv(index=False).encode('utf-8')
+
+
+# ---------------------------------------------------------------------------
+# Refresh
+# ---------------------------------------------------------------------------
+
+_refresh_lock = threading.Lock()
+_last_refresh = 0.0
+
+
+def refresh(min_interval=REFRESH_MIN_SECONDS):
+    """
+    Run an ingest cycle for the pages, unless one finished less than
+    *min_interval* seconds ago.  Sessions arriving while a cycle runs wait
+    for it and then reuse its result instead of starting another.
+
+    Returns:
+        bool: Whether this call ran the cycle
+    """
+    global _last_refresh
+    with _refresh_lock:
+        if time.time() - _last_refresh < min_interval:
+            return False
+        # Imported here so merely loading a page stays cheap
+        from utils.ingestion import fetch_and_store_transit_data
+        fetch_and_store_transit_data()
+        _last_refresh = time.time()
+        return True
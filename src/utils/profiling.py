@@ -0,0 +1,290 @@
+"""
+profiling.py
+------------
+Opt-in profiling for the query functions in utils/db.py.
+
+Enable with ``DB_PROFILING = True`` in config.py or ``TRANSIT_DB_PROFILING=1``
+in the environment.  Every call to a function decorated with :func:`profiled`
+then records:
+
+  - the SQL text and parameters of each query it ran
+  - rows returned and wall time, split into SQL (DuckDB execute + fetch) and
+    pandas post-processing (everything else)
+  - peak Python memory during the call (tracemalloc).  Tracing is process
+    wide, so concurrent calls share one trace: it starts with the first
+    active call, stops with the last, and its peak is only reset when no
+    other call is running.  Calls that overlapped another are marked
+    ``peak_memory_shared`` and their peak is an upper bound.
+  - for calls slower than ``DB_SLOW_QUERY_MS``: DuckDB ``EXPLAIN ANALYZE``
+    output for each query.  This re-runs the queries, so it happens on a
+    background thread, at most one pending per function; the record is
+    published once it is attached.
+
+Records are appended as JSON lines to a size-rotated log file and kept in a
+small in-memory ring buffer for the Pipeline Health page.  With profiling off
+the decorator is a single flag check.
+"""
+
+import contextvars
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from config import DB_PROFILING, DB_PROFILE_LOG, DB_SLOW_QUERY_MS
+except ImportError:
+    DB_PROFILING = False
+    DB_PROFILE_LOG = 'db_profile.log'
+    DB_SLOW_QUERY_MS = 500
+
+PROFILE_LOG_MAX_BYTES = 5 * 1024 * 1024
+PROFILE_LOG_BACKUPS = 3
+RECENT_PROFILES = 200
+
+_enabled = DB_PROFILING or os.environ.get('TRANSIT_DB_PROFILING', '') not in ('', '0')
+_current = contextvars.ContextVar('db_profile_queries', default=None)
+_recent = deque(maxlen=RECENT_PROFILES)
+_logger = None
+
+# Shared tracemalloc session: active profiled calls, calls ever started, and
+# whether this module started the tracing (so it never stops someone else's)
+_trace_lock = threading.Lock()
+_tracers = 0
+_trace_entries = 0
+_trace_owned = False
+
+# Slow-call EXPLAIN ANALYZE runs here, off the request path
+_explain_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-explain')
+_explain_pending = set()
+_explain_lock = threading.Lock()
+
+
+def is_enabled():
+    return _enabled
+
+
+def set_enabled(enabled):
+    """Turn profiling on or off at runtime."""
+    global _enabled
+    _enabled = bool(enabled)
+
+
+def recent_profiles():
+    """Most recent profile records (newest last)."""
+    return list(_recent)
+
+
+def _get_logger():
+    global _logger
+    if _logger is None:
+        _logger = logging.getLogger('transit.db_profile')
+        _logger.setLevel(logging.INFO)
+        _logger.propagate = False
+        handler = logging.handlers.RotatingFileHandler(
+            DB_PROFILE_LOG, maxBytes=PROFILE_LOG_MAX_BYTES, backupCount=PROFILE_LOG_BACKUPS
+        )
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        _logger.addHandler(handler)
+    return _logger
+
+
+# ---------------------------------------------------------------------------
+# Connection wrapper
+# ---------------------------------------------------------------------------
+
+class _ProfiledResult:
+    """Times fetches on a DuckDB result and counts the rows they return."""
+
+    def __init__(self, result, query):
+        self._result = result
+        self._query = query
+
+    def _timed(self, method, *args, **kwargs):
+        start = time.perf_counter()
+        value = getattr(self._result, method)(*args, **kwargs)
+        self._query['sql_ms'] += (time.perf_counter() - start) * 1000
+        if value is None:
+            rows = 0
+        elif method == 'fetchone':
+            rows = 1
+        elif hasattr(value, 'num_rows'):
+            rows = value.num_rows
+        else:
+            rows = len(value)
+        self._query['rows'] += rows
+        return value
+
+    def df(self, *args, **kwargs):
+        return self._timed('df', *args, **kwargs)
+
+    def fetchone(self):
+        return self._timed('fetchone')
+
+    def fetchall(self):
+        return self._timed('fetchall')
+
+    def fetch_arrow_table(self, *args, **kwargs):
+        return self._timed('fetch_arrow_table', *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._result, name)
+
+
+class _ProfiledConnection:
+    """Records every execute() on the wrapped connection into the active profile."""
+
+    def __init__(self, con, queries):
+        self._con = con
+        self._queries = queries
+
+    def execute(self, sql, parameters=None):
+        query = {'sql': ' '.join(sql.split()), 'params': parameters, 'sql_ms': 0.0, 'rows': 0}
+        start = time.perf_counter()
+        result = self._con.execute(sql, parameters) if parameters is not None else self._con.execute(sql)
+        query['sql_ms'] += (time.perf_counter() - start) * 1000
+        self._queries.append(query)
+        return _ProfiledResult(result, query)
+
+    def __getattr__(self, name):
+        return getattr(self._con, name)
+
+
+def wrap_connection(con):
+    """Return *con* wrapped for profiling if a profiled call is active, else *con*."""
+    queries = _current.get()
+    return con if queries is None else _ProfiledConnection(con, queries)
+
+
+# ---------------------------------------------------------------------------
+# Decorator
+# ---------------------------------------------------------------------------
+
+def _explain_analyze(connect, queries):
+    """Attach EXPLAIN ANALYZE output to each SELECT in *queries*."""
+    con = connect()
+    try:
+        for query in queries:
+            if not query['sql'].lstrip().upper().startswith(('SELECT', 'WITH')):
+                continue
+            try:
+                sql = f"EXPLAIN ANALYZE {query['sql']}"
+                rows = con.execute(sql, query['params']).fetchall() if query['params'] else con.execute(sql).fetchall()
+                query['explain_analyze'] = '\n'.join(str(r[-1]) for r in rows)
+            except Exception as e:
+                query['explain_analyze'] = f'unavailable: {e}'
+    finally:
+        con.close()
+
+
+def _rows_returned(result):
+    frame = result[0] if isinstance(result, tuple) and result else result
+    return len(frame) if hasattr(frame, '__len__') and not isinstance(frame, (str, bytes)) else None
+
+
+def _start_trace():
+    """Join the shared tracemalloc session; returns a token for _stop_trace."""
+    global _tracers, _trace_entries, _trace_owned
+    with _trace_lock:
+        shared = _tracers > 0
+        if not shared:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _trace_owned = True
+            tracemalloc.reset_peak()
+        _tracers += 1
+        _trace_entries += 1
+        return _trace_entries, shared
+
+
+def _stop_trace(token):
+    """Leave the shared session; returns (peak bytes, whether another call overlapped)."""
+    global _tracers, _trace_owned
+    entry, shared = token
+    with _trace_lock:
+        peak = tracemalloc.get_traced_memory()[1]
+        shared = shared or _tracers > 1 or _trace_entries != entry
+        _tracers -= 1
+        if _tracers == 0 and _trace_owned:
+            tracemalloc.stop()
+            _trace_owned = False
+        return peak, shared
+
+
+def _publish(record):
+    for q in record['queries']:
+        q['sql_ms'] = round(q['sql_ms'], 2)
+        q['params'] = [str(p) for p in q['params']] if q['params'] else None
+    _recent.append(record)
+    try:
+        _get_logger().info(json.dumps(record, default=str))
+    except OSError as e:
+        print(f"Profile log error: {e}")
+
+
+def _explain_and_publish(connect, record):
+    try:
+        _explain_analyze(connect, record['queries'])
+    finally:
+        with _explain_lock:
+            _explain_pending.discard(record['function'])
+        _publish(record)
+
+
+def profiled(connect):
+    """
+    Decorator factory for db functions.  *connect* opens a plain connection
+    (used for EXPLAIN ANALYZE on slow calls).  Nested profiled calls are
+    folded into the outermost one.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled or _current.get() is not None:
+                return func(*args, **kwargs)
+
+            queries = []
+            token = _current.set(queries)
+            trace = _start_trace()
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                wall_ms = (time.perf_counter() - start) * 1000
+                peak, shared = _stop_trace(trace)
+                _current.reset(token)
+
+            sql_ms = sum(q['sql_ms'] for q in queries)
+            record = {
+                'ts': time.time(),
+                'function': func.__name__,
+                'wall_ms': round(wall_ms, 2),
+                'sql_ms': round(sql_ms, 2),
+                'pandas_ms': round(max(wall_ms - sql_ms, 0.0), 2),
+                'rows_returned': _rows_returned(result),
+                'peak_memory_bytes': peak,
+                'peak_memory_shared': shared,
+                'slow': wall_ms >= DB_SLOW_QUERY_MS,
+                'queries': queries,
+            }
+            if record['slow']:
+                with _explain_lock:
+                    queue = func.__name__ not in _explain_pending
+                    if queue:
+                        _explain_pending.add(func.__name__)
+                if queue:
+                    _explain_executor.submit(_explain_and_publish, connect, record)
+                    return result
+                # One EXPLAIN per function at a time is enough to see its plan
+                for q in queries:
+                    q['explain_analyze'] = 'skipped: another call to this function is being explained'
+            _publish(record)
+            return result
+        return wrapper
+    return decorator
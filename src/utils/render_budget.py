@@ -0,0 +1,185 @@
+"""
+render_budget.py
+----------------
+Render budget for the Live Map.
+
+Everything the map sends to the browser grows with the number of vehicles
+drawn: tooltip values, heading arrow geometry, the deck's JSON and the
+client's own layer building.  In a region with thousands of vehicles a
+rerun could outlast the 20 s auto-refresh, and reruns queued up behind each
+other.  The page now draws a budgeted subset and degrades instead:
+
+- select_points(): at most *max_points* vehicles, moving and recently
+  updated ones first; below MAP_FULL_DETAIL_ZOOM only one vehicle per
+  MAP_THIN_CELL_PX screen cell (closer ones overlap at that zoom anyway)
+- fit_zoom(): the zoom a region's map opens at, fitted to its vehicles'
+  extent.  The browser doesn't report zoom changes back, so this is also
+  the zoom the thinning uses until the view is reset (e.g. by Locate Me)
+- RenderTimer: per-stage render times for the page's caption and the
+  Prometheus endpoint (transit_render_stage_seconds_total and friends)
+- next_cap(): shrinks a session's point cap after the point-dependent
+  stages of a render overran MAP_RENDER_BUDGET_MS, and lets it grow back
+  while they are cheap
+"""
+
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from utils import geo, metrics
+
+try:
+    from config import MAP_MAX_POINTS
+except ImportError:
+    MAP_MAX_POINTS = 3000
+
+try:
+    from config import MAP_MIN_POINTS
+except ImportError:
+    MAP_MIN_POINTS = 250
+
+try:
+    from config import MAP_RENDER_BUDGET_MS
+except ImportError:
+    MAP_RENDER_BUDGET_MS = 2000   # well inside the 20 s auto-refresh
+
+try:
+    from config import MAP_RECENT_SECONDS
+except ImportError:
+    MAP_RECENT_SECONDS = 120
+
+try:
+    from config import MAP_FULL_DETAIL_ZOOM, MAP_THIN_CELL_PX
+except ImportError:
+    MAP_FULL_DETAIL_ZOOM = 12
+    MAP_THIN_CELL_PX = 6
+
+try:
+    from config import MAP_VIEWPORT_PX
+except ImportError:
+    MAP_VIEWPORT_PX = 500   # st.pydeck_chart's default height
+
+# Cap growth per cheap render, and how far under budget counts as cheap
+CAP_GROWTH = 1.5
+CHEAP_FRACTION = 0.5
+
+
+def priority_order(df):
+    """
+    Row positions of *df* from most to least worth drawing: moving vehicles
+    (speed > 0) first, then those updated within MAP_RECENT_SECONDS of the
+    newest position, newest first within each group.
+    """
+    speed = pd.to_numeric(df['speed'], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    ts = pd.to_numeric(df['timestamp'], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    ts = np.nan_to_num(ts, nan=-np.inf)
+    # Recency is relative to the feed, not the wall clock, so playback and
+    # a lagging feed rank the same way
+    recent = ts >= ts.max() - MAP_RECENT_SECONDS
+    tier = (speed > 0).astype('int8') * 2 + recent
+    return np.lexsort((-ts, -tier))
+
+
+def fit_zoom(lat, lon, max_zoom, viewport_px=None):
+    """
+    Most detailed whole zoom, at most *max_zoom*, at which the points' extent
+    fits in *viewport_px* (default MAP_VIEWPORT_PX) screen pixels.  The
+    extent is taken between the 1st and 99th percentiles so one stray GPS
+    fix doesn't zoom the map out to the whole country.
+    """
+    viewport_px = MAP_VIEWPORT_PX if viewport_px is None else viewport_px
+    lat, lon = np.asarray(lat, dtype='float64'), np.asarray(lon, dtype='float64')
+    ok = ~(np.isnan(lat) | np.isnan(lon))
+    if not ok.any():
+        return max_zoom
+    x, y = geo.to_web_mercator(lat[ok], lon[ok])
+    extent = max(np.subtract(*np.percentile(x, [99, 1])), np.subtract(*np.percentile(y, [99, 1])))
+    if extent <= 0:
+        return max_zoom
+    # Width of the world at zoom z is 256 * 2**z pixels
+    return int(min(max_zoom, max(0, np.floor(np.log2(viewport_px / (256 * extent))))))
+
+
+def select_points(df, max_points, zoom=None):
+    """
+    Budgeted subset of a prepared map frame.
+
+    Args:
+        df: Frame from data_processor.prepare_map_data
+        max_points: Most vehicles to keep
+        zoom: View zoom; below MAP_FULL_DETAIL_ZOOM vehicles sharing a
+            MAP_THIN_CELL_PX screen cell are thinned to the highest-priority one
+
+    Returns:
+        DataFrame: The kept rows in their original order (*df* itself when
+            nothing is dropped)
+    """
+    if len(df) == 0 or (len(df) <= max_points and (zoom is None or zoom >= MAP_FULL_DETAIL_ZOOM)):
+        return df
+
+    order = priority_order(df)
+    if zoom is not None and zoom < MAP_FULL_DETAIL_ZOOM:
+        x, y = geo.to_web_mercator(df['latitude'].to_numpy()[order], df['longitude'].to_numpy()[order])
+        cells_per_side = 256 * 2 ** zoom / MAP_THIN_CELL_PX
+        cell = np.floor(x * cells_per_side).astype('int64') * (int(cells_per_side) + 1) \
+            + np.floor(y * cells_per_side).astype('int64')
+        # First occurrence in priority order = best vehicle of each cell
+        _, first = np.unique(cell, return_index=True)
+        order = order[np.sort(first)]
+
+    keep = np.sort(order[:max_points])
+    if len(keep) == len(df):
+        return df
+    return df.take(keep)
+
+
+def next_cap(cap, render_ms, budget_ms=None):
+    """
+    Point cap for a session's next render.
+
+    Shrinks in proportion when *render_ms* overran the budget (with some
+    headroom, never below MAP_MIN_POINTS), grows by CAP_GROWTH while renders
+    take under CHEAP_FRACTION of it, and never exceeds MAP_MAX_POINTS.
+    """
+    budget_ms = MAP_RENDER_BUDGET_MS if budget_ms is None else budget_ms
+    if render_ms > budget_ms:
+        cap = int(cap * budget_ms / render_ms * 0.8)
+    elif render_ms < budget_ms * CHEAP_FRACTION:
+        cap = int(cap * CAP_GROWTH)
+    return max(MAP_MIN_POINTS, min(MAP_MAX_POINTS, cap))
+
+
+class RenderTimer:
+    """Wall time per stage of one page render."""
+
+    def __init__(self, page):
+        self.page = page
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block and add it to *name* (repeated stages accumulate)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+    @property
+    def total_ms(self):
+        return sum(self.stages.values())
+
+    def finish(self):
+        """
+        Fold the stage times into the Prometheus registry.
+
+        Returns:
+            str: Stage times for a caption, e.g. "prepare 3 ms · layers 41 ms"
+        """
+        for name, ms in self.stages.items():
+            metrics.inc('transit_render_stage_seconds_total', ms / 1000, page=self.page, stage=name)
+            metrics.inc('transit_render_stage_runs_total', page=self.page, stage=name)
+            metrics.set_gauge('transit_render_last_stage_seconds', ms / 1000, page=self.page, stage=name)
+        return ' · '.join(f"{name} {ms:,.0f} ms" for name, ms in self.stages.items())
@@ -0,0 +1,124 @@
+"""
+route_stats.py
+--------------
+Incremental route-level aggregates for the Routes page.
+
+``route_hourly`` holds one row per (region, route_id, hour) with ping counts
+and summed speed of moving pings.  The writer folds in the rows each flush
+actually inserted (duplicates already dropped), in the same transaction, so
+average speed by route and hour of day is a scan of this small table rather
+than of the positions history.  The table is backfilled from the positions
+table when it is first created.
+
+Route names come from the cached GTFS Static route table
+(``gtfs_static.get_route_table``); headways from the trips table
+(utils/trips.py).
+"""
+
+import pandas as pd
+
+from utils import gtfs_static, schema
+
+try:
+    from config import DATABASE_TABLE
+except ImportError:
+    DATABASE_TABLE = 'live_buses'
+
+try:
+    from config import ROUTE_STATS_ENABLED, ROUTE_STATS_TABLE
+except ImportError:
+    ROUTE_STATS_ENABLED = True
+    ROUTE_STATS_TABLE = 'route_hourly'
+
+BUCKET_SECONDS = 3600
+
+# Same cap as data_processor.MAX_SPEED_KMH, in m/s
+MAX_SPEED_MPS = 120 / 3.6
+
+
+def _speed_expression(available):
+    """SQL for the display speed in m/s: reported speed, or derived speed where
+    the feed reports 0 / nothing (as data_processor.speed_kmh does)."""
+    speed = "TRY_CAST(speed AS DOUBLE)" if 'speed' in available else "CAST(NULL AS DOUBLE)"
+    if 'derived_speed' in available:
+        speed = (f"CASE WHEN COALESCE({speed}, 0) = 0 AND derived_speed IS NOT NULL "
+                 f"THEN TRY_CAST(derived_speed AS DOUBLE) ELSE {speed} END")
+    return f"LEAST(COALESCE({speed}, 0), {MAX_SPEED_MPS})"
+
+
+def upsert(con, source):
+    """
+    Add the positions in *source* (a table of newly inserted rows) to the
+    hourly route aggregates.  Runs in the caller's transaction.
+    """
+    available = schema.columns(con, source)
+    if 'route_id' not in available:
+        return
+    con.execute(f"""
+        INSERT INTO {ROUTE_STATS_TABLE} (region, route_id, hour_ts, pings, moving_pings, speed_sum_mps)
+        SELECT region, route_id, (ts // {BUCKET_SECONDS}) * {BUCKET_SECONDS} AS hour_ts,
+               count(*), count(*) FILTER (WHERE mps > 0), COALESCE(sum(mps) FILTER (WHERE mps > 0), 0)
+        FROM (
+            SELECT region, route_id, TRY_CAST(timestamp AS BIGINT) AS ts, {_speed_expression(available)} AS mps
+            FROM {source}
+            WHERE route_id IS NOT NULL AND route_id <> ''
+        )
+        WHERE ts IS NOT NULL
+        GROUP BY ALL
+        ON CONFLICT (region, route_id, hour_ts) DO UPDATE SET
+            pings = {ROUTE_STATS_TABLE}.pings + excluded.pings,
+            moving_pings = {ROUTE_STATS_TABLE}.moving_pings + excluded.moving_pings,
+            speed_sum_mps = {ROUTE_STATS_TABLE}.speed_sum_mps + excluded.speed_sum_mps
+    """)
+
+
+def ensure_table(con, source=DATABASE_TABLE):
+    """
+    Create the route aggregate table if it is missing, backfilling it from
+    *source* (the positions table) when that already holds history.
+    """
+    if schema.table_exists(con, ROUTE_STATS_TABLE):
+        return
+    con.execute(f"""
+        CREATE TABLE {ROUTE_STATS_TABLE} (
+            region VARCHAR,
+            route_id VARCHAR,
+            hour_ts BIGINT,
+            pings BIGINT,
+            moving_pings BIGINT,
+            speed_sum_mps DOUBLE,
+            PRIMARY KEY (region, route_id, hour_ts)
+        )
+    """)
+    if schema.table_exists(con, source):
+        print(f"Backfilling {ROUTE_STATS_TABLE} from {source}...")
+        upsert(con, source)
+
+
+def route_dimension(regions):
+    """
+    Route names for *regions*: DataFrame with region, route_id,
+    route_short_name, route_long_name, route_name.  Regions whose GTFS Static
+    feed is unavailable are left out.
+    """
+    frames = []
+    for region in regions:
+        slug = gtfs_static.STATIC_API_SOURCES.get(region)
+        routes = gtfs_static.get_route_table(slug) if slug else None
+        if routes is not None and len(routes):
+            frames.append(routes.reset_index().assign(region=region))
+    if not frames:
+        return pd.DataFrame(columns=['region', 'route_id', 'route_short_name', 'route_long_name', 'route_name'])
+    return pd.concat(frames, ignore_index=True)
+
+
+def with_route_names(df, regions=None):
+    """*df* (with region and route_id) plus a route_name column; falls back to
+    the route_id where GTFS Static has no name."""
+    if df.empty:
+        return df.assign(route_name=pd.Series(dtype=object))
+    regions = df['region'].unique().tolist() if regions is None else regions
+    names = route_dimension(regions)[['region', 'route_id', 'route_name']]
+    out = df.merge(names, on=['region', 'route_id'], how='left')
+    out['route_name'] = out['route_name'].where(out['route_name'].fillna('') != '', out['route_id'])
+    return out
@@ -0,0 +1,360 @@
+"""
+schedule.py
+-----------
+Schedule adherence and arrival prediction from GTFS Static stop_times.txt.
+
+stop_times.txt is by far the largest GTFS file, so each agency's table is
+loaded once per ZIP version into compact NumPy arrays sorted by
+(trip, stop_sequence) with a per-trip offsets array (CSR layout):
+
+    trip k's stops live in rows offsets[k] : offsets[k + 1]
+
+Every stop is also projected onto its trip's shape (via map_matching) so a
+vehicle's ``shape_dist_m`` can be interpolated directly into a scheduled time.
+Vehicles without a shape position fall back to their nearest stop on the trip.
+
+Each ingest batch updates an in-memory per-vehicle state (trip, next stop,
+delay) from which arrival predictions are answered without touching the ZIP.
+The state is a frame updated in one pass per batch; vehicles quiet for
+DATA_MAX_AGE are pruned, and state built against an older stop_times table
+is discarded when the ZIP is reloaded.
+"""
+
+import numpy as np
+import pandas as pd
+
+from utils import geo, gtfs_static, map_matching
+
+try:
+    from config import UTC_OFFSET_HOURS
+except ImportError:
+    UTC_OFFSET_HOURS = 8
+
+try:
+    from config import DATA_MAX_AGE
+except ImportError:
+    DATA_MAX_AGE = 3600
+
+SECONDS_PER_DAY = 86400
+# Larger offsets are almost certainly a wrong trip assignment, not a delay
+MAX_ABS_DELAY_SECONDS = 3 * 3600
+
+SCHEDULE_COLUMNS = ['schedule_delay_s']
+
+
+def _gtfs_time_to_seconds(values):
+    """Vectorised 'HH:MM:SS' -> seconds after midnight (hours may exceed 24)."""
+    parts = pd.Series(values).str.split(':', expand=True)
+    if parts.shape[1] < 3:
+        return np.full(len(values), -1, dtype='int32')
+    h, m, s = (pd.to_numeric(parts[i], errors='coerce') for i in range(3))
+    return (h * 3600 + m * 60 + s).fillna(-1).to_numpy(dtype='int32')
+
+
+class StopTimeTable:
+    """Array-backed stop_times / stops for a single agency."""
+
+    def __init__(self, stop_times, stops, shape_index=None, version=0.0):
+        # GTFS Static cache version the table was built from
+        self.version = float(version)
+
+        # ---- stops.txt ----
+        stops = stops.drop_duplicates('stop_id')
+        self.stop_ids = pd.Index(stops['stop_id'].to_numpy())
+        self.stop_lat = pd.to_numeric(stops['stop_lat'], errors='coerce').to_numpy(dtype='float32')
+        self.stop_lon = pd.to_numeric(stops['stop_lon'], errors='coerce').to_numpy(dtype='float32')
+        self.stop_name = stops['stop_name'].to_numpy(dtype=object) if 'stop_name' in stops.columns \
+            else np.full(len(stops), '', dtype=object)
+
+        # ---- stop_times.txt, sorted by trip then sequence ----
+        trip_codes, self.trip_ids = pd.factorize(stop_times['trip_id'], sort=True)
+        seq = pd.to_numeric(stop_times['stop_sequence'], errors='coerce').fillna(0).to_numpy(dtype='int32')
+        order = np.lexsort((seq, trip_codes))
+
+        self.trip_of_row = trip_codes[order].astype('int32')
+        self.stop_idx = self.stop_ids.get_indexer(stop_times['stop_id'].to_numpy()[order]).astype('int32')
+        arrival = _gtfs_time_to_seconds(stop_times['arrival_time'].to_numpy()[order])
+        departure = _gtfs_time_to_seconds(stop_times['departure_time'].to_numpy()[order])
+        # Timepoint-less rows: GTFS allows blank times between timepoints
+        self.arrival_s = np.where(arrival >= 0, arrival, departure).astype('int32')
+        self.departure_s = np.where(departure >= 0, departure, self.arrival_s).astype('int32')
+
+        counts = np.bincount(self.trip_of_row, minlength=len(self.trip_ids))
+        self.offsets = np.r_[0, np.cumsum(counts)].astype('int64')
+        self.trip_index = pd.Series(np.arange(len(self.trip_ids), dtype='int32'), index=self.trip_ids)
+
+        self._project_stops(shape_index)
+
+    def _project_stops(self, shape_index):
+        """
+        Distance of every stop_times row along its trip's shape (NaN if the
+        trip has no shape).  Each distinct (shape, stop) pair is projected
+        once, then trips whose distances aren't monotonic (loops matched onto
+        the wrong branch) are excluded from interpolation.
+        """
+        n = len(self.trip_of_row)
+        self.dist_m = np.full(n, np.nan, dtype='float32')
+        self.trip_monotonic = np.zeros(len(self.trip_ids), dtype=bool)
+        self._dist_span = 1.0
+        self._dist_keys = self.trip_of_row.astype('float64')
+        if shape_index is None or n == 0:
+            return
+
+        trip_shape = pd.Series(self.trip_ids).map(shape_index.trip_shape).to_numpy(dtype='float64', na_value=np.nan)
+        row_shape = trip_shape[self.trip_of_row]
+        ok = ~np.isnan(row_shape) & (self.stop_idx >= 0)
+        pairs = pd.DataFrame({'shape': row_shape[ok].astype('int64'), 'stop': self.stop_idx[ok]})
+        unique_pairs = pairs.drop_duplicates()
+        matched = shape_index.match_shapes(
+            unique_pairs['shape'].to_numpy(dtype='float64'),
+            self.stop_lat[unique_pairs['stop'].to_numpy()].astype('float64'),
+            self.stop_lon[unique_pairs['stop'].to_numpy()].astype('float64'),
+        )
+        unique_pairs = unique_pairs.assign(dist=matched['shape_dist_m'].to_numpy())
+        dist = pairs.merge(unique_pairs, on=['shape', 'stop'], how='left')['dist'].to_numpy()
+        self.dist_m[ok] = dist
+
+        # A trip is usable for interpolation if every stop matched and distances never decrease
+        step_ok = np.r_[True, (np.diff(self.dist_m) >= 0) | (self.trip_of_row[1:] != self.trip_of_row[:-1])]
+        row_ok = step_ok & ~np.isnan(self.dist_m)
+        bad = np.bincount(self.trip_of_row[~row_ok], minlength=len(self.trip_ids))
+        self.trip_monotonic = bad == 0
+
+        # Globally sorted (trip, distance) keys so locate() can binary-search
+        # every vehicle at once; the running max keeps non-monotonic trips
+        # from breaking the ordering for their neighbours
+        running = pd.Series(np.nan_to_num(self.dist_m).astype('float64')).groupby(self.trip_of_row).cummax()
+        self._dist_span = float(running.max()) + 1.0 if len(running) else 1.0
+        self._dist_keys = self.trip_of_row.astype('float64') * self._dist_span + running.to_numpy()
+
+    def locate(self, trip_ids, lat, lon, shape_dist):
+        """
+        Scheduled time (seconds after service-day midnight) at each vehicle's
+        current position and the stop_times row of the next stop.
+
+        Returns:
+            (scheduled_s, next_row) — float array (NaN if unknown) and int
+            array (-1 if unknown)
+        """
+        n = len(trip_ids)
+        scheduled = np.full(n, np.nan)
+        next_row = np.full(n, -1, dtype='int64')
+
+        trip = pd.Series(trip_ids).map(self.trip_index).to_numpy(dtype='float64', na_value=np.nan)
+        known = ~np.isnan(trip)
+        trip_k = np.where(known, trip, 0).astype('int64')
+        start, end = self.offsets[trip_k], self.offsets[trip_k + 1]
+        known &= (end - start) >= 2
+
+        # ---- Interpolate along the shape where possible ----
+        along = known & ~np.isnan(shape_dist) & self.trip_monotonic[trip_k]
+        if along.any():
+            rows = np.flatnonzero(along)
+            s, e, d = start[rows], end[rows], shape_dist[rows]
+            j = np.searchsorted(self._dist_keys, trip_k[rows] * self._dist_span + d, side='right')
+            j = np.clip(j, s + 1, e - 1)
+            d0, d1 = self.dist_m[j - 1].astype('float64'), self.dist_m[j].astype('float64')
+            t0, t1 = self.departure_s[j - 1].astype('float64'), self.arrival_s[j].astype('float64')
+            frac = np.clip(np.where(d1 > d0, (d - d0) / np.where(d1 > d0, d1 - d0, 1), 0.0), 0.0, 1.0)
+            scheduled[rows] = t0 + frac * (t1 - t0)
+            next_row[rows] = np.where(d >= d1, j + 1, j)
+
+        # ---- Fallback: nearest stop on the trip ----
+        nearest = known & ~along
+        if nearest.any():
+            rows = np.flatnonzero(nearest)
+            counts = (end - start)[rows]
+            cand_vehicle = np.repeat(np.arange(len(rows)), counts)
+            cand_row = np.repeat(start[rows], counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+            stop = self.stop_idx[cand_row]
+            dist = geo.haversine_m(
+                np.asarray(lat)[rows][cand_vehicle], np.asarray(lon)[rows][cand_vehicle],
+                self.stop_lat[stop], self.stop_lon[stop],
+            )
+            dist = np.where(stop >= 0, dist, np.inf)
+            order = np.lexsort((dist, cand_vehicle))
+            first = order[np.r_[True, cand_vehicle[order][1:] != cand_vehicle[order][:-1]]]
+            best = cand_row[first]
+            scheduled[rows[cand_vehicle[first]]] = self.arrival_s[best]
+            next_row[rows[cand_vehicle[first]]] = best + 1
+
+        next_row = np.where((next_row >= 0) & (next_row < end) & known, next_row, -1)
+        return scheduled, next_row
+
+
+def _build_stop_time_table(agency_slug):
+    stop_times = gtfs_static.load_table(
+        agency_slug, 'stop_times.txt',
+        ['trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence'],
+    )
+    stops = gtfs_static.load_table(agency_slug, 'stops.txt', ['stop_id', 'stop_name', 'stop_lat', 'stop_lon'])
+    if stop_times.empty or stops.empty:
+        return None
+    return StopTimeTable(stop_times, stops, map_matching.get_shape_index(agency_slug),
+                         version=gtfs_static.cache_version(agency_slug))
+
+
+def get_stop_time_table(agency_slug):
+    """Return the StopTimeTable for *agency_slug*, or None if unavailable."""
+    return gtfs_static.get_cached_index(agency_slug, 'stop_times', _build_stop_time_table)
+
+
+# ---------------------------------------------------------------------------
+# Per-vehicle adherence state, updated every ingest batch
+# ---------------------------------------------------------------------------
+
+# (region, vehicle_id) key -> the vehicle's current trip, next stop and delay.
+# table_version is the StopTimeTable version next_row indexes into; rows of
+# an older table point at the wrong stops once the GTFS ZIP is reloaded.
+_STATE = pd.DataFrame(
+    {
+        'agency_slug': pd.Series(dtype=object),
+        'trip_id': pd.Series(dtype=object),
+        'next_row': pd.Series(dtype='int64'),
+        'delay_s': pd.Series(dtype='float64'),
+        'scheduled_s': pd.Series(dtype='float64'),
+        'timestamp': pd.Series(dtype='int64'),
+        'table_version': pd.Series(dtype='float64'),
+    },
+    index=pd.Index([], dtype=object, name='key'),
+)
+
+
+def _vehicle_key(region, vehicle_id):
+    region = pd.Series(np.asarray(region, dtype=object)).astype(str)
+    return region + '\x1f' + pd.Series(np.asarray(vehicle_id, dtype=object)).astype(str)
+
+
+def reset_state():
+    """Forget all per-vehicle adherence state (used by replay and tests)."""
+    global _STATE
+    _STATE = _STATE.iloc[0:0]
+
+
+def update_adherence(df):
+    """
+    Add ``schedule_delay_s`` to an ingest batch (positive = late) and refresh
+    the per-vehicle state used by :func:`predict_arrivals`.
+
+    A vehicle's state is dropped when its latest ping has no usable delay,
+    when it hasn't reported for DATA_MAX_AGE, and when its agency's
+    stop_times table has been rebuilt from a newer ZIP since it was stored.
+
+    Args:
+        df: DataFrame with region, vehicle_id, trip_id, latitude, longitude,
+            timestamp and (optionally) shape_dist_m
+
+    Returns:
+        The same DataFrame with the schedule column added
+    """
+    global _STATE
+
+    df['schedule_delay_s'] = np.nan
+    if df.empty:
+        return df
+
+    updates = []
+    stale_agencies = {}
+    for region, idx in df.groupby('region', sort=False).groups.items():
+        agency_slug = gtfs_static.STATIC_API_SOURCES.get(region)
+        table = get_stop_time_table(agency_slug) if agency_slug else None
+        if table is None:
+            continue
+        stale_agencies[agency_slug] = table.version
+
+        rows = df.loc[idx]
+        ts = pd.to_numeric(rows['timestamp'], errors='coerce').to_numpy(dtype='float64')
+        shape_dist = rows['shape_dist_m'].to_numpy(dtype='float64') if 'shape_dist_m' in rows.columns \
+            else np.full(len(rows), np.nan)
+        scheduled, next_row = table.locate(
+            rows['trip_id'].to_numpy(),
+            rows['latitude'].to_numpy(dtype='float64'),
+            rows['longitude'].to_numpy(dtype='float64'),
+            shape_dist,
+        )
+
+        # Observed local time of day vs scheduled, wrapped so trips running past
+        # midnight (GTFS times > 24:00:00) compare against the right day
+        observed = (ts + UTC_OFFSET_HOURS * 3600) % SECONDS_PER_DAY
+        delay = (observed - scheduled + SECONDS_PER_DAY / 2) % SECONDS_PER_DAY - SECONDS_PER_DAY / 2
+        delay = np.where(np.abs(delay) <= MAX_ABS_DELAY_SECONDS, np.round(delay), np.nan)
+        df.loc[idx, 'schedule_delay_s'] = delay
+
+        updates.append(pd.DataFrame({
+            'key': _vehicle_key(rows['region'].to_numpy(), rows['vehicle_id'].to_numpy()).to_numpy(),
+            'agency_slug': agency_slug,
+            'trip_id': rows['trip_id'].to_numpy(dtype=object),
+            'next_row': next_row,
+            'delay_s': delay,
+            'scheduled_s': scheduled,
+            'timestamp': ts,
+            'table_version': table.version,
+        }))
+
+    if not updates:
+        return df
+
+    # Latest ping per vehicle; one without a usable delay clears the vehicle
+    update = pd.concat(updates, ignore_index=True).dropna(subset=['timestamp'])
+    update = update.sort_values('timestamp', kind='stable').drop_duplicates('key', keep='last')
+    cleared = update.index[np.isnan(update['delay_s'].to_numpy())]
+    keys = update['key']
+    update = update.drop(index=cleared).set_index('key')
+    update['timestamp'] = update['timestamp'].astype('int64')
+
+    state = _STATE[~_STATE.index.isin(keys)]
+    # State built against a table that has since been reloaded
+    current = state['agency_slug'].map(stale_agencies).to_numpy(dtype='float64', na_value=np.nan)
+    state = state[np.isnan(current) | (state['table_version'].to_numpy() == current)]
+
+    merged = pd.concat([state, update]) if len(state) else update
+    newest = pd.to_numeric(df['timestamp'], errors='coerce').max()
+    _STATE = merged[merged['timestamp'] >= newest - DATA_MAX_AGE]
+    return df
+
+
+def _vehicle_state(region, vehicle_id):
+    key = _vehicle_key([region], [vehicle_id]).iloc[0]
+    state = _STATE
+    return state.loc[key].to_dict() if key in state.index else None
+
+
+def get_vehicle_delay(region, vehicle_id):
+    """Return the latest schedule delay in seconds for a vehicle, or None."""
+    state = _vehicle_state(region, vehicle_id)
+    return state['delay_s'] if state else None
+
+
+def predict_arrivals(region, vehicle_id, limit=5):
+    """
+    Predict arrival times at the vehicle's upcoming stops.
+
+    The vehicle's current delay is propagated unchanged to the remaining stops,
+    i.e. predicted = now + (scheduled arrival - scheduled time at the vehicle's
+    current position).
+
+    Returns:
+        DataFrame with stop_id, stop_name, scheduled_arrival, predicted_arrival
+        (unix seconds), delay_s; empty if the vehicle has no schedule match
+    """
+    columns = ['stop_id', 'stop_name', 'scheduled_arrival', 'predicted_arrival', 'delay_s']
+    state = _vehicle_state(region, vehicle_id)
+    if not state or state['next_row'] < 0:
+        return pd.DataFrame(columns=columns)
+
+    table = get_stop_time_table(state['agency_slug'])
+    if table is None or table.version != state['table_version'] or state['trip_id'] not in table.trip_index.index:
+        return pd.DataFrame(columns=columns)
+
+    k = int(table.trip_index[state['trip_id']])
+    rows = np.arange(int(state['next_row']), min(state['next_row'] + limit, table.offsets[k + 1]))
+    stops = table.stop_idx[rows]
+    ahead = table.arrival_s[rows] - state['scheduled_s']
+    predicted = state['timestamp'] + ahead
+    return pd.DataFrame({
+        'stop_id': np.where(stops >= 0, table.stop_ids.to_numpy()[stops], ''),
+        'stop_name': np.where(stops >= 0, table.stop_name[stops], ''),
+        'scheduled_arrival': (predicted - state['delay_s']).astype('int64'),
+        'predicted_arrival': predicted.astype('int64'),
+        'delay_s': state['delay_s'],
+    })
@@ -0,0 +1,20 @@
+"""
+schema.py
+---------
+Schema probes on an open DuckDB connection, shared by the modules that keep
+derived tables next to the positions (keyframes.py, route_stats.py,
+density_tiles.py).  They run in the caller's connection and transaction, so
+unlike db.table_exists they see tables created earlier in the same flush.
+"""
+
+
+def table_exists(con, table):
+    """True if *table* exists in *con*'s database."""
+    return con.execute(
+        "SELECT count(*) FROM information_schema.tables WHERE table_name = ?", [table]
+    ).fetchone()[0] > 0
+
+
+def columns(con, source):
+    """Column names of *source* (a table or registered Arrow batch) as a set."""
+    return set(con.execute(f"SELECT * FROM {source} LIMIT 0").df().columns)
@@ -0,0 +1,206 @@
+"""
+spatial_index.py
+----------------
+Nearest-neighbour queries for the Locate Me panel: the K nearest live vehicles
+and the K nearest GTFS stops to a point, across all regions.
+
+Points are bucketed into a uniform lat/lon grid stored CSR-style (sorted cell
+keys + the points in each cell).  A query walks rings of cells outwards from
+the query cell until it has K candidates and the next ring can't contain
+anything closer, so it only touches a handful of cells regardless of fleet
+size.  The vehicle index is rebuilt from each new live-fleet snapshot
+(utils/fleet.py), so vehicles whose endpoint missed a cycle stay findable
+while they are live; the stop index is built from stops.txt once per set of
+GTFS Static ZIPs.
+"""
+
+import threading
+
+import numpy as np
+import pandas as pd
+
+from utils import geo, gtfs_static
+
+# ~1.1 km cells at Malaysian latitudes
+CELL_DEG = 0.01
+# Beyond this many rings it's cheaper to scan every point
+MAX_RINGS = 25
+
+
+class PointGrid:
+    """Grid index over a DataFrame of points with latitude / longitude columns."""
+
+    def __init__(self, df, cell_deg=CELL_DEG):
+        self.cell_deg = cell_deg
+        df = df[df['latitude'].notna() & df['longitude'].notna()].reset_index(drop=True)
+        self.lat = df['latitude'].to_numpy(dtype='float64')
+        self.lon = df['longitude'].to_numpy(dtype='float64')
+
+        cx, cy = self._cells(self.lat, self.lon)
+        keys = self._key(cx, cy)
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.data = df.iloc[order].reset_index(drop=True)
+        self.lat, self.lon = self.lat[order], self.lon[order]
+
+    def __len__(self):
+        return len(self.lat)
+
+    def _cells(self, lat, lon):
+        return (np.floor(np.asarray(lon) / self.cell_deg).astype('int64'),
+                np.floor(np.asarray(lat) / self.cell_deg).astype('int64'))
+
+    @staticmethod
+    def _key(cx, cy):
+        return (np.asarray(cx, dtype='int64') << 32) + (np.asarray(cy, dtype='int64') + (1 << 31))
+
+    def _ring(self, cx, cy, r):
+        """Point positions in the square ring of cells at Chebyshev distance r."""
+        if r == 0:
+            xs, ys = np.array([cx]), np.array([cy])
+        else:
+            side = np.arange(-r, r + 1)
+            xs = np.r_[cx + side, cx + side, np.full(2 * r - 1, cx - r), np.full(2 * r - 1, cx + r)]
+            ys = np.r_[np.full(2 * r + 1, cy - r), np.full(2 * r + 1, cy + r), cy + side[1:-1], cy + side[1:-1]]
+        keys = self._key(xs, ys)
+        lo = np.searchsorted(self.keys, keys, side='left')
+        hi = np.searchsorted(self.keys, keys, side='right')
+        counts = hi - lo
+        return np.repeat(lo, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+
+    def nearest(self, lat, lon, k=5):
+        """
+        Return the *k* nearest points to (lat, lon) as a copy of their rows with
+        ``distance_m`` and ``bearing_deg`` (from the query point) added.
+        """
+        if len(self) == 0 or k <= 0:
+            return self.data.iloc[0:0].assign(distance_m=pd.Series(dtype='float64'),
+                                              bearing_deg=pd.Series(dtype='float64'))
+
+        cx, cy = (int(v[()]) for v in self._cells(lat, lon))
+        # Smallest distance a ring r cell can be from the query point
+        cell_m = self.cell_deg * np.radians(1.0) * geo.EARTH_RADIUS_M * np.cos(np.radians(abs(lat) + self.cell_deg))
+
+        found = []
+        candidates = np.array([], dtype='int64')
+        dist = np.array([])
+        for r in range(MAX_RINGS + 1):
+            found.append(self._ring(cx, cy, r))
+            candidates = np.concatenate(found)
+            if len(candidates) >= min(k, len(self)):
+                dist = geo.haversine_m(lat, lon, self.lat[candidates], self.lon[candidates])
+                kth = np.partition(dist, min(k, len(dist)) - 1)[min(k, len(dist)) - 1]
+                if kth <= r * cell_m:
+                    break
+        else:
+            candidates = np.arange(len(self))
+            dist = geo.haversine_m(lat, lon, self.lat, self.lon)
+
+        best = np.argsort(dist, kind='stable')[:k]
+        rows = candidates[best]
+        result = self.data.iloc[rows].copy()
+        result['distance_m'] = dist[best]
+        result['bearing_deg'] = geo.initial_bearing_deg(lat, lon, self.lat[rows], self.lon[rows])
+        return result.reset_index(drop=True)
+
+
+# ---------------------------------------------------------------------------
+# Process-wide indexes
+# ---------------------------------------------------------------------------
+
+_VEHICLE_COLUMNS = ['region', 'vehicle_id', 'latitude', 'longitude', 'route_id', 'timestamp']
+
+_vehicle_index = PointGrid(pd.DataFrame(columns=_VEHICLE_COLUMNS).astype({'latitude': 'float64', 'longitude': 'float64'}))
+_vehicle_index_key = None     # (version, sync_ts) of the snapshot indexed
+_vehicle_index_lock = threading.Lock()
+_stop_index = None
+_stop_index_sources = ()      # per-agency stops tables the stop index was built from
+_stop_index_lock = threading.Lock()
+
+
+def rebuild_vehicle_index(df):
+    """
+    Replace the live-vehicle index with the latest position per vehicle in *df*
+    (an ingest batch or the live snapshot).
+    """
+    global _vehicle_index
+    cols = [c for c in _VEHICLE_COLUMNS if c in df.columns]
+    latest = df[cols].copy()
+    latest['latitude'] = pd.to_numeric(latest['latitude'], errors='coerce')
+    latest['longitude'] = pd.to_numeric(latest['longitude'], errors='coerce')
+    if 'timestamp' in latest.columns:
+        latest['timestamp'] = pd.to_numeric(latest['timestamp'], errors='coerce')
+        latest = latest.sort_values('timestamp', kind='stable')
+    latest = latest.drop_duplicates(['region', 'vehicle_id'], keep='last')
+    _vehicle_index = PointGrid(latest)
+
+
+def update_vehicle_index(snapshot):
+    """
+    Rebuild the live-vehicle index from a fleet.FleetSnapshot unless it was
+    already built from that snapshot.  Snapshots are told apart by version
+    and sync time, which also covers the ones a dashboard-only process
+    builds from the database (always version 0).
+
+    Returns:
+        bool: Whether the index was rebuilt
+    """
+    global _vehicle_index_key
+    if snapshot is None:
+        return False
+    key = (snapshot.version, snapshot.sync_ts)
+    with _vehicle_index_lock:
+        if key == _vehicle_index_key:
+            return False
+        rebuild_vehicle_index(snapshot.frame())
+        _vehicle_index_key = key
+        return True
+
+
+def vehicle_index_size():
+    return len(_vehicle_index)
+
+
+def nearest_vehicles(lat, lon, k=5):
+    """K nearest live vehicles (any region) with distance_m and bearing_deg."""
+    return _vehicle_index.nearest(lat, lon, k)
+
+
+def _build_stops(agency_slug):
+    stops = gtfs_static.load_table(agency_slug, 'stops.txt', ['stop_id', 'stop_name', 'stop_lat', 'stop_lon'])
+    if stops.empty:
+        return None
+    return pd.DataFrame({
+        'stop_id': stops['stop_id'],
+        'stop_name': stops['stop_name'] if 'stop_name' in stops.columns else '',
+        'latitude': pd.to_numeric(stops['stop_lat'], errors='coerce'),
+        'longitude': pd.to_numeric(stops['stop_lon'], errors='coerce'),
+    })
+
+
+def _get_stop_index():
+    """
+    Stops of every agency from stops.txt, rebuilt when any agency's table is
+    (i.e. when its GTFS Static ZIP changes).
+    """
+    global _stop_index, _stop_index_sources
+    with _stop_index_lock:
+        tables = tuple(gtfs_static.get_cached_index(slug, 'stops', _build_stops)
+                       for slug in gtfs_static.STATIC_API_SOURCES.values())
+        if _stop_index is not None and len(tables) == len(_stop_index_sources) \
+                and all(a is b for a, b in zip(tables, _stop_index_sources)):
+            return _stop_index
+
+        frames = [table.assign(region=region)
+                  for region, table in zip(gtfs_static.STATIC_API_SOURCES, tables) if table is not None]
+        stops = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(
+            {'region': [], 'stop_id': [], 'stop_name': [], 'latitude': [], 'longitude': []}
+        )
+        _stop_index = PointGrid(stops[['region', 'stop_id', 'stop_name', 'latitude', 'longitude']])
+        _stop_index_sources = tables
+        return _stop_index
+
+
+def nearest_stops(lat, lon, k=5):
+    """K nearest GTFS stops (any agency) with distance_m and bearing_deg."""
+    return _get_stop_index().nearest(lat, lon, k)
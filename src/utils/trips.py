@@ -0,0 +1,228 @@
+"""
+trips.py
+--------
+Incremental trip segmentation: consecutive pings of a vehicle on the same
+``trip_id`` form one trip record with start / end time, distance travelled,
+average speed, ping count and the GTFS shape (route direction) it ran on.
+
+Open trips (one per (region, vehicle_id)) are kept in memory between cycles
+and extended by each ingest batch in one vectorised pass (sort by vehicle and
+time, shift, haversine, group by run).  A trip is closed when the vehicle
+reports a different trip_id, goes quiet for more than TRIP_GAP_SECONDS, or
+stops reporting altogether; closed trips are returned for the ingester to
+hand to the buffered writer, which stores them in the trips table in the
+same transaction as the positions they came from, so route-level reports
+never re-scan raw pings.
+
+Pings without a trip_id are ignored.  Open trips are not persisted, so a
+trip in progress across an ingester restart is recorded as two trips.
+"""
+
+import numpy as np
+import pandas as pd
+
+from utils import geo
+
+try:
+    from config import TRIPS_ENABLED, TRIPS_TABLE, TRIP_GAP_SECONDS
+except ImportError:
+    TRIPS_ENABLED = True
+    TRIPS_TABLE = 'trips'
+    TRIP_GAP_SECONDS = 900   # silence after which an open trip is closed
+
+# Closed trips with fewer pings are dropped rather than stored
+TRIP_MIN_PINGS = 2
+
+TRIP_COLUMNS = ['region', 'vehicle_id', 'trip_id', 'route_id', 'shape_id', 'start_ts', 'end_ts',
+                'duration_s', 'distance_m', 'avg_speed_mps', 'pings']
+
+# (region, vehicle_id) key -> the vehicle's open trip
+_OPEN = pd.DataFrame(
+    {
+        'region': pd.Series(dtype=object),
+        'vehicle_id': pd.Series(dtype=object),
+        'trip_id': pd.Series(dtype=object),
+        'route_id': pd.Series(dtype=object),
+        'shape_id': pd.Series(dtype=object),
+        'start_ts': pd.Series(dtype='int64'),
+        'end_ts': pd.Series(dtype='int64'),
+        'distance_m': pd.Series(dtype='float64'),
+        'pings': pd.Series(dtype='int64'),
+        'latitude': pd.Series(dtype='float64'),
+        'longitude': pd.Series(dtype='float64'),
+    },
+    index=pd.Index([], dtype=object, name='key'),
+)
+
+
+def reset_state():
+    """Forget all open trips (used by replay and benchmarks)."""
+    global _OPEN
+    _OPEN = _OPEN.iloc[0:0]
+
+
+def open_trips():
+    """Copy of the trips currently in progress."""
+    return _finalise(_OPEN, min_pings=1)
+
+
+def _finalise(trips, min_pings=TRIP_MIN_PINGS):
+    """Trip records in TRIP_COLUMNS layout, with duration and average speed."""
+    trips = trips[trips['pings'] >= min_pings].reset_index(drop=True)
+    duration = (trips['end_ts'] - trips['start_ts']).astype('float64')
+    trips = trips.assign(
+        duration_s=duration,
+        avg_speed_mps=(trips['distance_m'] / duration.where(duration > 0)),
+    )
+    return trips[TRIP_COLUMNS]
+
+
+def _rows_in(keys):
+    """Boolean mask of open trips whose key is in *keys* (hash lookup; isin on
+    Arrow-backed strings walks the values in Python)."""
+    positions = _OPEN.index.get_indexer(pd.Index(keys))
+    mask = np.zeros(len(_OPEN), dtype=bool)
+    mask[positions[positions >= 0]] = True
+    return mask
+
+
+def _last_non_empty(values, starts, ends, carried, cont):
+    """
+    Last non-empty value of each run starts[i]..ends[i] of *values*, falling
+    back to the open trip's value for runs that continue one (a trip keeps
+    its shape through pings that failed to match).
+    """
+    position = np.where(values != '', np.arange(len(values)), -1)
+    position = np.maximum.accumulate(position)[ends]
+    last = np.where(position >= starts, values[np.maximum(position, 0)], '')
+    carried = np.where(cont, pd.Series(carried, dtype=object).fillna('').to_numpy(), '')
+    return np.where(last != '', last, carried).astype(object)
+
+
+def update_trips(df, current_unix):
+    """
+    Extend open trips with an ingest batch and return the trips that closed.
+
+    Args:
+        df: DataFrame with region, vehicle_id, trip_id, route_id, latitude,
+            longitude, timestamp and (optionally) shape_id from map matching
+        current_unix: Cycle time; open trips silent for longer than
+            TRIP_GAP_SECONDS before it are closed
+
+    Returns:
+        DataFrame of closed trips (TRIP_COLUMNS), possibly empty
+    """
+    global _OPEN
+
+    closed = [_OPEN.iloc[0:0]]
+    batch = pd.DataFrame({
+        'key': (df['region'].astype(str) + '\x1f' + df['vehicle_id'].astype(str)).to_numpy(),
+        'region': df['region'].astype(str).to_numpy(),
+        'vehicle_id': df['vehicle_id'].astype(str).to_numpy(),
+        'trip_id': df['trip_id'].fillna('').astype(str).to_numpy() if 'trip_id' in df.columns else '',
+        'route_id': df['route_id'].fillna('').astype(str).to_numpy() if 'route_id' in df.columns else '',
+        'shape_id': df['shape_id'].fillna('').astype(str).to_numpy() if 'shape_id' in df.columns else '',
+        'latitude': pd.to_numeric(df['latitude'], errors='coerce').to_numpy(dtype='float64'),
+        'longitude': pd.to_numeric(df['longitude'], errors='coerce').to_numpy(dtype='float64'),
+        'timestamp': pd.to_numeric(df['timestamp'], errors='coerce').to_numpy(dtype='float64'),
+    }) if len(df) else pd.DataFrame()
+
+    if len(batch):
+        batch = batch[(batch['trip_id'] != '') & batch['timestamp'].notna()]
+        # Drop pings already folded into the open trip (the feed re-serves positions)
+        open_end = batch['key'].map(_OPEN['end_ts']).to_numpy(dtype='float64', na_value=np.nan)
+        batch = batch[~(batch['timestamp'].to_numpy() <= open_end)]
+        batch = batch.sort_values(['key', 'timestamp'], kind='stable').drop_duplicates(['key', 'timestamp'])
+
+    if len(batch):
+        key = batch['key'].to_numpy()
+        trip = batch['trip_id'].to_numpy()
+        lat, lon, ts = batch['latitude'].to_numpy(), batch['longitude'].to_numpy(), batch['timestamp'].to_numpy()
+
+        # Previous ping: the row before in the batch, or the open trip's last ping
+        first = key != np.r_[None, key[:-1]]
+        state = _OPEN.reindex(key)
+        prev_trip = np.where(first, state['trip_id'].to_numpy(), np.r_[None, trip[:-1]])
+        prev_ts = np.where(first, state['end_ts'].to_numpy(dtype='float64'), np.r_[np.nan, ts[:-1]])
+        prev_lat = np.where(first, state['latitude'].to_numpy(), np.r_[np.nan, lat[:-1]])
+        prev_lon = np.where(first, state['longitude'].to_numpy(), np.r_[np.nan, lon[:-1]])
+
+        # A new trip starts on a trip_id change, a long silence, or with no open trip
+        new_trip = (trip != prev_trip) | ~(ts - prev_ts <= TRIP_GAP_SECONDS)
+        step = np.where(new_trip, 0.0, np.nan_to_num(geo.haversine_m(prev_lat, prev_lon, lat, lon)))
+
+        # Open trips interrupted by this batch are closed as they were
+        interrupted = np.unique(key[first & new_trip])
+        closed.append(_OPEN[_rows_in(interrupted)])
+
+        # Rows are sorted by vehicle and time, so each run is a contiguous
+        # slice; runs that continue an open trip add to it
+        starts = np.flatnonzero(new_trip | first)
+        ends = np.r_[starts[1:], len(key)] - 1
+        cont = (first & ~new_trip)[starts]
+        carried = _OPEN.reindex(key[starts])
+        runs = pd.DataFrame({
+            'region': batch['region'].to_numpy()[starts],
+            'vehicle_id': batch['vehicle_id'].to_numpy()[starts],
+            'trip_id': trip[starts],
+            'route_id': batch['route_id'].to_numpy()[ends],
+            'shape_id': _last_non_empty(batch['shape_id'].to_numpy(), starts, ends, carried['shape_id'].to_numpy(), cont),
+            'start_ts': np.where(cont, carried['start_ts'].to_numpy(dtype='float64'), ts[starts]).astype('int64'),
+            'end_ts': ts[ends].astype('int64'),
+            'distance_m': np.add.reduceat(step, starts) + np.where(cont, carried['distance_m'].to_numpy(), 0.0),
+            'pings': np.diff(np.r_[starts, len(key)]) + np.where(cont, carried['pings'].to_numpy(dtype='float64'), 0).astype('int64'),
+            'latitude': lat[ends],
+            'longitude': lon[ends],
+        }, index=pd.Index(key[starts], name='key'))
+
+        # Every run but a vehicle's last is complete
+        last = ~runs.index.duplicated(keep='last')
+        closed.append(runs[~last])
+        _OPEN = pd.concat([_OPEN[~_rows_in(runs.index[last])], runs[last]])
+
+    # Vehicles that went quiet
+    stale = _OPEN['end_ts'] < current_unix - TRIP_GAP_SECONDS
+    closed.append(_OPEN[stale])
+    _OPEN = _OPEN[~stale]
+
+    return _finalise(pd.concat(closed))
+
+
+def ensure_table(con):
+    """Create TRIPS_TABLE on *con* if it is missing (outside any insert transaction)."""
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {TRIPS_TABLE} (
+            region VARCHAR, vehicle_id VARCHAR, trip_id VARCHAR, route_id VARCHAR, shape_id VARCHAR,
+            start_ts BIGINT, end_ts BIGINT, duration_s DOUBLE, distance_m DOUBLE,
+            avg_speed_mps DOUBLE, pings BIGINT
+        )
+    """)
+    # Tables created before trips carried their shape (one route direction)
+    con.execute(f"ALTER TABLE {TRIPS_TABLE} ADD COLUMN IF NOT EXISTS shape_id VARCHAR")
+
+
+def insert(con, source):
+    """
+    Append closed trips from *source* (a table or registered Arrow batch),
+    skipping ones already stored (a spooled batch replayed after a crash).
+    Runs in the caller's transaction.
+    """
+    con.execute(f"""
+        INSERT INTO {TRIPS_TABLE} ({', '.join(TRIP_COLUMNS)})
+        SELECT {', '.join(f'c.{col}' for col in TRIP_COLUMNS)} FROM {source} c
+        WHERE NOT EXISTS (
+            SELECT 1 FROM {TRIPS_TABLE} t
+            WHERE t.region = c.region AND t.vehicle_id = c.vehicle_id AND t.start_ts = c.start_ts
+        )
+    """)
+
+
+def store(con, closed):
+    """Append closed trips to TRIPS_TABLE on *con*, creating it if needed."""
+    ensure_table(con)
+    if len(closed):
+        con.register('closed_trips', closed)
+        try:
+            insert(con, 'closed_trips')
+        finally:
+            con.unregister('closed_trips')
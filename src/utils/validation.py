@@ -0,0 +1,227 @@
+"""
+validation.py
+-------------
+Data-quality rules applied to every ingest batch after the basic filter.
+
+Each rule is a function ``rule(batch) -> bool array`` (True = drop) that
+works on the whole batch at once; rules are registered in order with
+:func:`register_rule` and can be switched off with ``VALIDATION_RULES``.
+A dropped row is attributed to the first rule that flags it, and per-rule,
+per-region counts go to the metrics registry and the cycle's measurements.
+
+Built-in rules:
+
+- ``outside_malaysia``: coordinates outside Malaysia's bounding box
+- ``outside_service_area``: outside the region's ``service_area`` geofences
+  (geofence.py) where configured, otherwise further than
+  SERVICE_AREA_MARGIN_M outside the convex hull of the agency's GTFS Static
+  stops
+- ``impossible_jump``: implied speed from the vehicle's last accepted ping
+  above MAX_IMPLIED_SPEED_KMH
+- ``frozen_gps``: exactly the last accepted coordinates while the timestamp
+  keeps advancing, for longer than FROZEN_GPS_SECONDS
+- ``duplicate_endpoint``: the same vehicle_id reported by several endpoints
+  of one region (e.g. myBAS Seremban A and B); the freshest endpoint wins
+
+The last two rules use motion.py's per-vehicle state, so validation runs
+before the motion stage advances it.
+"""
+
+import numpy as np
+import pandas as pd
+
+from utils import geo, geofence, gtfs_static, metrics, motion
+
+try:
+    from config import VALIDATION_RULES, MAX_IMPLIED_SPEED_KMH, FROZEN_GPS_SECONDS, SERVICE_AREA_MARGIN_M
+except ImportError:
+    VALIDATION_RULES = None        # None = every registered rule
+    MAX_IMPLIED_SPEED_KMH = 200
+    FROZEN_GPS_SECONDS = 900
+    SERVICE_AREA_MARGIN_M = 5000
+
+# (min_lat, min_lon, max_lat, max_lon), Peninsular plus Sabah / Sarawak
+MALAYSIA_BBOX = (0.8, 99.5, 7.5, 119.5)
+
+# Jumps shorter than this are GPS noise, whatever speed they imply
+JUMP_MIN_DISTANCE_M = 1000
+
+
+class Batch:
+    """An ingest batch with the columns the rules share parsed once."""
+
+    def __init__(self, df, current_unix):
+        self.df = df
+        self.current_unix = current_unix
+        self.latitude = pd.to_numeric(df['latitude'], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+        self.longitude = pd.to_numeric(df['longitude'], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+        self.timestamp = pd.to_numeric(df['timestamp'], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+        self._last = None
+
+    @property
+    def last(self):
+        """Each row's vehicle's last accepted ping (motion state)."""
+        if self._last is None:
+            self._last = motion.last_known(self.df)
+        return self._last
+
+
+# ---------------------------------------------------------------------------
+# Service areas
+# ---------------------------------------------------------------------------
+
+class ServiceArea:
+    """Convex hull of an agency's stops in local metres."""
+
+    def __init__(self, stop_lat, stop_lon):
+        ok = ~np.isnan(stop_lat) & ~np.isnan(stop_lon)
+        self.ref_lat = float(stop_lat[ok].mean())
+        x, y = geo.project_local(stop_lat[ok], stop_lon[ok], self.ref_lat)
+        hull = geo.convex_hull(x, y)
+        self.hull_x, self.hull_y = x[hull], y[hull]
+
+    def outside(self, lat, lon, margin_m=SERVICE_AREA_MARGIN_M):
+        """True for points further than *margin_m* outside the hull."""
+        if len(self.hull_x) < 3:
+            return np.zeros(len(lat), dtype=bool)
+        x, y = geo.project_local(lat, lon, self.ref_lat)
+        result = np.zeros(len(x), dtype=bool)
+        check = ~geo.points_in_polygon(x, y, self.hull_x, self.hull_y)
+        if check.any():
+            result[check] = geo.distance_to_ring(x[check], y[check], self.hull_x, self.hull_y) > margin_m
+        return result
+
+
+def _build_service_area(agency_slug):
+    stops = gtfs_static.load_table(agency_slug, 'stops.txt', ['stop_lat', 'stop_lon'])
+    if stops.empty:
+        return None
+    lat = pd.to_numeric(stops['stop_lat'], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    lon = pd.to_numeric(stops['stop_lon'], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    if np.isnan(lat).all():
+        return None
+    return ServiceArea(lat, lon)
+
+
+def get_service_area(agency_slug):
+    """Return the ServiceArea for *agency_slug*, or None if unavailable."""
+    return gtfs_static.get_cached_index(agency_slug, 'service_area', _build_service_area)
+
+
+# ---------------------------------------------------------------------------
+# Rules
+# ---------------------------------------------------------------------------
+
+def outside_malaysia(batch):
+    min_lat, min_lon, max_lat, max_lon = MALAYSIA_BBOX
+    lat, lon = batch.latitude, batch.longitude
+    # NaN comparisons are False, so missing coordinates are dropped too
+    return ~((lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon))
+
+
+def outside_service_area(batch):
+    drop = np.zeros(len(batch.df), dtype=bool)
+    fences = geofence.get_index()
+    for region, idx in batch.df.groupby('region', sort=False).indices.items():
+        if fences is not None and fences.has('service_area', region):
+            drop[idx] = ~fences.inside_any(batch.latitude[idx], batch.longitude[idx], 'service_area', region)
+            continue
+        agency_slug = gtfs_static.STATIC_API_SOURCES.get(region)
+        area = get_service_area(agency_slug) if agency_slug else None
+        if area is not None:
+            drop[idx] = area.outside(batch.latitude[idx], batch.longitude[idx])
+    return drop
+
+
+def impossible_jump(batch):
+    last = batch.last
+    last_ts = last['timestamp'].to_numpy(dtype='float64', na_value=np.nan)
+    dt = batch.timestamp - last_ts
+    # Only against a recent ping: after a long gap the vehicle may really be elsewhere
+    recent = (dt > 0) & (dt <= motion.MAX_PING_GAP_SECONDS)
+    dist = geo.haversine_m(last['latitude'].to_numpy(), last['longitude'].to_numpy(), batch.latitude, batch.longitude)
+    implied_kmh = dist / np.where(recent, dt, 1.0) * 3.6
+    return recent & (dist > JUMP_MIN_DISTANCE_M) & (implied_kmh > MAX_IMPLIED_SPEED_KMH)
+
+
+def frozen_gps(batch):
+    last = batch.last
+    last_ts = last['timestamp'].to_numpy(dtype='float64', na_value=np.nan)
+    same = (batch.latitude == last['latitude'].to_numpy()) & (batch.longitude == last['longitude'].to_numpy())
+    # Frozen rows aren't accepted, so the state keeps the time the freeze started
+    since = last['stopped_since'].to_numpy(dtype='float64', na_value=np.nan)
+    since = np.where(np.isnan(since), last_ts, since)
+    return same & (batch.timestamp > last_ts) & (batch.timestamp - since > FROZEN_GPS_SECONDS)
+
+
+def duplicate_endpoint(batch):
+    df = batch.df
+    drop = np.zeros(len(df), dtype=bool)
+    if 'endpoint' not in df.columns:
+        return drop
+    key = (df['region'].astype(str) + '\x1f' + df['vehicle_id'].astype(str)).to_numpy()
+    rows = np.flatnonzero(pd.Series(key).duplicated(keep=False).to_numpy())
+    if len(rows) == 0:
+        return drop
+    candidates = pd.DataFrame({
+        'key': key[rows],
+        'endpoint': df['endpoint'].astype(str).to_numpy()[rows],
+        'ts': batch.timestamp[rows],
+    })
+    # Freshest endpoint per vehicle (ties go to the first endpoint name)
+    winner = (candidates.sort_values(['ts', 'endpoint'], ascending=[False, True], kind='stable')
+              .drop_duplicates('key').set_index('key')['endpoint'])
+    drop[rows] = candidates['endpoint'].to_numpy() != candidates['key'].map(winner).to_numpy()
+    return drop
+
+
+RULES = {}
+
+
+def register_rule(name, rule):
+    """Add *rule* (``rule(batch) -> bool array``, True = drop) after the existing ones."""
+    RULES[name] = rule
+
+
+for _name, _rule in [
+    ('outside_malaysia', outside_malaysia),
+    ('outside_service_area', outside_service_area),
+    ('impossible_jump', impossible_jump),
+    ('frozen_gps', frozen_gps),
+    ('duplicate_endpoint', duplicate_endpoint),
+]:
+    register_rule(_name, _rule)
+
+
+def validate(df, current_unix, cycle=None):
+    """
+    Drop rows failing any enabled rule and count them per rule and region.
+
+    Args:
+        df: Filtered ingest batch (region, vehicle_id, latitude, longitude,
+            timestamp and, when fetched per endpoint, endpoint)
+        current_unix: Cycle time
+        cycle: metrics.Cycle to record ``drop_<rule>`` counts against
+
+    Returns:
+        The kept rows, without the endpoint column
+    """
+    if df.empty:
+        return df.drop(columns=['endpoint'], errors='ignore')
+
+    batch = Batch(df, current_unix)
+    keep = np.ones(len(df), dtype=bool)
+    regions = df['region'].astype(str).to_numpy()
+    for name, rule in RULES.items():
+        if VALIDATION_RULES is not None and name not in VALIDATION_RULES:
+            continue
+        dropped = keep & np.asarray(rule(batch), dtype=bool)
+        if not dropped.any():
+            continue
+        keep &= ~dropped
+        for region, count in pd.Series(regions[dropped]).value_counts().items():
+            metrics.inc('transit_validation_dropped_total', int(count), rule=name, region=region)
+            if cycle is not None:
+                cycle.record(f'drop_{name}', region=region, entities=int(count))
+
+    return df[keep].drop(columns=['endpoint'], errors='ignore')
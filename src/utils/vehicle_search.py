@@ -0,0 +1,243 @@
+"""
+vehicle_search.py
+-----------------
+Cross-region vehicle search by vehicle_id (plate), trip_id, route_id or route
+name, for the Route Viewer.
+
+The index is a sorted term dictionary: every vehicle contributes its
+lower-cased ids and route names, whole and split into words, as (term,
+vehicle) postings kept sorted by term.  A prefix query is two binary searches
+over the terms, so lookups stay in the low milliseconds whatever the fleet
+size; a query of several words matches vehicles having a term for every word.
+
+The index follows the live-fleet snapshot (fleet.py).  Vehicles get a stable
+integer id the first time they are seen; each update compares every vehicle's
+(trip_id, route_id) with what was indexed and re-tokenises only vehicles that
+are new or changed trip / route, inserting their postings into the sorted
+arrays instead of re-sorting everything.  Postings of vehicles that left the
+snapshot are dropped.  Positions are not indexed: results read the last-seen
+position from the snapshot the index was updated from.
+"""
+
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+from utils import fleet, route_stats
+
+# Whole values longer than this are only indexed by their words
+MAX_TERM_LENGTH = 40
+# Sorts after every character, so [prefix, prefix + _HIGH) spans all terms starting with prefix
+_HIGH = '\U0010ffff'
+
+RESULT_COLUMNS = ['region', 'vehicle_id', 'trip_id', 'route_id', 'route_name',
+                  'latitude', 'longitude', 'timestamp']
+
+
+def _words(text):
+    return [w for w in re.split(r'[\W_]+', text.lower()) if w]
+
+
+def _ids(snapshot, column, rows=slice(None)):
+    """Snapshot id column (at *rows*) as an object array of str."""
+    values = snapshot.columns[column]
+    return np.asarray(values.categories, dtype=object)[values.codes[rows]]
+
+
+class _Index:
+    """
+    One immutable version of the index; updates build a new one.
+
+    Attributes:
+        terms: Sorted object array of terms
+        postings: Vehicle id of each term
+        is_vehicle_id: Whether the term is a vehicle's whole vehicle_id
+        keys, identity, vid, route_name: Per snapshot row
+        row_of: Snapshot row of each vehicle id (-1 if not in the snapshot)
+        order: Snapshot rows in (vehicle_id, region) order; rank: the inverse
+    """
+
+    def __init__(self, terms, postings, is_vehicle_id, snapshot=None, keys=None, identity=None,
+                 vid=None, route_name=None, next_id=0):
+        self.terms, self.postings, self.is_vehicle_id = terms, postings, is_vehicle_id
+        self.snapshot = snapshot
+        self.next_id = next_id
+        n = len(snapshot) if snapshot is not None else 0
+        empty = np.empty(0, dtype=object)
+        self.keys = pd.Index(keys if keys is not None else empty, dtype=object)
+        self.identity = identity if identity is not None else empty
+        self.vid = vid if vid is not None else np.empty(0, dtype='int64')
+        self.route_name = route_name if route_name is not None else empty
+
+        self.row_of = np.full(next_id, -1, dtype='int64')
+        self.row_of[self.vid] = np.arange(n)
+        if n:
+            # Categorical categories are sorted, so their codes order rows by value
+            self.order = np.lexsort((snapshot.columns['region'].codes, snapshot.columns['vehicle_id'].codes))
+        else:
+            self.order = np.empty(0, dtype='int64')
+        self.rank = np.empty(n, dtype='int64')
+        self.rank[self.order] = np.arange(n)
+
+
+_EMPTY = _Index(np.empty(0, dtype=object), np.empty(0, dtype='int64'), np.empty(0, dtype=bool))
+_index = _EMPTY
+_lock = threading.Lock()
+
+
+def _route_names(regions):
+    """{(region, route_id): (short name, long name, display name)} from GTFS Static."""
+    names = route_stats.route_dimension(regions)
+    return {
+        (region, route_id): (str(short or ''), str(long_name or ''), str(name or ''))
+        for region, route_id, short, long_name, name in names[
+            ['region', 'route_id', 'route_short_name', 'route_long_name', 'route_name']
+        ].itertuples(index=False)
+    }
+
+
+def _postings(vid, vehicle_id, trip_id, route_id, names):
+    """Sorted (terms, vehicle ids, is_vehicle_id) for the given vehicles."""
+    terms, owners, whole_id = [], [], []
+    for v, vehicle, trip, route, (short_name, long_name, _) in zip(vid, vehicle_id, trip_id, route_id, names):
+        vehicle_terms = {}
+        for value in (vehicle, trip, route, short_name):
+            value = value.lower().strip()
+            if value and len(value) <= MAX_TERM_LENGTH:
+                vehicle_terms[value] = vehicle_terms.get(value, False) or value == vehicle.lower().strip()
+            for word in _words(value):
+                vehicle_terms.setdefault(word, False)
+        for word in _words(long_name):
+            vehicle_terms.setdefault(word, False)
+        terms.extend(vehicle_terms)
+        whole_id.extend(vehicle_terms.values())
+        owners.extend([v] * len(vehicle_terms))
+    terms = np.array(terms, dtype=object)
+    order = np.argsort(terms, kind='stable')
+    return terms[order], np.array(owners, dtype='int64')[order], np.array(whole_id, dtype=bool)[order]
+
+
+def update(snapshot):
+    """
+    Bring the index up to date with a FleetSnapshot (called by the ingester
+    after every publish, and lazily by search() for other snapshots).
+    """
+    global _index
+    with _lock:
+        current = _index
+        if snapshot is current.snapshot:
+            return
+        if snapshot is None or len(snapshot) == 0:
+            _index = _EMPTY
+            return
+
+        region, vehicle_id = _ids(snapshot, 'region'), _ids(snapshot, 'vehicle_id')
+        trip_id, route_id = _ids(snapshot, 'trip_id'), _ids(snapshot, 'route_id')
+        keys = region + '\x1f' + vehicle_id
+        identity = trip_id + '\x1f' + route_id
+
+        old = current.keys.get_indexer(keys)
+        known = old >= 0
+        unchanged = known.copy()
+        unchanged[known] = current.identity[old[known]] == identity[known]
+
+        # Existing vehicles keep their id, new ones get the next ones
+        vid = np.empty(len(keys), dtype='int64')
+        vid[known] = current.vid[old[known]]
+        n_new = int((~known).sum())
+        vid[~known] = current.next_id + np.arange(n_new)
+        next_id = current.next_id + n_new
+
+        # Keep postings only of vehicles still present with the same trip / route
+        valid = np.zeros(next_id, dtype=bool)
+        valid[vid[unchanged]] = True
+        keep = valid[current.postings]
+        terms, postings, is_vehicle_id = current.terms[keep], current.postings[keep], current.is_vehicle_id[keep]
+
+        route_name = np.empty(len(keys), dtype=object)
+        route_name[unchanged] = current.route_name[old[unchanged]]
+        added = np.flatnonzero(~unchanged)
+        if len(added):
+            lookup = _route_names(pd.unique(region[added]).tolist())
+            names = [lookup.get((r, route), ('', '', '')) for r, route in zip(region[added], route_id[added])]
+            route_name[added] = [name[2] or route for name, route in zip(names, route_id[added])]
+            new_terms, new_postings, new_is_vehicle_id = _postings(
+                vid[added], vehicle_id[added], trip_id[added], route_id[added], names)
+            at = np.searchsorted(terms, new_terms)
+            terms = np.insert(terms, at, new_terms)
+            postings = np.insert(postings, at, new_postings)
+            is_vehicle_id = np.insert(is_vehicle_id, at, new_is_vehicle_id)
+
+        _index = _Index(terms, postings, is_vehicle_id, snapshot, keys, identity, vid, route_name, next_id)
+
+
+def _span(index, prefix):
+    return (np.searchsorted(index.terms, prefix, side='left'),
+            np.searchsorted(index.terms, prefix + _HIGH, side='left'))
+
+
+def _rows(index, vids):
+    rows = index.row_of[np.unique(vids)]
+    return rows[rows >= 0]
+
+
+def search(query, region=None, limit=50, snapshot=None):
+    """
+    Vehicles matching *query* across all regions (or one *region*), with
+    their last-seen position.
+
+    A vehicle matches when the whole query is a prefix of one of its terms, or
+    every word of the query is.  An empty query returns every vehicle.  Exact
+    vehicle_id matches come first, then vehicle_id prefixes, then the rest,
+    each by vehicle_id.
+
+    Args:
+        query: Free text, e.g. a plate prefix, trip id, route id or route name
+        region: Restrict results to one region
+        limit: Maximum results (None for all)
+        snapshot: FleetSnapshot to search; defaults to fleet.get_snapshot()
+
+    Returns:
+        DataFrame with RESULT_COLUMNS
+    """
+    snapshot = snapshot if snapshot is not None else fleet.get_snapshot()
+    update(snapshot)
+    index = _index
+    if index.snapshot is None:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+
+    query = query.lower().strip()
+    if query:
+        lo, hi = _span(index, query)
+        rows = _rows(index, index.postings[lo:hi])
+        words = _words(query)
+        if len(words) > 1:
+            by_word = None
+            for word in words:
+                word_lo, word_hi = _span(index, word)
+                word_rows = _rows(index, index.postings[word_lo:word_hi])
+                by_word = word_rows if by_word is None else np.intersect1d(by_word, word_rows)
+            rows = np.union1d(rows, by_word)
+
+        # Exact vehicle_id, then vehicle_id prefix, then everything else
+        whole_id = index.is_vehicle_id[lo:hi]
+        prefix_rows = _rows(index, index.postings[lo:hi][whole_id])
+        exact_rows = _rows(index, index.postings[lo:hi][whole_id & (index.terms[lo:hi] == query)])
+        tier = np.where(np.isin(rows, exact_rows), 0, np.where(np.isin(rows, prefix_rows), 1, 2))
+        rows = rows[np.lexsort((index.rank[rows], tier))]
+    else:
+        rows = index.order
+
+    if region is not None:
+        bounds = index.snapshot.slices.get(region, slice(0, 0))
+        rows = rows[(rows >= bounds.start) & (rows < bounds.stop)]
+    if limit is not None:
+        rows = rows[:limit]
+
+    result = pd.DataFrame({col: _ids(index.snapshot, col, rows) for col in ['region', 'vehicle_id', 'trip_id', 'route_id']})
+    result['route_name'] = index.route_name[rows]
+    for col in ['latitude', 'longitude', 'timestamp']:
+        result[col] = index.snapshot.columns[col][rows]
+    return result[RESULT_COLUMNS]
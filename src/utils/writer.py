@@ -0,0 +1,450 @@
+"""
+writer.py
+---------
+Buffered writer for the live positions table.
+
+One :class:`BufferedWriter` per database file collects ingest batches as
+Arrow tables.  The buffer is flushed in a single transaction when it reaches
+``WRITE_BUFFER_MAX_ROWS`` rows or its oldest batch is
+``WRITE_BUFFER_MAX_SECONDS`` old (checked on each append).  A flush dedups
+and inserts all buffered batches in one pass, so the table-existence check
+and schema migration probes run once per process rather than once per cycle.
+Each flush opens its own connection and closes it afterwards, so DuckDB's
+file lock is only held while writing and other processes can open the
+database between cycles.  The same transaction updates the playback
+keyframes (utils/keyframes.py) and, from the rows it actually inserted, the
+hourly route aggregates (utils/route_stats.py) and the history density tiles
+(utils/density_tiles.py), and appends the trips closed by the buffered
+batches (utils/trips.py), so a trip is never stored without its positions.
+
+The default ``WRITE_BUFFER_MAX_SECONDS = 0`` flushes every cycle, which keeps
+the dashboard's "live" view current.  A dedicated ingester can buffer longer.
+
+With ``WRITE_SPOOL_DIR`` set, every batch is also written to an Arrow IPC file
+before it is buffered and removed once committed.  Spooled batches left by
+a crash are loaded back into the buffer when the writer starts. Rows that were
+already committed are dropped by the insert's dedup.
+
+A flush that fails is retried on the next one.  After
+``WRITE_MAX_FLUSH_ATTEMPTS`` failures the buffered batches are written one
+at a time and any batch that still fails is moved to
+``WRITE_QUARANTINE_DIR`` as an Arrow IPC file and dropped from the buffer,
+so one bad batch cannot block ingest or grow the buffer without bound.
+Quarantined files use the spool format: moving them back into
+``WRITE_SPOOL_DIR`` retries them on the next start.
+"""
+
+import atexit
+import glob
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+
+from utils import density_tiles, keyframes, route_stats, trips
+
+try:
+    from config import WRITE_BUFFER_MAX_ROWS, WRITE_BUFFER_MAX_SECONDS, WRITE_SPOOL_DIR
+except ImportError:
+    WRITE_BUFFER_MAX_ROWS = 50_000
+    WRITE_BUFFER_MAX_SECONDS = 0
+    WRITE_SPOOL_DIR = None
+
+try:
+    from config import WRITE_MAX_FLUSH_ATTEMPTS
+except ImportError:
+    WRITE_MAX_FLUSH_ATTEMPTS = 3
+
+try:
+    from config import WRITE_QUARANTINE_DIR
+except ImportError:
+    WRITE_QUARANTINE_DIR = None   # <database>.quarantine next to the database file
+
+# Columns produced by ingest-time stages after the original schema. They are
+# added to existing tables on demand and left NULL on historical rows.
+DERIVED_COLUMNS = {
+    'shape_id': 'VARCHAR',
+    'shape_dist_m': 'DOUBLE',
+    'cross_track_m': 'DOUBLE',
+    'snapped_latitude': 'DOUBLE',
+    'snapped_longitude': 'DOUBLE',
+    'derived_speed': 'DOUBLE',
+    'derived_bearing': 'DOUBLE',
+    'dwell_seconds': 'DOUBLE',
+    'schedule_delay_s': 'DOUBLE',
+}
+
+# A row is a duplicate of a stored one when all of these match
+DEDUP_KEY = ['region', 'vehicle_id', 'timestamp', 'latitude', 'longitude', 'bearing', 'speed']
+
+
+def migrate_schema(con, table, current_unix):
+    """Add any columns missing from an existing table (for migration)."""
+    columns = con.execute(
+        "SELECT column_name FROM information_schema.columns WHERE table_name = ?", [table]
+    ).df()['column_name'].tolist()
+
+    if 'insert_timestamp' not in columns:
+        con.execute(f"ALTER TABLE {table} ADD COLUMN insert_timestamp BIGINT")
+        con.execute(f"UPDATE {table} SET insert_timestamp = {current_unix} WHERE insert_timestamp IS NULL")
+
+    if 'created_at' not in columns:
+        con.execute(f"ALTER TABLE {table} ADD COLUMN created_at TIMESTAMP")
+        con.execute(f"UPDATE {table} SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL")
+
+    if 'trip_id' not in columns:
+        con.execute(f"ALTER TABLE {table} ADD COLUMN trip_id VARCHAR")
+        con.execute(f"UPDATE {table} SET trip_id = '' WHERE trip_id IS NULL")
+
+    if 'route_id' not in columns:
+        con.execute(f"ALTER TABLE {table} ADD COLUMN route_id VARCHAR")
+        con.execute(f"UPDATE {table} SET route_id = '' WHERE route_id IS NULL")
+
+    for col, col_type in DERIVED_COLUMNS.items():
+        if col not in columns:
+            con.execute(f"ALTER TABLE {table} ADD COLUMN {col} {col_type}")
+
+
+def _remove(spool_path):
+    if spool_path:
+        try:
+            os.remove(spool_path)
+        except OSError:
+            pass
+
+
+class BufferedWriter:
+    """
+    Buffers ingest batches for *table* in *database* and writes them in one
+    transaction per flush.
+
+    Args:
+        database: DuckDB file path
+        table: Positions table name
+        max_rows: Flush once this many rows are buffered
+        max_seconds: Flush once the oldest buffered batch is this old (0 = every append)
+        spool_dir: Directory for crash-recovery Arrow IPC files (None disables)
+        max_attempts: Failed flushes before failing batches are quarantined
+        quarantine_dir: Where quarantined batches are written
+    """
+
+    def __init__(self, database, table, max_rows=WRITE_BUFFER_MAX_ROWS,
+                 max_seconds=WRITE_BUFFER_MAX_SECONDS, spool_dir=WRITE_SPOOL_DIR,
+                 max_attempts=WRITE_MAX_FLUSH_ATTEMPTS, quarantine_dir=WRITE_QUARANTINE_DIR):
+        self.database = database
+        self.table = table
+        self.max_rows = max_rows
+        self.max_seconds = max_seconds
+        self.spool_dir = spool_dir
+        self.max_attempts = max_attempts
+        self.quarantine_dir = quarantine_dir or database + '.quarantine'
+        self.lock = threading.RLock()
+
+        self._failures = 0          # consecutive failed flushes
+        self._columns = None        # table columns once known to exist
+        self._batches = []          # [(pa.Table, spool path or None)]
+        self._trips = []            # closed trips, same layout
+        self._rows = 0
+        self._oldest = None         # monotonic time of the first buffered batch
+        self._seq = 0
+
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
+            self._recover_spool()
+
+    @property
+    def buffered_rows(self):
+        return self._rows
+
+    @contextmanager
+    def connection(self):
+        """
+        A connection for one unit of work, used as ``with w.connection() as con``.
+        Holds ``lock`` and closes the connection on exit, which releases
+        DuckDB's file lock for other processes.
+        """
+        with self.lock:
+            con = duckdb.connect(self.database)
+            try:
+                yield con
+            finally:
+                con.close()
+
+    # ------------------------------------------------------------------
+    # Spool
+    # ------------------------------------------------------------------
+
+    def _spool_name(self, kind):
+        # 'live_buses' for positions, 'live_buses.trips' for closed trips
+        return self.table if kind == 'positions' else f'{self.table}.{kind}'
+
+    def _spool_path(self, directory, kind='positions'):
+        self._seq += 1
+        return os.path.join(directory, f'{self._spool_name(kind)}_{time.time_ns()}_{self._seq}.arrow')
+
+    def _spool(self, batch, path=None, kind='positions'):
+        path = path or self._spool_path(self.spool_dir, kind)
+        tmp = path + '.tmp'
+        with pa.OSFile(tmp, 'wb') as sink, pa.ipc.new_file(sink, batch.schema) as ipc:
+            ipc.write_table(batch)
+        os.replace(tmp, path)
+        return path
+
+    def _recover_spool(self):
+        paths = []
+        for kind in ('positions', 'trips'):
+            kind_paths = sorted(glob.glob(os.path.join(self.spool_dir, f'{self._spool_name(kind)}_*.arrow')))
+            for path in kind_paths:
+                try:
+                    with pa.memory_map(path) as source:
+                        batch = pa.ipc.open_file(source).read_all()
+                except (OSError, pa.ArrowInvalid) as e:
+                    print(f"Skipping unreadable spool file {path}: {e}")
+                    continue
+                if kind == 'trips':
+                    self._trips.append((batch, path))
+                else:
+                    self._buffer(batch, path)
+            paths += kind_paths
+        if paths:
+            print(f"Recovered {self._rows} buffered rows from {len(paths)} spool files")
+
+    # ------------------------------------------------------------------
+    # Buffer / flush
+    # ------------------------------------------------------------------
+
+    def _buffer(self, batch, spool_path):
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+        self._batches.append((batch, spool_path))
+        self._rows += batch.num_rows
+
+    def append(self, df, current_unix, closed_trips=None):
+        """
+        Buffer an ingest batch and flush if a size or age trigger fires.
+
+        Args:
+            df: Positions
+            current_unix: Cycle time
+            closed_trips: Trips closed by this batch (trips.TRIP_COLUMNS),
+                committed by the same flush as the positions
+
+        Returns:
+            Rows inserted if a flush happened, otherwise None
+        """
+        batch = pa.Table.from_pandas(df, preserve_index=False)
+        trip_batch = pa.Table.from_pandas(closed_trips, preserve_index=False) \
+            if closed_trips is not None and len(closed_trips) else None
+        with self.lock:
+            if trip_batch is not None:
+                self._trips.append((trip_batch, self._spool(trip_batch, kind='trips') if self.spool_dir else None))
+            spool_path = self._spool(batch) if self.spool_dir else None
+            self._buffer(batch, spool_path)
+            if self._rows >= self.max_rows or time.monotonic() - self._oldest >= self.max_seconds:
+                return self.flush(current_unix)
+        return None
+
+    def _combined(self, batches):
+        tables = [batch for batch, _ in batches]
+        try:
+            return pa.concat_tables(tables, promote_options='permissive')
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+            # Column types drifted between batches (e.g. an all-NULL column)
+            return pa.Table.from_pandas(
+                pd.concat([t.to_pandas() for t in tables], ignore_index=True), preserve_index=False
+            )
+
+    def _ensure_schema(self, con, columns, distinct, current_unix):
+        """Create or migrate the table (once per writer) and add any new batch columns."""
+        if self._columns is None:
+            exists = con.execute(
+                "SELECT count(*) FROM information_schema.tables WHERE table_name = ?", [self.table]
+            ).fetchone()[0] > 0
+            if exists:
+                migrate_schema(con, self.table, current_unix)
+            else:
+                con.execute(f"CREATE TABLE {self.table} AS {distinct} LIMIT 0")
+            self._columns = set(con.execute(
+                "SELECT column_name FROM information_schema.columns WHERE table_name = ?", [self.table]
+            ).df()['column_name'])
+            if keyframes.KEYFRAMES_ENABLED:
+                keyframes.ensure_table(con, self.table)
+            if route_stats.ROUTE_STATS_ENABLED:
+                route_stats.ensure_table(con, self.table)
+            if density_tiles.DENSITY_TILES_ENABLED:
+                density_tiles.ensure_table(con, self.table)
+            if trips.TRIPS_ENABLED:
+                trips.ensure_table(con)
+
+        for col in columns:
+            if col not in self._columns:
+                col_type = DERIVED_COLUMNS.get(col, 'VARCHAR')
+                con.execute(f"ALTER TABLE {self.table} ADD COLUMN {col} {col_type}")
+                self._columns.add(col)
+
+    def _write(self, batches, current_unix, trip_batches=()):
+        """
+        Dedup and insert *batches*, and append *trip_batches* to the trips
+        table, in one transaction; returns position rows inserted.
+        """
+        batch = self._combined(batches)
+        columns = batch.column_names
+        with self.connection() as con:
+            con.register('buffered_batch', batch)
+            # Drop repeats inside the buffer itself before checking the table
+            distinct = f"SELECT DISTINCT ON ({', '.join(DEDUP_KEY)}) * FROM buffered_batch"
+            try:
+                # Schema changes are committed on their own: DuckDB can't
+                # commit writes to a table altered in the same transaction
+                self._ensure_schema(con, columns, distinct, current_unix)
+
+                con.execute("BEGIN TRANSACTION")
+                # New rows are staged so the aggregates below count each
+                # position once, however often the feed re-serves it
+                con.execute(f"""
+                    CREATE OR REPLACE TEMP TABLE new_rows AS
+                    SELECT b.* FROM ({distinct}) b
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM {self.table} existing
+                        WHERE {' AND '.join(f'existing.{c} = b.{c}' for c in DEDUP_KEY)}
+                    )
+                """)
+                # Columns are named explicitly because migrated tables may
+                # order them differently from the batch.
+                inserted = con.execute(f"""
+                    INSERT INTO {self.table} ({', '.join(columns)})
+                    SELECT {', '.join(columns)} FROM new_rows
+                """).fetchone()[0]
+                if keyframes.KEYFRAMES_ENABLED:
+                    keyframes.upsert(con, 'buffered_batch')
+                if route_stats.ROUTE_STATS_ENABLED:
+                    route_stats.upsert(con, 'new_rows')
+                if density_tiles.DENSITY_TILES_ENABLED:
+                    density_tiles.upsert(con, 'new_rows')
+                if trip_batches:
+                    self._insert_trips(con, trip_batches)
+                con.execute("DROP TABLE new_rows")
+                con.execute("COMMIT")
+            except Exception:
+                try:
+                    con.execute("ROLLBACK")
+                except duckdb.Error:
+                    pass   # failed before BEGIN, or the failed COMMIT already rolled back
+                self._columns = None   # re-probe the schema on the next attempt
+                raise
+            finally:
+                con.unregister('buffered_batch')
+        return inserted
+
+    def _insert_trips(self, con, trip_batches):
+        con.register('closed_trips', self._combined(trip_batches))
+        try:
+            trips.insert(con, 'closed_trips')
+        finally:
+            con.unregister('closed_trips')
+
+    def _write_trips(self, trip_batches):
+        """Append closed trips on their own (after positions were quarantined)."""
+        with self.connection() as con:
+            trips.ensure_table(con)
+            self._insert_trips(con, trip_batches)
+
+    def _quarantine(self, batch, spool_path, error, kind='positions'):
+        """Move a batch that keeps failing out of the buffer into quarantine_dir."""
+        os.makedirs(self.quarantine_dir, exist_ok=True)
+        path = self._spool_path(self.quarantine_dir, kind)
+        if spool_path:
+            os.replace(spool_path, path)
+        else:
+            self._spool(batch, path)
+        print(f"⚠ Quarantined {batch.num_rows} {kind} rows after {self._failures} failed flushes: {path} ({error})")
+
+    def flush(self, current_unix=None):
+        """
+        Write all buffered batches in one transaction; returns rows inserted.
+
+        A failure is raised and the batches stay buffered, until the
+        max_attempts-th consecutive failure: then each batch is written on
+        its own and the ones that still fail are quarantined.
+        """
+        with self.lock:
+            if not self._batches:
+                return 0
+            current_unix = int(time.time()) if current_unix is None else current_unix
+            try:
+                inserted = self._write(self._batches, current_unix, self._trips)
+            except Exception as e:
+                self._failures += 1
+                if self._failures < self.max_attempts:
+                    raise
+                print(f"Flush failed {self._failures} times ({e}); writing batches one at a time")
+                inserted = 0
+                for batch, spool_path in self._batches:
+                    try:
+                        inserted += self._write([(batch, spool_path)], current_unix)
+                    except Exception as batch_error:
+                        self._quarantine(batch, spool_path, batch_error)
+                    else:
+                        _remove(spool_path)
+                for batch, spool_path in self._trips:
+                    try:
+                        self._write_trips([(batch, spool_path)])
+                    except Exception as batch_error:
+                        self._quarantine(batch, spool_path, batch_error, kind='trips')
+                    else:
+                        _remove(spool_path)
+                self._batches, self._trips, self._rows, self._oldest = [], [], 0, None
+                self._failures = 0
+                return inserted
+
+            for _, spool_path in self._batches + self._trips:
+                _remove(spool_path)
+            n_batches = len(self._batches)
+            self._batches, self._trips, self._rows, self._oldest = [], [], 0, None
+            self._failures = 0
+
+        if inserted > 0:
+            print(f"✓ Inserted {inserted} new vehicles from {n_batches} batch(es) (skipped duplicates)")
+        else:
+            print(f"⚠ No new data inserted (all records were duplicates)")
+        return inserted
+
+    def close(self):
+        """Flush anything buffered (the connection is already closed after each flush)."""
+        self.flush()
+
+
+# ---------------------------------------------------------------------------
+# Process-wide writers
+# ---------------------------------------------------------------------------
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(database, table):
+    """The shared writer for (*database*, *table*), created on first use."""
+    with _writers_lock:
+        w = _writers.get((database, table))
+        if w is None:
+            w = _writers[(database, table)] = BufferedWriter(database, table)
+        return w
+
+
+def close_all():
+    """Flush and close every writer (registered to run at interpreter exit)."""
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for w in writers:
+        try:
+            w.close()
+        except Exception as e:
+            print(f"Writer flush error ({w.database}): {e}")
+
+
+atexit.register(close_all)
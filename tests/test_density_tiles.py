@@ -0,0 +1,58 @@
+# tests/test_density_tiles.py
+from utils import density_tiles, geo
+import struct
+import zlib
+import duckdb
+import numpy as np
+import pandas as pd
+
+def _decode(png):
+    """RGBA array from an unfiltered 8-bit RGBA PNG (what encode_png writes)."""
+    assert png[:8] == b'\x89PNG\r\n\x1a\n'
+    width, height = struct.unpack('>II', png[16:24])
+    length = struct.unpack('>I', png[33:37])[0]
+    assert png[37:41] == b'IDAT'
+    raw = np.frombuffer(zlib.decompress(png[41:41 + length]), dtype='uint8').reshape(height, -1)
+    return raw[:, 1:].reshape(height, width, 4)
+
+def test_incremental_counts_and_tiles(tmp_path, monkeypatch):
+    path = str(tmp_path / 'density.duckdb')
+    monkeypatch.setattr(density_tiles, 'DATABASE_NAME', path)
+    monkeypatch.setattr(density_tiles, '_tile_cache', {})
+    con = duckdb.connect(path)
+    density_tiles.ensure_table(con, 'live_buses')
+
+    def add(lat, lon):
+        con.register('new_rows', pd.DataFrame({'latitude': lat, 'longitude': lon}))
+        density_tiles.upsert(con, 'new_rows')
+        con.unregister('new_rows')
+
+    # Two pings in one cell, one ~1 km away; a (0, 0) placeholder is ignored
+    add([3.1500, 3.1500, 3.1600, 0.0], [101.6500, 101.6500, 101.6600, 0.0])
+    per_zoom = dict(con.execute(f"SELECT zoom, sum(pings) FROM {density_tiles.DENSITY_CELL_TABLE} GROUP BY zoom").fetchall())
+    assert set(per_zoom) == set(range(density_tiles.DENSITY_MIN_ZOOM, density_tiles.DENSITY_MAX_ZOOM + 1))
+    assert set(per_zoom.values()) == {3}
+    top = density_tiles.DENSITY_MAX_ZOOM
+    assert sorted(p for (p,) in con.execute(
+        f"SELECT pings FROM {density_tiles.DENSITY_CELL_TABLE} WHERE zoom = ?", [top]).fetchall()) == [1, 2]
+
+    x, y = geo.to_web_mercator(3.15, 101.65)
+    tile = (top, int(x * 2 ** top), int(y * 2 ** top))
+    con.close()
+    png, pings = density_tiles.tile_png(*tile)
+    image = _decode(png)
+    assert image.shape == (256, 256, 4) and pings >= 2
+    visible = int((image[..., 3] > 0).sum())
+    assert visible > 0 and visible % density_tiles.CELL_PX ** 2 == 0
+
+    # New pings change the tile's total, so it is re-rendered
+    con = duckdb.connect(path)
+    add([3.1500], [101.6500])
+    con.close()
+    png2, pings2 = density_tiles.tile_png(*tile)
+    assert pings2 == pings + 1 and png2 != png
+    assert density_tiles.tile_png(density_tiles.DENSITY_MIN_ZOOM, 0, 0) == (density_tiles.EMPTY_TILE, 0)
+
+    overlay = density_tiles.render_area(3.15, 101.65, 3.16, 101.66)
+    west, south, east, north = overlay[1]
+    assert west < 101.65 < 101.66 < east and south < 3.15 < 3.16 < north
@@ -0,0 +1,63 @@
+# tests/test_feed_archive.py
+from utils import db, density_tiles, feed_archive, gtfs_static, history_api, ingestion, motion, trips
+from google.transit import gtfs_realtime_pb2
+import duckdb
+import os
+
+def _feed(cycle_ts, positions):
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = '2.0'
+    feed.header.timestamp = cycle_ts
+    for vehicle_id, lat, lon in positions:
+        entity = feed.entity.add(id=vehicle_id)
+        entity.vehicle.vehicle.id = vehicle_id
+        entity.vehicle.position.latitude = lat
+        entity.vehicle.position.longitude = lon
+        entity.vehicle.timestamp = cycle_ts - 5
+        entity.vehicle.trip.trip_id = 'T1'
+    return feed.SerializeToString()
+
+def test_record_then_replay(tmp_path, monkeypatch):
+    archive = str(tmp_path / 'archive')
+    database = str(tmp_path / 'replay.duckdb')
+    monkeypatch.setattr(ingestion, 'API_SOURCES', {'Rapid Bus KL': ['prasarana?category=rapid-bus-kl'],
+                                                   'myBAS Johor': ['mybas-johor']})
+    monkeypatch.setattr(ingestion, 'INGEST_WORKERS', 0)
+    # --database retargets these; restored after the test
+    for module in (ingestion, db, density_tiles, history_api):
+        monkeypatch.setattr(module, 'DATABASE_NAME', module.DATABASE_NAME)
+    monkeypatch.setattr(gtfs_static, 'get_cached_index', lambda slug, kind, build: None)
+    motion.reset_state()
+    trips.reset_state()
+
+    # Two cycles; Johor's fetch failed in the second one
+    feed_archive.record(archive, 'Rapid Bus KL', 'prasarana?category=rapid-bus-kl',
+                        _feed(1735689600, [('A', 3.10, 101.60), ('B', 3.20, 101.70)]), 1735689600)
+    feed_archive.record(archive, 'myBAS Johor', 'mybas-johor', _feed(1735689600, [('J', 1.50, 103.70)]), 1735689600)
+    feed_archive.record(archive, 'Rapid Bus KL', 'prasarana?category=rapid-bus-kl',
+                        _feed(1735689630, [('A', 3.11, 101.60)]), 1735689630)
+    assert [(ts, sorted(region for region, _ in paths)) for ts, paths in feed_archive.load_cycles(archive)] == [
+        (1735689600, ['Rapid Bus KL', 'myBAS Johor']), (1735689630, ['Rapid Bus KL'])]
+
+    feed_archive.main([archive, '--speed', 'max', '--database', database])
+    assert ingestion.DATABASE_NAME == db.DATABASE_NAME == density_tiles.DATABASE_NAME == history_api.DATABASE_NAME == database
+    con = duckdb.connect(database)
+    rows = con.execute("SELECT vehicle_id, timestamp, insert_timestamp FROM live_buses ORDER BY insert_timestamp, vehicle_id").fetchall()
+    con.close()
+    assert rows == [('A', '1735689595', 1735689600), ('B', '1735689595', 1735689600), ('J', '1735689595', 1735689600),
+                    ('A', '1735689625', 1735689630)]
+    motion.reset_state()
+    trips.reset_state()
+
+def test_prune_by_age_then_size(tmp_path):
+    archive = str(tmp_path)
+    for day in ['20250101', '20250102', '20250103', '20250110']:
+        os.makedirs(os.path.join(archive, day))
+        with open(os.path.join(archive, day, 'payload.pb.gz'), 'wb') as fh:
+            fh.write(b'x' * 1000)
+
+    now = 1736467200   # 2025-01-10 00:00 UTC
+    assert feed_archive.prune(archive, now, max_days=8, max_bytes=0) == ['20250101']
+    # The current day is kept even when it alone is over the cap
+    assert feed_archive.prune(archive, now, max_days=0, max_bytes=1500) == ['20250102', '20250103']
+    assert sorted(os.listdir(archive)) == ['20250110']
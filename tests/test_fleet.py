@@ -0,0 +1,54 @@
+# tests/test_fleet.py
+from utils import fleet
+import numpy as np
+import pandas as pd
+import pytest
+
+def _batch(rows):
+    return pd.DataFrame(rows, columns=['region', 'vehicle_id', 'latitude', 'longitude', 'speed', 'timestamp'])
+
+def test_from_frame_keeps_latest_per_vehicle_sorted_by_region():
+    snapshot = fleet.FleetSnapshot.from_frame(_batch([
+        ('myBAS Johor', 'J1', 1.50, 103.70, 0.0, '1000'),
+        ('Rapid Bus KL', 'A', 3.10, 101.60, 5.0, '1000'),
+        ('Rapid Bus KL', 'A', 3.11, 101.61, 6.0, '1020'),
+        ('Rapid Bus KL', 'B', 3.20, 101.70, 0.0, '1010'),
+        ('Rapid Bus KL', 'OLD', 3.30, 101.80, 0.0, '900'),    # outside the live window
+        ('Rapid Bus KL', 'BAD', 3.30, 101.80, 0.0, 'n/a'),
+    ]))
+
+    assert snapshot.sync_ts == 1020
+    assert snapshot.regions == ['Rapid Bus KL', 'myBAS Johor']
+    assert snapshot.metrics() == {'total': 3, 'regions': 2, 'busiest': 'Rapid Bus KL'}
+
+    kl = snapshot.frame('Rapid Bus KL')
+    assert sorted(kl['vehicle_id'].astype(str)) == ['A', 'B']
+    assert kl.set_index('vehicle_id').loc['A', 'timestamp'] == 1020
+    assert kl['latitude'].dtype == np.float32
+    assert snapshot.frame('myBAS Johor')['vehicle_id'].tolist() == ['J1']
+    assert snapshot.frame('Nowhere').empty
+    assert len(snapshot.frame()) == 3
+
+    with pytest.raises(ValueError):
+        snapshot.columns['latitude'][0] = 0.0
+
+def test_publish_carries_vehicles_until_they_leave_the_window(monkeypatch):
+    monkeypatch.setattr(fleet, '_snapshot', None)
+
+    first = fleet.publish(_batch([
+        ('Rapid Bus KL', 'A', 3.10, 101.60, 5.0, '1000'),
+        ('myBAS Johor', 'J1', 1.50, 103.70, 0.0, '1000'),
+    ]))
+    assert first.version == 1
+
+    # The KL endpoint failed this cycle: A is carried over from the last snapshot
+    second = fleet.publish(_batch([('myBAS Johor', 'J1', 1.51, 103.71, 4.0, '1030')]))
+    assert second.version == 2 and fleet.current() is second
+    assert second.frame('Rapid Bus KL')['vehicle_id'].tolist() == ['A']
+    johor = second.frame('myBAS Johor')
+    assert johor['timestamp'].tolist() == [1030] and johor['speed'].tolist() == [4.0]
+
+    # Once A's last position is more than LIVE_WINDOW_SECONDS old it is dropped
+    third = fleet.publish(_batch([('myBAS Johor', 'J1', 1.52, 103.72, 4.0, str(1000 + fleet.LIVE_WINDOW_SECONDS + 1))]))
+    assert third.regions == ['myBAS Johor']
+    assert first.frame('Rapid Bus KL')['vehicle_id'].tolist() == ['A']   # published snapshots never change
@@ -0,0 +1,70 @@
+# tests/test_geofence.py
+from utils import geofence
+import json
+import numpy as np
+import pandas as pd
+import pytest
+
+def _square(lon0, lat0, size):
+    return [[lon0, lat0], [lon0 + size, lat0], [lon0 + size, lat0 + size], [lon0, lat0 + size], [lon0, lat0]]
+
+def _index(tmp_path):
+    collection = {'type': 'FeatureCollection', 'features': [
+        # 0.1° square with a 0.02° hole in the middle
+        {'type': 'Feature', 'properties': {'id': 'zone', 'name': 'Zone'},
+         'geometry': {'type': 'Polygon', 'coordinates': [_square(101.6, 3.0, 0.1), _square(101.64, 3.04, 0.02)]}},
+        {'type': 'Feature', 'properties': {'id': 'depot', 'kind': 'depot', 'region': 'Rapid Bus KL'},
+         'geometry': {'type': 'MultiPolygon', 'coordinates': [[_square(101.61, 3.01, 0.01)], [_square(101.8, 3.2, 0.01)]]}},
+        {'type': 'Feature', 'properties': {'id': 'line'}, 'geometry': {'type': 'LineString', 'coordinates': [[0, 0], [1, 1]]}},
+    ]}
+    path = tmp_path / 'fences.geojson'
+    path.write_text(json.dumps(collection))
+    return geofence.load_geojson(str(path))
+
+def test_batch_point_in_polygon(tmp_path):
+    index = _index(tmp_path)
+    assert index.fences['fence_id'].tolist() == ['zone', 'depot']
+
+    lat = np.array([3.015, 3.05, 3.205, 3.5, np.nan])
+    lon = np.array([101.615, 101.65, 101.805, 101.65, 101.65])
+    point, fence = index.contains(lat, lon)
+    pairs = sorted(zip(point.tolist(), index.fences['fence_id'].to_numpy()[fence].tolist()))
+    # In the hole, outside everything and NaN match nothing
+    assert pairs == [(0, 'depot'), (0, 'zone'), (2, 'depot')]
+
+def test_enter_and_exit_events(tmp_path):
+    index = _index(tmp_path)
+    geofence.reset_state()
+
+    def batch(region, lat, lon, ts):
+        return pd.DataFrame({'region': region, 'vehicle_id': 'V1', 'latitude': [lat], 'longitude': [lon], 'timestamp': [str(ts)]})
+
+    events = geofence.update_geofences(batch('Rapid Bus KL', 3.015, 101.615, 1000), 1000, index)
+    assert sorted(events['fence_id']) == ['depot', 'zone'] and set(events['event']) == {'enter'}
+
+    events = geofence.update_geofences(batch('Rapid Bus KL', 3.03, 101.63, 1300), 1300, index)
+    assert events[['fence_id', 'event', 'dwell_s']].values.tolist() == [['depot', 'exit', 300.0]]
+    assert geofence.vehicles_in('zone')['since'].tolist() == [1000]
+
+    # The depot only applies to Rapid Bus KL vehicles
+    events = geofence.update_geofences(batch('myBAS Seremban', 3.015, 101.615, 1300), 1300, index)
+    assert events['fence_id'].tolist() == ['zone']
+    geofence.reset_state()
+
+def test_repeated_id_is_rejected(tmp_path, monkeypatch):
+    collection = {'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'properties': {'id': 'depot'}, 'geometry': {'type': 'Polygon', 'coordinates': [_square(101.6, 3.0, 0.1)]}},
+        {'type': 'Feature', 'properties': {'id': 'depot'}, 'geometry': {'type': 'Polygon', 'coordinates': [_square(101.65, 3.05, 0.1)]}},
+    ]}
+    path = tmp_path / 'fences.geojson'
+    path.write_text(json.dumps(collection))
+    with pytest.raises(ValueError, match='depot'):
+        geofence.load_geojson(str(path))
+
+    # get_index reports it and disables geofencing, so ingest cycles carry on
+    monkeypatch.setattr(geofence, 'GEOFENCES_PATH', str(path))
+    monkeypatch.setitem(geofence._INDEX, 'key', None)
+    assert geofence.get_index() is None
+    batch = pd.DataFrame({'region': 'Rapid Bus KL', 'vehicle_id': 'V1', 'latitude': [3.07],
+                          'longitude': [101.67], 'timestamp': ['1000']})
+    assert geofence.update_geofences(batch, 1000).empty
@@ -0,0 +1,65 @@
+# tests/test_headways.py
+from utils import headways, schedule
+from datetime import date
+import numpy as np
+import pandas as pd
+
+class _EveryTenMinutesOnS1:
+    def at(self, shape_ids, time_of_day, service_date=None):
+        return np.where(np.asarray(shape_ids) == 'S1', 600.0, np.nan)
+
+def test_gaps_flagged_against_scheduled_headway(monkeypatch):
+    monkeypatch.setattr(headways, 'get_scheduled_headways', lambda slug: _EveryTenMinutesOnS1())
+
+    batch = pd.DataFrame({
+        'region': 'Rapid Bus KL',
+        'vehicle_id': ['C', 'A', 'B', 'D', 'E', 'F'],
+        'route_id': 'R1',
+        'shape_id': ['S1', 'S1', 'S1', 'S1', 'S2', 'S2'],
+        'shape_dist_m': [3000.0, 0.0, 100.0, 9000.0, 0.0, 200.0],
+        'speed': 5.0,
+        'timestamp': '1735686000',
+    })
+    result = headways.compute_headways(batch, 1735686000)
+
+    assert result['vehicle_id'].tolist() == ['A', 'B', 'C', 'E']
+    assert result['leader_id'].tolist() == ['B', 'C', 'D', 'F']
+    assert result['gap_m'].tolist() == [100.0, 2900.0, 6000.0, 200.0]
+    assert result['headway_s'].tolist() == [20.0, 580.0, 1200.0, 40.0]
+    # S2 has no schedule, so only the distance fallback applies
+    assert result['status'].tolist() == ['bunched', 'ok', 'gap', 'bunched']
+
+class _OneShape:
+    trip_shape = pd.Series(0, index=[f'T{i}' for i in range(9)])
+    shape_ids = ['S1']
+
+def test_scheduled_headway_follows_the_calendar():
+    # Weekday trips every 10 minutes from 08:00, weekend every 30, one
+    # weekday trip past midnight; 2025-01-01 is a holiday run as a weekend
+    departures = ['08:00:00', '08:10:00', '08:20:00', '08:30:00', '24:10:00', '24:20:00',
+                  '08:00:00', '08:30:00', '09:00:00']
+    services = ['WD'] * 6 + ['WE'] * 3
+    stop_times = pd.DataFrame({
+        'trip_id': np.repeat([f'T{i}' for i in range(9)], 2),
+        'arrival_time': np.repeat(departures, 2), 'departure_time': np.repeat(departures, 2),
+        'stop_id': ['A', 'B'] * 9, 'stop_sequence': ['1', '2'] * 9,
+    })
+    stops = pd.DataFrame({'stop_id': ['A', 'B'], 'stop_name': '', 'stop_lat': '3.1', 'stop_lon': ['101.6', '101.7']})
+    calendar = pd.DataFrame({
+        'service_id': ['WD', 'WE'], 'start_date': '20240101', 'end_date': '20251231',
+        'monday': ['1', '0'], 'tuesday': ['1', '0'], 'wednesday': ['1', '0'], 'thursday': ['1', '0'],
+        'friday': ['1', '0'], 'saturday': ['0', '1'], 'sunday': ['0', '1'],
+    })
+    calendar_dates = pd.DataFrame({'service_id': ['WD', 'WE'], 'date': '20250101', 'exception_type': ['2', '1']})
+    table = headways.ScheduledHeadways(
+        schedule.StopTimeTable(stop_times, stops), _OneShape(),
+        pd.DataFrame({'trip_id': [f'T{i}' for i in range(9)], 'service_id': services}), calendar, calendar_dates,
+    )
+
+    at = lambda seconds, day: table.at(['S1'], np.array([seconds]), day)[0]
+    assert at(8 * 3600 + 300, date(2025, 1, 6)) == 600.0      # Monday
+    assert at(8 * 3600 + 300, date(2025, 1, 4)) == 1800.0     # Saturday
+    assert at(8 * 3600 + 300, date(2025, 1, 1)) == 1800.0     # holiday
+    # Friday's after-midnight trips run early on Saturday
+    assert at(15 * 60, date(2025, 1, 4)) == 600.0
+    assert np.isnan(at(15 * 60, date(2025, 1, 6)))
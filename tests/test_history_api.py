@@ -0,0 +1,65 @@
+# tests/test_history_api.py
+from utils import history_api
+from utils.writer import migrate_schema
+import duckdb
+import io
+import pyarrow as pa
+import urllib.error
+import urllib.request
+import pytest
+
+MIGRATED_AT = 1_800_000_000
+
+def _database(tmp_path, monkeypatch):
+    database = str(tmp_path / 'test.duckdb')
+    monkeypatch.setattr(history_api, 'DATABASE_NAME', database)
+    monkeypatch.setattr(history_api, '_MIGRATION_STAMPS', {})
+    con = duckdb.connect(database)
+    # Positions stored before insert_timestamp existed, migrated long after they were recorded
+    con.execute("CREATE TABLE live_buses (region VARCHAR, vehicle_id VARCHAR, timestamp VARCHAR, latitude DOUBLE, longitude DOUBLE)")
+    con.execute("INSERT INTO live_buses VALUES ('Rapid Bus KL', 'OLD1', '1700000000', 3.1, 101.6), ('myBAS Johor', 'OLD2', '1700000100', 1.5, 103.7)")
+    migrate_schema(con, 'live_buses', MIGRATED_AT)
+    con.execute("""
+        INSERT INTO live_buses (region, vehicle_id, timestamp, latitude, longitude, insert_timestamp)
+        VALUES ('Rapid Bus KL', 'NEW1', '1800000500', 3.2, 101.7, 1800000510)
+    """)
+    con.close()
+    return database
+
+def test_read_history_keeps_migrated_rows(tmp_path, monkeypatch):
+    _database(tmp_path, monkeypatch)
+
+    table = history_api.read_history(end=1700000500, columns=['vehicle_id']).read_all()
+    assert sorted(table['vehicle_id'].to_pylist()) == ['OLD1', 'OLD2']
+
+    table = history_api.read_history(start=1700000050, regions=['myBAS Johor'], columns=['vehicle_id', 'timestamp']).read_all()
+    assert table.column_names == ['vehicle_id', 'timestamp']
+    assert table['vehicle_id'].to_pylist() == ['OLD2']
+
+    table = history_api.read_history(start=1800000000, end=1800001000).read_all()
+    assert table['vehicle_id'].to_pylist() == ['NEW1']
+
+    with pytest.raises(ValueError):
+        history_api.read_history(columns=['nope'])
+
+def test_history_endpoint(tmp_path, monkeypatch):
+    _database(tmp_path, monkeypatch)
+    monkeypatch.setattr(history_api.http_endpoint, '_servers', {})
+    server = history_api.start_http_server(0)
+    base = f'http://127.0.0.1:{server.server_address[1]}/history'
+    try:
+        with urllib.request.urlopen(f'{base}?end=1700000500&vehicle_id=OLD1&columns=vehicle_id,latitude') as response:
+            assert response.headers['Content-Type'] == 'application/vnd.apache.arrow.stream'
+            table = pa.ipc.open_stream(io.BytesIO(response.read())).read_all()
+        assert table.to_pylist() == [{'vehicle_id': 'OLD1', 'latitude': 3.1}]
+
+        with urllib.request.urlopen(f'{base}?format=parquet') as response:
+            import pyarrow.parquet as pq
+            assert pq.read_table(io.BytesIO(response.read())).num_rows == 3
+
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f'{base}?columns=nope')
+        assert error.value.code == 400
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,40 @@
+# tests/test_keyframes.py
+from utils import db, keyframes
+from utils.writer import BufferedWriter
+import duckdb
+import pandas as pd
+
+def _batch(rows):
+    df = pd.DataFrame(rows, columns=['vehicle_id', 'latitude', 'timestamp'])
+    return df.assign(region='Rapid Bus KL', longitude=101.6, bearing=0.0, speed=0.0, timestamp=df['timestamp'].astype(str))
+
+def test_keyframe_upsert_and_seek(tmp_path, monkeypatch):
+    database = str(tmp_path / 'test.duckdb')
+    monkeypatch.setattr(db, 'DATABASE_NAME', database)
+    bucket = keyframes.KEYFRAME_BUCKET_SECONDS
+    writer = BufferedWriter(database, 'live_buses', max_rows=100, max_seconds=3600)
+
+    writer.append(_batch([('A', 3.10, 10 * bucket + 5), ('B', 3.20, 10 * bucket + 10)]), 0)
+    writer.flush()
+    # Re-served ping, a newer one in the same bucket, and a late older one
+    writer.append(_batch([('A', 3.10, 10 * bucket + 5), ('A', 3.11, 10 * bucket + 20), ('A', 3.09, 10 * bucket + 1)]), 0)
+    writer.flush()
+    writer.append(_batch([('A', 3.12, 11 * bucket + 5)]), 0)
+    writer.flush()
+
+    con = duckdb.connect(database)
+    rows = con.execute(f"SELECT bucket_ts, vehicle_id, latitude, timestamp FROM {keyframes.KEYFRAME_TABLE} ORDER BY bucket_ts, vehicle_id").fetchall()
+    con.close()
+    # One row per vehicle per bucket, holding its newest position
+    assert rows == [(10 * bucket, 'A', 3.11, 10 * bucket + 20), (10 * bucket, 'B', 3.20, 10 * bucket + 10),
+                    (11 * bucket, 'A', 3.12, 11 * bucket + 5)]
+
+    def seek(ts, window=60):
+        fleet = db.get_fleet_at(ts, window)
+        return dict(zip(fleet['vehicle_id'], fleet['timestamp']))
+
+    assert seek(10 * bucket + 25) == {'A': 10 * bucket + 20, 'B': 10 * bucket + 10}
+    assert seek(11 * bucket + 10) == {'A': 11 * bucket + 5, 'B': 10 * bucket + 10}
+    # B's last position is now more than a minute old
+    assert seek(10 * bucket + 75) == {'A': 11 * bucket + 5}
+    assert seek(5 * bucket) == {}
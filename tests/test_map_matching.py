@@ -0,0 +1,46 @@
+# tests/test_map_matching.py
+from utils.map_matching import ShapeIndex
+import numpy as np
+import pandas as pd
+
+def _straight_shape():
+    # ~55 m between points along lat 3.1, heading east
+    return pd.DataFrame({
+        'shape_id': ['S1'] * 100,
+        'shape_pt_lat': ['3.1'] * 100,
+        'shape_pt_lon': [str(101.6 + i * 0.0005) for i in range(100)],
+        'shape_pt_sequence': [str(i) for i in range(100)],
+    })
+
+def test_snap_to_shape():
+    index = ShapeIndex(_straight_shape(), pd.DataFrame({'trip_id': ['T1'], 'shape_id': ['S1']}))
+    result = index.match(
+        np.array(['T1', 'T1', 'unknown']),
+        np.array([3.1003, 3.2, 3.1]),
+        np.array([101.61, 101.61, 101.61]),
+    )
+    assert result['shape_id'].tolist() == ['S1', '', '']
+    assert abs(result['cross_track_m'][0] - 33.4) < 1
+    assert abs(result['shape_dist_m'][0] - 1111) < 5
+    assert result['snapped_latitude'][0] == 3.1
+    assert np.isnan(result['shape_dist_m'][1])
+
+def test_long_diagonal_segment_grid_stays_linear():
+    # Two points ~78 km apart, like a sparse rail shape
+    shape = pd.DataFrame({
+        'shape_id': ['K1', 'K1'], 'shape_pt_lat': ['3.0', '3.5'],
+        'shape_pt_lon': ['101.0', '101.5'], 'shape_pt_sequence': ['1', '2'],
+    })
+    index = ShapeIndex(shape, pd.DataFrame({'trip_id': ['T1'], 'shape_id': ['K1']}))
+    length = index.seg_len[0]
+    assert length > 75_000
+    # A bounding-box registration would need (length / cell / sqrt 2) ** 2 ≈ 75k cells
+    assert len(index.cell_keys) < 4 * length / index.cell_m
+
+    # Points along the line, and ~100 m off it, still find the segment
+    t = np.array([0.0, 0.25, 0.5, 0.999])
+    lat, lon = 3.0 + 0.5 * t, 101.0 + 0.5 * t
+    result = index.match(np.array(['T1'] * 5), np.r_[lat, 3.25 + 0.0009], np.r_[lon, 101.25 - 0.0009])
+    assert (result['shape_id'] == 'K1').all()
+    assert np.allclose(result['shape_dist_m'][:4], t * length, atol=length * 0.002)
+    assert abs(result['cross_track_m'][4] - 141) < 10
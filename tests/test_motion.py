@@ -0,0 +1,28 @@
+# tests/test_motion.py
+from utils import data_processor, motion
+import numpy as np
+import pandas as pd
+
+def _batch(rows):
+    df = pd.DataFrame(rows, columns=['vehicle_id', 'latitude', 'longitude', 'timestamp'])
+    return df.assign(region='Rapid Bus KL', speed=0.0, timestamp=df['timestamp'].astype(str))
+
+def test_speed_heading_and_dwell_across_batches():
+    motion.reset_state()
+    first = motion.derive_motion(_batch([('V1', 3.100, 101.6, 1000)]))
+    assert first[motion.MOTION_COLUMNS].isna().all(axis=None)
+
+    # ~111 m due north in 20 s, then parked
+    second = motion.derive_motion(_batch([('V1', 3.101, 101.6, 1020), ('V1', 3.101, 101.6, 1040)]))
+    assert np.allclose(second['derived_speed'], [111.2 / 20, 0.0], atol=0.05)
+    assert abs(second['derived_bearing'][0]) < 0.01 and np.isnan(second['derived_bearing'][1])
+    assert second['dwell_seconds'].tolist() == [0.0, 20.0]
+    # The feed reports 0, so the display speed falls back to the derived one
+    assert data_processor.speed_kmh(second).tolist() == [20.0, 0.0]
+
+    # Re-served ping is skipped, the dwell carries over, a long gap resets
+    third = motion.derive_motion(_batch([('V1', 3.101, 101.6, 1040), ('V1', 3.101, 101.6, 1060), ('V1', 3.101, 101.6, 1500)]))
+    assert np.isnan(third['dwell_seconds'][0]) and third['dwell_seconds'][1] == 40.0
+    assert third[motion.MOTION_COLUMNS].iloc[2].isna().all()
+    assert motion.last_known(_batch([('V1', 0, 0, 0)]))['timestamp'].tolist() == [1500]
+    motion.reset_state()
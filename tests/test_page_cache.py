@@ -0,0 +1,54 @@
+# tests/test_page_cache.py
+from concurrent.futures import ThreadPoolExecutor
+from utils import db, page_cache
+import threading
+import time
+import pandas as pd
+
+def test_one_computation_per_version_across_sessions(monkeypatch):
+    calls = []
+
+    def get_historical_data():
+        calls.append(1)
+        time.sleep(0.05)   # long enough for every session to miss together
+        return pd.DataFrame({
+            'region': ['Rapid Bus KL', 'Rapid Bus KL', 'myBAS Ipoh'],
+            'vehicle_id': ['V1', 'V2', 'V3'],
+            'latitude': [3.1, 3.2, 4.6], 'longitude': [101.6, 101.7, 101.1], 'bearing': [0.0, 90.0, 180.0],
+            'speed': [10.0, 0.0, 5.0], 'timestamp': [1000, 1010, 1020],
+        }), {}, '1 Jan 1970 08:17:00'
+
+    monkeypatch.setattr(db, 'get_historical_data', get_historical_data)
+    page_cache.history.clear()
+    page_cache.analytics.clear()
+    page_cache.table_page.clear()
+
+    with ThreadPoolExecutor(10) as pool:
+        results = list(pool.map(lambda _: page_cache.analytics(('v1',)), range(10)))
+    assert len(calls) == 1
+    assert all(r['total_vehicles'] == 3 for r in results)
+    assert results[0]['moving_speed'] == {'max': 36.0, 'min': 18.0, 'avg': 27.0, 'median': 27.0}
+
+    display_df, csv = page_cache.table_page(('v1',), ('Rapid Bus KL',))
+    assert display_df['Vehicle ID'].tolist() == ['V2', 'V1'] and csv.startswith(b'Region,')
+    assert page_cache.history_regions(('v1',)) == ['Rapid Bus KL', 'myBAS Ipoh']
+    assert len(calls) == 1
+
+    # A new version is read again
+    page_cache.analytics(('v2',))
+    assert len(calls) == 2
+
+def test_refresh_runs_one_cycle_for_concurrent_sessions(monkeypatch):
+    import utils.ingestion
+    cycles = []
+    monkeypatch.setattr(utils.ingestion, 'fetch_and_store_transit_data', lambda: (cycles.append(1), time.sleep(0.05)))
+    monkeypatch.setattr(page_cache, '_last_refresh', 0.0)
+
+    threads = [threading.Thread(target=page_cache.refresh) for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(cycles) == 1
+    assert page_cache.refresh(min_interval=0)
+    assert len(cycles) == 2
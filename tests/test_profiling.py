@@ -0,0 +1,45 @@
+# tests/test_profiling.py
+from concurrent.futures import ThreadPoolExecutor
+from utils import profiling
+import threading
+import tracemalloc
+import duckdb
+
+def test_concurrent_calls_share_tracing_and_explain_off_the_call(tmp_path, monkeypatch):
+    database = str(tmp_path / 'profile.duckdb')
+    con = duckdb.connect(database)
+    con.execute("CREATE TABLE t AS SELECT range AS x FROM range(1000)")
+    con.close()
+    monkeypatch.setattr(profiling, '_enabled', True)
+    monkeypatch.setattr(profiling, 'DB_PROFILE_LOG', str(tmp_path / 'profile.log'))
+    monkeypatch.setattr(profiling, '_recent', profiling.deque(maxlen=10))
+    assert not tracemalloc.is_tracing()
+
+    inside = threading.Barrier(2)
+
+    @profiling.profiled(lambda: duckdb.connect(database))
+    def count_rows():
+        con = profiling.wrap_connection(duckdb.connect(database))
+        try:
+            inside.wait(timeout=5)   # both calls are traced at the same time
+            assert tracemalloc.is_tracing()
+            return con.execute("SELECT count(*) FROM t").fetchone()[0]
+        finally:
+            con.close()
+
+    with ThreadPoolExecutor(2) as pool:
+        assert list(pool.map(lambda _: count_rows(), range(2))) == [1000, 1000]
+    # Neither call stopped the other's trace; the last one out stopped it
+    assert not tracemalloc.is_tracing()
+    records = profiling.recent_profiles()
+    assert len(records) == 2 and all(r['peak_memory_shared'] for r in records)
+
+    # A slow call returns before EXPLAIN ANALYZE runs; the record follows
+    monkeypatch.setattr(profiling, 'DB_SLOW_QUERY_MS', 0)
+    inside = threading.Barrier(1)
+    assert count_rows() == 1000
+    profiling._explain_executor.submit(lambda: None).result()   # drain the background queue
+    slow = profiling.recent_profiles()[-1]
+    assert slow['slow'] and not slow['peak_memory_shared']
+    plan = slow['queries'][0]['explain_analyze']
+    assert plan and not plan.startswith(('unavailable', 'skipped'))
@@ -0,0 +1,51 @@
+# tests/test_render_budget.py
+from utils import render_budget
+import pandas as pd
+
+def _frame():
+    # V0-V2 stopped, V3-V5 moving; V0 and V3 last reported 10 minutes before the rest
+    return pd.DataFrame({
+        'vehicle_id': [f'V{i}' for i in range(6)],
+        'latitude': [3.1000, 3.1001, 3.2000, 3.1002, 3.3000, 3.4000],
+        'longitude': [101.6000, 101.6001, 101.7000, 101.6002, 101.8000, 101.9000],
+        'bearing': 0.0,
+        'speed': [0.0, 0.0, 0.0, 20.0, 30.0, 40.0],
+        'timestamp': [1000, 1600, 1590, 1000, 1580, 1595],
+    })
+
+def test_priority_and_cap():
+    df = _frame()
+    order = render_budget.priority_order(df)
+    # Moving and recent, moving, then stopped but recent (newest first), then the rest
+    assert df['vehicle_id'].take(order).tolist() == ['V5', 'V4', 'V3', 'V1', 'V2', 'V0']
+
+    shown = render_budget.select_points(df, 3)
+    assert shown['vehicle_id'].tolist() == ['V3', 'V4', 'V5']   # original order kept
+    assert render_budget.select_points(df, 10) is df
+    assert render_budget.select_points(df, 10, zoom=render_budget.MAP_FULL_DETAIL_ZOOM) is df
+
+def test_thinning_at_low_zoom():
+    df = _frame()
+    # At zoom 8 V0, V1 and V3 (~30 m apart) share a screen cell; the moving V3 is kept
+    shown = render_budget.select_points(df, 10, zoom=8)
+    assert shown['vehicle_id'].tolist() == ['V2', 'V3', 'V4', 'V5']
+
+def test_cap_adapts_to_render_time(monkeypatch):
+    monkeypatch.setattr(render_budget, 'MAP_MAX_POINTS', 3000)
+    monkeypatch.setattr(render_budget, 'MAP_MIN_POINTS', 250)
+    assert render_budget.next_cap(3000, 4000, budget_ms=2000) == 1200
+    assert render_budget.next_cap(300, 10_000, budget_ms=2000) == 250
+    assert render_budget.next_cap(1200, 1500, budget_ms=2000) == 1200
+    assert render_budget.next_cap(1200, 100, budget_ms=2000) == 1800
+    assert render_budget.next_cap(2500, 100, budget_ms=2000) == 3000
+
+def test_fit_zoom_to_region_extent():
+    # ~0.5° across (Klang Valley) fits 500 px at zoom 10, below full detail, so thinning runs
+    lat = [2.9 + i * 0.005 for i in range(100)]
+    lon = [101.4 + i * 0.005 for i in range(100)]
+    assert render_budget.fit_zoom(lat, lon, 13, viewport_px=500) == 10
+    assert render_budget.fit_zoom(lat, lon, 13, viewport_px=500) < render_budget.MAP_FULL_DETAIL_ZOOM
+    # A single stray fix far away doesn't zoom out to the whole country
+    assert render_budget.fit_zoom(lat + [6.4], lon + [100.2], 13, viewport_px=500) == 10
+    # A small cluster is capped at the default zoom
+    assert render_budget.fit_zoom([3.1, 3.1001], [101.6, 101.6001], 13) == 13
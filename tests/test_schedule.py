@@ -0,0 +1,66 @@
+# tests/test_schedule.py
+from utils import gtfs_static, schedule
+import pandas as pd
+
+# 2025-01-01 08:00 local (UTC+8)
+EIGHT_AM = 1735689600
+
+def _table(version=1.0):
+    stop_times = pd.DataFrame({
+        'trip_id': 'T1',
+        'arrival_time': ['08:00:00', '08:10:00', '08:20:00'],
+        'departure_time': ['08:00:00', '08:10:00', '08:20:00'],
+        'stop_id': ['A', 'B', 'C'],
+        'stop_sequence': ['1', '2', '3'],
+    })
+    stops = pd.DataFrame({
+        'stop_id': ['A', 'B', 'C'], 'stop_name': ['Alpha', 'Bravo', 'Charlie'],
+        'stop_lat': ['3.10', '3.10', '3.10'], 'stop_lon': ['101.60', '101.62', '101.64'],
+    })
+    return schedule.StopTimeTable(stop_times, stops, version=version)
+
+def _batch(vehicle_ids, lon, ts):
+    return pd.DataFrame({
+        'region': 'Rapid Bus KL', 'vehicle_id': vehicle_ids, 'trip_id': 'T1',
+        'latitude': 3.10, 'longitude': lon, 'timestamp': [str(t) for t in ts],
+    })
+
+def _use_table(monkeypatch, table):
+    monkeypatch.setattr(gtfs_static, 'STATIC_API_SOURCES', {'Rapid Bus KL': 'rapid-bus-kl'})
+    monkeypatch.setattr(schedule, 'get_stop_time_table', lambda slug: table)
+
+def test_delay_predictions_and_pruning(monkeypatch):
+    _use_table(monkeypatch, _table())
+    schedule.reset_state()
+
+    # V1 at Bravo two minutes late; its earlier ping in the same batch is superseded
+    df = schedule.update_adherence(_batch(['V1', 'V1', 'V2'], [101.60, 101.62, 101.64], [EIGHT_AM - 60, EIGHT_AM + 720, EIGHT_AM + 1200]))
+    assert df['schedule_delay_s'].tolist() == [-60.0, 120.0, 0.0]
+    assert schedule.get_vehicle_delay('Rapid Bus KL', 'V1') == 120.0
+
+    arrivals = schedule.predict_arrivals('Rapid Bus KL', 'V1')
+    assert arrivals['stop_name'].tolist() == ['Charlie']
+    assert arrivals['predicted_arrival'].tolist() == [EIGHT_AM + 720 + 600]
+    assert arrivals['scheduled_arrival'].tolist() == [EIGHT_AM + 1200]
+
+    # A ping off the schedule clears V2; V1 is pruned once quiet for DATA_MAX_AGE
+    schedule.update_adherence(_batch(['V2'], [101.64], [EIGHT_AM + 1200 + 4 * 3600]))
+    assert schedule.get_vehicle_delay('Rapid Bus KL', 'V2') is None
+    schedule.update_adherence(_batch(['V3'], [101.60], [EIGHT_AM + schedule.DATA_MAX_AGE + 721]))
+    assert schedule.get_vehicle_delay('Rapid Bus KL', 'V1') is None
+    assert schedule.get_vehicle_delay('Rapid Bus KL', 'V3') is not None
+    schedule.reset_state()
+
+def test_state_invalidated_when_table_reloads(monkeypatch):
+    _use_table(monkeypatch, _table(version=1.0))
+    schedule.reset_state()
+    schedule.update_adherence(_batch(['V1'], [101.62], [EIGHT_AM + 720]))
+    assert len(schedule.predict_arrivals('Rapid Bus KL', 'V1')) == 1
+
+    # A fresh ZIP: V1's next_row indexes the old table, so it is not used
+    _use_table(monkeypatch, _table(version=2.0))
+    assert schedule.predict_arrivals('Rapid Bus KL', 'V1').empty
+    schedule.update_adherence(_batch(['V2'], [101.60], [EIGHT_AM + 60]))
+    assert schedule.get_vehicle_delay('Rapid Bus KL', 'V1') is None
+    assert schedule.get_vehicle_delay('Rapid Bus KL', 'V2') == 60.0
+    schedule.reset_state()
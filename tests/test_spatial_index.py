@@ -0,0 +1,65 @@
+# tests/test_spatial_index.py
+from utils import fleet, spatial_index
+import pandas as pd
+
+def test_nearest_vehicles_follow_the_fleet_snapshot(monkeypatch):
+    monkeypatch.setattr(fleet, '_snapshot', None)
+    monkeypatch.setattr(spatial_index, '_vehicle_index_key', None)
+    # ~1.1 km, ~2.2 km and ~5.5 km north of the query point, plus one in Ipoh
+    fleet.publish(pd.DataFrame({
+        'region': ['Rapid Bus KL', 'Rapid Bus KL', 'Rapid Bus MRT Feeder', 'myBAS Ipoh'],
+        'vehicle_id': ['A', 'B', 'C', 'D'],
+        'latitude': [3.11, 3.12, 3.15, 4.6],
+        'longitude': [101.6, 101.6, 101.6, 101.1],
+        'timestamp': [1000, 1000, 1000, 1000],
+    }))
+    assert spatial_index.update_vehicle_index(fleet.current())
+    assert not spatial_index.update_vehicle_index(fleet.current())   # same snapshot: no rebuild
+
+    near = spatial_index.nearest_vehicles(3.1, 101.6, k=3)
+    assert near['vehicle_id'].astype(str).tolist() == ['A', 'B', 'C']
+    assert abs(near['distance_m'][0] - 1112) < 5
+    assert min(near['bearing_deg'][0], 360 - near['bearing_deg'][0]) < 1   # due north
+
+    # B's endpoint misses the next cycle and A moves next to the query point:
+    # B stays findable, A is found at its new position
+    snapshot = fleet.publish(pd.DataFrame({
+        'region': ['Rapid Bus KL', 'Rapid Bus MRT Feeder', 'myBAS Ipoh'],
+        'vehicle_id': ['A', 'C', 'D'],
+        'latitude': [3.1001, 3.15, 4.6],
+        'longitude': [101.6, 101.6, 101.1],
+        'timestamp': [1020, 1020, 1020],
+    }))
+    assert spatial_index.update_vehicle_index(snapshot)
+    near = spatial_index.nearest_vehicles(3.1, 101.6, k=2)
+    assert near['vehicle_id'].astype(str).tolist() == ['A', 'B']
+    assert near['distance_m'][0] < 20
+
+def test_nearest_stops_across_agencies(monkeypatch):
+    stops = {
+        'agency-a': pd.DataFrame({'stop_id': ['S1', 'S2'], 'stop_name': ['Pasar Seni', 'KL Sentral'],
+                                  'stop_lat': ['3.142', '3.134'], 'stop_lon': ['101.695', '101.686']}),
+        'agency-b': pd.DataFrame({'stop_id': ['S9'], 'stop_name': ['Ipoh'], 'stop_lat': ['4.6'], 'stop_lon': ['101.08']}),
+    }
+    loads = []
+
+    def load_table(slug, filename, columns=None):
+        loads.append((slug, filename))
+        return stops[slug]
+
+    monkeypatch.setattr(spatial_index.gtfs_static, 'STATIC_API_SOURCES', {'KL': 'agency-a', 'Ipoh': 'agency-b'})
+    monkeypatch.setattr(spatial_index.gtfs_static, 'is_cache_fresh', lambda slug: True)
+    monkeypatch.setattr(spatial_index.gtfs_static, 'cache_version', lambda slug: 1.0)
+    monkeypatch.setattr(spatial_index.gtfs_static, 'load_table', load_table)
+    monkeypatch.setattr(spatial_index.gtfs_static, '_INDEX_CACHE', {})
+    monkeypatch.setattr(spatial_index.gtfs_static, '_FAILED', {})
+    monkeypatch.setattr(spatial_index, '_stop_index', None)
+
+    near = spatial_index.nearest_stops(3.140, 101.693, k=2)
+    assert near['stop_name'].tolist() == ['Pasar Seni', 'KL Sentral']
+    assert near['region'].tolist() == ['KL', 'KL']
+    assert near['distance_m'].is_monotonic_increasing
+    far = spatial_index.nearest_stops(4.59, 101.08, k=1)
+    assert far['stop_id'].tolist() == ['S9'] and far['distance_m'][0] < 1200
+    # Only stops.txt is read, once per agency
+    assert sorted(loads) == [('agency-a', 'stops.txt'), ('agency-b', 'stops.txt')]
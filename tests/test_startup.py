@@ -0,0 +1,42 @@
+# tests/test_startup.py
+# Import-time budget for the app shell, measured with `python -X importtime`.
+import os
+import subprocess
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+# Modules only needed when data is fetched or a chart/map is drawn
+# (google.protobuf itself is pulled in by streamlit, so only the GTFS bindings are checked)
+DEFERRED_MODULES = {
+    'utils.ingestion', 'requests', 'google.transit',
+    'plotly.express', 'pydeck', 'streamlit_js_eval', 'streamlit_autorefresh',
+}
+
+# Ceiling on cumulative import time of all pages, in microseconds (about 2x the
+# ~1.17 s measured for all five pages once the heavy imports were deferred)
+PAGE_IMPORT_BUDGET_US = 2_400_000
+
+
+def import_times(statement):
+    """Run *statement* under -X importtime; return {module: cumulative_us}."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        cwd=SRC_DIR, capture_output=True, text=True, check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, _, cumulative, name = (part.strip() for part in line.replace('import time:', '|', 1).split('|'))
+        times[name] = int(cumulative)
+    return times
+
+
+def test_pages_defer_heavy_imports():
+    times = import_times('import app_pages.live_map, app_pages.data_table, app_pages.analytics, '
+                         'app_pages.routes, app_pages.pipeline_health')
+    assert not DEFERRED_MODULES & set(times)
+
+    page_us = sum(us for name, us in times.items() if name.startswith('app_pages.'))
+    assert page_us < PAGE_IMPORT_BUDGET_US
@@ -0,0 +1,91 @@
+# tests/test_trips.py
+from utils import db, trips
+from utils.writer import BufferedWriter
+import duckdb
+import pandas as pd
+import pytest
+
+def test_route_headways_per_direction(tmp_path, monkeypatch):
+    database = str(tmp_path / 'test.duckdb')
+    monkeypatch.setattr(db, 'DATABASE_NAME', database)
+
+    # Departures every 10 minutes each way, the two directions 5 minutes apart
+    starts = [0, 300, 600, 900, 1200, 1500]
+    closed = pd.DataFrame({
+        'region': 'Rapid Bus KL', 'vehicle_id': [f'V{i}' for i in range(6)], 'trip_id': [f'T{i}' for i in range(6)],
+        'route_id': 'R1', 'shape_id': ['out', 'back'] * 3, 'start_ts': starts, 'end_ts': [s + 1800 for s in starts],
+        'duration_s': 1800.0, 'distance_m': 9000.0, 'avg_speed_mps': 5.0, 'pings': 60,
+    })[trips.TRIP_COLUMNS]
+    con = duckdb.connect(database)
+    trips.store(con, closed)
+    con.close()
+
+    headways = db.get_route_headways('Rapid Bus KL')
+    assert headways['headway_s'].tolist() == [600] * 4
+
+def _pings(vehicle_id, trip_id, ts, lon):
+    return pd.DataFrame({
+        'region': 'Rapid Bus KL', 'vehicle_id': vehicle_id, 'trip_id': trip_id, 'route_id': 'R1', 'shape_id': 'S1',
+        'latitude': 3.1, 'longitude': lon, 'timestamp': [str(t) for t in ts],
+    })
+
+def test_trip_extends_across_batches():
+    trips.reset_state()
+    assert trips.update_trips(_pings('V1', 'T1', [100, 130], [101.600, 101.601]), 130).empty
+    assert trips.update_trips(_pings('V1', 'T1', [160], [101.602]), 160).empty
+
+    trip = trips.open_trips().iloc[0]
+    assert (trip['start_ts'], trip['end_ts'], trip['pings']) == (100, 160, 3)
+    assert round(trip['distance_m']) == 222   # two ~111 m steps
+    trips.reset_state()
+
+def test_trip_closes_on_new_trip_id_and_after_silence():
+    trips.reset_state()
+    trips.update_trips(_pings('V1', 'T1', [100, 130], [101.600, 101.601]), 130)
+    trips.update_trips(_pings('V2', 'T9', [100, 130], [101.700, 101.701]), 130)
+
+    # V1 starts its next trip in the same batch that continues T1
+    closed = trips.update_trips(_pings('V1', ['T1', 'T2', 'T2'], [160, 190, 220], [101.602, 101.602, 101.603]), 220)
+    assert closed[['vehicle_id', 'trip_id', 'start_ts', 'end_ts', 'pings']].values.tolist() == [['V1', 'T1', 100, 160, 3]]
+    assert trips.open_trips().set_index('vehicle_id')['trip_id'].to_dict() == {'V1': 'T2', 'V2': 'T9'}
+
+    # V2 went quiet
+    closed = trips.update_trips(_pings('V1', 'T2', [250], [101.604]), 130 + trips.TRIP_GAP_SECONDS + 1)
+    assert closed[['vehicle_id', 'trip_id', 'end_ts']].values.tolist() == [['V2', 'T9', 130]]
+    trips.reset_state()
+
+def test_reserved_pings_are_dropped():
+    trips.reset_state()
+    trips.update_trips(_pings('V1', 'T1', [100, 130], [101.600, 101.601]), 130)
+    # The feed serves the last position again, plus an older one and a duplicate
+    trips.update_trips(_pings('V1', 'T1', [130, 100, 160, 160], [101.601, 101.600, 101.602, 101.602]), 160)
+
+    trip = trips.open_trips().iloc[0]
+    assert (trip['end_ts'], trip['pings']) == (160, 3)
+    assert round(trip['distance_m']) == 222
+    trips.reset_state()
+
+def test_closed_trips_commit_with_their_positions(tmp_path):
+    database = str(tmp_path / 'test.duckdb')
+    w = BufferedWriter(database, 'live_buses', max_rows=100, max_seconds=3600, max_attempts=2)
+    positions = _pings('V1', 'T2', [190], [101.602]).assign(bearing=0.0, speed=0.0)
+    closed = pd.DataFrame([['Rapid Bus KL', 'V1', 'T1', 'R1', 'S1', 100, 160, 60.0, 222.0, 3.7, 3]],
+                          columns=trips.TRIP_COLUMNS)
+
+    w.append(positions, 190)
+    assert w.flush(190) == 1
+
+    # A flush that fails leaves no trips behind; they stay buffered with the positions
+    w.append(positions.assign(timestamp='220'), 220, closed_trips=closed)
+    w.append(positions.assign(timestamp='250', latitude='not a number'), 250)
+    with pytest.raises(Exception):
+        w.flush(250)
+    con = duckdb.connect(database)
+    assert con.execute("SELECT count(*) FROM trips").fetchone()[0] == 0
+    con.close()
+
+    # The retry quarantines the bad batch and writes the good one with its trips
+    assert w.flush(250) == 1
+    con = duckdb.connect(database)
+    assert con.execute("SELECT trip_id, shape_id, pings FROM trips").fetchall() == [('T1', 'S1', 3)]
+    con.close()
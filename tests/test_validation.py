@@ -0,0 +1,43 @@
+# tests/test_validation.py
+from utils import metrics, motion, validation
+import numpy as np
+import pandas as pd
+
+def _batch(rows):
+    return pd.DataFrame(rows, columns=['region', 'endpoint', 'vehicle_id', 'latitude', 'longitude', 'timestamp'])
+
+def test_rules_drop_bad_positions_and_count_per_rule(monkeypatch):
+    monkeypatch.setattr(validation, 'get_service_area', lambda slug: None)
+    monkeypatch.setattr(validation, 'VALIDATION_RULES', None)
+    monkeypatch.setattr(validation, 'FROZEN_GPS_SECONDS', 900)
+    motion.reset_state()
+
+    # Seed the last accepted pings
+    motion.derive_motion(_batch([
+        ('Rapid Bus KL', '', 'JUMP', 3.10, 101.60, '1000'),
+        ('Rapid Bus KL', '', 'FROZEN', 3.20, 101.70, '1000'),
+    ]).drop(columns=['endpoint']))
+
+    batch = _batch([
+        ('Rapid Bus KL', '', 'OK', 3.15, 101.65, '1060'),
+        ('Rapid Bus KL', '', 'NOWHERE', 51.5, -0.12, '1060'),
+        ('Rapid Bus KL', '', 'JUMP', 3.60, 101.60, '1060'),          # ~55 km in a minute
+        ('Rapid Bus KL', '', 'FROZEN', 3.20, 101.70, '2000'),
+        ('myBAS Seremban', 'mybas-seremban-a', 'DUP', 2.72, 101.94, '1050'),
+        ('myBAS Seremban', 'mybas-seremban-b', 'DUP', 2.72, 101.94, '1060'),
+    ])
+    cycle = metrics.Cycle(1060)
+    kept = validation.validate(batch, 1060, cycle)
+
+    assert kept['vehicle_id'].tolist() == ['OK', 'DUP']
+    assert 'endpoint' not in kept.columns
+    drops = {row['stage']: row['entities'] for row in cycle.rows}
+    assert drops == {'drop_outside_malaysia': 1, 'drop_impossible_jump': 1,
+                     'drop_frozen_gps': 1, 'drop_duplicate_endpoint': 1}
+    motion.reset_state()
+
+def test_service_area_allows_margin_outside_hull():
+    # Stops in a ~10 km square; the margin is 5 km
+    area = validation.ServiceArea(np.array([3.0, 3.0, 3.09, 3.09]), np.array([101.6, 101.69, 101.6, 101.69]))
+    outside = area.outside(np.array([3.05, 3.12, 3.20]), np.array([101.65, 101.65, 101.65]))
+    assert outside.tolist() == [False, False, True]
@@ -0,0 +1,37 @@
+# tests/test_vehicle_search.py
+from utils import fleet, vehicle_search
+import pandas as pd
+
+def _snapshot(trips):
+    return fleet.FleetSnapshot.from_frame(pd.DataFrame({
+        'region': ['Rapid Bus KL', 'Rapid Bus KL', 'myBAS Ipoh'],
+        'vehicle_id': ['WKM12', 'WKM1', 'AKA1'],
+        'trip_id': trips,
+        'route_id': ['R1', 'R2', 'R1'],
+        'latitude': [3.1, 3.2, 4.6],
+        'longitude': [101.6, 101.7, 101.1],
+        'timestamp': ['1000', '1000', '1000'],
+    }))
+
+def test_prefix_search_across_regions_and_incremental_update(monkeypatch):
+    monkeypatch.setattr(vehicle_search.route_stats, 'route_dimension', lambda regions: pd.DataFrame({
+        'region': ['Rapid Bus KL'], 'route_id': ['R1'], 'route_short_name': ['T789'],
+        'route_long_name': ['Hab Pasar Seni ~ KL Sentral'], 'route_name': ['T789 Hab Pasar Seni ~ KL Sentral'],
+    }))
+    vehicle_search.update(None)
+
+    snapshot = _snapshot(['trip-a', 'trip-b', 'trip-c'])
+    # Exact vehicle_id first, then other vehicle_id prefixes
+    assert vehicle_search.search('wkm1', snapshot=snapshot)['vehicle_id'].tolist() == ['WKM1', 'WKM12']
+    result = vehicle_search.search('pasar sentral', snapshot=snapshot)
+    assert result['vehicle_id'].tolist() == ['WKM12']
+    assert result['route_name'].tolist() == ['T789 Hab Pasar Seni ~ KL Sentral']
+    assert abs(result['latitude'].iloc[0] - 3.1) < 1e-5
+    assert vehicle_search.search('r1', snapshot=snapshot)['region'].tolist() == ['myBAS Ipoh', 'Rapid Bus KL']
+    assert vehicle_search.search('', region='Rapid Bus KL', snapshot=snapshot)['vehicle_id'].tolist() == ['WKM1', 'WKM12']
+
+    # A changed trip replaces the vehicle's terms
+    snapshot = _snapshot(['trip-a', 'trip-z', 'trip-c'])
+    assert vehicle_search.search('trip-b', snapshot=snapshot).empty
+    assert vehicle_search.search('trip-z', snapshot=snapshot)['vehicle_id'].tolist() == ['WKM1']
+    vehicle_search.update(None)
@@ -0,0 +1,84 @@
+# tests/test_writer.py
+from utils.writer import BufferedWriter
+import duckdb
+import pandas as pd
+import pytest
+
+def _batch(vehicle_ids, ts):
+    return pd.DataFrame({
+        'region': 'Rapid Bus KL',
+        'vehicle_id': vehicle_ids,
+        'latitude': 3.1,
+        'longitude': 101.6,
+        'bearing': 0.0,
+        'speed': 0.0,
+        'timestamp': str(ts),
+    })
+
+def test_buffered_batches_flush_once_with_dedup(tmp_path):
+    database = str(tmp_path / 'test.duckdb')
+    spool = str(tmp_path / 'spool')
+    writer = BufferedWriter(database, 'live_buses', max_rows=10, max_seconds=3600, spool_dir=spool)
+
+    assert writer.append(_batch(['A', 'B'], 100), 100) is None
+    # Same rows again plus one new: duplicates inside the buffer are dropped
+    assert writer.append(_batch(['A', 'B', 'C'], 100), 100) is None
+    assert writer.buffered_rows == 5
+
+    # Simulate a crash: a new writer recovers the spooled batches
+    recovered = BufferedWriter(database, 'live_buses', max_rows=10, max_seconds=3600, spool_dir=spool)
+    assert recovered.buffered_rows == 5
+    assert recovered.flush(100) == 3
+    assert recovered.flush(100) == 0
+
+    # Rows already committed are skipped on the next flush
+    recovered.append(_batch(['A', 'D'], 100), 100)
+    assert recovered.flush(100) == 1
+    recovered.close()
+
+    con = duckdb.connect(database)
+    assert con.execute("SELECT count(*) FROM live_buses").fetchone()[0] == 4
+    con.close()
+
+def test_route_aggregates_count_each_position_once(tmp_path):
+    database = str(tmp_path / 'test.duckdb')
+    writer = BufferedWriter(database, 'live_buses', max_rows=10, max_seconds=3600)
+
+    writer.append(_batch(['A', 'B'], 3600).assign(route_id='r1', speed=[5.0, 0.0]), 3600)
+    assert writer.flush(3600) == 2
+    # Re-served positions are not added again
+    writer.append(_batch(['A', 'B', 'C'], 3600).assign(route_id='r1', speed=[5.0, 0.0, 3.0]), 3600)
+    assert writer.flush(3600) == 1
+    writer.close()
+
+    con = duckdb.connect(database)
+    rows = con.execute("SELECT hour_ts, pings, moving_pings, speed_sum_mps FROM route_hourly").fetchall()
+    assert rows == [(3600, 3, 2, 8.0)]
+    con.close()
+
+def test_connection_released_and_poison_batch_quarantined(tmp_path):
+    database = str(tmp_path / 'test.duckdb')
+    writer = BufferedWriter(database, 'live_buses', max_rows=10, max_seconds=3600, max_attempts=2)
+    writer.append(_batch(['A'], 100), 100)
+    assert writer.flush(100) == 1
+
+    # No connection is held between flushes: another (read-only) one can open the file
+    con = duckdb.connect(database, read_only=True)
+    con.close()
+
+    # A batch that can never be inserted, buffered with a good one
+    writer.append(_batch(['B'], 100).assign(latitude='not a number'), 100)
+    writer.append(_batch(['C'], 100), 100)
+    with pytest.raises(Exception):
+        writer.flush(100)
+    assert writer.buffered_rows == 2
+
+    # The second failure writes batches one at a time and quarantines the bad one
+    assert writer.flush(100) == 1
+    assert writer.buffered_rows == 0
+    assert len(list((tmp_path / 'test.duckdb.quarantine').glob('live_buses_*.arrow'))) == 1
+    writer.close()
+
+    con = duckdb.connect(database)
+    assert sorted(r[0] for r in con.execute("SELECT vehicle_id FROM live_buses").fetchall()) == ['A', 'C']
+    con.close()